@@ -7,13 +7,7 @@ from typing import Optional, Tuple, Dict, Any
 import logging
 from django.conf import settings
 
-try:
-    from tensorflow import keras
-    from tensorflow.keras.models import load_model
-    TENSORFLOW_AVAILABLE = True
-except ImportError:
-    TENSORFLOW_AVAILABLE = False
-    logging.warning("TensorFlow not available. LSTM predictions will be limited.")
+from ml_service.core.lstm_runtime import load_lstm_model as load_lstm_runtime, TENSORFLOW_AVAILABLE
 
 logger = logging.getLogger(__name__)
 
@@ -87,7 +81,9 @@ class MovementPredictor:
         
         species_lower = species.lower()
         
+        # Exported NumPy runtime models (.npz) are preferred over Keras files
         possible_paths = [
+            DATA_DIR / "lstm" / f"{species_lower}_lstm.npz",
             DATA_DIR / "lstm" / f"{species_lower}_lstm.h5",
             DATA_DIR / "lstm" / f"{species_lower}_lstm.pkl",
             DATA_DIR / "lstm" / "wildlife_lstm_improved_*_model.h5",
@@ -98,7 +94,7 @@ class MovementPredictor:
         scaler_x_path = None
         scaler_y_path = None
         
-        for pattern in possible_paths[:2]:
+        for pattern in possible_paths[:3]:
             if pattern.exists():
                 model_path = pattern
                 break
@@ -106,7 +102,7 @@ class MovementPredictor:
         if model_path is None:
             lstm_dir = DATA_DIR / "lstm"
             if lstm_dir.exists():
-                for file in lstm_dir.glob("*.h5"):
+                for file in sorted(lstm_dir.glob("*.npz")) + sorted(lstm_dir.glob("*.h5")):
                     model_path = file
                     break
                 if model_path is None:
@@ -133,18 +129,12 @@ class MovementPredictor:
                 break
         
         try:
-            if model_path.suffix == '.h5' and TENSORFLOW_AVAILABLE:
-                import tensorflow as tf
-                
-                custom_objects = {
-                    'InputLayer': tf.keras.layers.InputLayer
-                }
-                
+            if model_path.suffix in ('.npz', '.h5'):
                 try:
-                    model = load_model(str(model_path), compile=False, custom_objects=custom_objects)
-                    logger.info(f"Loaded LSTM .h5 model for {species}")
+                    model = load_lstm_runtime(model_path)
+                    logger.info(f"Loaded LSTM {model_path.suffix} model for {species} ({type(model).__name__})")
                 except Exception as h5_error:
-                    logger.warning(f"Error loading .h5 model: {h5_error}, trying .pkl fallback")
+                    logger.warning(f"Error loading {model_path.suffix} model: {h5_error}, trying .pkl fallback")
                     pkl_path = model_path.with_suffix('.pkl')
                     if pkl_path.exists():
                         with open(pkl_path, 'rb') as f:
@@ -174,13 +174,15 @@ class AnimalViewSet(viewsets.ModelViewSet):
                 behavior_state = tracking.activity_type
                 if not behavior_state and hmm_predictor:
                     try:
-                        behavior_state = hmm_predictor.predict_behavior(
+                        behavior_state = hmm_predictor.update_behavior(
+                            animal_id=animal.id,
                             speed_kmh=speed_kmh,
                             directional_angle=directional_angle,
                             prev_speed=prev_speed,
                             prev_angle=prev_angle,
-                            species=species
-                        )
+                            species=species,
+                            timestamp=last_seen
+                        )['behavior']
                         logger.debug(f"{animal.name} behavior: {behavior_state} (HMM)")
                     except Exception as hmm_err:
                         logger.warning(f"HMM prediction failed for {animal.name}: {hmm_err}")
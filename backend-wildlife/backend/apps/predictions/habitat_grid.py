@@ -0,0 +1,287 @@
+"""
+Habitat suitability grids over bounding boxes
+
+Scores are computed per web-mercator (XYZ) tile of TILE_SIZE x TILE_SIZE
+pixels. Tiles come from the precomputed pyramid (tile_pyramid) when it was
+built from the current model, and are otherwise cached per (species, model
+version, month, zoom, tile), so neighbouring and repeated requests reuse
+the same tiles. Missing tiles are scored RENDER_BATCH_TILES at a time, with
+one raster sampling pass and one model call per batch, and the requested
+grid is resampled from the tile mosaic at its cell centers.
+
+Scores are stored as uint8: 0..SCALE maps to 0..1, NODATA marks cells
+outside the environmental rasters.
+"""
+
+import math
+import logging
+import numpy as np
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+NODATA = 255
+SCALE = 254
+
+# Tiles are scored for the middle of the month at midday
+SCORING_DAY = 15
+SCORING_HOUR = 12
+SCORING_YEAR = 2023
+
+MAX_MERCATOR_LAT = 85.0511
+
+# Tiles scored per raster sampling pass and model call (16 x 65,536 pixels)
+RENDER_BATCH_TILES = 16
+
+# Process-memory tiles, used when the shared cache is unavailable
+LOCAL_TILE_LIMIT = 256
+_local_tiles: "OrderedDict[str, bytes]" = OrderedDict()
+
+
+class GridRequestError(ValueError):
+    """Raised for bounding boxes or resolutions the grid endpoint cannot serve"""
+
+
+def parse_bbox(value: str) -> Tuple[float, float, float, float]:
+    """
+    Parse a 'min_lon,min_lat,max_lon,max_lat' bounding box
+
+    Raises:
+        GridRequestError: If the box is malformed, empty or outside the map
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        raise GridRequestError("bbox must be 'min_lon,min_lat,max_lon,max_lat'")
+    if not all(math.isfinite(v) for v in (min_lon, min_lat, max_lon, max_lat)):
+        raise GridRequestError("bbox values must be finite")
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise GridRequestError("bbox minimums must be smaller than maximums")
+    if min_lon < -180 or max_lon > 180 or min_lat < -MAX_MERCATOR_LAT or max_lat > MAX_MERCATOR_LAT:
+        raise GridRequestError("bbox is outside the web-mercator map")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def scoring_time(month: int) -> datetime:
+    """Date and time the temporal model features are computed for"""
+    return datetime(SCORING_YEAR, month, SCORING_DAY, SCORING_HOUR)
+
+
+def zoom_for_resolution(resolution: float, max_zoom: int) -> int:
+    """Smallest zoom whose pixels are no wider than the resolution in degrees"""
+    zoom = math.ceil(math.log2(360.0 / (TILE_SIZE * resolution)))
+    return int(min(max(zoom, 0), max_zoom))
+
+
+def lon_to_pixel(lons, zoom: int) -> np.ndarray:
+    """Global pixel column of longitudes at a zoom level"""
+    world = TILE_SIZE * (1 << zoom)
+    pixels = (np.asarray(lons, dtype=float) + 180.0) / 360.0 * world
+    return np.clip(np.floor(pixels), 0, world - 1).astype(np.int64)
+
+
+def lat_to_pixel(lats, zoom: int) -> np.ndarray:
+    """Global pixel row of latitudes at a zoom level"""
+    world = TILE_SIZE * (1 << zoom)
+    lat_rad = np.radians(np.clip(np.asarray(lats, dtype=float), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    pixels = (1.0 - np.arcsinh(np.tan(lat_rad)) / math.pi) / 2.0 * world
+    return np.clip(np.floor(pixels), 0, world - 1).astype(np.int64)
+
+
+def tile_pixel_centers(zoom: int, x: int, y: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Longitudes of the pixel columns and latitudes of the pixel rows of a tile"""
+    world = TILE_SIZE * (1 << zoom)
+    offsets = np.arange(TILE_SIZE) + 0.5
+    lons = (x * TILE_SIZE + offsets) / world * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(math.pi * (1.0 - 2.0 * (y * TILE_SIZE + offsets) / world))))
+    return lons, lats
+
+
+def quantize(scores: np.ndarray) -> np.ndarray:
+    """Scores in [0, 1] (NaN for no data) as uint8 grid values"""
+    values = np.full(scores.shape, NODATA, dtype=np.uint8)
+    valid = ~np.isnan(scores)
+    values[valid] = np.rint(np.clip(scores[valid], 0.0, 1.0) * SCALE).astype(np.uint8)
+    return values
+
+
+def grid_version(predictor, species: str) -> str:
+    """Version of the model and rasters behind a species' tiles"""
+    return f"{predictor.model_version(species)}-{predictor.raster_version}"
+
+
+def tile_cache_key(species: str, version: str, month: int, zoom: int, x: int, y: int) -> str:
+    return f"habitat_tile:{species.lower()}:{version}:{month}:{zoom}:{x}:{y}"
+
+
+def _get_tiles(keys: List[str]) -> Dict[str, bytes]:
+    try:
+        return cache.get_many(keys)
+    except Exception as e:
+        logger.debug(f"Habitat tile cache unavailable, using process memory: {e}")
+        return {key: _local_tiles[key] for key in keys if key in _local_tiles}
+
+
+def _set_tiles(tiles: Dict[str, bytes]):
+    timeout = getattr(settings, 'HABITAT_TILE_CACHE_TIMEOUT', 86400)
+    try:
+        cache.set_many(tiles, timeout)
+    except Exception as e:
+        logger.debug(f"Habitat tile cache unavailable, using process memory: {e}")
+        for key, data in tiles.items():
+            _local_tiles[key] = data
+            _local_tiles.move_to_end(key)
+        while len(_local_tiles) > LOCAL_TILE_LIMIT:
+            _local_tiles.popitem(last=False)
+
+
+def render_tiles(predictor, species: str, month: int, zoom: int, tiles: List[Tuple[int, int]],
+                 batch_tiles: int = RENDER_BATCH_TILES) -> Dict[Tuple[int, int], np.ndarray]:
+    """
+    Score tiles with one raster sampling pass and one model call per batch
+
+    Args:
+        predictor: XGBoostHabitatPredictor
+        species: Species name
+        month: Month the tiles are scored for
+        zoom: Zoom level
+        tiles: (x, y) tile coordinates
+        batch_tiles: Tiles scored per model call, which bounds the pixels
+            (and feature rows) held in memory at once
+
+    Returns:
+        Mapping of (x, y) to a TILE_SIZE x TILE_SIZE uint8 array
+    """
+    result = {}
+    when = scoring_time(month)
+    for start in range(0, len(tiles), batch_tiles):
+        batch = tiles[start:start + batch_tiles]
+        lats, lons = [], []
+        for x, y in batch:
+            tile_lons, tile_lats = tile_pixel_centers(zoom, x, y)
+            grid_lons, grid_lats = np.meshgrid(tile_lons, tile_lats)
+            lons.append(grid_lons.ravel())
+            lats.append(grid_lats.ravel())
+
+        scores = predictor.score_points(np.concatenate(lats), np.concatenate(lons), species, when)
+        values = quantize(scores).reshape(len(batch), TILE_SIZE, TILE_SIZE)
+        result.update((tile, values[i]) for i, tile in enumerate(batch))
+    return result
+
+
+def get_tiles(predictor, species: str, month: int, zoom: int,
+              tiles: List[Tuple[int, int]], version: Optional[str] = None) -> Dict[Tuple[int, int], np.ndarray]:
+    """
+    Tiles from the precomputed pyramid or the cache, rendering and storing
+    the ones that are in neither
+
+    Returns:
+        Mapping of (x, y) to a TILE_SIZE x TILE_SIZE uint8 array
+    """
+    from .tile_pyramid import get_tile_pyramid
+
+    version = version or grid_version(predictor, species)
+    pyramid = get_tile_pyramid()
+    result = {}
+    for tile in tiles:
+        values = pyramid.tile(species, month, zoom, *tile, version=version)
+        if values is not None:
+            result[tile] = values
+
+    keys = {tile: tile_cache_key(species, version, month, zoom, *tile) for tile in tiles if tile not in result}
+    cached = _get_tiles(list(keys.values())) if keys else {}
+
+    missing = []
+    for tile, key in keys.items():
+        data = cached.get(key)
+        if data is not None and len(data) == TILE_SIZE * TILE_SIZE:
+            result[tile] = np.frombuffer(data, dtype=np.uint8).reshape(TILE_SIZE, TILE_SIZE)
+        else:
+            missing.append(tile)
+
+    if missing:
+        rendered = render_tiles(predictor, species, month, zoom, missing)
+        _set_tiles({keys[tile]: values.tobytes() for tile, values in rendered.items()})
+        result.update(rendered)
+    return result
+
+
+def suitability_grid(predictor, species: str, bbox: Tuple[float, float, float, float],
+                     resolution: float, month: int) -> Dict:
+    """
+    Habitat suitability grid over a bounding box
+
+    Args:
+        predictor: XGBoostHabitatPredictor with a model for the species
+        species: Species name
+        bbox: (min_lon, min_lat, max_lon, max_lat)
+        resolution: Cell size in degrees
+        month: Month the grid is scored for
+
+    Returns:
+        Dict with the uint8 'values' (rows north to south), 'width', 'height',
+        'zoom', 'tiles' and 'model_version'
+
+    Raises:
+        GridRequestError: If the grid or the number of tiles is too large
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if not (math.isfinite(resolution) and resolution > 0):
+        raise GridRequestError("resolution must be a positive number of degrees")
+
+    width = max(1, math.ceil(round((max_lon - min_lon) / resolution, 9)))
+    height = max(1, math.ceil(round((max_lat - min_lat) / resolution, 9)))
+    max_cells = getattr(settings, 'HABITAT_GRID_MAX_CELLS', 250000)
+    if width * height > max_cells:
+        raise GridRequestError(f"grid of {width}x{height} cells exceeds the limit of {max_cells}")
+
+    zoom = zoom_for_resolution(resolution, getattr(settings, 'HABITAT_GRID_MAX_ZOOM', 10))
+    cell_lons = min_lon + (np.arange(width) + 0.5) * resolution
+    cell_lats = max_lat - (np.arange(height) + 0.5) * resolution
+    cols = lon_to_pixel(cell_lons, zoom)
+    rows = lat_to_pixel(cell_lats, zoom)
+
+    x0, x1 = int(cols.min()) // TILE_SIZE, int(cols.max()) // TILE_SIZE
+    y0, y1 = int(rows.min()) // TILE_SIZE, int(rows.max()) // TILE_SIZE
+    tile_count = (x1 - x0 + 1) * (y1 - y0 + 1)
+    max_tiles = getattr(settings, 'HABITAT_GRID_MAX_TILES', 64)
+    if tile_count > max_tiles:
+        raise GridRequestError(f"bbox needs {tile_count} tiles at zoom {zoom}, more than {max_tiles}")
+
+    tiles = [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+    version = grid_version(predictor, species)
+    rendered = get_tiles(predictor, species, month, zoom, tiles, version)
+
+    mosaic = np.empty(((y1 - y0 + 1) * TILE_SIZE, (x1 - x0 + 1) * TILE_SIZE), dtype=np.uint8)
+    for (x, y), values in rendered.items():
+        mosaic[(y - y0) * TILE_SIZE:(y - y0 + 1) * TILE_SIZE, (x - x0) * TILE_SIZE:(x - x0 + 1) * TILE_SIZE] = values
+    values = mosaic[np.ix_(rows - y0 * TILE_SIZE, cols - x0 * TILE_SIZE)]
+
+    return {
+        'values': values,
+        'width': width,
+        'height': height,
+        'zoom': zoom,
+        'tiles': tile_count,
+        'model_version': version,
+    }
+
+
+def encode_rle(values: np.ndarray) -> Tuple[List[int], List[int]]:
+    """
+    Run-length encode a grid in row-major order
+
+    Returns:
+        (run values, run lengths)
+    """
+    flat = np.asarray(values).ravel()
+    if flat.size == 0:
+        return [], []
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.concatenate((starts, [flat.size])))
+    return flat[starts].tolist(), lengths.tolist()
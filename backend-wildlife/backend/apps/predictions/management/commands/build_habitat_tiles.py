@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.predictions.habitat_grid import grid_version
+from apps.predictions.tile_pyramid import build_pyramid, get_tile_pyramid
+from apps.predictions.xgboost_loader import get_xgboost_predictor
+
+
+class Command(BaseCommand):
+    help = 'Render the habitat suitability tile pyramid of every species over the study area'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--species', nargs='+', help='Species to render (default: every loaded model)')
+        parser.add_argument('--months', nargs='+', type=int, default=list(range(1, 13)),
+                            help='Months to render (default: all)')
+        parser.add_argument('--min-zoom', type=int, default=settings.HABITAT_TILE_MIN_ZOOM)
+        parser.add_argument('--max-zoom', type=int, default=settings.HABITAT_TILE_MAX_ZOOM)
+        parser.add_argument('--output', default=settings.HABITAT_TILE_DIR, help='Root directory of the pyramids')
+        parser.add_argument('--batch-tiles', type=int, default=16, help='Tiles scored per model call')
+        parser.add_argument('--force', action='store_true', help='Rebuild pyramids that are already up to date')
+
+    def handle(self, *args, **options):
+        predictor = get_xgboost_predictor()
+        species_list = [s.lower() for s in (options['species'] or sorted(predictor.models))]
+        missing = [s for s in species_list if s not in predictor.models]
+        if missing or not species_list:
+            raise CommandError(f"No XGBoost model loaded for: {', '.join(missing) or 'any species'}")
+        if any(not 1 <= month <= 12 for month in options['months']):
+            raise CommandError('Months must be between 1 and 12')
+        if options['min_zoom'] > options['max_zoom']:
+            raise CommandError('--min-zoom must not be larger than --max-zoom')
+
+        pyramid = get_tile_pyramid(options['output'])
+        zooms = range(options['min_zoom'], options['max_zoom'] + 1)
+        bbox = tuple(settings.HABITAT_TILE_BBOX)
+
+        for species in species_list:
+            version = grid_version(predictor, species)
+            for month in options['months']:
+                index = pyramid.index(species, month)
+                if (not options['force'] and index and index['model_version'] == version
+                        and index['bbox'] == list(bbox) and set(index['zooms']) >= {str(z) for z in zooms}):
+                    self.stdout.write(f"{species} month {month}: up to date ({version})")
+                    continue
+                index = build_pyramid(predictor, species, month, bbox, zooms, options['output'],
+                                      batch_tiles=options['batch_tiles'])
+                tiles = sum((level['x1'] - level['x0'] + 1) * (level['y1'] - level['y0'] + 1)
+                            for level in index['zooms'].values())
+                self.stdout.write(self.style.SUCCESS(
+                    f"{species} month {month}: {tiles} tiles at zooms {min(zooms)}-{max(zooms)} ({version})"
+                ))
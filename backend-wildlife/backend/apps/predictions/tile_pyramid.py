@@ -0,0 +1,236 @@
+"""
+Precomputed habitat suitability tile pyramid
+
+Suitability only changes when a model or a raster changes, so the tiles of
+habitat_grid are rendered offline (manage.py build_habitat_tiles) for the
+whole study area and served from disk.
+
+Layout, per species and month:
+
+    HABITAT_TILE_DIR/<species>/m<MM>/index.json
+    HABITAT_TILE_DIR/<species>/m<MM>/z<zoom>.<build>.bin
+
+Each z<zoom>.<build>.bin holds the uint8 tiles of the zoom's tile rectangle
+(x0..x1, y0..y1 in the index) back to back, row by row, TILE_BYTES each, so
+a tile is one seek and one read at a computed offset and HTTP range requests
+map directly onto the file. Every build writes packs under new names and
+then replaces index.json, so the index always points at complete packs.
+"""
+
+import os
+import re
+import json
+import logging
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, Tuple
+from django.conf import settings
+
+from .habitat_grid import (
+    TILE_SIZE, NODATA, SCALE, RENDER_BATCH_TILES, grid_version, lon_to_pixel, lat_to_pixel, render_tiles
+)
+
+logger = logging.getLogger(__name__)
+
+TILE_BYTES = TILE_SIZE * TILE_SIZE
+INDEX_FILE = 'index.json'
+PYRAMID_FORMAT_VERSION = 1
+
+# Species names become directory names, so only plain names are accepted
+SPECIES_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]*$')
+
+
+def pyramid_path(root, species: str, month: int) -> Path:
+    species = species.lower()
+    if not SPECIES_NAME.match(species):
+        raise ValueError(f"invalid species name {species!r}")
+    return Path(root) / species / f"m{month:02d}"
+
+
+def tile_rectangle(bbox: Tuple[float, float, float, float], zoom: int) -> Tuple[int, int, int, int]:
+    """(x0, y0, x1, y1) of the tiles covering a bounding box at a zoom level"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    cols = lon_to_pixel([min_lon, max_lon], zoom) // TILE_SIZE
+    rows = lat_to_pixel([max_lat, min_lat], zoom) // TILE_SIZE
+    return int(cols[0]), int(rows[0]), int(cols[1]), int(rows[1])
+
+
+def build_pyramid(predictor, species: str, month: int, bbox: Tuple[float, float, float, float],
+                  zooms: Iterable[int], root, batch_tiles: int = RENDER_BATCH_TILES) -> Dict:
+    """
+    Render the tile pyramid of one species and month
+
+    Tiles are scored batch_tiles at a time into pack files named after this
+    build. index.json is then atomically replaced to point at them, so the
+    tile endpoint reads either the previous pyramid or the new one, never a
+    partial one. Packs of earlier builds are deleted afterwards.
+
+    Args:
+        predictor: XGBoostHabitatPredictor with a model for the species
+        species: Species name
+        month: Month the tiles are scored for
+        bbox: (min_lon, min_lat, max_lon, max_lat) to cover
+        zooms: Zoom levels to render
+        root: Root directory of the pyramids
+        batch_tiles: Tiles scored per model call
+
+    Returns:
+        The pyramid index
+    """
+    path = pyramid_path(root, species, month)
+    path.mkdir(parents=True, exist_ok=True)
+    build = f"{datetime.now():%Y%m%d%H%M%S%f}-{os.getpid()}"
+    tmp_index = path / f"{INDEX_FILE}.tmp-{os.getpid()}"
+    written = []
+
+    index = {
+        'format': PYRAMID_FORMAT_VERSION,
+        'species': species.lower(),
+        'month': month,
+        'model_version': grid_version(predictor, species),
+        'bbox': list(bbox),
+        'tile_size': TILE_SIZE,
+        'dtype': 'uint8',
+        'scale': SCALE,
+        'nodata': NODATA,
+        'created': datetime.now().isoformat(),
+        'zooms': {},
+    }
+    try:
+        for zoom in sorted(set(zooms)):
+            x0, y0, x1, y1 = tile_rectangle(bbox, zoom)
+            tiles = [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+            filename = f"z{zoom}.{build}.bin"
+            written.append(path / filename)
+            with open(path / filename, 'wb') as f:
+                for start in range(0, len(tiles), batch_tiles):
+                    batch = tiles[start:start + batch_tiles]
+                    rendered = render_tiles(predictor, species, month, zoom, batch, batch_tiles)
+                    for tile in batch:
+                        f.write(rendered[tile].tobytes())
+            index['zooms'][str(zoom)] = {'x0': x0, 'y0': y0, 'x1': x1, 'y1': y1, 'file': filename}
+            logger.info(f"Rendered {len(tiles)} {species} tiles for month {month} at zoom {zoom}")
+
+        with open(tmp_index, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_index, path / INDEX_FILE)
+    except Exception:
+        for leftover in written + [tmp_index]:
+            leftover.unlink(missing_ok=True)
+        raise
+
+    current = {level['file'] for level in index['zooms'].values()}
+    for pack in path.glob('z*.bin'):
+        if pack.name not in current:
+            pack.unlink(missing_ok=True)
+    return index
+
+
+class TilePyramid:
+    """
+    Read access to the pyramids under a root directory
+
+    Indexes are loaded once and reloaded when their file changes, so a
+    rebuild is picked up without restarting the server.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._indexes = {}
+
+    def species(self) -> Set[str]:
+        """Species with at least one built pyramid"""
+        try:
+            return {p.name for p in self.root.iterdir() if p.is_dir() and SPECIES_NAME.match(p.name)}
+        except OSError:
+            return set()
+
+    def index(self, species: str, month: int) -> Optional[Dict]:
+        """Index of a species and month, or None if it has not been built"""
+        index_path = pyramid_path(self.root, species, month) / INDEX_FILE
+        try:
+            stat = index_path.stat()
+        except OSError:
+            return None
+        # A rebuild replaces the file, so its inode changes even if the mtime does not
+        mtime = (stat.st_mtime_ns, stat.st_ino)
+        cached = self._indexes.get(index_path)
+        if cached is None or cached[0] != mtime:
+            try:
+                with open(index_path) as f:
+                    index = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read tile index {index_path}: {e}")
+                return None
+            if index.get('format') != PYRAMID_FORMAT_VERSION:
+                return None
+            cached = (mtime, index)
+            self._indexes[index_path] = cached
+        return cached[1]
+
+    def locate(self, species: str, month: int, zoom: int, x: int, y: int) -> Optional[Tuple[Path, int, Dict]]:
+        """
+        File and byte offset of a tile
+
+        Returns:
+            (pack file, offset, index), or None if the tile is not in the pyramid
+        """
+        index = self.index(species, month)
+        if index is None:
+            return None
+        level = index['zooms'].get(str(zoom))
+        if level is None or not (level['x0'] <= x <= level['x1'] and level['y0'] <= y <= level['y1']):
+            return None
+        position = (y - level['y0']) * (level['x1'] - level['x0'] + 1) + (x - level['x0'])
+        return pyramid_path(self.root, species, month) / level['file'], position * TILE_BYTES, index
+
+    def read(self, species: str, month: int, zoom: int, x: int, y: int,
+             start: int = 0, length: int = TILE_BYTES) -> Optional[bytes]:
+        """Bytes start..start+length of a tile, or None if it is not in the pyramid"""
+        start = max(0, min(start, TILE_BYTES))
+        length = max(0, min(length, TILE_BYTES - start))
+        for _ in range(2):
+            located = self.locate(species, month, zoom, x, y)
+            if located is None:
+                return None
+            pack, offset, _ = located
+            try:
+                with open(pack, 'rb') as f:
+                    f.seek(offset + start)
+                    return f.read(length)
+            except FileNotFoundError:
+                # A rebuild replaced the index (and removed this pack) since it was loaded
+                continue
+        return None
+
+    def tile(self, species: str, month: int, zoom: int, x: int, y: int,
+             version: Optional[str] = None) -> Optional[np.ndarray]:
+        """
+        A tile as a TILE_SIZE x TILE_SIZE uint8 array
+
+        Args:
+            version: If given, only serve pyramids built from this model version
+
+        Returns:
+            The tile, or None if it is not in the pyramid (or is out of date)
+        """
+        if version is not None:
+            index = self.index(species, month)
+            if index is None or index.get('model_version') != version:
+                return None
+        data = self.read(species, month, zoom, x, y)
+        if data is None or len(data) != TILE_BYTES:
+            return None
+        return np.frombuffer(data, dtype=np.uint8).reshape(TILE_SIZE, TILE_SIZE)
+
+
+_tile_pyramids: Dict[str, TilePyramid] = {}
+
+
+def get_tile_pyramid(root=None) -> TilePyramid:
+    """Shared TilePyramid of a root directory (HABITAT_TILE_DIR by default)"""
+    root = str(root or settings.HABITAT_TILE_DIR)
+    if root not in _tile_pyramids:
+        _tile_pyramids[root] = TilePyramid(root)
+    return _tile_pyramids[root]
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PredictionViewSet, xgboost_environment, predict_habitat
+from .views import PredictionViewSet, xgboost_environment, predict_habitat, habitat_grid, habitat_tile
 
 router = DefaultRouter()
 router.register(r'', PredictionViewSet, basename='prediction')
@@ -9,4 +9,6 @@ urlpatterns = [
     path('', include(router.urls)),
     path('xgboost/environment/', xgboost_environment, name='xgboost-environment'),
     path('xgboost/predict/', predict_habitat, name='xgboost-predict'),
+    path('xgboost/grid/', habitat_grid, name='xgboost-grid'),
+    path('xgboost/tiles/<str:species>/<int:z>/<int:x>/<int:y>/', habitat_tile, name='xgboost-tile'),
 ]
@@ -6,6 +6,9 @@ from rest_framework.decorators import api_view, permission_classes
 from asgiref.sync import async_to_sync
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
+from django.conf import settings
+from django.http import HttpResponse
+from datetime import datetime
 import os
 import sys
 from pathlib import Path
@@ -187,15 +190,27 @@ def xgboost_environment(request):
 @swagger_auto_schema(
     method='post',
     operation_summary="Predict habitat suitability",
-    operation_description="Predict habitat suitability for specific coordinates",
+    operation_description=(
+        "Predict habitat suitability for specific coordinates from the environmental rasters. "
+        "Send 'points' (a list of {lat, lon}) to score many locations in one call."
+    ),
     request_body=openapi.Schema(
         type=openapi.TYPE_OBJECT,
         properties={
             'lat': openapi.Schema(type=openapi.TYPE_NUMBER, description='Latitude'),
             'lon': openapi.Schema(type=openapi.TYPE_NUMBER, description='Longitude'),
+            'points': openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                items=openapi.Schema(type=openapi.TYPE_OBJECT, properties={
+                    'lat': openapi.Schema(type=openapi.TYPE_NUMBER),
+                    'lon': openapi.Schema(type=openapi.TYPE_NUMBER),
+                }),
+                description='Locations to score instead of lat/lon'
+            ),
             'species': openapi.Schema(type=openapi.TYPE_STRING, description='Species'),
+            'features': openapi.Schema(type=openapi.TYPE_OBJECT, description='Feature values used instead of the raster values'),
         },
-        required=['lat', 'lon', 'species']
+        required=['species']
     ),
     tags=['ML Predictions']
 )
@@ -203,9 +218,29 @@ def xgboost_environment(request):
 @permission_classes([AllowAny])
 def predict_habitat(request):
     try:
-        lat = float(request.data.get('lat'))
-        lon = float(request.data.get('lon'))
         species = request.data.get('species', 'elephant').lower()
+        features = request.data.get('features') or None
+        if features is not None:
+            # The predictor falls back to the default score on bad overrides, so they are rejected here
+            if not isinstance(features, dict):
+                raise TypeError("features must be an object of feature values")
+            invalid = [name for name, value in features.items()
+                       if isinstance(value, bool) or not isinstance(value, (int, float))]
+            if invalid:
+                raise ValueError(f"feature values must be numbers: {', '.join(map(str, invalid))}")
+            features = {name: float(value) for name, value in features.items()}
+        points = request.data.get('points')
+        if points is not None:
+            max_points = getattr(settings, 'HABITAT_MAX_POINTS', 10000)
+            if not isinstance(points, list) or not points:
+                raise ValueError("points must be a non-empty list of {lat, lon}")
+            if len(points) > max_points:
+                raise ValueError(f"at most {max_points} points per request")
+            lats = [float(point['lat']) for point in points]
+            lons = [float(point['lon']) for point in points]
+        else:
+            lats = [float(request.data.get('lat'))]
+            lons = [float(request.data.get('lon'))]
         
         predictor = get_xgboost_predictor()
         
@@ -215,13 +250,24 @@ def predict_habitat(request):
                 'suitability': 'unknown'
             }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         
-        result = predictor.predict_habitat(lat, lon, species)
-        result['confidence'] = 0.85
-        result['features_used'] = ['ndvi', 'elevation', 'water_distance', 'land_cover', 'slope', 'lat', 'lon']
+        features_used = predictor.feature_names(species)
+        results = predictor.predict_habitat_batch(lats, lons, species, features)
+        for result in results:
+            result['confidence'] = 0.85
+        
+        if points is not None:
+            return Response({
+                'species': species,
+                'count': len(results),
+                'features_used': features_used,
+                'results': results
+            })
         
+        result = results[0]
+        result['features_used'] = features_used
         return Response(result)
         
-    except (ValueError, KeyError) as e:
+    except (ValueError, KeyError, TypeError) as e:
         return Response(
             {'error': f'Invalid input: {e}'},
             status=status.HTTP_400_BAD_REQUEST
@@ -233,3 +279,205 @@ def predict_habitat(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+
+@swagger_auto_schema(
+    method='get',
+    operation_summary="Habitat suitability grid",
+    operation_description=(
+        "Habitat suitability over a bounding box as a uint8 grid (rows north to south, "
+        "0-254 = score x 254, 255 = no data). Returned run-length encoded as JSON, "
+        "or as raw bytes with encoding=binary."
+    ),
+    manual_parameters=[
+        openapi.Parameter('bbox', openapi.IN_QUERY, description="min_lon,min_lat,max_lon,max_lat", type=openapi.TYPE_STRING, required=True),
+        openapi.Parameter('resolution', openapi.IN_QUERY, description="Cell size in degrees", type=openapi.TYPE_NUMBER, default=0.05),
+        openapi.Parameter('species', openapi.IN_QUERY, description="Species (elephant or wildebeest)", type=openapi.TYPE_STRING, default='elephant'),
+        openapi.Parameter('month', openapi.IN_QUERY, description="Month to score (defaults to the current month)", type=openapi.TYPE_INTEGER),
+        openapi.Parameter('encoding', openapi.IN_QUERY, description="rle or binary", type=openapi.TYPE_STRING, default='rle'),
+    ],
+    tags=['ML Predictions']
+)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def habitat_grid(request):
+    from .habitat_grid import GridRequestError, parse_bbox, suitability_grid, encode_rle, SCALE, NODATA
+    try:
+        bbox = parse_bbox(request.query_params.get('bbox'))
+        resolution = float(request.query_params.get('resolution', 0.05))
+        species = request.query_params.get('species', 'elephant').lower()
+        month = int(request.query_params.get('month', datetime.now().month))
+        encoding = request.query_params.get('encoding', 'rle').lower()
+        if not 1 <= month <= 12:
+            raise GridRequestError("month must be between 1 and 12")
+        if encoding not in ('rle', 'binary'):
+            raise GridRequestError("encoding must be 'rle' or 'binary'")
+        
+        predictor = get_xgboost_predictor()
+        if not predictor or species not in predictor.models:
+            return Response({
+                'error': f'XGBoost model not available for {species}'
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        
+        grid = suitability_grid(predictor, species, bbox, resolution, month)
+        
+        if encoding == 'binary':
+            response = HttpResponse(grid['values'].tobytes(), content_type='application/octet-stream')
+            response['X-Grid-Width'] = str(grid['width'])
+            response['X-Grid-Height'] = str(grid['height'])
+            response['X-Grid-Bbox'] = ','.join(str(v) for v in bbox)
+            response['X-Grid-Resolution'] = str(resolution)
+            response['X-Grid-Scale'] = str(SCALE)
+            response['X-Grid-Nodata'] = str(NODATA)
+            response['X-Model-Version'] = grid['model_version']
+            return response
+        
+        values, counts = encode_rle(grid['values'])
+        return Response({
+            'species': species,
+            'bbox': list(bbox),
+            'resolution': resolution,
+            'month': month,
+            'width': grid['width'],
+            'height': grid['height'],
+            'scale': SCALE,
+            'nodata': NODATA,
+            'zoom': grid['zoom'],
+            'model_version': grid['model_version'],
+            'encoding': 'rle',
+            'values': values,
+            'counts': counts,
+        })
+        
+    except (GridRequestError, ValueError, TypeError) as e:
+        return Response(
+            {'error': f'Invalid parameters: {e}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        logger.error(f"Error computing habitat grid: {e}", exc_info=True)
+        return Response(
+            {'error': 'Failed to compute habitat grid', 'detail': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+def _byte_range(header, size):
+    """(start, end) of a single 'bytes=' range, None without one, or ValueError if unsatisfiable"""
+    if not header or not header.startswith('bytes='):
+        return None
+    spec = header[len('bytes='):].strip()
+    if ',' in spec:
+        return None
+    first, _, last = spec.partition('-')
+    if not first:
+        length = int(last)
+        if length <= 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+@swagger_auto_schema(
+    method='get',
+    operation_summary="Habitat suitability tile",
+    operation_description=(
+        "One 256x256 web-mercator (XYZ) habitat suitability tile as raw uint8 bytes, rows north "
+        "to south (0-254 = score x 254, 255 = no data). Served from the precomputed tile pyramid "
+        "(manage.py build_habitat_tiles) with an ETag; tiles outside it, or built from an older model, "
+        "are rendered on demand. "
+        "Supports If-None-Match and single byte ranges."
+    ),
+    manual_parameters=[
+        openapi.Parameter('month', openapi.IN_QUERY, description="Month (defaults to the current month)", type=openapi.TYPE_INTEGER),
+    ],
+    tags=['ML Predictions']
+)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def habitat_tile(request, species, z, x, y):
+    from .habitat_grid import get_tiles, grid_version, SCALE, NODATA
+    from .tile_pyramid import get_tile_pyramid, TILE_BYTES
+    try:
+        species = species.lower()
+        month = int(request.query_params.get('month', datetime.now().month))
+        if not 1 <= month <= 12:
+            raise ValueError("month must be between 1 and 12")
+        if not (0 <= z <= 22 and 0 <= x < (1 << z) and 0 <= y < (1 << z)):
+            raise ValueError(f"tile {z}/{x}/{y} does not exist")
+        
+        pyramid = get_tile_pyramid()
+        predictor = get_xgboost_predictor()
+        has_model = bool(predictor) and species in predictor.models
+        if not has_model and species not in pyramid.species():
+            return Response({
+                'error': f'No precomputed tile and no XGBoost model for {species}'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        located = pyramid.locate(species, month, z, x, y)
+        if located is not None and has_model and located[2]['model_version'] != grid_version(predictor, species):
+            # The model or rasters changed since the pyramid was built
+            located = None
+        
+        if located is not None:
+            version = located[2]['model_version']
+            source = 'pyramid'
+        else:
+            if not has_model:
+                return Response({
+                    'error': f'No precomputed tile and no XGBoost model for {species}'
+                }, status=status.HTTP_404_NOT_FOUND)
+            if z > settings.HABITAT_GRID_MAX_ZOOM:
+                raise ValueError(f"zoom {z} is above the on-demand limit of {settings.HABITAT_GRID_MAX_ZOOM}")
+            version = grid_version(predictor, species)
+            source = 'rendered'
+        
+        etag = f'"{version}-{month}-{z}-{x}-{y}"'
+        headers = {
+            'ETag': etag,
+            'Cache-Control': f'public, max-age={settings.HABITAT_TILE_CACHE_TIMEOUT}',
+            'Accept-Ranges': 'bytes',
+            'X-Tile-Scale': str(SCALE),
+            'X-Tile-Nodata': str(NODATA),
+            'X-Model-Version': version,
+            'X-Tile-Source': source,
+        }
+        
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            try:
+                byte_range = _byte_range(request.headers.get('Range'), TILE_BYTES)
+            except ValueError:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = f'bytes */{TILE_BYTES}'
+                return response
+            start, end = byte_range or (0, TILE_BYTES - 1)
+            
+            if source == 'pyramid':
+                data = pyramid.read(species, month, z, x, y, start, end - start + 1)
+            else:
+                tile = get_tiles(predictor, species, month, z, [(x, y)], version)[(x, y)]
+                data = tile.tobytes()[start:end + 1]
+            
+            response = HttpResponse(data, content_type='application/octet-stream')
+            if byte_range:
+                response.status_code = status.HTTP_206_PARTIAL_CONTENT
+                response['Content-Range'] = f'bytes {start}-{end}/{TILE_BYTES}'
+        
+        for name, value in headers.items():
+            response[name] = value
+        return response
+        
+    except ValueError as e:
+        return Response(
+            {'error': f'Invalid parameters: {e}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        logger.error(f"Error serving habitat tile: {e}", exc_info=True)
+        return Response(
+            {'error': 'Failed to serve habitat tile', 'detail': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
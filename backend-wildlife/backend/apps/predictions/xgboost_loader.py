@@ -1,10 +1,14 @@
 import os
 import sys
 import pickle
+import hashlib
 import logging
 import numpy as np
+import pandas as pd
+from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List
+from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
@@ -13,11 +17,66 @@ ml_service_path = str(BASE_DIR / "ml_service")
 if ml_service_path not in sys.path:
     sys.path.insert(0, ml_service_path)
 
+from ml_service.core.xgboost_runtime import try_compile, apply_scaler
+
+# RasterStack layer -> feature column, as extracted by the XGBoost training pipeline
+RASTER_FEATURES = {
+    'ndvi': 'ndvi',
+    'landcover': 'land_cover',
+    'elevation': 'elevation',
+    'rainfall': 'rainfall_mm',
+    'dist_water': 'distance_to_water_km',
+    'dist_settlement': 'distance_to_settlement_km',
+    'dist_roads': 'distance_to_roads_km',
+    'dist_protected_areas': 'distance_to_protected_areas_km',
+}
+
+# Values used when the rasters are not available
+FALLBACK_FEATURES = {
+    'ndvi': 0.5,
+    'land_cover': 10,
+    'elevation': 1000.0,
+    'rainfall_mm': 800.0,
+    'distance_to_water_km': 5.0,
+    'distance_to_settlement_km': 10.0,
+    'distance_to_roads_km': 5.0,
+    'distance_to_protected_areas_km': 10.0,
+}
+
+# Request feature names accepted for the training feature names
+FEATURE_ALIASES = {
+    'rainfall': 'rainfall_mm',
+    'water_distance_km': 'distance_to_water_km',
+    'distance_to_water': 'distance_to_water_km',
+    'settlement_distance_km': 'distance_to_settlement_km',
+    'road_distance_km': 'distance_to_roads_km',
+    'protected_area_distance_km': 'distance_to_protected_areas_km',
+    'landcover': 'land_cover',
+}
+
+# MODIS IGBP classes of the land cover raster
+LAND_COVER_CLASSES = {
+    0: 'water', 1: 'evergreen needleleaf forest', 2: 'evergreen broadleaf forest',
+    3: 'deciduous needleleaf forest', 4: 'deciduous broadleaf forest', 5: 'mixed forest',
+    6: 'closed shrubland', 7: 'open shrubland', 8: 'woody savanna', 9: 'savanna',
+    10: 'grassland', 11: 'permanent wetland', 12: 'cropland', 13: 'urban',
+    14: 'cropland/natural vegetation mosaic', 15: 'snow and ice', 16: 'barren',
+}
+
+# LabelEncoder codes fitted by the training pipeline (classes sorted alphabetically)
+SPECIES_CODES = {'elephant': 0, 'wildebeest': 1}
+TIME_OF_DAY_CODES = {'afternoon': 0, 'evening': 1, 'morning': 2, 'night': 3}
+WET_SEASON_MONTHS = (3, 4, 5, 10, 11)
+
 class XGBoostHabitatPredictor:
     
     def __init__(self):
         self.models = {}
+        self.model_paths = {}
+        self.compiled = {}
         self.models_loaded = False
+        self._raster_stack = None
+        self._raster_stack_failed = False
         self._load_models()
     
     def _load_models(self):
@@ -42,6 +101,10 @@ class XGBoostHabitatPredictor:
                         model = pickle.load(f)
                     
                     self.models[species] = model
+                    self.model_paths[species] = str(model_path)
+                    compiled = try_compile(model)
+                    if compiled is not None:
+                        self.compiled[species] = compiled
                     logger.info(f"Loaded XGBoost model for {species}")
                     self.models_loaded = True
                     
@@ -50,28 +113,275 @@ class XGBoostHabitatPredictor:
             else:
                 logger.warning(f"XGBoost model not found: {model_path}")
     
-    def predict_habitat(
-        self,
-        lat: float,
-        lon: float,
-        species: str = 'elephant',
-        features: Optional[Dict] = None
-    ) -> Dict:
+    def model_version(self, species: str) -> Optional[str]:
+        """Short hash of the loaded model file, or None if the species has no model"""
+        path = self.model_paths.get(species.lower())
+        if path is None:
+            return None
+        stat = os.stat(path)
+        return hashlib.sha1(f"{path}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+
+    @property
+    def raster_stack(self):
+        """
+        Shared RasterStack of HABITAT_RASTER_DIR, or None if the rasters cannot be opened
+
+        Every band is decoded once into the memory-mapped band cache when the
+        stack is opened, so requests only index arrays that stay resident.
+        """
+        if self._raster_stack is None and not self._raster_stack_failed:
+            raster_dir = getattr(settings, 'HABITAT_RASTER_DIR', None)
+            try:
+                from ml_service.core.raster_stack import get_raster_stack
+                stack = None
+                if raster_dir and os.path.isdir(raster_dir):
+                    stack = get_raster_stack(raster_dir, cache_dir=getattr(settings, 'HABITAT_RASTER_CACHE_DIR', None))
+                if stack is not None and len(stack.layers) == 0:
+                    stack = None
+                if stack is not None:
+                    for layer in stack.layers:
+                        stack.band(layer)
+                    logger.info(f"Environmental rasters loaded: {', '.join(stack.layers)}")
+                self._raster_stack = stack
+            except Exception as e:
+                logger.warning(f"Environmental rasters not available: {e}")
+                stack = None
+            self._raster_stack_failed = stack is None
+        return self._raster_stack
+
+    @property
+    def raster_version(self) -> str:
+        """Short hash of the raster files used for features ('none' without rasters)"""
+        stack = self.raster_stack
+        if stack is None:
+            return 'none'
+        signature = []
+        for name, path in sorted(stack.paths.items()):
+            stat = os.stat(path)
+            signature.append(f"{name}|{path}|{stat.st_size}|{stat.st_mtime_ns}")
+        return hashlib.sha1("\n".join(signature).encode()).hexdigest()[:12]
+
+    def sample_environment(self, lats, lons) -> Dict[str, np.ndarray]:
+        """
+        Environmental features at many points in one raster pass
+
+        Values are prepared like the training extraction: float32 samples,
+        land cover -1 where it has no data, and the training fallbacks for
+        distance layers that are missing. Without rasters every feature takes
+        its FALLBACK_FEATURES value.
+
+        Args:
+            lats: Array of latitudes
+            lons: Array of longitudes
+
+        Returns:
+            Mapping of feature column to float64 array; NaN outside the rasters
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        stack = self.raster_stack
+        if stack is None:
+            return {name: np.full(lats.shape, float(value)) for name, value in FALLBACK_FEATURES.items()}
+
+        sampled = stack.sample(lats, lons, layers=list(RASTER_FEATURES))
+        env = {}
+        for layer, column in RASTER_FEATURES.items():
+            if layer not in sampled:
+                continue
+            values = sampled[layer]
+            if layer == 'landcover':
+                env[column] = np.where(np.isnan(values), -1.0, values)
+            else:
+                env[column] = values.astype(np.float32).astype(np.float64)
+
+        for name in ('ndvi', 'land_cover', 'elevation', 'rainfall_mm'):
+            if name not in env:
+                env[name] = np.full(lats.shape, float(FALLBACK_FEATURES[name]))
+        if 'distance_to_water_km' not in env:
+            env['distance_to_water_km'] = (1 - env['ndvi']) * 10
+        if 'distance_to_settlement_km' not in env:
+            env['distance_to_settlement_km'] = np.where(env['land_cover'] == 13, 0.5, 10.0)
+        if 'distance_to_roads_km' not in env:
+            env['distance_to_roads_km'] = (1 - env['ndvi']) * 10
+        if 'distance_to_protected_areas_km' not in env:
+            env['distance_to_protected_areas_km'] = (1 - env['ndvi']) * 10
+        return env
+
+    def feature_matrix(self, lats, lons, species: str, feature_names, when: Optional[datetime] = None,
+                       overrides: Optional[Dict] = None):
+        """
+        Model features for many points, derived like the training pipeline
+
+        Args:
+            lats: Array of latitudes
+            lons: Array of longitudes
+            species: Species name
+            feature_names: Feature columns of the model, in training order
+            when: Date and time used for the temporal features (defaults to now)
+            overrides: Environmental or model feature values applied to every
+                       point before the derived features are computed
+
+        Returns:
+            (float64 array of shape (points, features), environmental features)
+        """
+        when = when or datetime.now()
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+        env = self.sample_environment(lats, lons)
+
+        overrides = {FEATURE_ALIASES.get(name, name): float(value) for name, value in (overrides or {}).items()}
+        for name in env:
+            if name in overrides:
+                env[name] = np.full(lats.shape, overrides[name])
+
+        hour = when.hour
+        if hour <= 6:
+            time_of_day = 'night'
+        elif hour <= 12:
+            time_of_day = 'morning'
+        elif hour <= 18:
+            time_of_day = 'afternoon'
+        else:
+            time_of_day = 'evening'
+        is_wet_season = int(when.month in WET_SEASON_MONTHS)
+
+        columns = dict(env)
+        columns.update({
+            'lat': lats,
+            'lon': lons,
+            'month': when.month,
+            'hour': hour,
+            'day_of_year': when.timetuple().tm_yday,
+            'is_wet_season': is_wet_season,
+            'time_of_day_encoded': TIME_OF_DAY_CODES[time_of_day],
+            'species_encoded': SPECIES_CODES.get(species.lower(), 0),
+            'vegetation_productivity': env['ndvi'] * (env['rainfall_mm'] / 100),
+            'elevation_vegetation_index': (env['elevation'] / 1000) * env['ndvi'],
+            'water_access_quality': env['ndvi'] / (env['distance_to_water_km'] + 0.1),
+            'seasonal_resource_index': env['rainfall_mm'] * is_wet_season,
+        })
+
+        X = np.empty((len(lats), len(feature_names)))
+        for i, name in enumerate(feature_names):
+            if name in overrides:
+                X[:, i] = overrides[name]
+            elif name in columns:
+                X[:, i] = columns[name]
+            elif name.startswith('land_cover_'):
+                X[:, i] = env['land_cover'] == float(name[len('land_cover_'):])
+            else:
+                X[:, i] = 0.0
+        return X, env
+
+    def build_features(self, lats, lons, species: str, feature_names, when: Optional[datetime] = None,
+                       overrides: Optional[Dict] = None) -> pd.DataFrame:
+        """feature_matrix as a DataFrame with one column per model feature"""
+        X, _ = self.feature_matrix(lats, lons, species, feature_names, when, overrides)
+        return pd.DataFrame(X, columns=list(feature_names))
+
+    def _model_parts(self, species: str):
+        """(model, scaler, feature names, compiled ensemble or None) of a species"""
+        species = species.lower()
+        package = self.models.get(species)
+        if package is None:
+            raise KeyError(f"XGBoost model not loaded for {species}")
+
+        if isinstance(package, dict):
+            model = package['model']
+            scaler = package.get('scaler')
+            feature_names = package['feature_names']
+        else:
+            model, scaler = package, None
+            feature_names = list(getattr(model, 'feature_names_in_', []))
+        if not feature_names:
+            raise ValueError(f"XGBoost model for {species} does not record its feature names")
+        return model, scaler, feature_names, self.compiled.get(species)
+
+    def feature_names(self, species: str) -> List[str]:
+        """Feature columns of a species' model in training order, empty if it is not loaded"""
+        try:
+            return list(self._model_parts(species)[2])
+        except (KeyError, ValueError):
+            return []
+
+    def predict_features(self, species: str, features) -> np.ndarray:
+        """
+        Suitability probability of feature rows (from feature_matrix or build_features)
+
+        Rows with missing features score NaN. Small inputs are evaluated by the
+        compiled tree runtime, large ones by XGBoost's threaded predictor.
+        """
+        model, scaler, feature_names, compiled = self._model_parts(species)
+        if isinstance(features, pd.DataFrame):
+            features = features[feature_names].to_numpy(dtype=float)
+        no_data = np.isnan(features).any(axis=1)
+
+        scores = np.full(len(features), np.nan)
+        if (~no_data).any():
+            valid = features[~no_data]
+            if compiled is not None:
+                scores[~no_data] = compiled.predict_proba(apply_scaler(scaler, valid))[:, 1]
+            else:
+                valid = pd.DataFrame(valid, columns=feature_names)
+                X = scaler.transform(valid) if scaler is not None else valid
+                scores[~no_data] = model.predict_proba(X)[:, 1]
+        return scores
+
+    def score_points(self, lats, lons, species: str = 'elephant', when: Optional[datetime] = None,
+                     overrides: Optional[Dict] = None) -> np.ndarray:
+        """
+        Habitat suitability probability for many points with one model call
+
+        Args:
+            lats: Array of latitudes
+            lons: Array of longitudes
+            species: Species name
+            when: Date and time used for the temporal features
+            overrides: Feature values applied to every point
+
+        Returns:
+            Float array of scores in [0, 1]; NaN where the rasters have no data
+        """
+        _, _, feature_names, _ = self._model_parts(species)
+        X, _ = self.feature_matrix(lats, lons, species, feature_names, when, overrides)
+        return self.predict_features(species, X)
+
+    def predict_habitat_batch(self, lats, lons, species: str = 'elephant',
+                              features: Optional[Dict] = None) -> List[Dict]:
+        """
+        Habitat suitability of many points with one raster pass and one model call
+
+        Args:
+            lats: Latitudes
+            lons: Longitudes
+            species: Species name
+            features: Feature values applied to every point instead of the raster values
+
+        Returns:
+            One predict_habitat result per point; points outside the rasters
+            get the default result
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
         species_lower = species.lower()
         
-        model = self.models.get(species_lower)
-        
-        if not model:
+        if species_lower not in self.models:
             logger.warning(f"XGBoost model not loaded for {species}")
-            return self._get_default_habitat(lat, lon, species)
+            return [self._get_default_habitat(float(lat), float(lon), species) for lat, lon in zip(lats, lons)]
         
         try:
-            if features:
-                feature_vector = self._prepare_features(lat, lon, features)
-            else:
-                feature_vector = self._extract_features_from_location(lat, lon, species)
-            
-            habitat_score = model.predict(feature_vector)[0]
+            _, _, feature_names, _ = self._model_parts(species_lower)
+            X, _ = self.feature_matrix(lats, lons, species_lower, feature_names, overrides=features)
+            scores = self.predict_features(species_lower, X)
+        except Exception as e:
+            logger.error(f"Error predicting habitat for {species}: {e}")
+            return [self._get_default_habitat(float(lat), float(lon), species) for lat, lon in zip(lats, lons)]
+        
+        results = []
+        for i, habitat_score in enumerate(scores):
+            lat, lon = float(lats[i]), float(lons[i])
+            if np.isnan(habitat_score):
+                results.append(self._get_default_habitat(lat, lon, species))
+                continue
             
             if habitat_score > 0.7:
                 suitability = 'High'
@@ -80,53 +390,24 @@ class XGBoostHabitatPredictor:
             else:
                 suitability = 'Low'
             
-            return {
+            results.append({
                 'habitat_score': float(habitat_score),
                 'suitability': suitability,
                 'location': {'lat': lat, 'lon': lon},
                 'species': species,
                 'model': 'xgboost',
-                'features': feature_vector.tolist() if hasattr(feature_vector, 'tolist') else []
-            }
-            
-        except Exception as e:
-            logger.error(f"Error predicting habitat for {species}: {e}")
-            return self._get_default_habitat(lat, lon, species)
-    
-    def _prepare_features(self, lat: float, lon: float, features: Dict) -> np.ndarray:
-        feature_list = [
-            features.get('ndvi', 0.5),
-            features.get('elevation', 1000),
-            features.get('slope', 5.0),
-            features.get('water_distance_km', 2.0),
-            features.get('land_cover', 0.5),
-            lat,
-            lon
-        ]
-        
-        return np.array([feature_list])
+                'features': X[i].tolist()
+            })
+        return results
     
-    def _extract_features_from_location(self, lat: float, lon: float, species: str) -> np.ndarray:
-        if -3.0 <= lat <= -1.0 and 35.0 <= lon <= 38.0:
-            ndvi = 0.6
-            elevation = 1200
-            water_dist = 2.5
-        else:
-            ndvi = 0.5
-            elevation = 1000
-            water_dist = 5.0
-        
-        features = [
-            ndvi,
-            elevation,
-            5.0,
-            water_dist,
-            0.6,
-            lat,
-            lon
-        ]
-        
-        return np.array([features])
+    def predict_habitat(
+        self,
+        lat: float,
+        lon: float,
+        species: str = 'elephant',
+        features: Optional[Dict] = None
+    ) -> Dict:
+        return self.predict_habitat_batch([lat], [lon], species, features)[0]
     
     def _get_default_habitat(self, lat: float, lon: float, species: str) -> Dict:
         return {
@@ -146,6 +427,21 @@ class XGBoostHabitatPredictor:
         species: str = 'elephant'
     ) -> Dict:
         habitat = self.predict_habitat(lat, lon, species)
+        env = {name: float(values[0]) for name, values in self.sample_environment([lat], [lon]).items()}
+        
+        def value(name):
+            return None if np.isnan(env[name]) else round(env[name], 4)
+        
+        ndvi = value('ndvi')
+        if ndvi is None:
+            vegetation_density = None
+        elif ndvi < 0.2:
+            vegetation_density = 'sparse'
+        elif ndvi < 0.5:
+            vegetation_density = 'moderate'
+        else:
+            vegetation_density = 'dense'
+        land_cover_code = int(env['land_cover'])
         
         result = {
             'center': {'lat': lat, 'lon': lon},
@@ -153,12 +449,17 @@ class XGBoostHabitatPredictor:
             'species': species,
             'habitat': habitat,
             'features': {
-                'ndvi': 0.6,
-                'elevation': 1200,
-                'water_distance_km': 2.5,
-                'land_cover': 'grassland',
-                'slope': 5.2,
-                'vegetation_density': 'moderate'
+                'ndvi': ndvi,
+                'elevation': value('elevation'),
+                'rainfall_mm': value('rainfall_mm'),
+                'water_distance_km': value('distance_to_water_km'),
+                'settlement_distance_km': value('distance_to_settlement_km'),
+                'road_distance_km': value('distance_to_roads_km'),
+                'protected_area_distance_km': value('distance_to_protected_areas_km'),
+                'land_cover': LAND_COVER_CLASSES.get(land_cover_code, 'unknown'),
+                'land_cover_code': land_cover_code,
+                'vegetation_density': vegetation_density,
+                'source': 'rasters' if self.raster_stack is not None else 'defaults'
             },
             'model_available': species.lower() in self.models,
             'model_type': 'xgboost' if species.lower() in self.models else 'default'
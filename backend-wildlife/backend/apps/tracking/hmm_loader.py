@@ -5,9 +5,16 @@ import logging
 import numpy as np
 from pathlib import Path
 from typing import Optional, Dict, List
+from django.core.cache import cache
 
 logger = logging.getLogger(__name__)
 
+try:
+    # Compiled forward/backward/Viterbi kernels shipped with hmmlearn
+    from hmmlearn import _hmmc
+except ImportError:
+    _hmmc = None
+
 BASE_DIR = Path(__file__).resolve().parents[2]
 ml_service_path = str(BASE_DIR / "ml_service")
 if ml_service_path not in sys.path:
@@ -20,9 +27,28 @@ class HMMBehaviorPredictor:
     STATE_TRAVELING = 'traveling'
     STATE_MIGRATING = 'migrating'
     
+    STATE_MAPPING = {
+        0: STATE_RESTING,
+        1: STATE_FORAGING,
+        2: STATE_TRAVELING,
+        3: STATE_MIGRATING
+    }
+    
+    # (rest, forage, travel) speed thresholds in km/h for the rule-based fallback
+    RULE_THRESHOLDS = {
+        'elephant': (0.5, 2.0, 6.0),
+        'wildebeest': (0.8, 3.0, 10.0)
+    }
+    DEFAULT_RULE_THRESHOLDS = (0.5, 2.5, 8.0)
+    
+    # Filtered state distributions of animals without a new fix for this long are dropped
+    FILTER_CACHE_TIMEOUT = 86400
+    
     def __init__(self):
         self.models = {}
         self.models_loaded = False
+        self._emission_params = {}
+        self._filter_states = {}
         self._load_models()
     
     def _load_models(self):
@@ -109,6 +135,21 @@ class HMMBehaviorPredictor:
         prev_angle: Optional[float],
         species: str
     ) -> str:
+        try:
+            observation = self._build_observation(speed, angle, prev_speed)
+            probabilities = self._forward_step(model, species, None, observation)
+            return self._state_to_behavior(int(np.argmax(probabilities)))
+            
+        except Exception as e:
+            logger.warning(f"HMM decode error: {e}")
+            return self._predict_with_rules(speed, angle, prev_speed, prev_angle, species)
+    
+    def _build_observation(
+        self,
+        speed: float,
+        angle: Optional[float],
+        prev_speed: Optional[float]
+    ) -> np.ndarray:
         features = [speed]
         
         if angle is not None:
@@ -117,28 +158,178 @@ class HMMBehaviorPredictor:
         if prev_speed is not None:
             features.append(prev_speed)
         
-        observation = np.array([features])
+        return np.array(features, dtype=float)
+    
+    def _state_to_behavior(self, state: int) -> str:
+        return self.STATE_MAPPING.get(state, self.STATE_TRAVELING)
+    
+    def _model_n_features(self, model) -> Optional[int]:
+        n_features = getattr(model, 'n_features', None)
+        if n_features is None and hasattr(model, 'means_'):
+            n_features = np.shape(model.means_)[1]
+        return n_features
+    
+    def _emission_log_likelihood(self, model, species: str, observations: np.ndarray) -> np.ndarray:
+        """Log likelihood of each observation row under each hidden state, shape (n_obs, n_states)"""
+        n_features = self._model_n_features(model)
+        if n_features is not None and observations.shape[1] != n_features:
+            raise ValueError(f"model expects {n_features} features, got {observations.shape[1]}")
+        
+        if not (hasattr(model, 'means_') and hasattr(model, 'covars_')):
+            return model._compute_log_likelihood(observations)
+        
+        # Gaussian emissions: invert the covariances once per model
+        params = self._emission_params.get(species.lower())
+        if params is None or params[0] is not model:
+            covars = np.asarray(model.covars_, dtype=float)
+            means = np.asarray(model.means_, dtype=float)
+            if covars.ndim == 2:
+                covars = np.array([np.diag(c) for c in covars])
+            cholesky = np.linalg.cholesky(covars)
+            cholesky_inv = np.linalg.inv(cholesky)
+            log_norm = -0.5 * means.shape[1] * np.log(2 * np.pi) - np.log(
+                np.diagonal(cholesky, axis1=1, axis2=2)
+            ).sum(axis=1)
+            params = (model, means, cholesky_inv, log_norm)
+            self._emission_params[species.lower()] = params
+        
+        _, means, cholesky_inv, log_norm = params
+        whitened = np.einsum('kij,nkj->nki', cholesky_inv, observations[:, np.newaxis, :] - means)
+        return log_norm - 0.5 * (whitened ** 2).sum(axis=2)
+    
+    def _forward_step(
+        self,
+        model,
+        species: str,
+        probabilities: Optional[np.ndarray],
+        observation: Optional[np.ndarray]
+    ) -> np.ndarray:
+        """
+        One forward-algorithm update of the filtered state distribution.
+        
+        Propagates the previous distribution through the transition matrix
+        (or starts from the initial distribution) and weights it by the
+        observation likelihood, O(K^2) for K states. A missing observation
+        only applies the transition.
+        """
+        if probabilities is None:
+            prior = np.asarray(model.startprob_, dtype=float)
+        else:
+            prior = probabilities @ np.asarray(model.transmat_, dtype=float)
+        
+        if observation is None:
+            return prior / prior.sum()
         
+        log_likelihood = self._emission_log_likelihood(model, species, observation[np.newaxis, :])[0]
+        log_posterior = np.log(np.maximum(prior, 1e-300)) + log_likelihood
+        log_posterior -= log_posterior.max()
+        posterior = np.exp(log_posterior)
+        return posterior / posterior.sum()
+    
+    def _behavior_probabilities(self, probabilities: np.ndarray) -> Dict[str, float]:
+        return self._behavior_probability_rows(probabilities[np.newaxis, :])[0]
+    
+    def _behavior_probability_rows(self, probabilities: np.ndarray) -> List[Dict[str, float]]:
+        """Sum state probabilities (n_obs, n_states) into one behavior dict per row"""
+        state_behaviors = [self._state_to_behavior(state) for state in range(probabilities.shape[1])]
+        behaviors = list(dict.fromkeys(state_behaviors))
+        membership = np.array(
+            [[behavior == name for name in behaviors] for behavior in state_behaviors], dtype=float
+        )
+        return [dict(zip(behaviors, row)) for row in (probabilities @ membership).tolist()]
+    
+    def _filter_cache_key(self, animal_id, species: str) -> str:
+        return f"hmm_filter:{species.lower()}:{animal_id}"
+    
+    def _get_filter_state(self, key: str) -> Optional[Dict]:
         try:
-            if hasattr(model, 'predict'):
-                state = model.predict(observation)[0]
-            elif hasattr(model, 'decode'):
-                state = model.decode(observation)[0]
-            else:
-                return self._predict_with_rules(speed, angle, prev_speed, prev_angle, species)
-            
-            state_mapping = {
-                0: self.STATE_RESTING,
-                1: self.STATE_FORAGING,
-                2: self.STATE_TRAVELING,
-                3: self.STATE_MIGRATING
-            }
+            return cache.get(key)
+        except Exception as e:
+            logger.debug(f"HMM filter cache unavailable, using process memory: {e}")
+            return self._filter_states.get(key)
+    
+    def _set_filter_state(self, key: str, filter_state: Dict):
+        try:
+            cache.set(key, filter_state, self.FILTER_CACHE_TIMEOUT)
+        except Exception as e:
+            logger.debug(f"HMM filter cache unavailable, using process memory: {e}")
+            self._filter_states[key] = filter_state
+    
+    def update_behavior(
+        self,
+        animal_id,
+        speed_kmh: float,
+        directional_angle: Optional[float] = None,
+        prev_speed: Optional[float] = None,
+        prev_angle: Optional[float] = None,
+        species: str = 'elephant',
+        timestamp=None
+    ) -> Dict:
+        """
+        Classify an animal's newest fix with its running forward filter.
+        
+        The filtered state distribution of each animal is kept in the cache
+        between calls, so every new fix costs one O(K^2) update instead of
+        re-decoding a window. Fixes at or before the last processed
+        timestamp return the stored result without updating.
+        
+        Returns:
+            Dict with 'behavior', 'behavior_probabilities' and 'model_used'
+        """
+        model = self.models.get(species.lower())
+        
+        if model:
+            key = self._filter_cache_key(animal_id, species)
+            filter_state = self._get_filter_state(key)
             
-            return state_mapping.get(state, self.STATE_TRAVELING)
+            if (
+                filter_state is not None and timestamp is not None
+                and filter_state.get('timestamp') is not None
+                and timestamp <= filter_state['timestamp']
+            ):
+                probabilities = np.asarray(filter_state['probabilities'])
+                return {
+                    'behavior': self._state_to_behavior(int(np.argmax(probabilities))),
+                    'behavior_probabilities': self._behavior_probabilities(probabilities),
+                    'model_used': 'hmm'
+                }
             
+            try:
+                previous = np.asarray(filter_state['probabilities']) if filter_state else None
+                observation = self._build_observation(speed_kmh, directional_angle, prev_speed)
+                probabilities = self._forward_step(model, species, previous, observation)
+                
+                self._set_filter_state(key, {
+                    'probabilities': probabilities.tolist(),
+                    'timestamp': timestamp
+                })
+                
+                return {
+                    'behavior': self._state_to_behavior(int(np.argmax(probabilities))),
+                    'behavior_probabilities': self._behavior_probabilities(probabilities),
+                    'model_used': 'hmm'
+                }
+            except Exception as e:
+                logger.warning(f"HMM filter update failed for {species}: {e}, using rules")
+        
+        return {
+            'behavior': self._predict_with_rules(
+                speed_kmh, directional_angle, prev_speed, prev_angle, species
+            ),
+            'behavior_probabilities': None,
+            'model_used': 'rule_based'
+        }
+    
+    def reset_behavior_filter(self, animal_id, species: str = 'elephant'):
+        key = self._filter_cache_key(animal_id, species)
+        self._filter_states.pop(key, None)
+        try:
+            cache.delete(key)
         except Exception as e:
-            logger.warning(f"HMM decode error: {e}")
-            return self._predict_with_rules(speed, angle, prev_speed, prev_angle, species)
+            logger.debug(f"HMM filter cache unavailable: {e}")
+    
+    def _rule_thresholds(self, species: str):
+        return self.RULE_THRESHOLDS.get(species.lower(), self.DEFAULT_RULE_THRESHOLDS)
     
     def _predict_with_rules(
         self,
@@ -148,20 +339,7 @@ class HMMBehaviorPredictor:
         prev_angle: Optional[float],
         species: str
     ) -> str:
-        species_lower = species.lower()
-        
-        if species_lower == 'elephant':
-            rest_threshold = 0.5
-            forage_threshold = 2.0
-            travel_threshold = 6.0
-        elif species_lower == 'wildebeest':
-            rest_threshold = 0.8
-            forage_threshold = 3.0
-            travel_threshold = 10.0
-        else:
-            rest_threshold = 0.5
-            forage_threshold = 2.5
-            travel_threshold = 8.0
+        rest_threshold, forage_threshold, travel_threshold = self._rule_thresholds(species)
         
         direction_change = 0
         if angle is not None and prev_angle is not None:
@@ -190,6 +368,180 @@ class HMMBehaviorPredictor:
             else:
                 return self.STATE_TRAVELING
     
+    def _predict_with_rules_batch(
+        self,
+        speed: np.ndarray,
+        angle: np.ndarray,
+        prev_angle: np.ndarray,
+        species: str
+    ) -> np.ndarray:
+        """Vectorized _predict_with_rules; missing angles count as no direction change"""
+        rest_threshold, forage_threshold, travel_threshold = self._rule_thresholds(species)
+        
+        direction_change = np.abs(angle - prev_angle)
+        direction_change = np.where(direction_change > 180, 360 - direction_change, direction_change)
+        direction_change = np.nan_to_num(direction_change, nan=0.0)
+        
+        return np.select(
+            [
+                speed < rest_threshold,
+                (speed < forage_threshold) & (direction_change > 45),
+                speed < forage_threshold,
+                (speed < travel_threshold) & (direction_change < 30),
+                speed < travel_threshold,
+                direction_change < 20,
+            ],
+            [
+                self.STATE_RESTING,
+                self.STATE_FORAGING,
+                self.STATE_RESTING,
+                self.STATE_TRAVELING,
+                self.STATE_FORAGING,
+                self.STATE_MIGRATING,
+            ],
+            default=self.STATE_TRAVELING
+        )
+    
+    def _sequence_features(self, tracking_points: List[Dict]):
+        """Speed and heading columns of a point sequence, with NaN for missing values"""
+        def column(name):
+            return np.array(
+                [np.nan if point.get(name) is None else point.get(name) for point in tracking_points],
+                dtype=float
+            )
+        
+        speed = np.array([point.get('speed_kmh', 0) for point in tracking_points], dtype=float)
+        angle = column('directional_angle')
+        prev_speed = np.concatenate([[np.nan], speed[:-1]])
+        prev_angle = np.concatenate([[np.nan], angle[:-1]])
+        return speed, angle, prev_speed, prev_angle
+    
+    def _viterbi(self, model, log_emissions: np.ndarray) -> np.ndarray:
+        """Most likely state path in log space; rows of zeros are missing observations"""
+        if _hmmc is not None:
+            return _hmmc.viterbi(
+                np.asarray(model.startprob_, dtype=np.float64),
+                np.asarray(model.transmat_, dtype=np.float64),
+                np.ascontiguousarray(log_emissions, dtype=np.float64)
+            )[1]
+        
+        with np.errstate(divide='ignore'):
+            log_startprob = np.log(np.asarray(model.startprob_, dtype=float))
+            log_transmat = np.log(np.asarray(model.transmat_, dtype=float))
+        
+        n_obs, n_states = log_emissions.shape
+        backpointers = np.empty((n_obs, n_states), dtype=np.intp)
+        delta = log_startprob + log_emissions[0]
+        for t in range(1, n_obs):
+            scores = delta[:, np.newaxis] + log_transmat
+            backpointers[t] = scores.argmax(axis=0)
+            delta = scores[backpointers[t], np.arange(n_states)] + log_emissions[t]
+        
+        path = np.empty(n_obs, dtype=np.intp)
+        path[-1] = delta.argmax()
+        for t in range(n_obs - 1, 0, -1):
+            path[t - 1] = backpointers[t, path[t]]
+        return path
+    
+    def _forward_backward(self, model, log_emissions: np.ndarray) -> np.ndarray:
+        """Posterior state probabilities of every observation (scaled forward-backward)"""
+        startprob = np.asarray(model.startprob_, dtype=float)
+        transmat = np.asarray(model.transmat_, dtype=float)
+        
+        # Per-row rescaling keeps the likelihoods finite and cancels in normalization
+        emissions = np.exp(log_emissions - log_emissions.max(axis=1, keepdims=True))
+        n_obs, n_states = emissions.shape
+        
+        if _hmmc is not None:
+            _, alpha, scale = _hmmc.forward_scaling(startprob, transmat, emissions)
+            beta = _hmmc.backward_scaling(startprob, transmat, emissions, scale)
+            posteriors = alpha * beta
+            return posteriors / posteriors.sum(axis=1, keepdims=True)
+        
+        alpha = np.empty((n_obs, n_states))
+        scale = np.empty(n_obs)
+        alpha[0] = startprob * emissions[0]
+        scale[0] = alpha[0].sum()
+        alpha[0] /= scale[0]
+        for t in range(1, n_obs):
+            alpha[t] = (alpha[t - 1] @ transmat) * emissions[t]
+            scale[t] = alpha[t].sum()
+            alpha[t] /= scale[t]
+        
+        beta = np.ones((n_obs, n_states))
+        for t in range(n_obs - 2, -1, -1):
+            beta[t] = transmat @ (emissions[t + 1] * beta[t + 1]) / scale[t + 1]
+        
+        posteriors = alpha * beta
+        return posteriors / posteriors.sum(axis=1, keepdims=True)
+    
+    def decode_sequence(
+        self,
+        tracking_points: List[Dict],
+        species: str = 'elephant'
+    ) -> Dict:
+        """
+        Decode a whole window of fixes in one pass.
+        
+        With a model, builds the feature matrix once, runs log-space Viterbi
+        for the state path and forward-backward for per-point posteriors.
+        Points whose features do not fit the model are decoded as missing
+        observations and labelled by the rules, as predict_behavior does.
+        Without a model the rules are applied to all points at once.
+        
+        Returns:
+            Dict with 'behaviors' (one label per point), 'states' (HMM state
+            per point, None without a model), 'behavior_probabilities'
+            (per-point dict, None where not decoded) and 'model_used'
+        """
+        n_points = len(tracking_points)
+        if n_points == 0:
+            return {'behaviors': [], 'states': None, 'behavior_probabilities': [], 'model_used': 'rule_based'}
+        
+        speed, angle, prev_speed, prev_angle = self._sequence_features(tracking_points)
+        speed = np.nan_to_num(speed, nan=0.0)
+        rule_behaviors = self._predict_with_rules_batch(speed, angle, prev_angle, species)
+        
+        model = self.models.get(species.lower())
+        if model:
+            try:
+                # Same features as _build_observation: speed, then angle and previous speed when present
+                features = np.column_stack([speed, angle, prev_speed])
+                present = ~np.isnan(features)
+                order = np.argsort(~present, axis=1, kind='stable')
+                compact = np.take_along_axis(features, order, axis=1)
+                
+                n_features = self._model_n_features(model) or features.shape[1]
+                fits = present.sum(axis=1) == n_features
+                
+                log_emissions = np.zeros((n_points, model.n_components))
+                if fits.any():
+                    log_emissions[fits] = self._emission_log_likelihood(model, species, compact[fits, :n_features])
+                
+                states = self._viterbi(model, log_emissions)
+                posteriors = self._forward_backward(model, log_emissions)
+                
+                state_behaviors = np.array([self._state_to_behavior(state) for state in range(model.n_components)])
+                behaviors = np.where(fits, state_behaviors[states], rule_behaviors)
+                return {
+                    'behaviors': behaviors.tolist(),
+                    'states': states.tolist(),
+                    'behavior_probabilities': [
+                        row if fit else None
+                        for row, fit in zip(self._behavior_probability_rows(posteriors), fits.tolist())
+                    ],
+                    'model_used': 'hmm'
+                }
+            except Exception as e:
+                logger.warning(f"HMM sequence decoding failed for {species}: {e}, using rules")
+        
+        return {
+            'behaviors': rule_behaviors.tolist(),
+            'states': None,
+            'behavior_probabilities': [None] * n_points,
+            'model_used': 'rule_based'
+        }
+    
     def analyze_movement_sequence(
         self,
         tracking_points: List[Dict],
@@ -198,28 +550,18 @@ class HMMBehaviorPredictor:
         if not tracking_points:
             return []
         
-        analyzed = []
+        decoded = self.decode_sequence(tracking_points, species)
         
-        for i, point in enumerate(tracking_points):
-            speed = point.get('speed_kmh', 0)
-            angle = point.get('directional_angle')
-            
-            prev_speed = None
-            prev_angle = None
-            if i > 0:
-                prev_speed = tracking_points[i-1].get('speed_kmh')
-                prev_angle = tracking_points[i-1].get('directional_angle')
-            
-            behavior = self.predict_behavior(
-                speed, angle, prev_speed, prev_angle, species
-            )
-            
-            analyzed.append({
+        return [
+            {
                 **point,
-                'behavior_state': behavior
-            })
-        
-        return analyzed
+                'behavior_state': behavior,
+                'behavior_probabilities': probabilities
+            }
+            for point, behavior, probabilities in zip(
+                tracking_points, decoded['behaviors'], decoded['behavior_probabilities']
+            )
+        ]
 
 _hmm_predictor = None
 
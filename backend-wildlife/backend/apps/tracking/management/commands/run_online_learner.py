@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.tracking.online_learning import OnlineLearningWorker
+
+
+class Command(BaseCommand):
+    help = 'Fine-tune the LSTM movement models on newly stored tracking fixes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the pending fixes once and exit')
+        parser.add_argument('--force', action='store_true', help='With --once, fine-tune however few windows are pending')
+        parser.add_argument('--interval', type=int, default=settings.ONLINE_LSTM_INTERVAL,
+                            help='Seconds between polls')
+
+    def handle(self, *args, **options):
+        worker = OnlineLearningWorker()
+
+        if options['once']:
+            result = worker.run_once(force=options['force'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Read {result['rows']} fixes, built {result['windows']} windows, published {result['published'] or 'nothing'}"
+            ))
+            return
+
+        self.stdout.write(f"Online learner polling every {options['interval']}s")
+        worker.run_forever(interval=options['interval'])
@@ -0,0 +1,174 @@
+"""
+Online LSTM learning from newly stored Tracking rows
+
+OnlineLearningWorker reads the fixes created since its watermark, feeds them
+to an OnlineLSTMLearner and stores the new watermark together with the
+windows still waiting for a fine-tune. It runs once per call of run_once,
+from the Celery task in tasks.py, or as a loop through the
+run_online_learner management command.
+"""
+
+import json
+import time
+import uuid
+import logging
+from pathlib import Path
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import Tracking
+
+logger = logging.getLogger(__name__)
+
+RECORD_FIELDS = ('id', 'animal_id', 'animal__species', 'timestamp', 'lat', 'lon', 'speed_kmh', 'created_at')
+
+
+def _to_record(row):
+    record = dict(row)
+    record['species'] = (record.pop('animal__species') or '').lower()
+    return record
+
+
+class OnlineLearningWorker:
+
+    def __init__(self, learner=None, state_path=None, batch_size=None):
+        """
+        Args:
+            learner: OnlineLSTMLearner (built from settings, with the real-time tracker, if None)
+            state_path: JSON file holding the watermark (defaults to ONLINE_LSTM_DIR/watermark.json)
+            batch_size: Maximum Tracking rows read per run
+        """
+        if learner is None:
+            learner = self._build_learner()
+        self.learner = learner
+        self.state_path = Path(state_path or Path(settings.ONLINE_LSTM_DIR) / "watermark.json")
+        self.batch_size = batch_size or settings.ONLINE_LSTM_BATCH_SIZE
+        self.pending_file = None
+        self.watermark = self.load_watermark()
+
+    @staticmethod
+    def _build_learner():
+        from ml_service.core.online_learner import OnlineLSTMLearner
+        from .views import get_realtime_tracker_lazy
+
+        return OnlineLSTMLearner(
+            artifact_dir=settings.ONLINE_LSTM_DIR,
+            tracker=get_realtime_tracker_lazy(),
+            min_windows=settings.ONLINE_LSTM_MIN_WINDOWS,
+            epochs=settings.ONLINE_LSTM_EPOCHS
+        )
+
+    def load_watermark(self):
+        """(created_at, id) of the last row already consumed, or None
+
+        Windows built from rows up to the watermark that were not yet
+        fine-tuned on are stored next to it and handed back to the learner.
+        """
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            watermark = parse_datetime(state['created_at']), state['id']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        self.pending_file = state.get('pending')
+        if self.pending_file:
+            try:
+                self.learner.load_pending(self.state_path.parent / self.pending_file)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Could not restore pending online learning windows: {e}")
+        return watermark
+
+    def save_watermark(self, created_at, row_id):
+        """Store the watermark together with the learner's pending windows"""
+        self.watermark = (created_at, str(row_id))
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # A new pending file is written before the watermark that points at it
+        previous_file = self.pending_file
+        self.pending_file = None
+        if any(self.learner.pending.values()):
+            self.pending_file = f"{self.state_path.stem}.pending-{uuid.uuid4().hex}.npz"
+            self.learner.save_pending(self.state_path.parent / self.pending_file)
+
+        tmp_path = self.state_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'created_at': created_at.isoformat(), 'id': str(row_id), 'pending': self.pending_file}, f)
+        tmp_path.replace(self.state_path)
+
+        if previous_file and previous_file != self.pending_file:
+            (self.state_path.parent / previous_file).unlink(missing_ok=True)
+
+    def fetch_new_rows(self):
+        """Tracking rows created after the watermark, oldest first"""
+        queryset = Tracking.objects.all()
+        if self.watermark is not None:
+            created_at, row_id = self.watermark
+            # The id breaks ties between rows stored in the same instant
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=row_id))
+        return list(queryset.order_by('created_at', 'id').values(*RECORD_FIELDS)[:self.batch_size])
+
+    def _prime_new_animals(self, records):
+        """Give animals seen for the first time by this process their recent history"""
+        first_fix = {}
+        for record in records:
+            animal_id = record['animal_id']
+            if animal_id not in self.learner.tails:
+                first_fix[animal_id] = min(record['timestamp'], first_fix.get(animal_id, record['timestamp']))
+
+        for animal_id, timestamp in first_fix.items():
+            history = Tracking.objects.filter(
+                animal_id=animal_id, timestamp__lt=timestamp
+            ).order_by('-timestamp').values(*RECORD_FIELDS)[:self.learner.sequence_length]
+            self.learner.prime(animal_id, [_to_record(row) for row in history])
+
+    def run_once(self, force=False):
+        """
+        Consume new fixes and fine-tune every species with enough new windows
+
+        Args:
+            force: Fine-tune even if fewer than min_windows windows are pending
+
+        Returns:
+            Dict with the rows read, windows built and versions published
+        """
+        rows = self.fetch_new_rows()
+        records = [_to_record(row) for row in rows]
+
+        windows = 0
+        if records:
+            self._prime_new_animals(records)
+            windows = self.learner.ingest(records)
+
+        published = self.learner.update(force=force)
+        if records:
+            self.save_watermark(rows[-1]['created_at'], rows[-1]['id'])
+        elif published and self.watermark is not None:
+            # The consumed windows must not be restored on the next start
+            self.save_watermark(*self.watermark)
+        if records or published:
+            logger.info(f"Online learner read {len(records)} fixes, built {windows} windows, published {published}")
+
+        return {'rows': len(records), 'windows': windows, 'published': published}
+
+    def run_forever(self, interval=None):
+        """Poll for new fixes every interval seconds"""
+        interval = interval or settings.ONLINE_LSTM_INTERVAL
+        while True:
+            try:
+                result = self.run_once()
+                if result['rows'] >= self.batch_size:
+                    continue
+            except Exception as e:
+                logger.error(f"Online learner run failed: {e}", exc_info=True)
+            time.sleep(interval)
+
+
+_worker = None
+
+def get_online_learning_worker():
+    global _worker
+    if _worker is None:
+        _worker = OnlineLearningWorker()
+    return _worker
@@ -0,0 +1,24 @@
+"""
+Background tasks for the tracking app
+
+Celery is optional: without it the same work runs through the
+run_online_learner management command.
+"""
+
+try:
+    from celery import shared_task
+    CELERY_AVAILABLE = True
+except ImportError:
+    CELERY_AVAILABLE = False
+
+from .online_learning import get_online_learning_worker
+
+
+def update_lstm_from_tracking(force=False):
+    """Fine-tune the LSTM models on tracking fixes stored since the last run"""
+    return get_online_learning_worker().run_once(force=force)
+
+
+if CELERY_AVAILABLE:
+    # Schedule with celery beat, e.g. every ONLINE_LSTM_INTERVAL seconds
+    update_lstm_from_tracking = shared_task(name='tracking.update_lstm_from_tracking')(update_lstm_from_tracking)
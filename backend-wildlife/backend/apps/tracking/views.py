@@ -193,7 +193,8 @@ def analyze_behavior(request):
                     'timestamp': p['timestamp'],
                     'behavior': p.get('behavior_state'),
                     'speed_kmh': p.get('speed_kmh'),
-                    'direction': p.get('directional_angle')
+                    'direction': p.get('directional_angle'),
+                    'probabilities': p.get('behavior_probabilities')
                 }
                 for p in analyzed_points[-10:]
             ],
@@ -241,13 +242,15 @@ def behavior_summary(request):
             
             behavior = latest.activity_type
             if not behavior:
-                behavior = hmm_predictor.predict_behavior(
+                behavior = hmm_predictor.update_behavior(
+                    animal_id=animal.id,
                     speed_kmh=latest.speed_kmh or 0,
                     directional_angle=latest.directional_angle,
                     prev_speed=prev.speed_kmh if prev else None,
                     prev_angle=prev.directional_angle if prev else None,
-                    species=animal.species
-                )
+                    species=animal.species,
+                    timestamp=latest.timestamp
+                )['behavior']
             
             results.append({
                 'animal_id': str(animal.id),
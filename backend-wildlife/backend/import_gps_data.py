@@ -34,11 +34,15 @@ django.setup()
 from apps.tracking.models import Tracking
 from apps.animals.models import Animal
 from django.contrib.auth import get_user_model
+from ml_service.models.dataset_cache import read_csv_cached
 import httpx
 import tempfile
 
 User = get_user_model()
 
+# Parsed CSVs are kept as Parquet next to the download cache
+DATASET_CACHE_DIR = os.getenv('DATASET_CACHE_DIR', str(Path(tempfile.gettempdir()) / "gps_import_cache" / "datasets"))
+
 
 def download_from_cloudflare(cloudflare_base_url: str, file_path: str):
     """Download file from Cloudflare R2 and return local path"""
@@ -133,39 +137,6 @@ def import_gps_data_from_cloudflare(species: str, max_points_per_animal: int = 2
         print(f"  Place {hmm_file.name} in backend/ directory")
         return
     
-    # Load BBMM GPS data
-    print(f"Loading BBMM GPS data: {bbmm_file.name}")
-    bbmm_df = pd.read_csv(bbmm_file, low_memory=False)
-    bbmm_df.columns = bbmm_df.columns.str.strip()
-    print(f"  Loaded {len(bbmm_df)} records with GPS coordinates")
-    
-    # Load HMM 3-state predictions
-    print(f"Loading HMM 3-state predictions: {hmm_file.name}")
-    hmm_df = pd.read_csv(hmm_file)
-    hmm_df.columns = hmm_df.columns.str.strip()
-    print(f"  Loaded {len(hmm_df)} predictions\n")
-    
-    print("HMM Behavior distribution (3 states):")
-    print(hmm_df['behavior'].value_counts())
-    print()
-    
-    # Merge by index (files are aligned from same preprocessing)
-    print("Merging BBMM GPS + HMM behaviors...")
-    min_len = min(len(bbmm_df), len(hmm_df))
-    df = bbmm_df.iloc[:min_len].reset_index(drop=True)
-    
-    # Replace 2-state HMM with 3-state HMM behaviors
-    df['hmm_behavioral_state'] = hmm_df.iloc[:min_len]['behavior'].values
-    df['step_length'] = hmm_df.iloc[:min_len]['step_length'].values
-    df['turning_angle'] = hmm_df.iloc[:min_len]['turning_angle'].values
-    
-    print(f"SUCCESS: Merged {len(df)} records")
-    print(f"Columns: {list(df.columns)[:10]}... (showing first 10)\n")
-    
-    print("Final behavior distribution:")
-    print(df['hmm_behavioral_state'].value_counts())
-    print()
-    
     # Column mapping based on actual BBMM model output structure
     # BBMM files have GPS coords + HMM behavioral states merged
     col_patterns = {
@@ -182,34 +153,48 @@ def import_gps_data_from_cloudflare(species: str, max_points_per_animal: int = 2
         'sinuosity': ['sinuosity'],
     }
     
-    # Auto detect actual columns in the CSV
+    # HMM 3-state predictions replace these BBMM columns after the merge
+    hmm_columns = {'hmm_behavioral_state': 'behavior', 'step_length': 'step_length', 'turning_angle': 'turning_angle'}
+    
+    # Auto detect actual columns from the CSV header, so only mapped columns are read
+    bbmm_columns = list(pd.read_csv(bbmm_file, nrows=0).columns.str.strip())
+    available = bbmm_columns + [col for col in hmm_columns if col not in bbmm_columns]
     col_map = {}
     for field, patterns in col_patterns.items():
         for pattern in patterns:
-            if pattern in df.columns:
+            if pattern in available:
                 col_map[field] = pattern
                 break
     
     print("Column mapping:")
     for key, val in col_map.items():
-        if val in df.columns:
-            print(f"   {key} -> {val}")
-        else:
-            print(f"   WARNING: {key} -> {val} (NOT FOUND)")
+        print(f"   {key} -> {val}")
     print()
     
-    # Get or create system user for imports
-    system_user, _ = User.objects.get_or_create(
-        email='system@wildlife.com',
-        defaults={'name': 'System Import', 'role': 'admin'}
-    )
+    # Load HMM 3-state predictions
+    print(f"Loading HMM 3-state predictions: {hmm_file.name}")
+    hmm_df = read_csv_cached(hmm_file, columns=list(hmm_columns.values()), cache_dir=DATASET_CACHE_DIR)
+    print(f"  Loaded {len(hmm_df)} predictions\n")
+    
+    print("HMM Behavior distribution (3 states):")
+    print(hmm_df['behavior'].value_counts())
+    print()
+    
+    # Load BBMM GPS data: the CSV is parsed once into the Parquet dataset cache,
+    # later imports read only the collar column and then the sampled collars
+    print(f"Loading BBMM GPS data: {bbmm_file.name}")
+    collar_id_col = col_map['collar_id']
+    collars = read_csv_cached(bbmm_file, columns=[collar_id_col], cache_dir=DATASET_CACHE_DIR, low_memory=False)
+    print(f"  Loaded {len(collars)} records with GPS coordinates")
+    
+    # Merge by index (files are aligned from same preprocessing)
+    min_len = min(len(collars), len(hmm_df))
     
     total_imported = 0
     total_skipped = 0
     
     # Get unique collar IDs and sample for representative dataset
-    collar_id_col = col_map['collar_id']
-    all_collar_ids = df[collar_id_col].unique()
+    all_collar_ids = collars[collar_id_col].iloc[:min_len].unique()
     
     print(f"\nFound {len(all_collar_ids)} unique collars in dataset")
     print(f"Sampling {min(max_animals, len(all_collar_ids))} animals with {max_points_per_animal} points each")
@@ -221,6 +206,28 @@ def import_gps_data_from_cloudflare(species: str, max_points_per_animal: int = 2
     print(f"Selected collars: {list(sampled_collar_ids)[:5]}{'...' if len(sampled_collar_ids) > 5 else ''}")
     print()
     
+    print("Merging BBMM GPS + HMM behaviors...")
+    needed = [col for col in col_map.values() if col in bbmm_columns and col not in hmm_columns]
+    individuals = list(sampled_collar_ids) if collar_id_col == 'individual_id' else None
+    df = read_csv_cached(bbmm_file, columns=needed, individuals=individuals, cache_dir=DATASET_CACHE_DIR, low_memory=False)
+    df = df[(df.index < min_len) & df[collar_id_col].isin(sampled_collar_ids)].copy()
+    
+    # Replace 2-state HMM with 3-state HMM behaviors
+    for col, hmm_col in hmm_columns.items():
+        df[col] = hmm_df[hmm_col].values[df.index]
+    
+    print(f"SUCCESS: Merged {len(df)} records of the sampled collars\n")
+    
+    print("Final behavior distribution:")
+    print(df['hmm_behavioral_state'].value_counts())
+    print()
+    
+    # Get or create system user for imports
+    system_user, _ = User.objects.get_or_create(
+        email='system@wildlife.com',
+        defaults={'name': 'System Import', 'role': 'admin'}
+    )
+    
     for collar_id in sampled_collar_ids:
         collar_df = df[df[collar_id_col] == collar_id].copy()
         
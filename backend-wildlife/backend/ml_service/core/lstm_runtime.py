@@ -0,0 +1,364 @@
+"""
+NumPy LSTM Runtime
+CPU inference for the LSTM movement models without importing TensorFlow
+
+A trained model (the LSTM/Dropout/Dense stack built by create_lstm_model) is
+exported to a single .npz file holding the layer configuration and weights.
+NumpyLSTMModel runs the recurrent forward pass with NumPy and exposes the
+predict(X, verbose=0) call the trackers already use, so serving processes
+only need NumPy. Keras .h5 files (Keras 2 or 3) can also be read directly
+with h5py, which lets existing model files be served or converted without
+TensorFlow.
+
+Usage:
+    python -m ml_service.core.lstm_runtime model.h5 [model.npz]
+"""
+
+import os
+import sys
+import json
+import logging
+import importlib.util
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, List, Union
+
+logger = logging.getLogger(__name__)
+
+TENSORFLOW_AVAILABLE = importlib.util.find_spec('tensorflow') is not None
+H5PY_AVAILABLE = importlib.util.find_spec('h5py') is not None
+
+FORMAT_VERSION = 1
+
+# Layers that only matter during training
+PASSTHROUGH_LAYERS = {'InputLayer', 'Dropout', 'GaussianNoise', 'GaussianDropout', 'ActivityRegularization'}
+
+
+def _sigmoid(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+
+def _hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0.0, 1.0)
+
+
+def _hard_sigmoid_keras3(x):
+    return np.clip(x / 6.0 + 0.5, 0.0, 1.0)
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    None: lambda x: x,
+    'relu': lambda x: np.maximum(x, 0.0),
+    'tanh': np.tanh,
+    'sigmoid': _sigmoid,
+    'hard_sigmoid': _hard_sigmoid,
+    'hard_sigmoid_keras3': _hard_sigmoid_keras3,
+}
+
+
+def _activation(name: Any):
+    if isinstance(name, dict):
+        name = name.get('config', {}).get('name', name.get('class_name'))
+    if name not in ACTIVATIONS:
+        raise ValueError(f"Unsupported activation for the NumPy LSTM runtime: {name}")
+    return ACTIVATIONS[name]
+
+
+def _layer_spec(class_name: str, config: Dict[str, Any], weights: List[np.ndarray],
+                keras_major: int = 2) -> Dict[str, Any]:
+    """Inference description of one Keras layer (None for pass-through layers)"""
+    if class_name in PASSTHROUGH_LAYERS:
+        return None
+
+    if keras_major >= 3:
+        # Keras 3 redefined hard_sigmoid as relu6(x + 3) / 6
+        config = {k: ('hard_sigmoid_keras3' if v == 'hard_sigmoid' else v) for k, v in config.items()}
+
+    if class_name == 'LSTM':
+        if config.get('return_state') or config.get('stateful'):
+            raise ValueError(f"LSTM layer {config.get('name')} uses return_state/stateful, which the runtime does not support")
+        spec = {
+            'type': 'lstm',
+            'units': int(config['units']),
+            'activation': config.get('activation', 'tanh'),
+            'recurrent_activation': config.get('recurrent_activation', 'sigmoid'),
+            'return_sequences': bool(config.get('return_sequences', False)),
+            'go_backwards': bool(config.get('go_backwards', False)),
+        }
+        kernel, recurrent_kernel = weights[0], weights[1]
+        bias = weights[2] if config.get('use_bias', True) else np.zeros(kernel.shape[1])
+        spec['weights'] = [kernel, recurrent_kernel, bias]
+    elif class_name == 'Dense':
+        spec = {'type': 'dense', 'units': int(config['units']), 'activation': config.get('activation', 'linear')}
+        kernel = weights[0]
+        bias = weights[1] if config.get('use_bias', True) else np.zeros(kernel.shape[1])
+        spec['weights'] = [kernel, bias]
+    else:
+        raise ValueError(f"Unsupported layer for the NumPy LSTM runtime: {class_name}")
+
+    _activation(spec['activation'])
+    if spec['type'] == 'lstm':
+        _activation(spec['recurrent_activation'])
+    spec['weights'] = [np.asarray(w, dtype=np.float32) for w in spec['weights']]
+    return spec
+
+
+def _input_shape(layer_configs: List[Dict[str, Any]]):
+    for layer in layer_configs:
+        config = layer['config']
+        shape = config.get('batch_input_shape') or config.get('batch_shape')
+        if shape:
+            return tuple(shape)
+    return None
+
+
+class NumpyLSTMModel:
+    """
+    Stacked LSTM/Dense model evaluated with NumPy
+
+    Only the sequential stacks produced by create_lstm_model are supported:
+    LSTM and Dense layers (Dropout and the input layer are skipped at
+    inference time).
+    """
+
+    def __init__(self, layers: List[Dict[str, Any]], input_shape=None, name: str = 'lstm_model'):
+        self.layers = layers
+        self.name = name
+        if input_shape is None and layers and layers[0]['type'] == 'lstm':
+            input_shape = (None, None, layers[0]['weights'][0].shape[0])
+        self.input_shape = tuple(input_shape) if input_shape is not None else None
+        self.output_shape = (None, layers[-1]['units']) if layers else None
+        self._functions = [
+            (_activation(layer['activation']),
+             _activation(layer['recurrent_activation']) if layer['type'] == 'lstm' else None)
+            for layer in layers
+        ]
+
+    @classmethod
+    def from_keras(cls, model) -> 'NumpyLSTMModel':
+        """Convert an in-memory Keras model"""
+        import keras
+
+        keras_major = int(keras.__version__.split('.')[0])
+        layers = []
+        for layer in model.layers:
+            spec = _layer_spec(type(layer).__name__, layer.get_config(), layer.get_weights(), keras_major)
+            if spec is not None:
+                layers.append(spec)
+        return cls(layers, input_shape=tuple(model.inputs[0].shape), name=model.name)
+
+    @classmethod
+    def from_h5(cls, path: Union[str, Path]) -> 'NumpyLSTMModel':
+        """Read a Keras .h5 model file (Keras 2 or 3 format) with h5py"""
+        import h5py
+
+        with h5py.File(str(path), 'r') as f:
+            keras_version = f.attrs.get('keras_version', '2')
+            if isinstance(keras_version, bytes):
+                keras_version = keras_version.decode('utf-8')
+            keras_major = int(str(keras_version).split('.')[0])
+            model_config = f.attrs['model_config']
+            if isinstance(model_config, bytes):
+                model_config = model_config.decode('utf-8')
+            model_config = json.loads(model_config)
+            layer_configs = model_config['config']['layers']
+            weights_group = f['model_weights'] if 'model_weights' in f else f
+
+            layers = []
+            for layer in layer_configs:
+                name = layer['config']['name']
+                weights = []
+                if name in weights_group:
+                    group = weights_group[name]
+                    for weight_name in group.attrs.get('weight_names', []):
+                        if isinstance(weight_name, bytes):
+                            weight_name = weight_name.decode('utf-8')
+                        weights.append(np.array(group[weight_name]))
+                spec = _layer_spec(layer['class_name'], layer['config'], weights, keras_major)
+                if spec is not None:
+                    layers.append(spec)
+
+        return cls(layers, input_shape=_input_shape(layer_configs), name=model_config['config'].get('name', 'lstm_model'))
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'NumpyLSTMModel':
+        """Load a model exported with save"""
+        with np.load(str(path), allow_pickle=False) as data:
+            meta = json.loads(str(data['config']))
+            if meta.get('format_version', 1) > FORMAT_VERSION:
+                raise ValueError(f"{path} was exported by a newer runtime (format {meta['format_version']})")
+            layers = []
+            for i, layer in enumerate(meta['layers']):
+                layer = dict(layer)
+                layer['weights'] = [data[f'layer{i}_w{j}'] for j in range(layer.pop('n_weights'))]
+                layers.append(layer)
+        return cls(layers, input_shape=meta.get('input_shape'), name=meta.get('name', 'lstm_model'))
+
+    def save(self, path: Union[str, Path], source: Union[str, Path, None] = None):
+        """
+        Write the layer configuration and weights to a single .npz file
+
+        Args:
+            path: Destination .npz file
+            source: .h5 file the weights were read from; its size and mtime are
+                recorded so load_lstm_model can tell when the export is stale
+        """
+        arrays = {}
+        layers = []
+        for i, layer in enumerate(self.layers):
+            layers.append({k: v for k, v in layer.items() if k != 'weights'} | {'n_weights': len(layer['weights'])})
+            for j, weight in enumerate(layer['weights']):
+                arrays[f'layer{i}_w{j}'] = weight
+        meta = {'format_version': FORMAT_VERSION, 'name': self.name, 'input_shape': self.input_shape, 'layers': layers}
+        if source is not None:
+            meta['source'] = _file_signature(source)
+        with open(path, 'wb') as f:
+            np.savez(f, config=np.array(json.dumps(meta)), **arrays)
+
+    def _lstm(self, x, layer, activation, recurrent_activation):
+        kernel, recurrent_kernel, bias = layer['weights']
+        units = layer['units']
+        if layer['go_backwards']:
+            x = x[:, ::-1]
+
+        # Input contributions for every step at once; only the recurrence is sequential
+        z_inputs = x @ kernel + bias
+        h = np.zeros((x.shape[0], units), dtype=np.float32)
+        c = np.zeros((x.shape[0], units), dtype=np.float32)
+        outputs = np.empty((x.shape[0], x.shape[1], units), dtype=np.float32) if layer['return_sequences'] else None
+
+        for t in range(x.shape[1]):
+            z = z_inputs[:, t] + h @ recurrent_kernel
+            i = recurrent_activation(z[:, :units])
+            f = recurrent_activation(z[:, units:2 * units])
+            g = activation(z[:, 2 * units:3 * units])
+            o = recurrent_activation(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * activation(c)
+            if outputs is not None:
+                outputs[:, t] = h
+
+        return outputs if outputs is not None else h
+
+    def predict(self, X, verbose=0, batch_size=None) -> np.ndarray:
+        """Forward pass; verbose and batch_size are accepted for Keras compatibility"""
+        x = np.asarray(X, dtype=np.float32)
+        for layer, (activation, recurrent_activation) in zip(self.layers, self._functions):
+            if layer['type'] == 'lstm':
+                x = self._lstm(x, layer, activation, recurrent_activation)
+            else:
+                kernel, bias = layer['weights']
+                x = activation(x @ kernel + bias)
+        return x
+
+    __call__ = predict
+
+    def to_keras(self):
+        """Rebuild an equivalent Keras model (without dropout), e.g. for fine-tuning"""
+        from tensorflow import keras
+
+        model = keras.Sequential(name=self.name)
+        model.add(keras.Input(shape=self.input_shape[1:]))
+        for layer in self.layers:
+            if layer['type'] == 'lstm':
+                model.add(keras.layers.LSTM(
+                    layer['units'], activation=layer['activation'],
+                    recurrent_activation=layer['recurrent_activation'],
+                    return_sequences=layer['return_sequences'], go_backwards=layer['go_backwards']
+                ))
+            else:
+                model.add(keras.layers.Dense(layer['units'], activation=layer['activation']))
+            model.layers[-1].set_weights(layer['weights'])
+        return model
+
+
+def _file_signature(path: Union[str, Path]) -> Dict[str, int]:
+    stat = Path(path).stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _export_is_current(exported: Path, source: Path) -> bool:
+    """Whether an .npz export still matches the .h5 file it sits next to"""
+    with np.load(str(exported), allow_pickle=False) as data:
+        recorded = json.loads(str(data['config'])).get('source')
+    if recorded is not None:
+        return recorded == _file_signature(source)
+    # Exports of in-memory models are written after the .h5 they were saved to
+    return exported.stat().st_mtime_ns >= source.stat().st_mtime_ns
+
+
+def export_lstm_model(model_or_path, output_path: Union[str, Path]) -> NumpyLSTMModel:
+    """
+    Export a Keras model (in memory or a .h5 file) to the NumPy runtime format
+
+    Args:
+        model_or_path: Keras model, or path of a .h5 model file
+        output_path: Destination .npz file
+
+    Returns:
+        The exported NumpyLSTMModel
+    """
+    if isinstance(model_or_path, (str, Path)):
+        runtime_model = NumpyLSTMModel.from_h5(model_or_path)
+        runtime_model.save(output_path, source=model_or_path)
+    else:
+        runtime_model = NumpyLSTMModel.from_keras(model_or_path)
+        runtime_model.save(output_path)
+    return runtime_model
+
+
+def load_lstm_model(path: Union[str, Path]):
+    """
+    Load an LSTM model for inference, preferring the NumPy runtime
+
+    An exported .npz is used directly. For a .h5 file, an exported .npz next
+    to it is preferred while it is current (the .h5 it was read from is
+    unchanged, or it is newer than the .h5), then reading the .h5 weights
+    with h5py and re-exporting them; TensorFlow is only imported if the
+    model cannot be run by the NumPy runtime.
+    """
+    path = Path(path)
+    exported = path if path.suffix == '.npz' else path.with_suffix('.npz')
+    if exported.exists():
+        if exported == path or not path.exists() or _export_is_current(exported, path):
+            return NumpyLSTMModel.load(exported)
+        logger.info(f"{exported.name} is older than {path.name}; rebuilding it")
+
+    if path.suffix == '.h5' and H5PY_AVAILABLE:
+        try:
+            runtime_model = NumpyLSTMModel.from_h5(path)
+        except (ValueError, KeyError) as e:
+            logger.info(f"{path.name} cannot run on the NumPy LSTM runtime ({e}); loading it with TensorFlow")
+        else:
+            if exported.exists():
+                # Replace the stale export so the next load reads it again
+                tmp_path = exported.with_name(f".{exported.stem}.{os.getpid()}.tmp.npz")
+                try:
+                    runtime_model.save(tmp_path, source=path)
+                    os.replace(tmp_path, exported)
+                except OSError as e:
+                    tmp_path.unlink(missing_ok=True)
+                    logger.warning(f"Could not re-export {exported}: {e}")
+            return runtime_model
+
+    if not TENSORFLOW_AVAILABLE:
+        raise ImportError(f"TensorFlow is required to load {path}")
+    from tensorflow.keras.models import load_model
+    return load_model(str(path), compile=False)
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv:
+        print("Usage: python -m ml_service.core.lstm_runtime model.h5 [model.npz]")
+        sys.exit(2)
+
+    source = Path(argv[0])
+    output = Path(argv[1]) if len(argv) > 1 else source.with_suffix('.npz')
+    runtime_model = export_lstm_model(source, output)
+    print(f"Exported {source} to {output} ({len(runtime_model.layers)} layers, input {runtime_model.input_shape})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,429 @@
+"""
+Online LSTM Learner
+Fine-tunes the LSTM movement models on newly received GPS fixes and publishes
+each update as a versioned artifact that RealTimeTracker can hot-swap
+"""
+
+import os
+import json
+import time
+import shutil
+import pickle
+import logging
+import numpy as np
+from pathlib import Path
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from numpy.lib.stride_tricks import sliding_window_view
+
+from ..models.replay_buffer import ReplayBuffer
+from .lstm_runtime import NumpyLSTMModel, load_lstm_model, TENSORFLOW_AVAILABLE
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+ONLINE_LSTM_DIR = Path(os.getenv('ONLINE_LSTM_DIR', str(BASE_DIR / "ml_service" / "data" / "lstm" / "online")))
+ONLINE_LSTM_KEEP_VERSIONS = int(os.getenv('ONLINE_LSTM_KEEP_VERSIONS', '5'))
+
+# Columns of the live tracking records, in the order predict_with_lstm stacks them
+FEATURE_COLUMNS = ('lat', 'lon', 'speed_kmh')
+TARGET_COLUMNS = ('lat', 'lon')
+
+LATEST_FILE = "LATEST"
+
+
+def _species_dir(species: str, artifact_dir: Optional[Path] = None) -> Path:
+    return Path(artifact_dir or ONLINE_LSTM_DIR) / species.lower()
+
+
+def published_version(species: str, artifact_dir: Optional[Path] = None) -> int:
+    """Version number of the newest published model for a species (0 if none)"""
+    try:
+        return int((_species_dir(species, artifact_dir) / LATEST_FILE).read_text().strip())
+    except (OSError, ValueError):
+        return 0
+
+
+def load_published_model(species: str, artifact_dir: Optional[Path] = None,
+                         runtime: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Load the newest published model for a species
+
+    Args:
+        species: Species name
+        artifact_dir: Root directory of the published models
+        runtime: Load the NumPy inference export; otherwise the Keras model (for fine-tuning)
+
+    Returns:
+        Dict with model, scalers, version and metadata, or None if nothing is published
+    """
+    version = published_version(species, artifact_dir)
+    if version == 0 or (not runtime and not TENSORFLOW_AVAILABLE):
+        return None
+
+    version_dir = _species_dir(species, artifact_dir) / f"v{version:04d}"
+    try:
+        if runtime:
+            model = load_lstm_model(version_dir / "model.h5")
+        else:
+            from tensorflow.keras.models import load_model as keras_load
+            model = keras_load(str(version_dir / "model.h5"), compile=False)
+        with open(version_dir / "scalers.pkl", 'rb') as f:
+            scalers = pickle.load(f)
+        with open(version_dir / "metadata.json") as f:
+            metadata = json.load(f)
+    except Exception as e:
+        logger.error(f"Error loading published LSTM v{version} for {species}: {e}")
+        return None
+
+    return {'model': model, 'scalers': scalers, 'version': version, 'metadata': metadata}
+
+
+def publish_model(species: str, model, scalers: Dict[str, Any], metadata: Dict[str, Any],
+                  artifact_dir: Optional[Path] = None) -> int:
+    """
+    Write a model as the next version and point LATEST at it
+
+    The version directory is written under a temporary name and renamed into
+    place, and LATEST is replaced atomically, so readers never see a partial
+    artifact.
+
+    Returns:
+        The new version number
+    """
+    species_dir = _species_dir(species, artifact_dir)
+    species_dir.mkdir(parents=True, exist_ok=True)
+
+    existing = [int(p.name[1:]) for p in species_dir.glob("v[0-9]*") if p.name[1:].isdigit()]
+    version = max(existing + [published_version(species, artifact_dir)]) + 1
+    version_dir = species_dir / f"v{version:04d}"
+    tmp_dir = species_dir / f".v{version:04d}.tmp"
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir()
+
+    try:
+        model.save(str(tmp_dir / "model.h5"))
+        NumpyLSTMModel.from_keras(model).save(tmp_dir / "model.npz")
+        with open(tmp_dir / "scalers.pkl", 'wb') as f:
+            pickle.dump(scalers, f)
+        with open(tmp_dir / "metadata.json", 'w') as f:
+            json.dump(dict(metadata, species=species, version=version, created=time.time()), f)
+        os.replace(tmp_dir, version_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    latest_tmp = species_dir / f"{LATEST_FILE}.tmp"
+    latest_tmp.write_text(str(version))
+    os.replace(latest_tmp, species_dir / LATEST_FILE)
+
+    for old in sorted(v for v in existing if v <= version - ONLINE_LSTM_KEEP_VERSIONS):
+        shutil.rmtree(species_dir / f"v{old:04d}", ignore_errors=True)
+
+    return version
+
+
+class OnlineLSTMLearner:
+    """
+    Incremental fine-tuning of the per-species LSTM models
+
+    New fixes are appended to a short per-animal tail, so each call to
+    ingest only builds the windows that end at the new fixes. Once a species
+    has enough new windows, update fine-tunes a copy of its current model
+    for a few epochs on those windows mixed with replayed older ones,
+    publishes the copy as a new version and hands it to the tracker.
+    """
+
+    def __init__(
+        self,
+        artifact_dir: Optional[Path] = None,
+        tracker=None,
+        sequence_length: int = 10,
+        min_windows: int = 64,
+        epochs: int = 2,
+        batch_size: int = 32,
+        replay_ratio: float = 0.5,
+        learning_rate: float = 1e-4,
+        replay_capacity: int = 5000,
+        feature_columns=FEATURE_COLUMNS
+    ):
+        """
+        Args:
+            artifact_dir: Root directory for published models and replay buffers
+            tracker: Object with lstm_models/lstm_scalers dicts and swap_lstm_model
+                (RealTimeTracker); its models are the starting point for fine-tuning
+            sequence_length: Fixes per input window (must match the served model)
+            min_windows: New windows a species needs before it is fine-tuned
+            epochs: Fine-tuning epochs per update
+            batch_size: Training batch size
+            replay_ratio: Replayed samples per new window in each epoch
+            learning_rate: Adam learning rate for fine-tuning
+            replay_capacity: Windows kept in each species' replay buffer
+            feature_columns: Record keys used as LSTM input features
+        """
+        self.artifact_dir = Path(artifact_dir or ONLINE_LSTM_DIR)
+        self.tracker = tracker
+        self.sequence_length = sequence_length
+        self.min_windows = min_windows
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.replay_ratio = replay_ratio
+        self.learning_rate = learning_rate
+        self.replay_capacity = replay_capacity
+        self.feature_columns = tuple(feature_columns)
+        self.target_index = [self.feature_columns.index(c) for c in TARGET_COLUMNS]
+
+        self.models: Dict[str, Dict[str, Any]] = {}
+        self.replay_buffers: Dict[str, ReplayBuffer] = {}
+        self.tails: Dict[Any, np.ndarray] = {}
+        self.last_timestamps: Dict[Any, Any] = {}
+        self.pending: Dict[str, List[tuple]] = defaultdict(list)
+        self.callbacks: List[Callable] = []
+
+    def _features(self, records: List[Dict[str, Any]]) -> np.ndarray:
+        return np.array(
+            [[np.nan if r.get(c) is None else r[c] for c in self.feature_columns] for r in records],
+            dtype=np.float64
+        ).reshape(len(records), len(self.feature_columns))
+
+    def _group_by_animal(self, records: Iterable[Dict[str, Any]]) -> Dict[Any, List[Dict[str, Any]]]:
+        groups = defaultdict(list)
+        for record in records:
+            groups[record['animal_id']].append(record)
+        for animal_records in groups.values():
+            animal_records.sort(key=lambda r: r['timestamp'])
+        return groups
+
+    def prime(self, animal_id, records: Iterable[Dict[str, Any]]):
+        """Seed an animal's tail with fixes that were already learned from (no windows are built)"""
+        records = sorted(records, key=lambda r: r['timestamp'])
+        if records:
+            self.tails[animal_id] = self._features(records)[-self.sequence_length:]
+            self.last_timestamps[animal_id] = records[-1]['timestamp']
+
+    def ingest(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Build training windows from new tracking records
+
+        Args:
+            records: Dicts with animal_id, species, timestamp and the feature columns
+
+        Returns:
+            Number of windows added
+        """
+        L = self.sequence_length
+        added = 0
+
+        for animal_id, animal_records in self._group_by_animal(records).items():
+            last = self.last_timestamps.get(animal_id)
+            if last is not None:
+                animal_records = [r for r in animal_records if r['timestamp'] > last]
+            if not animal_records:
+                continue
+
+            species = (animal_records[-1].get('species') or '').lower()
+            tail = self.tails.get(animal_id, np.empty((0, len(self.feature_columns))))
+            sequence = np.vstack([tail, self._features(animal_records)])
+            self.tails[animal_id] = sequence[-L:]
+            self.last_timestamps[animal_id] = animal_records[-1]['timestamp']
+
+            if len(sequence) <= L or not species:
+                continue
+
+            # Window i covers fixes i..i+L-1 and predicts the position at fix i+L
+            windows = sliding_window_view(sequence[:-1], L, axis=0).transpose(0, 2, 1)
+            targets = sequence[L:][:, self.target_index]
+            valid = np.isfinite(windows).all(axis=(1, 2)) & np.isfinite(targets).all(axis=1)
+            if valid.any():
+                self.pending[species].append((windows[valid].copy(), targets[valid]))
+                added += int(valid.sum())
+
+        return added
+
+    def pending_windows(self, species: str) -> int:
+        return sum(len(X) for X, _ in self.pending.get(species, []))
+
+    def save_pending(self, path: Path):
+        """Write the windows not yet fine-tuned on to an .npz file"""
+        arrays = {}
+        for species, batches in self.pending.items():
+            if batches:
+                arrays[f"X_{species}"] = np.concatenate([b[0] for b in batches])
+                arrays[f"y_{species}"] = np.concatenate([b[1] for b in batches])
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def load_pending(self, path: Path):
+        """Queue the windows stored by save_pending ahead of any new ones"""
+        with np.load(path) as data:
+            for key in data.files:
+                if key.startswith("X_"):
+                    species = key[2:]
+                    self.pending[species].insert(0, (data[key], data[f"y_{species}"]))
+
+    def _current_model(self, species: str) -> Optional[Dict[str, Any]]:
+        current = self.models.get(species)
+        published = published_version(species, self.artifact_dir)
+        if current is not None and current['version'] >= published:
+            return current
+
+        if published:
+            loaded = load_published_model(species, self.artifact_dir, runtime=False)
+            if loaded is not None:
+                self.models[species] = loaded
+                return loaded
+
+        if current is None and self.tracker is not None and self.tracker.lstm_models.get(species) is not None:
+            model = self.tracker.lstm_models[species]
+            if isinstance(model, NumpyLSTMModel):
+                model = model.to_keras()
+            current = {
+                'model': model,
+                'scalers': dict(self.tracker.lstm_scalers.get(species) or {}),
+                'version': getattr(self.tracker, 'lstm_versions', {}).get(species, 0),
+                'metadata': {}
+            }
+            self.models[species] = current
+        return current
+
+    def _replay_buffer(self, species: str) -> ReplayBuffer:
+        if species not in self.replay_buffers:
+            directory = self.artifact_dir / species / "replay"
+            if (directory / "metadata.json").exists():
+                self.replay_buffers[species] = ReplayBuffer.load(str(directory))
+            else:
+                self.replay_buffers[species] = ReplayBuffer(self.replay_capacity, directory=str(directory))
+        return self.replay_buffers[species]
+
+    def _compatible(self, model, scalers: Dict[str, Any]) -> bool:
+        n_features = len(self.feature_columns)
+        input_shape = tuple(getattr(model, 'input_shape', ()) or ())
+        if input_shape[1:] != (self.sequence_length, n_features):
+            return False
+        scaler_x = scalers.get('x')
+        expected = getattr(scaler_x, 'n_features_in_', self.sequence_length * n_features)
+        return scaler_x is None or expected == self.sequence_length * n_features
+
+    def _scale_inputs(self, X: np.ndarray, scaler_x) -> np.ndarray:
+        if scaler_x is None:
+            return X.astype(np.float32)
+        return scaler_x.transform(X.reshape(len(X), -1)).reshape(X.shape).astype(np.float32)
+
+    def _scale_targets(self, model, X_scaled: np.ndarray, targets: np.ndarray, scaler_y) -> np.ndarray:
+        # Outputs without a new observation (e.g. suitability) are trained towards
+        # the current model's own prediction so they are left where they were
+        y_scaled = model.predict(X_scaled, verbose=0)
+        y = scaler_y.inverse_transform(y_scaled) if scaler_y is not None else y_scaled.copy()
+        y[:, :targets.shape[1]] = targets
+        return (scaler_y.transform(y) if scaler_y is not None else y).astype(np.float32)
+
+    def fine_tune(self, species: str, X: np.ndarray, targets: np.ndarray) -> Optional[int]:
+        """
+        Fine-tune a copy of the species model on new windows and publish it
+
+        Returns:
+            Published version, or None if the species has no usable model
+        """
+        current = self._current_model(species)
+        if current is None or not TENSORFLOW_AVAILABLE:
+            logger.warning(f"No LSTM model to fine-tune for {species}; dropping {len(X)} windows")
+            return None
+
+        model, scalers = current['model'], current['scalers']
+        if not self._compatible(model, scalers):
+            logger.warning(
+                f"LSTM model for {species} expects inputs {getattr(model, 'input_shape', None)}, "
+                f"not {self.sequence_length} x {self.feature_columns}; skipping online update"
+            )
+            return None
+
+        from tensorflow import keras
+
+        start = time.perf_counter()
+        X_scaled = self._scale_inputs(X, scalers.get('x'))
+        y_scaled = self._scale_targets(model, X_scaled, targets, scalers.get('y'))
+        n_targets = targets.shape[1]
+
+        def position_loss(m):
+            pred = m.predict(X_scaled, verbose=0)[:, :n_targets]
+            return float(np.mean((pred - y_scaled[:, :n_targets]) ** 2))
+
+        loss_before = position_loss(model)
+
+        candidate = keras.models.clone_model(model)
+        candidate.set_weights(model.get_weights())
+        candidate.compile(optimizer=keras.optimizers.Adam(learning_rate=self.learning_rate), loss='mse')
+
+        replay = self._replay_buffer(species)
+        replay_size = int(len(X_scaled) * self.replay_ratio)
+        for _ in range(self.epochs):
+            if len(replay) > 0 and replay_size > 0:
+                X_replay, y_replay = replay.sample(replay_size)
+                X_epoch = np.concatenate([X_scaled, X_replay], axis=0)
+                y_epoch = np.concatenate([y_scaled, y_replay], axis=0)
+            else:
+                X_epoch, y_epoch = X_scaled, y_scaled
+            candidate.fit(X_epoch, y_epoch, epochs=1, batch_size=self.batch_size, shuffle=True, verbose=0)
+
+        loss_after = position_loss(candidate)
+        if not np.isfinite(loss_after):
+            logger.error(f"Online LSTM update for {species} diverged; keeping v{current['version']}")
+            return None
+
+        replay.add(X_scaled, y_scaled)
+        replay.save(replay.directory)
+
+        metadata = {
+            'parent_version': current['version'],
+            'windows': int(len(X)),
+            'replay_samples': int(len(replay)),
+            'epochs': self.epochs,
+            'loss_before': loss_before,
+            'loss_after': loss_after,
+            'sequence_length': self.sequence_length,
+            'feature_columns': list(self.feature_columns),
+            'train_seconds': time.perf_counter() - start
+        }
+        version = publish_model(species, candidate, scalers, metadata, self.artifact_dir)
+        self.models[species] = {'model': candidate, 'scalers': scalers, 'version': version, 'metadata': metadata}
+        logger.info(
+            f"Published online LSTM v{version} for {species} from {len(X)} windows "
+            f"(position loss {loss_before:.5f} -> {loss_after:.5f})"
+        )
+
+        served = NumpyLSTMModel.from_keras(candidate)
+        if self.tracker is not None and hasattr(self.tracker, 'swap_lstm_model'):
+            self.tracker.swap_lstm_model(species, served, scalers, version)
+        for callback in self.callbacks:
+            callback(species, served, scalers, version)
+        return version
+
+    def update(self, force: bool = False) -> Dict[str, int]:
+        """
+        Fine-tune every species with at least min_windows new windows
+
+        Args:
+            force: Fine-tune species with any number of pending windows
+
+        Returns:
+            Dict mapping species to the version published for it
+        """
+        published = {}
+        for species in list(self.pending):
+            if not force and self.pending_windows(species) < self.min_windows:
+                continue
+            batches = self.pending.pop(species)
+            if not batches:
+                continue
+            X = np.concatenate([b[0] for b in batches])
+            targets = np.concatenate([b[1] for b in batches])
+            try:
+                version = self.fine_tune(species, X, targets)
+            except Exception:
+                # Keep the windows queued, ahead of any ingested meanwhile, for the next update
+                self.pending[species][:0] = batches
+                raise
+            if version is not None:
+                published[species] = version
+        return published
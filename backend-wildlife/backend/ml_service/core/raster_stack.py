@@ -0,0 +1,221 @@
+"""
+Raster Stack Utility
+Opens the environmental rasters once and samples every layer for many points
+"""
+
+import os
+import hashlib
+import tempfile
+import logging
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+try:
+    import rasterio
+    RASTERIO_AVAILABLE = True
+except ImportError:
+    rasterio = None
+    RASTERIO_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+RASTER_LAYERS = (
+    "ndvi",
+    "landcover",
+    "elevation",
+    "rainfall",
+    "dist_water",
+    "dist_settlement",
+    "dist_roads",
+    "dist_protected_areas",
+)
+
+
+class RasterStack:
+    """
+    The environmental raster layers of the study area, opened together.
+
+    Decoded bands are cached as .npy files and memory-mapped, so repeated runs
+    and multiple consumers (XGBoost pipeline, RL environment through
+    DataConnector.load_environmental_raster, Django endpoints) share the same
+    pages instead of re-decoding GeoTIFFs.
+    """
+
+    def __init__(self, paths: Dict[str, Union[str, Path]], cache_dir: Optional[Union[str, Path]] = None):
+        """
+        Open raster layers
+
+        Args:
+            paths: Mapping of layer name (e.g. "ndvi") to GeoTIFF path
+            cache_dir: Directory for memory-mapped band caches
+                       (defaults to the ml_service temp cache)
+        """
+        if not RASTERIO_AVAILABLE:
+            raise ImportError("rasterio is required to open environmental rasters")
+
+        self.cache_dir = Path(cache_dir) if cache_dir else Path(tempfile.gettempdir()) / "ml_service_cache" / "raster_bands"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.paths = {}
+        self.meta = {}
+        self._datasets = {}
+        self._bands = {}
+
+        for name, path in paths.items():
+            if not path or not os.path.exists(path):
+                logger.warning(f"Raster layer '{name}' not found: {path}")
+                continue
+            src = rasterio.open(path)
+            self._datasets[name] = src
+            self.paths[name] = str(path)
+            self.meta[name] = {
+                "transform": src.transform,
+                "shape": (src.height, src.width),
+                "crs": src.crs,
+                "nodata": src.nodata,
+                "bounds": src.bounds,
+            }
+
+        self.aligned = self._check_alignment()
+        if not self.aligned:
+            logger.warning("Raster layers are on different grids; sampling each layer with its own transform")
+
+    @classmethod
+    def from_directory(cls, raster_dir: Union[str, Path], layers: Iterable[str] = RASTER_LAYERS,
+                       cache_dir: Optional[Union[str, Path]] = None) -> "RasterStack":
+        """Open the standard `{name}_raster_kenya_tanzania.tif` layers in a directory."""
+        paths = {name: f"{raster_dir}/{name}_raster_kenya_tanzania.tif" for name in layers}
+        return cls(paths, cache_dir=cache_dir)
+
+    @property
+    def layers(self) -> Tuple[str, ...]:
+        return tuple(self.paths.keys())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.paths
+
+    def _check_alignment(self) -> bool:
+        """True when every layer shares shape, transform and CRS."""
+        metas = list(self.meta.values())
+        if len(metas) < 2:
+            return True
+        first = metas[0]
+        for meta in metas[1:]:
+            if meta["shape"] != first["shape"] or meta["crs"] != first["crs"]:
+                return False
+            if not np.allclose(tuple(meta["transform"])[:6], tuple(first["transform"])[:6]):
+                return False
+        return True
+
+    def _cache_file(self, name: str) -> Path:
+        """Band cache file keyed by source path, size and modification time."""
+        path = self.paths[name]
+        stat = os.stat(path)
+        key = hashlib.sha1(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+        return self.cache_dir / f"{name}_{key}.npy"
+
+    def band(self, name: str) -> np.ndarray:
+        """Decoded band of a layer as a read-only memory-mapped array."""
+        if name in self._bands:
+            return self._bands[name]
+        if name not in self.paths:
+            raise KeyError(f"Raster layer '{name}' is not loaded")
+
+        cache_file = self._cache_file(name)
+        if not cache_file.exists():
+            data = self._datasets[name].read(1)
+            # Per-process temp name: workers sharing the cache may decode the same band at once
+            tmp_file = cache_file.with_name(f"{cache_file.stem}.tmp-{os.getpid()}.npy")
+            try:
+                np.save(tmp_file, data)
+                os.replace(tmp_file, cache_file)
+            except Exception:
+                tmp_file.unlink(missing_ok=True)
+                raise
+            logger.info(f"Cached raster band '{name}' to {cache_file}")
+
+        band = np.load(cache_file, mmap_mode="r")
+        self._bands[name] = band
+        return band
+
+    @staticmethod
+    def _pixel_indices(transform, shape, lats: np.ndarray, lons: np.ndarray):
+        """Row/col indices of points under an affine transform plus an in-bounds mask."""
+        cols, rows = (~transform) * (lons, lats)
+        rows = np.floor(rows).astype(np.int64)
+        cols = np.floor(cols).astype(np.int64)
+        valid = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+        return rows, cols, valid
+
+    def sample(self, lats, lons, layers: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Sample layers at N points in one pass
+
+        Args:
+            lats: Array of latitudes
+            lons: Array of longitudes
+            layers: Layer names to sample (defaults to every loaded layer)
+
+        Returns:
+            Mapping of layer name to float64 array; NaN outside the raster or on nodata
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+        layers = [name for name in (layers or self.layers) if name in self.paths]
+
+        shared = None
+        if self.aligned and layers:
+            meta = self.meta[layers[0]]
+            shared = self._pixel_indices(meta["transform"], meta["shape"], lats, lons)
+
+        samples = {}
+        for name in layers:
+            meta = self.meta[name]
+            rows, cols, valid = shared or self._pixel_indices(meta["transform"], meta["shape"], lats, lons)
+            values = np.full(lats.shape, np.nan)
+            values[valid] = self.band(name)[rows[valid], cols[valid]]
+            if meta["nodata"] is not None and not np.isnan(meta["nodata"]):
+                values[values == meta["nodata"]] = np.nan
+            samples[name] = values
+        return samples
+
+    def as_env_rasters(self, layers: Optional[Iterable[str]] = None) -> Dict[str, Dict]:
+        """Layers in the raster dict format used by DataConnector and the RL environment."""
+        rasters = {}
+        for name in (layers or self.layers):
+            if name not in self.paths:
+                continue
+            meta = self.meta[name]
+            rasters[name] = {
+                "data": self.band(name),
+                "transform": meta["transform"],
+                "bounds": meta["bounds"],
+                "crs": meta["crs"],
+                "nodata": meta["nodata"],
+                "raster_type": name,
+            }
+        return rasters
+
+    def close(self):
+        """Close the underlying datasets; cached bands stay usable."""
+        for src in self._datasets.values():
+            src.close()
+        self._datasets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+_raster_stacks: Dict[str, RasterStack] = {}
+
+
+def get_raster_stack(raster_dir: Union[str, Path], cache_dir: Optional[Union[str, Path]] = None) -> RasterStack:
+    """Get or create the shared raster stack for a raster directory."""
+    key = str(raster_dir)
+    if key not in _raster_stacks:
+        _raster_stacks[key] = RasterStack.from_directory(raster_dir, cache_dir=cache_dir)
+    return _raster_stacks[key]
@@ -3,8 +3,10 @@ Real-time tracking service that integrates HMM, BBMM, XGBoost, LSTM, and RL mode
 for multi-species wildlife tracking and conflict prediction.
 """
 import os
+import time
 import pickle
 import zipfile
+import threading
 import numpy as np
 import pandas as pd
 from pathlib import Path
@@ -14,12 +16,9 @@ from math import radians, sin, cos, sqrt, atan2, pi
 import logging
 from collections import defaultdict
 
-try:
-    from tensorflow import keras
-    from tensorflow.keras.models import load_model as keras_load
-    TENSORFLOW_AVAILABLE = True
-except ImportError:
-    TENSORFLOW_AVAILABLE = False
+from .online_learner import load_published_model, published_version
+
+from .lstm_runtime import load_lstm_model, TENSORFLOW_AVAILABLE
 
 try:
     from stable_baselines3 import PPO, A2C, DQN
@@ -37,6 +36,7 @@ logger = logging.getLogger(__name__)
 
 BASE_DIR = Path(__file__).resolve().parents[2]
 DATA_DIR = BASE_DIR / "ml_service" / "data"
+LSTM_RELOAD_INTERVAL = float(os.getenv('ONLINE_LSTM_RELOAD_SECONDS', '60'))
 
 
 class RealTimeTracker:
@@ -54,6 +54,9 @@ class RealTimeTracker:
         self.hmm_models = {}
         self.lstm_models = {}
         self.lstm_scalers = {}
+        self.lstm_versions = {}
+        self._lstm_lock = threading.Lock()
+        self._lstm_checked = {}
         self.rl_models = {}
         self.rl_envs = {}
         
@@ -72,6 +75,7 @@ class RealTimeTracker:
             self._load_bbmm_model(species_lower)
             self._load_hmm_model(species_lower)
             self._load_lstm_model(species_lower)
+            self._refresh_published_lstm(species_lower, force=True)
             self._load_rl_model(species_lower)
         
         logger.info("All models loaded successfully")
@@ -178,9 +182,12 @@ class RealTimeTracker:
         try:
             lstm_dir_local = DATA_DIR / "lstm"
             
+            # Exported NumPy runtime models (.npz) are preferred over Keras files
             model_paths_to_try = [
+                f"ml-information/trained_models/lstm/{species}_lstm.npz",
                 f"ml-information/trained_models/lstm/{species}_lstm.h5",
                 f"ml-information/trained_models/lstm/{species}_lstm.pkl",
+                f"ml-information/trained_models/lstm/wildlife_lstm_improved_20251021_115339_model.npz",
                 f"ml-information/trained_models/lstm/wildlife_lstm_improved_20251021_115339_model.h5",
             ]
             
@@ -192,17 +199,16 @@ class RealTimeTracker:
                         break
             
             if model_path is None:
-                lstm_dir = lstm_dir_local
-                model_path = lstm_dir / f"{species}_lstm.h5"
-                if not model_path.exists():
-                    model_path = lstm_dir / f"{species}_lstm.pkl"
-                if not model_path.exists():
-                    model_path = lstm_dir / "wildlife_lstm_improved_20251021_115339_model.h5"
+                for cloudflare_path in model_paths_to_try:
+                    model_path = lstm_dir_local / Path(cloudflare_path).name
+                    if model_path.exists():
+                        break
             
             if model_path and (isinstance(model_path, str) or (isinstance(model_path, Path) and model_path.exists())):
+                model_path = Path(model_path)
                 try:
-                    if model_path.suffix == '.h5' and TENSORFLOW_AVAILABLE:
-                        model = keras_load(str(model_path))
+                    if model_path.suffix in ('.npz', '.h5'):
+                        model = load_lstm_model(model_path)
                     else:
                         with open(model_path, 'rb') as f:
                             model = pickle.load(f)
@@ -251,6 +257,41 @@ class RealTimeTracker:
             logger.error(f"Error loading LSTM model for {species}: {e}")
             self.lstm_models[species] = None
     
+    def swap_lstm_model(self, species: str, model, scalers: Dict[str, Any], version: int) -> bool:
+        """
+        Replace the LSTM model of a species without restarting the service
+
+        Args:
+            species: Species name
+            model: New Keras model
+            scalers: Dict with 'x' and 'y' scalers
+            version: Published version of the model; older versions are ignored
+
+        Returns:
+            True if the model was swapped in
+        """
+        with self._lstm_lock:
+            if version <= self.lstm_versions.get(species, 0):
+                return False
+            self.lstm_models[species] = model
+            self.lstm_scalers[species] = scalers
+            self.lstm_versions[species] = version
+        logger.info(f"Swapped in online LSTM v{version} for {species}")
+        return True
+    
+    def _refresh_published_lstm(self, species: str, force: bool = False):
+        """Load a newer published LSTM version (written by the online learner in another process)"""
+        now = time.monotonic()
+        if not force and now - self._lstm_checked.get(species, float('-inf')) < LSTM_RELOAD_INTERVAL:
+            return
+        self._lstm_checked[species] = now
+        
+        if published_version(species) <= self.lstm_versions.get(species, 0):
+            return
+        published = load_published_model(species)
+        if published is not None:
+            self.swap_lstm_model(species, published['model'], published['scalers'], published['version'])
+    
     def _load_rl_model(self, species: str):
         """Load RL model (PPO, A2C, or DQN) from zip file"""
         from ..config.settings import get_settings
@@ -470,8 +511,10 @@ class RealTimeTracker:
         
         Returns: (predicted_lat, predicted_lon)
         """
-        model = self.lstm_models.get(species)
-        scalers = self.lstm_scalers.get(species, {})
+        self._refresh_published_lstm(species)
+        with self._lstm_lock:
+            model = self.lstm_models.get(species)
+            scalers = self.lstm_scalers.get(species) or {}
         scaler_x = scalers.get('x')
         scaler_y = scalers.get('y')
         
@@ -0,0 +1,458 @@
+"""
+Compiled XGBoost Tree Runtime
+NumPy evaluation of the XGBoost habitat models for low-latency scoring
+
+XGBoost's own predict builds a DMatrix (or an in-place adapter), dispatches
+to its thread pool and validates feature names on every call, which costs
+far more than walking a couple of hundred shallow trees for one row.
+CompiledTreeEnsemble flattens a gbtree booster into node arrays (children
+of a node are stored next to each other, so a step down every tree is a
+few array lookups) and walks all trees at once with NumPy.
+
+Margins are bit-identical to the booster: splits compare float32 features
+with float32 thresholds, missing values follow the default direction, and
+leaf values are summed in float32 in tree order starting from the base
+margin. Probabilities go through the same float32 sigmoid; exp itself can
+round differently from the platform libm XGBoost links, so they match to
+within one float32 ulp.
+
+Single rows and small batches are fastest here. For large batches XGBoost's
+multi-threaded predictor wins, so predict_proba hands inputs of
+BOOSTER_MIN_ROWS or more to the booster when one is attached; small inputs
+never touch its thread pool.
+
+Usage:
+    python -m ml_service.core.xgboost_runtime model.pkl [model.npz]
+    python -m ml_service.core.xgboost_runtime model.pkl --benchmark
+"""
+
+import sys
+import json
+import time
+import pickle
+import logging
+import importlib.util
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+XGBOOST_AVAILABLE = importlib.util.find_spec('xgboost') is not None
+
+FORMAT_VERSION = 1
+
+# Inputs with at least this many rows go to the booster when one is attached
+BOOSTER_MIN_ROWS = 512
+
+# Rows walked together by the NumPy batch path (keeps the node arrays in cache)
+BATCH_ROWS = 256
+
+LOGISTIC_OBJECTIVES = {'binary:logistic', 'reg:logistic'}
+SOFTMAX_OBJECTIVES = {'multi:softprob', 'multi:softmax'}
+IDENTITY_OBJECTIVES = {
+    'binary:logitraw', 'reg:squarederror', 'reg:squaredlogerror', 'reg:pseudohubererror',
+    'reg:absoluteerror', 'reg:quantileerror',
+}
+
+FLOAT32_MAX = np.finfo(np.float32).max
+
+
+def _parse_base_score(value) -> np.ndarray:
+    """base_score from learner_model_param ('5E-1' or '[5E-1,...]' in XGBoost 3)"""
+    if isinstance(value, str):
+        value = [float(part) for part in value.strip('[]').split(',') if part.strip()]
+    return np.atleast_1d(np.asarray(value, dtype=np.float32))
+
+
+def _sigmoid(margin: np.ndarray) -> np.ndarray:
+    # XGBoost: 1.0f / (expf(-x) + 1.0f), in float32
+    e = np.exp(-margin.astype(np.float64)).astype(np.float32)
+    return np.float32(1.0) / (e + np.float32(1.0))
+
+
+def _softmax(margin: np.ndarray) -> np.ndarray:
+    shifted = margin - margin.max(axis=1, keepdims=True)
+    e = np.exp(shifted.astype(np.float64)).astype(np.float32)
+    return e / np.cumsum(e, axis=1, dtype=np.float32)[:, -1:]
+
+
+class CompiledTreeEnsemble:
+    """
+    A gbtree XGBoost model flattened into NumPy node arrays
+
+    Node arrays cover all trees back to back. For a split node, left[i] is
+    the left child and left[i] + 1 the right child; a leaf points to itself
+    and has an infinite threshold, so extra steps below a shallow leaf keep
+    it in place.
+    """
+
+    ARRAYS = ('feature', 'threshold', 'left', 'default_left', 'leaf_value', 'roots', 'tree_group', 'base_margin')
+
+    def __init__(self, feature, threshold, left, default_left, leaf_value, roots, tree_group,
+                 base_margin, depth: int, objective: str, n_features: int,
+                 feature_names: Optional[List[str]] = None, missing: float = np.nan):
+        self.feature = np.asarray(feature, dtype=np.intp)
+        self.threshold = np.asarray(threshold, dtype=np.float32)
+        self.left = np.asarray(left, dtype=np.intp)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.leaf_value = np.asarray(leaf_value, dtype=np.float32)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.tree_group = np.asarray(tree_group, dtype=np.intp)
+        self.base_margin = np.asarray(base_margin, dtype=np.float32)
+        self.depth = int(depth)
+        self.objective = objective
+        self.n_features = int(n_features)
+        self.feature_names = list(feature_names) if feature_names else None
+        self.missing = float(missing)
+        self.n_groups = len(self.base_margin)
+        self.booster = None
+        self._iteration_range = None
+
+        if objective not in LOGISTIC_OBJECTIVES | SOFTMAX_OBJECTIVES | IDENTITY_OBJECTIVES:
+            raise ValueError(f"Objective {objective} is not supported by the compiled runtime")
+        # Column positions of each group's trees, in tree order
+        self._group_trees = [np.flatnonzero(self.tree_group == g) for g in range(self.n_groups)]
+
+    @classmethod
+    def from_booster(cls, booster, iteration_range=None, missing: float = np.nan) -> 'CompiledTreeEnsemble':
+        """
+        Compile an xgboost.Booster
+
+        Args:
+            booster: Trained booster (gbtree)
+            iteration_range: (begin, end) boosting rounds to use, as in Booster.predict
+            missing: Value treated as missing besides NaN
+
+        Raises:
+            ValueError: For boosters the runtime cannot evaluate (dart, gblinear,
+                        categorical splits, unsupported objectives)
+        """
+        learner = json.loads(booster.save_raw(raw_format='json'))['learner']
+        gradient_booster = learner['gradient_booster']
+        if gradient_booster['name'] != 'gbtree':
+            raise ValueError(f"{gradient_booster['name']} boosters are not supported by the compiled runtime")
+
+        model = gradient_booster['model']
+        params = learner['learner_model_param']
+        objective = learner['objective']['name']
+        n_features = int(params['num_feature'])
+        n_groups = max(int(params.get('num_class', 0)), int(params.get('num_target', 1)), 1)
+
+        trees = model['trees']
+        tree_info = [int(group) for group in model['tree_info']]
+        if iteration_range is not None and tuple(iteration_range) != (0, 0):
+            begin, end = iteration_range
+            indptr = model.get('iteration_indptr')
+            if indptr is None:
+                per_round = n_groups * int(model['gbtree_model_param'].get('num_parallel_tree', 1))
+                indptr = [i * per_round for i in range(len(trees) // per_round + 1)]
+            end = min(end, len(indptr) - 1) if end else len(indptr) - 1
+            trees = trees[indptr[begin]:indptr[end]]
+            tree_info = tree_info[indptr[begin]:indptr[end]]
+
+        base_score = _parse_base_score(params['base_score'])
+        if len(base_score) < n_groups:
+            base_score = np.resize(base_score, n_groups)
+        if objective in LOGISTIC_OBJECTIVES:
+            # ProbToMargin: -logf(1.0f / base_score - 1.0f)
+            base_margin = -np.log((np.float32(1.0) / base_score - np.float32(1.0)).astype(np.float64)).astype(np.float32)
+        else:
+            base_margin = base_score
+
+        feature, threshold, left, default_left, leaf_value, roots = [], [], [], [], [], []
+        depth = 0
+        offset = 0
+        for tree in trees:
+            if tree.get('categories_nodes'):
+                raise ValueError("Categorical splits are not supported by the compiled runtime")
+            children_left = tree['left_children']
+            children_right = tree['right_children']
+
+            # Renumber breadth-first so that siblings are adjacent
+            order = [0]
+            first_child = {}
+            node_depth = {0: 0}
+            for node in order:
+                if children_left[node] != -1:
+                    first_child[node] = len(order)
+                    order.extend((children_left[node], children_right[node]))
+                    node_depth[children_left[node]] = node_depth[children_right[node]] = node_depth[node] + 1
+            depth = max(depth, max(node_depth.values()))
+
+            for position, node in enumerate(order):
+                if children_left[node] == -1:
+                    feature.append(0)
+                    threshold.append(np.inf)
+                    left.append(offset + position)
+                    default_left.append(True)
+                    leaf_value.append(tree['split_conditions'][node])
+                else:
+                    feature.append(tree['split_indices'][node])
+                    threshold.append(tree['split_conditions'][node])
+                    left.append(offset + first_child[node])
+                    default_left.append(bool(tree['default_left'][node]))
+                    leaf_value.append(0.0)
+            roots.append(offset)
+            offset += len(order)
+
+        return cls(feature, threshold, left, default_left, leaf_value, roots, tree_info, base_margin,
+                   depth, objective, n_features, feature_names=booster.feature_names, missing=missing)
+
+    @classmethod
+    def from_model(cls, model) -> 'CompiledTreeEnsemble':
+        """
+        Compile an XGBClassifier/XGBRegressor, a Booster or anything with get_booster()
+
+        The sklearn wrappers' best_iteration and missing value are honoured the
+        same way as in their predict methods, and the booster stays attached for
+        large inputs.
+        """
+        booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        iteration_range = None
+        best_iteration = booster.attributes().get('best_iteration')
+        if best_iteration is not None and hasattr(model, 'get_booster'):
+            iteration_range = (0, int(best_iteration) + 1)
+        missing = getattr(model, 'missing', np.nan)
+        compiled = cls.from_booster(booster, iteration_range=iteration_range,
+                                    missing=np.nan if missing is None else missing)
+        compiled.booster = booster
+        compiled._iteration_range = iteration_range
+        return compiled
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'CompiledTreeEnsemble':
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('format') != FORMAT_VERSION:
+                raise ValueError(f"Unsupported compiled model format in {path}")
+            arrays = {name: data[name] for name in cls.ARRAYS}
+        return cls(**arrays, depth=meta['depth'], objective=meta['objective'], n_features=meta['n_features'],
+                   feature_names=meta['feature_names'], missing=meta['missing'])
+
+    def save(self, path: Union[str, Path]):
+        meta = {
+            'format': FORMAT_VERSION,
+            'depth': self.depth,
+            'objective': self.objective,
+            'n_features': self.n_features,
+            'feature_names': self.feature_names,
+            'missing': self.missing,
+        }
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        np.savez(path, meta=np.array(json.dumps(meta)), **arrays)
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def _as_float32(self, X) -> np.ndarray:
+        if hasattr(X, 'columns') and self.feature_names and list(X.columns) != self.feature_names:
+            X = X[self.feature_names]
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got {X.shape[1]}")
+        if not np.isnan(self.missing):
+            X = np.where(X == np.float32(self.missing), np.float32(np.nan), X)
+        # +inf must not step past a leaf (x < inf); it compares like the largest float
+        return np.ascontiguousarray(np.minimum(X, FLOAT32_MAX))
+
+    def _leaves_row(self, x: np.ndarray) -> np.ndarray:
+        """Leaf of every tree for one row"""
+        node = self.roots
+        has_missing = np.isnan(x).any()
+        for _ in range(self.depth):
+            value = x.take(self.feature.take(node))
+            go_left = value < self.threshold.take(node)
+            if has_missing:
+                go_left |= np.isnan(value) & self.default_left.take(node)
+            node = self.left.take(node) + ~go_left
+        return node
+
+    def _leaves_batch(self, X: np.ndarray) -> np.ndarray:
+        """Leaf of every tree for each row, shape (rows, trees)"""
+        n = len(X)
+        node = np.empty((n, self.n_trees), dtype=np.intp)
+        node[:] = self.roots
+        row_offset = (np.arange(n, dtype=np.intp) * self.n_features)[:, None]
+        flat = X.ravel()
+        has_missing = np.isnan(flat).any()
+        for _ in range(self.depth):
+            index = self.feature.take(node)
+            index += row_offset
+            value = flat.take(index)
+            go_left = value < self.threshold.take(node)
+            if has_missing:
+                go_left |= np.isnan(value) & self.default_left.take(node)
+            node = self.left.take(node) + ~go_left
+        return node
+
+    def _margin_from_leaves(self, leaves: np.ndarray) -> np.ndarray:
+        values = self.leaf_value.take(leaves)
+        margin = np.empty((len(leaves), self.n_groups), dtype=np.float32)
+        for group, columns in enumerate(self._group_trees):
+            # Sequential float32 sum from the base margin, as XGBoost accumulates
+            terms = np.empty((len(leaves), len(columns) + 1), dtype=np.float32)
+            terms[:, 0] = self.base_margin[group]
+            terms[:, 1:] = values[:, columns]
+            margin[:, group] = np.cumsum(terms, axis=1, dtype=np.float32)[:, -1]
+        return margin
+
+    def predict_margin(self, X) -> np.ndarray:
+        """
+        Raw margins, shape (rows,) or (rows, groups) for multi-class models
+        """
+        X = self._as_float32(X)
+        if len(X) == 1:
+            margin = self._margin_from_leaves(self._leaves_row(X[0])[None, :])
+        else:
+            margin = np.concatenate([
+                self._margin_from_leaves(self._leaves_batch(X[start:start + BATCH_ROWS]))
+                for start in range(0, len(X), BATCH_ROWS)
+            ]) if len(X) else np.empty((0, self.n_groups), dtype=np.float32)
+        return margin[:, 0] if self.n_groups == 1 else margin
+
+    def _use_booster(self, X) -> bool:
+        return self.booster is not None and len(X) >= BOOSTER_MIN_ROWS
+
+    def predict(self, X) -> np.ndarray:
+        """Predictions in the objective's output space, like Booster.predict"""
+        if self._use_booster(X):
+            return self.booster.inplace_predict(self._as_float32(X), iteration_range=self._iteration_range or (0, 0))
+        margin = self.predict_margin(X)
+        if self.objective in LOGISTIC_OBJECTIVES:
+            return _sigmoid(margin)
+        if self.objective == 'multi:softprob':
+            return _softmax(margin)
+        if self.objective == 'multi:softmax':
+            return np.argmax(margin, axis=1).astype(np.float32)
+        return margin
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Class probabilities, shaped like XGBClassifier.predict_proba"""
+        if self.objective == 'multi:softmax':
+            return _softmax(self.predict_margin(X))
+        probabilities = self.predict(X)
+        if probabilities.ndim == 1:
+            return np.column_stack([np.float32(1.0) - probabilities, probabilities])
+        return probabilities
+
+
+def compile_model(model, output_path: Optional[Union[str, Path]] = None) -> CompiledTreeEnsemble:
+    """
+    Compile an XGBoost model, optionally saving it as .npz
+
+    Args:
+        model: XGBClassifier/XGBRegressor, Booster, or a training package dict
+               with a 'model' entry (as saved by xgboost_habitat_modeling.py)
+        output_path: Destination .npz file
+
+    Returns:
+        The CompiledTreeEnsemble (with the booster attached)
+    """
+    if isinstance(model, dict):
+        model = model['model']
+    compiled = CompiledTreeEnsemble.from_model(model)
+    if output_path is not None:
+        compiled.save(output_path)
+    return compiled
+
+
+def try_compile(model) -> Optional[CompiledTreeEnsemble]:
+    """compile_model, or None (logged) if the model cannot be compiled"""
+    try:
+        return compile_model(model)
+    except Exception as e:
+        logger.info(f"XGBoost model served by the booster, not compiled: {e}")
+        return None
+
+
+def apply_scaler(scaler, X) -> np.ndarray:
+    """
+    Standardize features like scaler.transform, without its per-call validation
+
+    A fitted StandardScaler is applied directly from its mean_ and scale_
+    (the same float64 arithmetic as transform); other scalers fall back to
+    transform.
+    """
+    if scaler is None:
+        return np.asarray(X, dtype=np.float64)
+    if type(scaler).__name__ == 'StandardScaler' and hasattr(scaler, 'scale_'):
+        X = np.array(X, dtype=np.float64)
+        if scaler.mean_ is not None:
+            X -= scaler.mean_
+        if scaler.scale_ is not None:
+            X /= scaler.scale_
+        return X
+    return scaler.transform(X)
+
+
+def benchmark(model, X, repeats: int = 200) -> Dict[str, Dict[str, float]]:
+    """
+    Latency of the compiled runtime and the booster for one row and for all rows of X
+
+    Args:
+        model: Model accepted by compile_model
+        X: Feature matrix (rows, features)
+        repeats: Calls timed for the single-row case
+
+    Returns:
+        {'1 row': {...}, '<n> rows': {...}} with milliseconds per call for
+        'xgboost' (predict_proba), 'compiled' (NumPy only) and 'dispatch'
+        (CompiledTreeEnsemble.predict_proba, booster for large inputs)
+    """
+    wrapper = model['model'] if isinstance(model, dict) else model
+    compiled = compile_model(model)
+    numpy_only = CompiledTreeEnsemble.from_model(wrapper)
+    numpy_only.booster = None
+    X = np.asarray(X, dtype=np.float32)
+
+    results = {}
+    for label, rows, calls in (('1 row', X[:1], repeats), (f'{len(X)} rows', X, max(repeats // 50, 3))):
+        timings = {}
+        for name, predict in (('xgboost', wrapper.predict_proba),
+                              ('compiled', numpy_only.predict_proba),
+                              ('dispatch', compiled.predict_proba)):
+            predict(rows)
+            start = time.perf_counter()
+            for _ in range(calls):
+                predict(rows)
+            timings[name] = (time.perf_counter() - start) / calls * 1000
+        results[label] = timings
+    return results
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    run_benchmark = '--benchmark' in argv
+    argv = [arg for arg in argv if arg != '--benchmark']
+    if not argv:
+        print("Usage: python -m ml_service.core.xgboost_runtime model.pkl [model.npz] [--benchmark]")
+        sys.exit(2)
+
+    source = Path(argv[0])
+    with open(source, 'rb') as f:
+        package = pickle.load(f)
+
+    if run_benchmark:
+        wrapper = package['model'] if isinstance(package, dict) else package
+        rng = np.random.default_rng(0)
+        X = rng.standard_normal((10000, CompiledTreeEnsemble.from_model(wrapper).n_features)).astype(np.float32)
+        reference = wrapper.predict_proba(X)
+        compiled = compile_model(package)
+        compiled.booster = None
+        difference = np.abs(compiled.predict_proba(X) - reference).max()
+        print(f"Max probability difference vs XGBoost on {len(X)} rows: {difference:.2e}")
+        for label, timings in benchmark(package, X).items():
+            print(f"{label:>10}: " + ", ".join(f"{name} {ms:.3f} ms" for name, ms in timings.items()))
+        return
+
+    output = Path(argv[1]) if len(argv) > 1 else source.with_suffix('.npz')
+    compiled = compile_model(package, output)
+    print(f"Compiled {source} to {output} ({compiled.n_trees} trees, depth {compiled.depth})")
+
+
+if __name__ == '__main__':
+    main()
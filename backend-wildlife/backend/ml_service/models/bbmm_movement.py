@@ -7,34 +7,70 @@ from scipy.spatial.distance import cdist, euclidean
 from datetime import datetime, timedelta
 import warnings
 import os
-warnings.filterwarnings('ignore')
 
-np.random.seed(42)
+try:
+    from .parallel_utils import group_individuals, map_individuals
+except ImportError:
+    from parallel_utils import group_individuals, map_individuals
 
-plt.style.use('seaborn-v0_8-darkgrid')
-sns.set_palette("husl")
+try:
+    from .dataset_cache import DEFAULT_DATASET_DIR, PYARROW_AVAILABLE, dataset_path, read_dataset, source_digest, write_dataset
+except ImportError:
+    from dataset_cache import DEFAULT_DATASET_DIR, PYARROW_AVAILABLE, dataset_path, read_dataset, source_digest, write_dataset
 
 output_dir = '/data/outputs'
 results_dir = '/data/results'
-os.makedirs(output_dir, exist_ok=True)
-os.makedirs(results_dir, exist_ok=True)
-
-print("Brownian Bridge Movement Model for Animal Tracking")
-print("Purpose: Map probability of animal location between observed GPS points")
-print("Output: Continuous movement paths and home range corridors")
-print()
 
 ELEPHANT_FILE = '/content/Elephant-Data-Tanzania.csv'
 WILDEBEEST_FILE = '/content/White-bearded wildebeest in Kenya-gps.csv'
 ELEPHANT_HMM_FILE = '/content/elephant_predictions.csv'
 WILDEBEEST_HMM_FILE = '/content/wildebeest_predictions.csv'
 
-print("Data files configured:")
-print(f"  Elephant GPS data: {ELEPHANT_FILE}")
-print(f"  Wildebeest GPS data: {WILDEBEEST_FILE}")
-print(f"  Elephant HMM results: {ELEPHANT_HMM_FILE}")
-print(f"  Wildebeest HMM results: {WILDEBEEST_HMM_FILE}")
-print()
+SPECIES_CONFIG = {
+    'Elephant': {
+        'gps_file': ELEPHANT_FILE,
+        'hmm_file': ELEPHANT_HMM_FILE,
+        'max_speed_kmh': 25,
+        'n_ud_individuals': 1
+    },
+    'Wildebeest': {
+        'gps_file': WILDEBEEST_FILE,
+        'hmm_file': WILDEBEEST_HMM_FILE,
+        'max_speed_kmh': 40,
+        'n_ud_individuals': 3
+    }
+}
+
+
+def setup_pipeline(config):
+    """
+    Seed, plot style and output directories for a pipeline run
+
+    Parameters:
+    config: run options from the pipeline runner
+    """
+    warnings.filterwarnings('ignore')
+    np.random.seed(42)
+
+    plt.style.use('seaborn-v0_8-darkgrid')
+    sns.set_palette("husl")
+
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(results_dir, exist_ok=True)
+
+    print("Brownian Bridge Movement Model for Animal Tracking")
+    print("Purpose: Map probability of animal location between observed GPS points")
+    print("Output: Continuous movement paths and home range corridors")
+    print()
+
+    print("Data files configured:")
+    for species_name, species_config in SPECIES_CONFIG.items():
+        print(f"  {species_name} GPS data: {species_config['gps_file']}")
+    for species_name, species_config in SPECIES_CONFIG.items():
+        print(f"  {species_name} HMM results: {species_config['hmm_file']}")
+    print(f"Worker processes: {config.get('workers', 1)}")
+    print()
+
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
@@ -108,16 +144,6 @@ def load_data(filepath, species_name):
         print(f"Error loading file: {str(e)}")
         return None
 
-print("STEP 1: LOADING DATA")
-print()
-
-print("ELEPHANT DATA ANALYSIS")
-print()
-elephant_raw = load_data(ELEPHANT_FILE, 'Elephant')
-
-print("WILDEBEEST DATA ANALYSIS")
-print()
-wildebeest_raw = load_data(WILDEBEEST_FILE, 'Wildebeest')
 
 def inspect_data_quality(df, species_name):
     """
@@ -164,20 +190,6 @@ def inspect_data_quality(df, species_name):
 
     return missing_df
 
-print("STEP 2: INSPECTING DATA QUALITY")
-print()
-
-if elephant_raw is not None:
-    elephant_missing = inspect_data_quality(elephant_raw, 'Elephant')
-else:
-    print("Elephant data not loaded, skipping quality inspection")
-    print()
-
-if wildebeest_raw is not None:
-    wildebeest_missing = inspect_data_quality(wildebeest_raw, 'Wildebeest')
-else:
-    print("Wildebeest data not loaded, skipping quality inspection")
-    print()
 
 def identify_coordinate_columns(df, species_name):
     """
@@ -216,18 +228,6 @@ def identify_coordinate_columns(df, species_name):
 
     return coord_mapping
 
-print("STEP 3: IDENTIFYING COORDINATE COLUMNS")
-print()
-
-if elephant_raw is not None:
-    elephant_coords = identify_coordinate_columns(elephant_raw, 'Elephant')
-else:
-    elephant_coords = None
-
-if wildebeest_raw is not None:
-    wildebeest_coords = identify_coordinate_columns(wildebeest_raw, 'Wildebeest')
-else:
-    wildebeest_coords = None
 
 def identify_timestamp_columns(df, species_name):
     """
@@ -318,14 +318,6 @@ def identify_timestamp_columns(df, species_name):
 
     return df
 
-print("STEP 4: PARSING TIMESTAMPS")
-print()
-
-if elephant_raw is not None:
-    elephant_raw = identify_timestamp_columns(elephant_raw, 'Elephant')
-
-if wildebeest_raw is not None:
-    wildebeest_raw = identify_timestamp_columns(wildebeest_raw, 'Wildebeest')
 
 def identify_individual_column(df, species_name):
     """
@@ -382,18 +374,6 @@ def identify_individual_column(df, species_name):
 
     return id_col
 
-print("STEP 5: IDENTIFYING INDIVIDUAL IDs")
-print()
-
-if elephant_raw is not None:
-    elephant_id_col = identify_individual_column(elephant_raw, 'Elephant')
-else:
-    elephant_id_col = None
-
-if wildebeest_raw is not None:
-    wildebeest_id_col = identify_individual_column(wildebeest_raw, 'Wildebeest')
-else:
-    wildebeest_id_col = None
 
 def clean_data(df, coord_mapping, id_col, species_name):
     """
@@ -478,22 +458,6 @@ def clean_data(df, coord_mapping, id_col, species_name):
 
     return df_clean
 
-print("STEP 6: CLEANING DATA")
-print()
-
-elephant_clean = None
-if elephant_raw is not None and elephant_coords and elephant_id_col:
-    elephant_clean = clean_data(elephant_raw, elephant_coords, elephant_id_col, 'Elephant')
-else:
-    print("Cannot clean elephant data: missing coordinates or ID column")
-    print()
-
-wildebeest_clean = None
-if wildebeest_raw is not None and wildebeest_coords and wildebeest_id_col:
-    wildebeest_clean = clean_data(wildebeest_raw, wildebeest_coords, wildebeest_id_col, 'Wildebeest')
-else:
-    print("Cannot clean wildebeest data: missing coordinates or ID column")
-    print()
 
 def calculate_step_length(df):
     """
@@ -532,22 +496,6 @@ def calculate_step_length(df):
 
     return df
 
-print("STEP 7: CALCULATING STEP LENGTHS")
-print()
-
-if elephant_clean is not None and len(elephant_clean) > 0:
-    elephant_clean = calculate_step_length(elephant_clean)
-else:
-    print("Elephant data not available or empty after cleaning")
-    elephant_clean = None
-    print()
-
-if wildebeest_clean is not None and len(wildebeest_clean) > 0:
-    wildebeest_clean = calculate_step_length(wildebeest_clean)
-else:
-    print("Wildebeest data not available or empty after cleaning")
-    wildebeest_clean = None
-    print()
 
 def calculate_turning_angle(df):
     """
@@ -615,20 +563,6 @@ def calculate_turning_angle(df):
 
     return df
 
-print("STEP 8: CALCULATING TURNING ANGLES")
-print()
-
-if elephant_clean is not None and len(elephant_clean) > 0:
-    elephant_clean = calculate_turning_angle(elephant_clean)
-else:
-    print("Elephant data not available")
-    print()
-
-if wildebeest_clean is not None and len(wildebeest_clean) > 0:
-    wildebeest_clean = calculate_turning_angle(wildebeest_clean)
-else:
-    print("Wildebeest data not available")
-    print()
 
 def remove_outliers(df, species_name, max_speed_kmh=50):
     """
@@ -660,22 +594,6 @@ def remove_outliers(df, species_name, max_speed_kmh=50):
 
     return df_filtered
 
-print("STEP 9: REMOVING OUTLIERS")
-print()
-
-if elephant_clean is not None and len(elephant_clean) > 0:
-    elephant_filtered = remove_outliers(elephant_clean, 'Elephant', max_speed_kmh=25)
-else:
-    elephant_filtered = None
-    print("Elephant data not available")
-    print()
-
-if wildebeest_clean is not None and len(wildebeest_clean) > 0:
-    wildebeest_filtered = remove_outliers(wildebeest_clean, 'Wildebeest', max_speed_kmh=40)
-else:
-    wildebeest_filtered = None
-    print("Wildebeest data not available")
-    print()
 
 def visualize_cleaned_data(df, species_name):
     """
@@ -725,14 +643,6 @@ def visualize_cleaned_data(df, species_name):
     plt.close()
     print()
 
-print("STEP 10: VISUALIZING CLEANED DATA")
-print()
-
-if elephant_filtered is not None and len(elephant_filtered) > 0:
-    visualize_cleaned_data(elephant_filtered, 'Elephant')
-
-if wildebeest_filtered is not None and len(wildebeest_filtered) > 0:
-    visualize_cleaned_data(wildebeest_filtered, 'Wildebeest')
 
 def visualize_movement_distributions(df, species_name):
     """
@@ -803,14 +713,6 @@ def visualize_movement_distributions(df, species_name):
     plt.close()
     print()
 
-print("STEP 11: VISUALIZING MOVEMENT DISTRIBUTIONS")
-print()
-
-if elephant_filtered is not None and len(elephant_filtered) > 0:
-    visualize_movement_distributions(elephant_filtered, 'Elephant')
-
-if wildebeest_filtered is not None and len(wildebeest_filtered) > 0:
-    visualize_movement_distributions(wildebeest_filtered, 'Wildebeest')
 
 def calculate_bbmm_variance(df, species_name):
     """
@@ -844,16 +746,19 @@ def calculate_bbmm_variance(df, species_name):
 
     variance_by_individual = {}
 
-    for individual_id in df['individual_id'].unique():
-        individual_data = valid_data[valid_data['individual_id'] == individual_id]
+    per_individual = valid_data.assign(step_length_sq=valid_data['step_length']**2).groupby('individual_id').agg(
+        n_steps=('step_length_sq', 'size'),
+        sum_squared=('step_length_sq', 'sum'),
+        sum_time=('time_diff_hours', 'sum')
+    )
 
-        if len(individual_data) > 5:
-            ind_sum_squared = np.sum(individual_data['step_length']**2)
-            ind_sum_time = np.sum(individual_data['time_diff_hours'])
+    for individual_id in df['individual_id'].unique():
+        if individual_id not in per_individual.index:
+            continue
+        stats = per_individual.loc[individual_id]
 
-            if ind_sum_time > 0:
-                ind_variance = ind_sum_squared / (4 * ind_sum_time)
-                variance_by_individual[individual_id] = ind_variance
+        if stats['n_steps'] > 5 and stats['sum_time'] > 0:
+            variance_by_individual[individual_id] = stats['sum_squared'] / (4 * stats['sum_time'])
 
     print(f"Calculated individual variances for {len(variance_by_individual)} individuals")
 
@@ -866,24 +771,6 @@ def calculate_bbmm_variance(df, species_name):
     print()
     return overall_variance, variance_by_individual
 
-print("STEP 12: CALCULATING BBMM VARIANCE PARAMETER")
-print()
-
-if elephant_filtered is not None and len(elephant_filtered) > 0:
-    elephant_variance, elephant_ind_variance = calculate_bbmm_variance(elephant_filtered, 'Elephant')
-    print()
-else:
-    elephant_variance, elephant_ind_variance = None, {}
-    print("Elephant data not available for variance calculation")
-    print()
-
-if wildebeest_filtered is not None and len(wildebeest_filtered) > 0:
-    wildebeest_variance, wildebeest_ind_variance = calculate_bbmm_variance(wildebeest_filtered, 'Wildebeest')
-    print()
-else:
-    wildebeest_variance, wildebeest_ind_variance = None, {}
-    print("Wildebeest data not available for variance calculation")
-    print()
 
 def calculate_brownian_bridge_probability(x, y, x1, y1, x2, y2, t, t1, t2, sigma_squared, location_error=0.01):
     """
@@ -923,7 +810,165 @@ def calculate_brownian_bridge_probability(x, y, x1, y1, x2, y2, t, t1, t2, sigma
 
     return probability
 
-def create_utilization_distribution(df, individual_id, sigma_squared, grid_resolution=20, location_error=0.01):
+def brownian_bridge_density_grid(x1, y1, x2, y2, durations, lon_grid, lat_grid, sigma_squared,
+                                 location_error=0.01, n_time_slices=1, max_chunk_elements=8_000_000,
+                                 footprint_sigmas=None, tile_size=None, out=None):
+    """
+    Sum Brownian bridge densities of many movement segments over a regular grid
+
+    The bridge kernel is separable in x and y:
+    exp( minus ((x minus mu_x) squared + (y minus mu_y) squared) / (2 * variance_xy) )
+    = exp( minus (x minus mu_x) squared / (2 * variance_xy) ) * exp( minus (y minus mu_y) squared / (2 * variance_xy) )
+    so for a chunk of segments the grid contribution is one matrix product of
+    per-segment latitude and longitude profiles. Each bridge is integrated over
+    n_time_slices evenly spaced times (slice midpoints); a single slice evaluates
+    the bridge midpoint only.
+
+    With footprint_sigmas = k, each bridge slice is evaluated only on the cells
+    within k standard deviations of its mean and scatter-added into the grid, so
+    the cost follows track length rather than track length times grid area. The
+    grid can then also be processed in tile_size x tile_size tiles, accumulating
+    into `out` (which may be a np.memmap for very large study areas).
+
+    Parameters:
+    x1, y1: arrays of segment start coordinates
+    x2, y2: arrays of segment end coordinates
+    durations: array of segment durations in hours (non-positive segments are skipped)
+    lon_grid: 1D array of ascending grid longitudes
+    lat_grid: 1D array of ascending grid latitudes
+    sigma_squared: movement variance parameter
+    location_error: GPS measurement error standard deviation
+    n_time_slices: number of time slices used to integrate each bridge
+    max_chunk_elements: bound on the size of the per-chunk working arrays
+    footprint_sigmas: truncate each kernel at this many standard deviations (None = whole grid)
+    tile_size: edge length of output tiles for the footprint-limited path
+    out: optional preallocated output array of shape (len(lat_grid), len(lon_grid))
+
+    Returns:
+    2D array of summed densities indexed [lat index, lon index]
+    """
+    x1, y1, x2, y2, durations = (np.asarray(a, dtype=float) for a in (x1, y1, x2, y2, durations))
+    lon_grid = np.asarray(lon_grid, dtype=float)
+    lat_grid = np.asarray(lat_grid, dtype=float)
+
+    valid = durations > 0
+    x1, y1, x2, y2, durations = x1[valid], y1[valid], x2[valid], y2[valid], durations[valid]
+
+    density = out if out is not None else np.zeros((len(lat_grid), len(lon_grid)))
+    if len(durations) == 0:
+        return density
+
+    # One row per (segment, time slice) pair
+    frac = ((np.arange(n_time_slices) + 0.5) / n_time_slices)[np.newaxis, :]
+    mu_x = (x1[:, np.newaxis] + (x2 - x1)[:, np.newaxis] * frac).ravel()
+    mu_y = (y1[:, np.newaxis] + (y2 - y1)[:, np.newaxis] * frac).ravel()
+    t = durations[:, np.newaxis] * frac
+    time_variance = sigma_squared * t * (durations[:, np.newaxis] - t) / durations[:, np.newaxis]
+    total_variance = (time_variance + location_error**2).ravel()
+    weight = 1.0 / n_time_slices
+
+    if footprint_sigmas is None:
+        chunk_size = max(1, max_chunk_elements // (len(lon_grid) + len(lat_grid)))
+        for start in range(0, len(mu_x), chunk_size):
+            stop = start + chunk_size
+            two_var = 2 * total_variance[start:stop, np.newaxis]
+            lon_profile = np.exp(-(lon_grid[np.newaxis, :] - mu_x[start:stop, np.newaxis])**2 / two_var)
+            lat_profile = np.exp(-(lat_grid[np.newaxis, :] - mu_y[start:stop, np.newaxis])**2 / two_var)
+            density += weight * (lat_profile.T @ lon_profile)
+        return density
+
+    # Footprint of each row as [start, stop) index ranges on the lon and lat axes
+    radius = footprint_sigmas * np.sqrt(total_variance)
+    ix0 = np.searchsorted(lon_grid, mu_x - radius, side='left')
+    ix1 = np.searchsorted(lon_grid, mu_x + radius, side='right')
+    iy0 = np.searchsorted(lat_grid, mu_y - radius, side='left')
+    iy1 = np.searchsorted(lat_grid, mu_y + radius, side='right')
+
+    ny, nx = len(lat_grid), len(lon_grid)
+    tile_size = tile_size or max(ny, nx)
+    for ty in range(0, ny, tile_size):
+        for tx in range(0, nx, tile_size):
+            tile_y1, tile_x1 = min(ty + tile_size, ny), min(tx + tile_size, nx)
+            # Clip footprints to the tile and keep rows that still cover cells
+            cx0, cx1 = np.maximum(ix0, tx), np.minimum(ix1, tile_x1)
+            cy0, cy1 = np.maximum(iy0, ty), np.minimum(iy1, tile_y1)
+            rows = np.flatnonzero((cx1 > cx0) & (cy1 > cy0))
+            if len(rows) == 0:
+                continue
+            tile = np.zeros((tile_y1 - ty, tile_x1 - tx))
+            _scatter_bridge_footprints(
+                tile, tx, ty, rows, cx0, cx1, cy0, cy1,
+                mu_x, mu_y, total_variance, lon_grid, lat_grid, max_chunk_elements
+            )
+            density[ty:tile_y1, tx:tile_x1] += weight * tile
+
+    return density
+
+# Footprints up to this many cells are scattered together with bincount; for
+# larger ones the per-row loop costs less than enumerating every cell index
+VECTORIZED_FOOTPRINT_CELLS = 512
+
+def _scatter_bridge_footprints(tile, tx, ty, rows, cx0, cx1, cy0, cy1,
+                               mu_x, mu_y, total_variance, lon_grid, lat_grid,
+                               max_chunk_elements=8_000_000):
+    """
+    Add the clipped kernel footprints of `rows` into a tile
+
+    Small footprints (typical of fine grids with short fix intervals) are
+    enumerated as flat tile indices and summed with one bincount per chunk of
+    at most max_chunk_elements // 8 cells, so there is no Python loop over
+    them. Larger footprints are added one at a time as the outer product of a
+    latitude and longitude profile, where the per-row overhead is small next
+    to the cells written.
+    """
+    widths = cx1[rows] - cx0[rows]
+    sizes = widths * (cy1[rows] - cy0[rows])
+    small = sizes <= VECTORIZED_FOOTPRINT_CELLS
+
+    cells = np.cumsum(sizes[small])
+    small_rows, small_widths = rows[small], widths[small]
+    chunk_cells = max(1, max_chunk_elements // 8)
+    start = 0
+    while start < len(small_rows):
+        base = cells[start - 1] if start else 0
+        stop = max(start + 1, int(np.searchsorted(cells, base + chunk_cells, side='right')))
+        chunk = small_rows[start:stop]
+        counts = np.diff(cells[start:stop], prepend=base)
+
+        lon_profile, lon_offset = _footprint_profiles(chunk, cx0, cx1, mu_x, total_variance, lon_grid)
+        lat_profile, lat_offset = _footprint_profiles(chunk, cy0, cy1, mu_y, total_variance, lat_grid)
+
+        # Footprint of every cell and the cell's position inside it
+        owner = np.repeat(np.arange(len(chunk)), counts)
+        local = np.arange(cells[stop - 1] - base) - np.repeat(cells[start:stop] - counts - base, counts)
+        width = small_widths[start:stop][owner]
+        row_in_footprint = local // width
+        col_in_footprint = local - row_in_footprint * width
+
+        values = lat_profile[lat_offset[owner] + row_in_footprint] * lon_profile[lon_offset[owner] + col_in_footprint]
+        iy = cy0[chunk][owner] + row_in_footprint - ty
+        ix = cx0[chunk][owner] + col_in_footprint - tx
+        tile += np.bincount(iy * tile.shape[1] + ix, weights=values, minlength=tile.size).reshape(tile.shape)
+        start = stop
+
+    for r in rows[~small]:
+        two_var = 2 * total_variance[r]
+        lon_profile = np.exp(-(lon_grid[cx0[r]:cx1[r]] - mu_x[r])**2 / two_var)
+        lat_profile = np.exp(-(lat_grid[cy0[r]:cy1[r]] - mu_y[r])**2 / two_var)
+        tile[cy0[r] - ty:cy1[r] - ty, cx0[r] - tx:cx1[r] - tx] += np.outer(lat_profile, lon_profile)
+
+def _footprint_profiles(rows, i0, i1, mu, total_variance, grid):
+    """Concatenated kernel profiles of rows along one axis and the offset of each row's profile"""
+    lengths = i1[rows] - i0[rows]
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    index = i0[rows][owner] + np.arange(lengths.sum()) - np.repeat(offsets, lengths)
+    r = rows[owner]
+    return np.exp(-(grid[index] - mu[r])**2 / (2 * total_variance[r])), offsets
+
+def create_utilization_distribution(df, individual_id, sigma_squared, grid_resolution=20, location_error=0.01,
+                                    n_time_slices=1, max_chunk_elements=8_000_000,
+                                    footprint_sigmas=None, tile_size=None):
     """
     Create utilization distribution showing probable locations for an individual
 
@@ -934,8 +979,12 @@ def create_utilization_distribution(df, individual_id, sigma_squared, grid_resol
     df: DataFrame with GPS data for all individuals
     individual_id: ID of individual to create UD for
     sigma_squared: movement variance parameter
-    grid_resolution: number of grid cells along each dimension
+    grid_resolution: number of grid cells along each dimension (500 and above are practical)
     location_error: GPS measurement error
+    n_time_slices: number of time slices integrated per bridge (1 = bridge midpoint only)
+    max_chunk_elements: bound on the working memory of the density engine
+    footprint_sigmas: evaluate each bridge only within this many standard deviations (None = whole grid)
+    tile_size: process the grid in tiles of this size when footprint_sigmas is set
 
     Returns:
     tuple of (longitude grid, latitude grid, probability grid)
@@ -952,8 +1001,37 @@ def create_utilization_distribution(df, individual_id, sigma_squared, grid_resol
 
     print(f"Processing {len(individual_data)} GPS fixes")
 
-    lon_min, lon_max = individual_data['lon'].min(), individual_data['lon'].max()
-    lat_min, lat_max = individual_data['lat'].min(), individual_data['lat'].max()
+    arrays = {
+        'lon': individual_data['lon'].to_numpy(dtype=float),
+        'lat': individual_data['lat'].to_numpy(dtype=float),
+        'time_ns': individual_data['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    }
+    lon_mesh, lat_mesh, probability_grid = _utilization_distribution_task(
+        individual_id, arrays, sigma_squared, grid_resolution, location_error,
+        n_time_slices, max_chunk_elements, footprint_sigmas, tile_size
+    )
+
+    print(f"Created {grid_resolution}x{grid_resolution} utilization distribution")
+    print(f"Maximum probability density: {np.max(probability_grid):.6e}")
+    print()
+
+    return lon_mesh, lat_mesh, probability_grid
+
+def _utilization_distribution_task(individual_id, arrays, sigma_squared, grid_resolution, location_error,
+                                   n_time_slices, max_chunk_elements, footprint_sigmas, tile_size):
+    """
+    Utilization distribution from one individual's time-sorted lon, lat and time_ns arrays
+
+    Returns:
+    tuple of (longitude grid, latitude grid, probability grid), or (None, None, None)
+    when fewer than two fixes are available
+    """
+    lons, lats, times_ns = arrays['lon'], arrays['lat'], arrays['time_ns']
+    if len(lons) < 2:
+        return None, None, None
+
+    lon_min, lon_max = lons.min(), lons.max()
+    lat_min, lat_max = lats.min(), lats.max()
 
     lon_buffer = (lon_max - lon_min) * 0.1
     lat_buffer = (lat_max - lat_min) * 0.1
@@ -962,46 +1040,70 @@ def create_utilization_distribution(df, individual_id, sigma_squared, grid_resol
     lat_grid = np.linspace(lat_min - lat_buffer, lat_max + lat_buffer, grid_resolution)
 
     lon_mesh, lat_mesh = np.meshgrid(lon_grid, lat_grid)
-    probability_grid = np.zeros_like(lon_mesh)
 
-    for i in range(len(individual_data) - 1):
-        row1 = individual_data.iloc[i]
-        row2 = individual_data.iloc[i + 1]
+    durations = np.diff(times_ns) / 3.6e12
 
-        x1, y1 = row1['lon'], row1['lat']
-        x2, y2 = row2['lon'], row2['lat']
-
-        t1 = row1['timestamp']
-        t2 = row2['timestamp']
+    probability_grid = brownian_bridge_density_grid(
+        lons[:-1], lats[:-1], lons[1:], lats[1:], durations,
+        lon_grid, lat_grid, sigma_squared, location_error,
+        n_time_slices=n_time_slices, max_chunk_elements=max_chunk_elements,
+        footprint_sigmas=footprint_sigmas, tile_size=tile_size
+    )
 
-        if t2 <= t1:
-            continue
+    probability_sum = np.sum(probability_grid)
+    if probability_sum > 0:
+        probability_grid = probability_grid / probability_sum
 
-        time_diff_hours = (t2 - t1).total_seconds() / 3600.0
-        t_mid_hours = time_diff_hours / 2.0
+    return lon_mesh, lat_mesh, probability_grid
 
-        for ix in range(grid_resolution):
-            for iy in range(grid_resolution):
-                x = lon_mesh[iy, ix]
-                y = lat_mesh[iy, ix]
+def create_utilization_distributions(df, individual_ids, sigma_squared, grid_resolution=20, location_error=0.01,
+                                     n_time_slices=1, max_chunk_elements=8_000_000,
+                                     footprint_sigmas=None, tile_size=None, workers=1):
+    """
+    Create utilization distributions for several individuals in parallel
 
-                prob = calculate_brownian_bridge_probability(
-                    x, y, x1, y1, x2, y2,
-                    t_mid_hours, 0, time_diff_hours,
-                    sigma_squared, location_error
-                )
+    The data is grouped by individual once and each individual's UD is computed
+    in a worker process from shared-memory arrays
 
-                probability_grid[iy, ix] += prob
+    Parameters:
+    df: DataFrame with GPS data for all individuals
+    individual_ids: IDs of individuals to create UDs for
+    sigma_squared: movement variance parameter
+    workers: number of worker processes
+    (remaining parameters as in create_utilization_distribution)
 
-    probability_sum = np.sum(probability_grid)
-    if probability_sum > 0:
-        probability_grid = probability_grid / probability_sum
+    Returns:
+    dict of individual_id to (longitude grid, latitude grid, probability grid),
+    in the order of individual_ids
+    """
+    print(f"Creating utilization distributions for {len(individual_ids)} individuals ({workers} workers)")
+
+    subset = df[df['individual_id'].isin(individual_ids)].dropna(subset=['lat', 'lon', 'timestamp'])
+    subset, groups = group_individuals(subset)
+    arrays = {
+        'lon': subset['lon'].to_numpy(dtype=float),
+        'lat': subset['lat'].to_numpy(dtype=float),
+        'time_ns': subset['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    }
 
-    print(f"Created {grid_resolution}x{grid_resolution} utilization distribution")
-    print(f"Maximum probability density: {np.max(probability_grid):.6e}")
+    results = dict(map_individuals(
+        _utilization_distribution_task, arrays, groups,
+        args=(sigma_squared, grid_resolution, location_error, n_time_slices,
+              max_chunk_elements, footprint_sigmas, tile_size),
+        workers=workers
+    ))
+
+    uds = {}
+    for individual_id in individual_ids:
+        lon_mesh, lat_mesh, probability_grid = results.get(individual_id, (None, None, None))
+        if probability_grid is None:
+            print(f"Insufficient data points for individual {individual_id}")
+        else:
+            print(f"Individual {individual_id}: maximum probability density {np.max(probability_grid):.6e}")
+        uds[individual_id] = (lon_mesh, lat_mesh, probability_grid)
     print()
 
-    return lon_mesh, lat_mesh, probability_grid
+    return uds
 
 def visualize_utilization_distribution(lon_mesh, lat_mesh, probability_grid, df, individual_id, species_name):
     """
@@ -1055,42 +1157,6 @@ def visualize_utilization_distribution(lon_mesh, lat_mesh, probability_grid, df,
     plt.close()
     print()
 
-print("STEP 13: CREATING UTILIZATION DISTRIBUTIONS")
-print()
-
-if elephant_filtered is not None and elephant_variance is not None and len(elephant_filtered) > 0:
-    print("Creating utilization distributions for Elephant individuals")
-    elephant_individuals = elephant_filtered['individual_id'].unique()[:1]
-
-    for individual_id in elephant_individuals:
-        lon_mesh, lat_mesh, prob_grid = create_utilization_distribution(
-            elephant_filtered, individual_id, elephant_variance,
-            grid_resolution=80, location_error=0.01
-        )
-
-        if prob_grid is not None:
-            visualize_utilization_distribution(
-                lon_mesh, lat_mesh, prob_grid,
-                elephant_filtered, individual_id, 'Elephant'
-            )
-    print()
-
-if wildebeest_filtered is not None and wildebeest_variance is not None and len(wildebeest_filtered) > 0:
-    print("Creating utilization distributions for Wildebeest individuals")
-    wildebeest_individuals = wildebeest_filtered['individual_id'].unique()[:3]
-
-    for individual_id in wildebeest_individuals:
-        lon_mesh, lat_mesh, prob_grid = create_utilization_distribution(
-            wildebeest_filtered, individual_id, wildebeest_variance,
-            grid_resolution=80, location_error=0.01
-        )
-
-        if prob_grid is not None:
-            visualize_utilization_distribution(
-                lon_mesh, lat_mesh, prob_grid,
-                wildebeest_filtered, individual_id, 'Wildebeest'
-            )
-    print()
 
 def load_hmm_predictions(hmm_filepath, species_name):
     """
@@ -1126,7 +1192,8 @@ def load_hmm_predictions(hmm_filepath, species_name):
         print(f"Error loading HMM predictions: {str(e)}")
         return None
 
-def predict_intermediate_locations(df, sigma_squared, species_name, n_predictions_per_step=5):
+def predict_intermediate_locations(df, sigma_squared, species_name, n_predictions_per_step=5,
+                                   sample_noise=False, random_state=None):
     """
     Predict animal locations at intermediate times between observed GPS fixes using BBMM
 
@@ -1134,11 +1201,18 @@ def predict_intermediate_locations(df, sigma_squared, species_name, n_prediction
     located at times between actual GPS fixes. These predictions can be compared
     to held-out GPS data to validate the BBMM model accuracy
 
+    All movement steps are handled as columns: start and end arrays for every
+    step are broadcast against the j / (n + 1) time proportions. With
+    sample_noise the bridge mean is perturbed by Gaussian noise with the
+    Brownian bridge variance sigma squared * duration * p * (1 minus p)
+
     Parameters:
     df: DataFrame with GPS data
-    sigma_squared: movement variance parameter
+    sigma_squared: movement variance parameter (km squared per hour)
     species_name: name of the species
     n_predictions_per_step: number of intermediate points to predict per step
+    sample_noise: draw locations from the bridge distribution instead of using its mean
+    random_state: seed or numpy Generator for noise sampling
 
     Returns:
     DataFrame with predicted locations
@@ -1146,49 +1220,58 @@ def predict_intermediate_locations(df, sigma_squared, species_name, n_prediction
     print(f"Predicting intermediate locations for {species_name}")
     print(f"Predictions per movement step: {n_predictions_per_step}")
 
-    prediction_records = []
-
-    for individual_id in df['individual_id'].unique():
-        individual_data = df[df['individual_id'] == individual_id].copy()
-        individual_data = individual_data.dropna(subset=['lat', 'lon', 'timestamp'])
-        individual_data = individual_data.sort_values('timestamp')
-
-        for i in range(len(individual_data) - 1):
-            row1 = individual_data.iloc[i]
-            row2 = individual_data.iloc[i + 1]
-
-            x1, y1 = row1['lon'], row1['lat']
-            x2, y2 = row2['lon'], row2['lat']
-            t1 = row1['timestamp']
-            t2 = row2['timestamp']
-
-            if t2 <= t1:
-                continue
-
-            total_duration = t2 - t1
-
-            for j in range(1, n_predictions_per_step + 1):
-                time_proportion = j / (n_predictions_per_step + 1)
-                t_pred = t1 + total_duration * time_proportion
-
-                x_pred = x1 + (x2 - x1) * time_proportion
-                y_pred = y1 + (y2 - y1) * time_proportion
-
-                prediction_records.append({
-                    'individual_id': individual_id,
-                    'timestamp': t_pred,
-                    'predicted_lon': x_pred,
-                    'predicted_lat': y_pred,
-                    'start_lon': x1,
-                    'start_lat': y1,
-                    'end_lon': x2,
-                    'end_lat': y2,
-                    'start_time': t1,
-                    'end_time': t2,
-                    'time_proportion': time_proportion
-                })
-
-    predictions_df = pd.DataFrame(prediction_records)
+    valid = df.dropna(subset=['lat', 'lon', 'timestamp'])
+    valid, _ = group_individuals(valid)
+
+    ids = valid['individual_id'].to_numpy()
+    lons = valid['lon'].to_numpy(dtype=float)
+    lats = valid['lat'].to_numpy(dtype=float)
+    times = valid['timestamp']
+
+    # Steps between consecutive fixes of the same individual with positive duration
+    same_individual = ids[1:] == ids[:-1]
+    durations = times.diff().to_numpy()[1:]
+    step = np.flatnonzero(same_individual & (durations > np.timedelta64(0, 'ns')))
+    start_idx, end_idx = step, step + 1
+
+    proportions = np.arange(1, n_predictions_per_step + 1) / (n_predictions_per_step + 1)
+    n_steps = len(step)
+
+    x1, y1 = lons[start_idx][:, np.newaxis], lats[start_idx][:, np.newaxis]
+    x2, y2 = lons[end_idx][:, np.newaxis], lats[end_idx][:, np.newaxis]
+    predicted_lon = x1 + (x2 - x1) * proportions
+    predicted_lat = y1 + (y2 - y1) * proportions
+
+    if sample_noise and n_steps > 0:
+        rng = np.random.default_rng(random_state)
+        duration_hours = (durations[step] / np.timedelta64(1, 'h'))[:, np.newaxis]
+        std_km = np.sqrt(sigma_squared * duration_hours * proportions * (1 - proportions))
+        # Convert km to degrees (longitude degrees shrink with latitude)
+        std_lat = std_km / 111.32
+        std_lon = std_km / (111.32 * np.cos(np.radians(predicted_lat)))
+        predicted_lon = predicted_lon + rng.normal(size=predicted_lon.shape) * std_lon
+        predicted_lat = predicted_lat + rng.normal(size=predicted_lat.shape) * std_lat
+
+    # One output row per (step, proportion)
+    start_rep = np.repeat(start_idx, n_predictions_per_step)
+    end_rep = np.repeat(end_idx, n_predictions_per_step)
+    start_time_rep = times.iloc[start_rep].reset_index(drop=True)
+    end_time_rep = times.iloc[end_rep].reset_index(drop=True)
+    proportion_rep = np.tile(proportions, n_steps)
+
+    predictions_df = pd.DataFrame({
+        'individual_id': ids[start_rep],
+        'timestamp': start_time_rep + (end_time_rep - start_time_rep) * proportion_rep,
+        'predicted_lon': predicted_lon.ravel(),
+        'predicted_lat': predicted_lat.ravel(),
+        'start_lon': lons[start_rep],
+        'start_lat': lats[start_rep],
+        'end_lon': lons[end_rep],
+        'end_lat': lats[end_rep],
+        'start_time': start_time_rep,
+        'end_time': end_time_rep,
+        'time_proportion': proportion_rep
+    })
 
     print(f"Generated {len(predictions_df):,} intermediate location predictions")
     print(f"Predictions for {predictions_df['individual_id'].nunique()} individuals")
@@ -1196,37 +1279,6 @@ def predict_intermediate_locations(df, sigma_squared, species_name, n_prediction
 
     return predictions_df
 
-print("STEP 14: PREDICTING INTERMEDIATE LOCATIONS")
-print()
-
-if elephant_filtered is not None and elephant_variance is not None and len(elephant_filtered) > 0:
-    elephant_predictions = predict_intermediate_locations(
-        elephant_filtered, elephant_variance, 'Elephant', n_predictions_per_step=5
-    )
-    print()
-else:
-    elephant_predictions = None
-    print("Elephant data not available for predictions")
-    print()
-
-if wildebeest_filtered is not None and wildebeest_variance is not None and len(wildebeest_filtered) > 0:
-    wildebeest_predictions = predict_intermediate_locations(
-        wildebeest_filtered, wildebeest_variance, 'Wildebeest', n_predictions_per_step=5
-    )
-    print()
-else:
-    wildebeest_predictions = None
-    print("Wildebeest data not available for predictions")
-    print()
-
-print("STEP 15: LOADING HMM BEHAVIORAL PREDICTIONS")
-print()
-
-elephant_hmm = load_hmm_predictions(ELEPHANT_HMM_FILE, 'Elephant')
-print()
-
-wildebeest_hmm = load_hmm_predictions(WILDEBEEST_HMM_FILE, 'Wildebeest')
-print()
 
 def merge_hmm_predictions_with_gps(gps_df, hmm_df, species_name):
     """
@@ -1321,16 +1373,14 @@ def merge_hmm_predictions_with_gps(gps_df, hmm_df, species_name):
     print("Merge complete.\n")
     return merged_df
 
-print("STEP 16: MERGING HMM PREDICTIONS WITH GPS DATA")
-print()
 
-if elephant_filtered is not None and elephant_hmm is not None:
-    elephant_filtered = merge_hmm_predictions_with_gps(elephant_filtered, elephant_hmm, 'Elephant')
-    print()
-
-if wildebeest_filtered is not None and wildebeest_hmm is not None:
-    wildebeest_filtered = merge_hmm_predictions_with_gps(wildebeest_filtered, wildebeest_hmm, 'Wildebeest')
-    print()
+def _timestamps_to_ns(timestamps):
+    """
+    Integer nanoseconds for a datetime Series (UTC for timezone-aware values)
+    """
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert('UTC').dt.tz_localize(None)
+    return timestamps.to_numpy(dtype='datetime64[ns]').astype(np.int64)
 
 def calculate_prediction_accuracy(predictions_df, actual_df, species_name):
     """
@@ -1343,11 +1393,9 @@ def calculate_prediction_accuracy(predictions_df, actual_df, species_name):
     This version:
     - Validates presence of required columns.
     - Converts timestamps to datetime and individual_id to string.
-    - Uses per-individual numpy search for speed and stability.
+    - Matches all predictions at once with sorted pd.merge_asof joins by individual.
     - Returns a dictionary of accuracy metrics or None if no matches found.
     """
-    import numpy as np
-    import pandas as pd
 
     print(f"Calculating prediction accuracy for {species_name}")
 
@@ -1401,89 +1449,58 @@ def calculate_prediction_accuracy(predictions_df, actual_df, species_name):
         print("No usable prediction or actual rows after cleaning.")
         return None
 
-    # Build lookup per individual for actual observations (sorted)
-    actual_by_ind = {}
-    for ind, group in acts.groupby('individual_id'):
-        g = group.sort_values('timestamp').reset_index(drop=True)
-        # store numeric timestamps (ns) for fast numpy operations, and lat/lon arrays
-        times_ns = g['timestamp'].values.astype('datetime64[ns]').astype('int64')  # ns
-        lons = g['lon'].values
-        lats = g['lat'].values
-        actual_by_ind[ind] = {
-            'times_ns': times_ns,
-            'lons': lons,
-            'lats': lats
-        }
-
-    errors = []
-
-    # Helper: safe haversine call (expects lat1, lon1, lat2, lon2)
-    def _haversine(lat1, lon1, lat2, lon2):
-        try:
-            return haversine_distance(lat1, lon1, lat2, lon2)
-        except Exception:
-            # If haversine_distance raises for some values, fallback to np.nan
-            return np.nan
-
-    # Iterate predictions grouped by individual for efficiency
-    preds_grouped = preds.groupby('individual_id')
     n_pred_total = len(preds)
-    n_matched = 0
 
-    for ind, pred_group in preds_grouped:
-        if ind not in actual_by_ind:
-            # No actual observations for this individual
-            continue
-
-        act_info = actual_by_ind[ind]
-        times_ns = act_info['times_ns']
-        lons = act_info['lons']
-        lats = act_info['lats']
-
-        # For each prediction row for this individual
-        for _, pred_row in pred_group.iterrows():
-            pred_time_ns = np.int64(pred_row['timestamp'].value)  # ns
-            start_ns = np.int64(pred_row['start_time'].value)
-            end_ns = np.int64(pred_row['end_time'].value)
-
-            if end_ns < start_ns:
-                # skip invalid window
-                continue
-
-            # find candidate indices within window using numpy boolean mask
-            # Using searchsorted to speed up locating approximate range
-            left_idx = np.searchsorted(times_ns, start_ns, side='left')
-            right_idx = np.searchsorted(times_ns, end_ns, side='right')
-
-            if left_idx >= right_idx:
-                # no observations in the time window
-                continue
-
-            candidate_idx = np.arange(left_idx, right_idx)
-            candidate_times = times_ns[candidate_idx]
-
-            # find index of closest time to pred_time
-            nearest_offset = np.argmin(np.abs(candidate_times - pred_time_ns))
-            nearest_idx = candidate_idx[nearest_offset]
-
-            actual_lon = lons[nearest_idx]
-            actual_lat = lats[nearest_idx]
-
-            pred_lon = pred_row['predicted_lon']
-            pred_lat = pred_row['predicted_lat']
-
-            # compute haversine distance (km)
-            err_km = _haversine(pred_lat, pred_lon, actual_lat, actual_lon)
-            if not np.isnan(err_km):
-                errors.append(err_km)
-                n_matched += 1
+    preds['pred_ns'] = _timestamps_to_ns(preds['timestamp'])
+    preds['start_ns'] = _timestamps_to_ns(preds['start_time'])
+    preds['end_ns'] = _timestamps_to_ns(preds['end_time'])
+    # skip invalid windows
+    preds = preds[preds['end_ns'] >= preds['start_ns']].sort_values('pred_ns', kind='mergesort')
+
+    acts = pd.DataFrame({
+        'individual_id': acts['individual_id'].to_numpy(),
+        'actual_ns': _timestamps_to_ns(acts['timestamp']),
+        'actual_lon': acts['lon'].to_numpy(dtype=float),
+        'actual_lat': acts['lat'].to_numpy(dtype=float)
+    }).sort_values('actual_ns', kind='mergesort')
+    # Of repeated fixes at the same time the first is matched, as the per-prediction
+    # search did; merge_asof on its own would take the last one looking backward
+    acts = acts.drop_duplicates(subset=['individual_id', 'actual_ns'], keep='first')
+
+    # Nearest observation at or before, and at or after, each prediction time
+    left = preds[['individual_id', 'pred_ns']]
+    before = pd.merge_asof(left, acts, left_on='pred_ns', right_on='actual_ns',
+                           by='individual_id', direction='backward')
+    after = pd.merge_asof(left, acts, left_on='pred_ns', right_on='actual_ns',
+                          by='individual_id', direction='forward')
+
+    # The closest observation inside start_time..end_time is one of the two;
+    # ties go to the earlier observation
+    pred_ns = preds['pred_ns'].to_numpy()
+    before_ns = before['actual_ns'].to_numpy(dtype=float)
+    after_ns = after['actual_ns'].to_numpy(dtype=float)
+    before_ok = np.isfinite(before_ns) & (before_ns >= preds['start_ns'].to_numpy())
+    after_ok = np.isfinite(after_ns) & (after_ns <= preds['end_ns'].to_numpy())
+    use_before = before_ok & (~after_ok | (pred_ns - before_ns <= after_ns - pred_ns))
+    matched = before_ok | after_ok
+
+    actual_lon = np.where(use_before, before['actual_lon'].to_numpy(), after['actual_lon'].to_numpy())[matched]
+    actual_lat = np.where(use_before, before['actual_lat'].to_numpy(), after['actual_lat'].to_numpy())[matched]
+
+    # compute haversine distance (km) for all matched pairs at once
+    with np.errstate(invalid='ignore'):
+        errors = haversine_distance(
+            preds['predicted_lat'].to_numpy(dtype=float)[matched],
+            preds['predicted_lon'].to_numpy(dtype=float)[matched],
+            actual_lat, actual_lon
+        )
+    errors = errors[~np.isnan(errors)]
+    n_matched = len(errors)
 
     if len(errors) == 0:
         print("Could not match predictions to observations for validation (no matches found in time windows).")
         return None
 
-    errors = np.array(errors)
-
     mae = np.mean(errors)
     rmse = np.sqrt(np.mean(errors**2))
     median_error = np.median(errors)
@@ -1514,24 +1531,6 @@ def calculate_prediction_accuracy(predictions_df, actual_df, species_name):
 
     return accuracy_metrics
 
-print("STEP 17: CALCULATING PREDICTION ACCURACY")
-print()
-
-if elephant_predictions is not None and elephant_filtered is not None:
-    elephant_accuracy = calculate_prediction_accuracy(
-        elephant_predictions, elephant_filtered, 'Elephant'
-    )
-    print()
-else:
-    elephant_accuracy = None
-
-if wildebeest_predictions is not None and wildebeest_filtered is not None:
-    wildebeest_accuracy = calculate_prediction_accuracy(
-        wildebeest_predictions, wildebeest_filtered, 'Wildebeest'
-    )
-    print()
-else:
-    wildebeest_accuracy = None
 
 def calculate_step_length_error(df, predictions_df, species_name):
     """
@@ -1575,27 +1574,17 @@ def calculate_step_length_error(df, predictions_df, species_name):
         print("No valid prediction rows after cleaning.")
         return None
 
-    # Compute distances (km)
-    def safe_haversine(lat1, lon1, lat2, lon2):
-        try:
-            return haversine_distance(lat1, lon1, lat2, lon2)
-        except Exception:
-            return np.nan
-
-    pred_step1 = np.array([
-        safe_haversine(a, b, c, d)
-        for a, b, c, d in zip(
-            preds_valid['start_lat'], preds_valid['start_lon'],
-            preds_valid['predicted_lat'], preds_valid['predicted_lon']
+    # Compute distances (km) over whole columns
+    coords = {col: pd.to_numeric(preds_valid[col], errors='coerce').to_numpy(dtype=float) for col in required_cols}
+    with np.errstate(invalid='ignore'):
+        pred_step1 = haversine_distance(
+            coords['start_lat'], coords['start_lon'],
+            coords['predicted_lat'], coords['predicted_lon']
         )
-    ])
-    pred_step2 = np.array([
-        safe_haversine(a, b, c, d)
-        for a, b, c, d in zip(
-            preds_valid['predicted_lat'], preds_valid['predicted_lon'],
-            preds_valid['end_lat'], preds_valid['end_lon']
+        pred_step2 = haversine_distance(
+            coords['predicted_lat'], coords['predicted_lon'],
+            coords['end_lat'], coords['end_lon']
         )
-    ])
 
     predicted_steps = np.concatenate([pred_step1, pred_step2])
     predicted_steps = predicted_steps[np.isfinite(predicted_steps)]
@@ -1641,24 +1630,6 @@ def calculate_step_length_error(df, predictions_df, species_name):
 
     return step_length_metrics
 
-print("STEP 18: CALCULATING STEP LENGTH PREDICTION ERROR")
-print()
-
-if elephant_filtered is not None and elephant_predictions is not None:
-    elephant_step_error = calculate_step_length_error(
-        elephant_filtered, elephant_predictions, 'Elephant'
-    )
-    print()
-else:
-    elephant_step_error = None
-
-if wildebeest_filtered is not None and wildebeest_predictions is not None:
-    wildebeest_step_error = calculate_step_length_error(
-        wildebeest_filtered, wildebeest_predictions, 'Wildebeest'
-    )
-    print()
-else:
-    wildebeest_step_error = None
 
 def calculate_turning_angle_error(df, predictions_df, species_name):
     """
@@ -1780,24 +1751,6 @@ def calculate_turning_angle_error(df, predictions_df, species_name):
         'n_actual_angles': len(actual_angles)
     }
 
-print("STEP 19: CALCULATING TURNING ANGLE PREDICTION ERROR")
-print()
-
-if elephant_filtered is not None and elephant_predictions is not None:
-    elephant_angle_error = calculate_turning_angle_error(
-        elephant_filtered, elephant_predictions, 'Elephant'
-    )
-    print()
-else:
-    elephant_angle_error = None
-
-if wildebeest_filtered is not None and wildebeest_predictions is not None:
-    wildebeest_angle_error = calculate_turning_angle_error(
-        wildebeest_filtered, wildebeest_predictions, 'Wildebeest'
-    )
-    print()
-else:
-    wildebeest_angle_error = None
 
 def compare_bbmm_with_hmm_states(df, species_name):
     """
@@ -1909,24 +1862,6 @@ def compare_bbmm_with_hmm_states(df, species_name):
     print()
     return comparison_stats
 
-print("STEP 20: COMPARING BBMM WITH HMM BEHAVIORAL STATES")
-print()
-
-if elephant_filtered is not None and 'hmm_behavioral_state' in elephant_filtered.columns:
-    elephant_comparison = compare_bbmm_with_hmm_states(elephant_filtered, 'Elephant')
-    print()
-else:
-    elephant_comparison = None
-    print("Elephant HMM behavioral states not available for comparison")
-    print()
-
-if wildebeest_filtered is not None and 'hmm_behavioral_state' in wildebeest_filtered.columns:
-    wildebeest_comparison = compare_bbmm_with_hmm_states(wildebeest_filtered, 'Wildebeest')
-    print()
-else:
-    wildebeest_comparison = None
-    print("Wildebeest HMM behavioral states not available for comparison")
-    print()
 
 def visualize_evaluation_results(accuracy_metrics, step_error, angle_error, species_name):
     """
@@ -2061,20 +1996,6 @@ def visualize_evaluation_results(accuracy_metrics, step_error, angle_error, spec
     plt.close()
     print()
 
-print("STEP 21: VISUALIZING EVALUATION RESULTS")
-print()
-
-if elephant_accuracy is not None or elephant_step_error is not None or elephant_angle_error is not None:
-    visualize_evaluation_results(
-        elephant_accuracy, elephant_step_error, elephant_angle_error, 'Elephant'
-    )
-    print()
-
-if wildebeest_accuracy is not None or wildebeest_step_error is not None or wildebeest_angle_error is not None:
-    visualize_evaluation_results(
-        wildebeest_accuracy, wildebeest_step_error, wildebeest_angle_error, 'Wildebeest'
-    )
-    print()
 
 def save_bbmm_results(df, variance, species_name):
     """
@@ -2107,57 +2028,392 @@ def save_bbmm_results(df, variance, species_name):
     print(f"Saved summary statistics to {summary_file}")
     print()
 
-print("STEP 22: SAVING BBMM RESULTS")
-print()
 
-if elephant_filtered is not None and elephant_variance is not None and len(elephant_filtered) > 0:
-    save_bbmm_results(
-        elephant_filtered, elephant_variance, 'Elephant'
-    )
+"""## Pipeline stages"""
+
+
+def cleaned_tracks_path(species_name, species_config, config):
+    """
+    Dataset cache entry for the cleaned tracks of a species
+
+    The key covers the source file contents, the speed limit and the code of
+    every loading and cleaning step, so editing any of them starts a new entry.
+
+    Parameters:
+    species_name: name of the species
+    species_config: entry of SPECIES_CONFIG for the species
+    config: run options from the pipeline runner ('dataset_cache' is the cache root, None disables it)
+
+    Returns:
+    dataset directory, or None if the cache is disabled
+    """
+    cache_dir = config.get('dataset_cache', DEFAULT_DATASET_DIR)
+    filepath = species_config['gps_file']
+    if not cache_dir or not PYARROW_AVAILABLE or not os.path.exists(filepath):
+        return None
+    code = source_digest(load_data, identify_coordinate_columns, identify_timestamp_columns,
+                         identify_individual_column, clean_data, calculate_step_length,
+                         calculate_turning_angle, remove_outliers)
+    params = {'species': species_name, 'max_speed_kmh': species_config['max_speed_kmh'], 'code': code}
+    return dataset_path(filepath, 'bbmm_tracks', params, cache_dir)
+
+
+def stage_load(state, config):
+    """
+    Steps 1-5: load GPS data and identify coordinate, timestamp and ID columns
+
+    Species whose cleaned tracks are in the dataset cache skip steps 1-9.
+
+    Parameters:
+    state: pipeline state, updated with one dict per species
+    config: run options from the pipeline runner
+    """
+    print("STEP 1: LOADING DATA")
     print()
 
-if wildebeest_filtered is not None and wildebeest_variance is not None and len(wildebeest_filtered) > 0:
-    save_bbmm_results(
-        wildebeest_filtered, wildebeest_variance, 'Wildebeest'
-    )
+    for species_name, species_config in SPECIES_CONFIG.items():
+        print(f"{species_name.upper()} DATA ANALYSIS")
+        print()
+        tracks_path = cleaned_tracks_path(species_name, species_config, config)
+        filtered = read_dataset(tracks_path) if tracks_path else None
+        if filtered is not None:
+            print(f"Loaded {len(filtered):,} cleaned records from the dataset cache: {tracks_path}")
+            print()
+            state[species_name] = {'raw': None, 'filtered': filtered, 'tracks_path': tracks_path}
+        else:
+            state[species_name] = {'raw': load_data(species_config['gps_file'], species_name), 'tracks_path': tracks_path}
+
+    pending = [species_name for species_name in SPECIES_CONFIG if 'filtered' not in state[species_name]]
+
+    print("STEP 2: INSPECTING DATA QUALITY")
+    print()
+
+    for species_name in pending:
+        raw = state[species_name]['raw']
+        if raw is not None:
+            inspect_data_quality(raw, species_name)
+        else:
+            print(f"{species_name} data not loaded, skipping quality inspection")
+            print()
+
+    print("STEP 3: IDENTIFYING COORDINATE COLUMNS")
+    print()
+
+    for species_name in pending:
+        raw = state[species_name]['raw']
+        state[species_name]['coords'] = identify_coordinate_columns(raw, species_name) if raw is not None else None
+
+    print("STEP 4: PARSING TIMESTAMPS")
+    print()
+
+    for species_name in pending:
+        if state[species_name]['raw'] is not None:
+            state[species_name]['raw'] = identify_timestamp_columns(state[species_name]['raw'], species_name)
+
+    print("STEP 5: IDENTIFYING INDIVIDUAL IDs")
+    print()
+
+    for species_name in pending:
+        raw = state[species_name]['raw']
+        state[species_name]['id_col'] = identify_individual_column(raw, species_name) if raw is not None else None
+
+
+def stage_clean(state, config):
+    """
+    Steps 6-9: clean records, compute step lengths and turning angles, remove outliers
+
+    The filtered tracks are stored in the dataset cache for later runs.
+    """
+    pending = [species_name for species_name in SPECIES_CONFIG if 'filtered' not in state[species_name]]
+
+    print("STEP 6: CLEANING DATA")
+    print()
+
+    cleaned = {}
+    for species_name in pending:
+        data = state[species_name]
+        cleaned[species_name] = None
+        if data['raw'] is not None and data['coords'] and data['id_col']:
+            cleaned[species_name] = clean_data(data['raw'], data['coords'], data['id_col'], species_name)
+        else:
+            print(f"Cannot clean {species_name.lower()} data: missing coordinates or ID column")
+            print()
+        # Raw records are not needed after cleaning; keeps stage caches small
+        data.pop('raw', None)
+
+    print("STEP 7: CALCULATING STEP LENGTHS")
+    print()
+
+    for species_name, df in cleaned.items():
+        if df is not None and len(df) > 0:
+            cleaned[species_name] = calculate_step_length(df)
+        else:
+            print(f"{species_name} data not available or empty after cleaning")
+            cleaned[species_name] = None
+            print()
+
+    print("STEP 8: CALCULATING TURNING ANGLES")
+    print()
+
+    for species_name, df in cleaned.items():
+        if df is not None and len(df) > 0:
+            cleaned[species_name] = calculate_turning_angle(df)
+        else:
+            print(f"{species_name} data not available")
+            print()
+
+    print("STEP 9: REMOVING OUTLIERS")
+    print()
+
+    for species_name, df in cleaned.items():
+        state[species_name]['filtered'] = None
+        if df is not None and len(df) > 0:
+            state[species_name]['filtered'] = remove_outliers(
+                df, species_name, max_speed_kmh=SPECIES_CONFIG[species_name]['max_speed_kmh']
+            )
+            tracks_path = state[species_name].get('tracks_path')
+            if tracks_path:
+                write_dataset(state[species_name]['filtered'], tracks_path, species=species_name)
+        else:
+            print(f"{species_name} data not available")
+            print()
+
+
+def stage_visualize_data(state, config):
+    """
+    Steps 10-11: plot cleaned tracks and movement distributions
+    """
+    plots = config.get('plots', True)
+
+    print("STEP 10: VISUALIZING CLEANED DATA")
+    print()
+
+    if plots:
+        for species_name in SPECIES_CONFIG:
+            filtered = state[species_name]['filtered']
+            if filtered is not None and len(filtered) > 0:
+                visualize_cleaned_data(filtered, species_name)
+
+    print("STEP 11: VISUALIZING MOVEMENT DISTRIBUTIONS")
+    print()
+
+    if plots:
+        for species_name in SPECIES_CONFIG:
+            filtered = state[species_name]['filtered']
+            if filtered is not None and len(filtered) > 0:
+                visualize_movement_distributions(filtered, species_name)
+
+
+def stage_variance(state, config):
+    """
+    Step 12: Brownian motion variance of each species
+    """
+    print("STEP 12: CALCULATING BBMM VARIANCE PARAMETER")
+    print()
+
+    for species_name in SPECIES_CONFIG:
+        data = state[species_name]
+        if data['filtered'] is not None and len(data['filtered']) > 0:
+            data['variance'], data['ind_variance'] = calculate_bbmm_variance(data['filtered'], species_name)
+            print()
+        else:
+            data['variance'], data['ind_variance'] = None, {}
+            print(f"{species_name} data not available for variance calculation")
+            print()
+
+
+def stage_utilization(state, config):
+    """
+    Step 13: utilization distributions for a sample of individuals
+    """
+    print("STEP 13: CREATING UTILIZATION DISTRIBUTIONS")
+    print()
+
+    for species_name, species_config in SPECIES_CONFIG.items():
+        data = state[species_name]
+        data['uds'] = None
+        filtered = data['filtered']
+        if filtered is None or data['variance'] is None or len(filtered) == 0:
+            continue
+
+        print(f"Creating utilization distributions for {species_name} individuals")
+        individuals = filtered['individual_id'].unique()[:species_config['n_ud_individuals']]
+
+        data['uds'] = create_utilization_distributions(
+            filtered, list(individuals), data['variance'],
+            grid_resolution=80, location_error=0.01, footprint_sigmas=5.0, workers=config.get('workers', 1)
+        )
+
+        if config.get('plots', True):
+            for individual_id, (lon_mesh, lat_mesh, prob_grid) in data['uds'].items():
+                if prob_grid is not None:
+                    visualize_utilization_distribution(
+                        lon_mesh, lat_mesh, prob_grid,
+                        filtered, individual_id, species_name
+                    )
+        print()
+
+
+def stage_predict(state, config):
+    """
+    Step 14: intermediate locations between consecutive fixes
+    """
+    print("STEP 14: PREDICTING INTERMEDIATE LOCATIONS")
+    print()
+
+    for species_name in SPECIES_CONFIG:
+        data = state[species_name]
+        if data['filtered'] is not None and data['variance'] is not None and len(data['filtered']) > 0:
+            data['predictions'] = predict_intermediate_locations(
+                data['filtered'], data['variance'], species_name, n_predictions_per_step=5
+            )
+            print()
+        else:
+            data['predictions'] = None
+            print(f"{species_name} data not available for predictions")
+            print()
+
+
+def stage_merge_hmm(state, config):
+    """
+    Steps 15-16: attach HMM behavioral states to the GPS records
+    """
+    print("STEP 15: LOADING HMM BEHAVIORAL PREDICTIONS")
+    print()
+
+    hmm_predictions = {}
+    for species_name, species_config in SPECIES_CONFIG.items():
+        hmm_predictions[species_name] = load_hmm_predictions(species_config['hmm_file'], species_name)
+        print()
+
+    print("STEP 16: MERGING HMM PREDICTIONS WITH GPS DATA")
     print()
 
-print("BBMM ANALYSIS COMPLETE")
-print()
-
-print("Summary of Results:")
-print()
-
-if elephant_filtered is not None and len(elephant_filtered) > 0:
-    print("ELEPHANT:")
-    print(f"  Total GPS records processed: {len(elephant_filtered):,}")
-    print(f"  Number of individuals: {elephant_filtered['individual_id'].nunique()}")
-    if elephant_variance is not None:
-        print(f"  Movement variance: {elephant_variance:.6f} km squared per hour")
-    if elephant_accuracy is not None:
-        print(f"  Prediction MAE: {elephant_accuracy['mae']:.4f} km")
-        print(f"  Prediction RMSE: {elephant_accuracy['rmse']:.4f} km")
-    if elephant_step_error is not None:
-        print(f"  Step length error: {elephant_step_error['mean_error']:.4f} km ({elephant_step_error['relative_mean_error']:.2f}%)")
-    if elephant_angle_error is not None:
-        print(f"  Turning angle error: {elephant_angle_error['mean_angular_error_degrees']:.2f} degrees")
+    for species_name in SPECIES_CONFIG:
+        data = state[species_name]
+        if data['filtered'] is not None and hmm_predictions[species_name] is not None:
+            data['filtered'] = merge_hmm_predictions_with_gps(data['filtered'], hmm_predictions[species_name], species_name)
+            print()
+
+
+def stage_evaluate(state, config):
+    """
+    Steps 17-21: location, step length and turning angle errors and HMM comparison
+    """
+    print("STEP 17: CALCULATING PREDICTION ACCURACY")
     print()
 
-if wildebeest_filtered is not None and len(wildebeest_filtered) > 0:
-    print("WILDEBEEST:")
-    print(f"  Total GPS records processed: {len(wildebeest_filtered):,}")
-    print(f"  Number of individuals: {wildebeest_filtered['individual_id'].nunique()}")
-    if wildebeest_variance is not None:
-        print(f"  Movement variance: {wildebeest_variance:.6f} km squared per hour")
-    if wildebeest_accuracy is not None:
-        print(f"  Prediction MAE: {wildebeest_accuracy['mae']:.4f} km")
-        print(f"  Prediction RMSE: {wildebeest_accuracy['rmse']:.4f} km")
-    if wildebeest_step_error is not None:
-        print(f"  Step length error: {wildebeest_step_error['mean_error']:.4f} km ({wildebeest_step_error['relative_mean_error']:.2f}%)")
-    if wildebeest_angle_error is not None:
-        print(f"  Turning angle error: {wildebeest_angle_error['mean_angular_error_degrees']:.2f} degrees")
+    for species_name in SPECIES_CONFIG:
+        data = state[species_name]
+        data['accuracy'] = None
+        if data['predictions'] is not None and data['filtered'] is not None:
+            data['accuracy'] = calculate_prediction_accuracy(data['predictions'], data['filtered'], species_name)
+            print()
+
+    print("STEP 18: CALCULATING STEP LENGTH PREDICTION ERROR")
     print()
 
-print("All results saved to:", output_dir)
-print()
-print("Analysis complete.")
\ No newline at end of file
+    for species_name in SPECIES_CONFIG:
+        data = state[species_name]
+        data['step_error'] = None
+        if data['filtered'] is not None and data['predictions'] is not None:
+            data['step_error'] = calculate_step_length_error(data['filtered'], data['predictions'], species_name)
+            print()
+
+    print("STEP 19: CALCULATING TURNING ANGLE PREDICTION ERROR")
+    print()
+
+    for species_name in SPECIES_CONFIG:
+        data = state[species_name]
+        data['angle_error'] = None
+        if data['filtered'] is not None and data['predictions'] is not None:
+            data['angle_error'] = calculate_turning_angle_error(data['filtered'], data['predictions'], species_name)
+            print()
+
+    print("STEP 20: COMPARING BBMM WITH HMM BEHAVIORAL STATES")
+    print()
+
+    for species_name in SPECIES_CONFIG:
+        data = state[species_name]
+        data['comparison'] = None
+        if data['filtered'] is not None and 'hmm_behavioral_state' in data['filtered'].columns:
+            data['comparison'] = compare_bbmm_with_hmm_states(data['filtered'], species_name)
+            print()
+        else:
+            print(f"{species_name} HMM behavioral states not available for comparison")
+            print()
+
+    print("STEP 21: VISUALIZING EVALUATION RESULTS")
+    print()
+
+    if config.get('plots', True):
+        for species_name in SPECIES_CONFIG:
+            data = state[species_name]
+            if data['accuracy'] is not None or data['step_error'] is not None or data['angle_error'] is not None:
+                visualize_evaluation_results(data['accuracy'], data['step_error'], data['angle_error'], species_name)
+                print()
+
+
+def stage_save(state, config):
+    """
+    Step 22: write BBMM results and print the summary
+    """
+    print("STEP 22: SAVING BBMM RESULTS")
+    print()
+
+    for species_name in SPECIES_CONFIG:
+        data = state[species_name]
+        if data['filtered'] is not None and data['variance'] is not None and len(data['filtered']) > 0:
+            save_bbmm_results(data['filtered'], data['variance'], species_name)
+            print()
+
+    print("BBMM ANALYSIS COMPLETE")
+    print()
+
+    print("Summary of Results:")
+    print()
+
+    for species_name in SPECIES_CONFIG:
+        data = state[species_name]
+        filtered = data['filtered']
+        if filtered is None or len(filtered) == 0:
+            continue
+        print(f"{species_name.upper()}:")
+        print(f"  Total GPS records processed: {len(filtered):,}")
+        print(f"  Number of individuals: {filtered['individual_id'].nunique()}")
+        if data['variance'] is not None:
+            print(f"  Movement variance: {data['variance']:.6f} km squared per hour")
+        if data['accuracy'] is not None:
+            print(f"  Prediction MAE: {data['accuracy']['mae']:.4f} km")
+            print(f"  Prediction RMSE: {data['accuracy']['rmse']:.4f} km")
+        if data['step_error'] is not None:
+            print(f"  Step length error: {data['step_error']['mean_error']:.4f} km ({data['step_error']['relative_mean_error']:.2f}%)")
+        if data['angle_error'] is not None:
+            print(f"  Turning angle error: {data['angle_error']['mean_angular_error_degrees']:.2f} degrees")
+        print()
+
+    print("All results saved to:", output_dir)
+    print()
+    print("Analysis complete.")
+
+
+PIPELINE_STAGES = [
+    ('load', stage_load),
+    ('clean', stage_clean),
+    ('visualize_data', stage_visualize_data),
+    ('variance', stage_variance),
+    ('utilization', stage_utilization),
+    ('predict', stage_predict),
+    ('merge_hmm', stage_merge_hmm),
+    ('evaluate', stage_evaluate),
+    ('save', stage_save),
+]
+
+
+if __name__ == '__main__':
+    import sys
+    try:
+        from .pipeline import run_cli
+    except ImportError:
+        from pipeline import run_cli
+    run_cli(sys.modules[__name__], 'bbmm')
@@ -0,0 +1,319 @@
+"""
+Columnar cache of tracking datasets for the training pipelines
+
+Reading the Movebank CSVs, detecting their columns, cleaning the records and
+filtering outliers gives the same result on every run, yet it is most of the
+time spent before any model is fitted. The result is stored once as a Parquet
+dataset partitioned by species and individual, under a key built from a hash
+of the source file and of the code and options that produced it. Later runs
+read it back with only the columns and individuals they need; the partition
+directories let pyarrow skip the files of other individuals entirely.
+
+Parquet needs pyarrow. Without it every lookup misses and the pipelines read
+the CSVs exactly as before.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import inspect
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+DEFAULT_DATASET_DIR = os.environ.get('DATASET_CACHE_DIR', '/data/cache/datasets')
+
+# Bump when the on-disk layout changes so older datasets are not read
+CACHE_FORMAT_VERSION = 1
+
+PARTITION_COLUMNS = ('species', 'individual_id')
+ROW_COLUMN = '_row'
+INDEX_COLUMN = '_index'
+METADATA_FILE = '_dataset.json'
+
+_digests = {}
+
+
+def file_digest(filepath, chunk_size=1 << 24):
+    """
+    BLAKE2 digest of a file's contents
+
+    Digests are remembered per (path, size, mtime) for the life of the
+    process, so each pipeline stage can key on the file without re-reading it.
+
+    Parameters:
+    filepath: path to the file
+    chunk_size: bytes read at a time
+
+    Returns:
+    hex digest string
+    """
+    stat = os.stat(filepath)
+    memo_key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _digests:
+        digest = hashlib.blake2b(digest_size=20)
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        _digests[memo_key] = digest.hexdigest()
+    return _digests[memo_key]
+
+
+def source_digest(*functions):
+    """
+    Digest of the source code of the functions that build a dataset
+
+    Editing any of them changes the cache key, so a change to the cleaning
+    code never serves tracks cleaned by the old version.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for function in functions:
+        try:
+            digest.update(inspect.getsource(function).encode())
+        except (OSError, TypeError):
+            digest.update(getattr(function, '__qualname__', repr(function)).encode())
+    return digest.hexdigest()
+
+
+def dataset_path(source_path, namespace, params=None, cache_dir=DEFAULT_DATASET_DIR):
+    """
+    Directory of the cached dataset built from a source file
+
+    Parameters:
+    source_path: CSV file the dataset is built from
+    namespace: sub-directory grouping datasets of one kind (e.g. 'hmm_tracks')
+    params: JSON-serializable options that change the result (species, thresholds, code digest)
+    cache_dir: root directory of the dataset cache
+
+    Returns:
+    path of the dataset directory
+    """
+    key = hashlib.blake2b(digest_size=16)
+    key.update(file_digest(source_path).encode())
+    key.update(json.dumps({'format': CACHE_FORMAT_VERSION, 'params': params or {}},
+                          sort_keys=True, default=str).encode())
+    return os.path.join(cache_dir, namespace, key.hexdigest())
+
+
+def _arrow_column(series):
+    """Arrow array of a column; mixed-type object columns are stored as strings"""
+    try:
+        return pa.array(series, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(series.map(lambda value: value if pd.isna(value) else str(value)), from_pandas=True)
+
+
+def write_dataset(df, path, species=None, metadata=None):
+    """
+    Store a DataFrame as a Parquet dataset partitioned by species and individual
+
+    Row order, index and dtypes are recorded so read_dataset returns the same
+    frame. The dataset is written to a temporary directory and renamed into
+    place, so readers never see a partial dataset.
+
+    Parameters:
+    df: DataFrame to store
+    path: dataset directory (from dataset_path)
+    species: species name stored as the first partition level
+    metadata: extra JSON-serializable details kept next to the data
+
+    Returns:
+    True if the dataset was written
+    """
+    if not PYARROW_AVAILABLE or df is None or len(df) == 0:
+        return False
+
+    columns = list(df.columns)
+    arrays = {col: _arrow_column(df[col]) for col in columns if col not in PARTITION_COLUMNS}
+    arrays[ROW_COLUMN] = pa.array(np.arange(len(df), dtype=np.int64))
+    arrays[INDEX_COLUMN] = _arrow_column(pd.Series(df.index))
+
+    # Partition values are directory names, so they are stored as strings
+    # and cast back to their original dtype on read
+    if 'species' in df.columns:
+        arrays['species'] = pa.array(df['species'].astype(str))
+    else:
+        arrays['species'] = pa.array(np.full(len(df), str(species or 'all'), dtype=object))
+    if 'individual_id' in df.columns:
+        arrays['individual_id'] = pa.array(df['individual_id'].astype(str))
+    else:
+        arrays['individual_id'] = pa.array(np.full(len(df), 'all', dtype=object))
+
+    table = pa.table(arrays)
+    partitioning = ds.partitioning(
+        pa.schema([(col, pa.string()) for col in PARTITION_COLUMNS]), flavor='hive'
+    )
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    try:
+        ds.write_dataset(
+            table, tmp_path, format='parquet', partitioning=partitioning,
+            basename_template='part-{i}.parquet', max_partitions=1 << 16,
+            existing_data_behavior='overwrite_or_ignore'
+        )
+        with open(os.path.join(tmp_path, METADATA_FILE), 'w') as f:
+            json.dump({
+                'format': CACHE_FORMAT_VERSION,
+                'rows': len(df),
+                'columns': columns,
+                'dtypes': {col: str(dtype) for col, dtype in df.dtypes.items()},
+                'index_name': df.index.name,
+                'index_dtype': str(df.index.dtype),
+                'metadata': metadata or {},
+            }, f, indent=2, default=str)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        print(f"Warning: could not write dataset cache {path}: {e}")
+        return False
+
+    print(f"Cached {len(df):,} records as Parquet in {path}")
+    return True
+
+
+def read_dataset_metadata(path):
+    """Metadata saved by write_dataset, or None if there is no complete dataset"""
+    try:
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if metadata.get('format') != CACHE_FORMAT_VERSION:
+        return None
+    return metadata
+
+
+def _restore_dtype(series, dtype):
+    if str(series.dtype) == dtype:
+        return series
+    try:
+        return series.astype(dtype)
+    except (TypeError, ValueError):
+        return series
+
+
+def read_dataset(path, columns=None, individuals=None, filters=None):
+    """
+    Read a cached dataset back into a DataFrame
+
+    Only the requested columns are decoded, and partitions of individuals
+    that are not requested are never opened.
+
+    Parameters:
+    path: dataset directory (from dataset_path)
+    columns: columns to read (all if None)
+    individuals: individual IDs to read (all if None)
+    filters: extra row filters in DNF form, e.g. [('speed', '>', 1.0)]
+
+    Returns:
+    DataFrame in the original row order, or None if the dataset is missing
+    """
+    if not PYARROW_AVAILABLE:
+        return None
+    metadata = read_dataset_metadata(path)
+    if metadata is None:
+        return None
+
+    wanted = list(metadata['columns']) if columns is None else [col for col in columns if col in metadata['columns']]
+    partitioning = ds.partitioning(
+        pa.schema([(col, pa.string()) for col in PARTITION_COLUMNS]), flavor='hive'
+    )
+    dataset = ds.dataset(path, format='parquet', partitioning=partitioning,
+                         exclude_invalid_files=True, ignore_prefixes=['.', '_'])
+
+    expression = None
+    if individuals is not None:
+        expression = ds.field('individual_id').isin([str(value) for value in individuals])
+    if filters:
+        filter_expression = pq.filters_to_expression(filters)
+        expression = filter_expression if expression is None else expression & filter_expression
+
+    table = dataset.to_table(columns=wanted + [ROW_COLUMN, INDEX_COLUMN], filter=expression)
+    df = table.to_pandas().sort_values(ROW_COLUMN, kind='stable')
+
+    index = _restore_dtype(df[INDEX_COLUMN], metadata['index_dtype'])
+    df = df[wanted]
+    df.index = pd.Index(index.values, name=metadata['index_name'])
+    for col in wanted:
+        df[col] = _restore_dtype(df[col], metadata['dtypes'][col])
+    return df
+
+
+def load_cached(source_path, namespace, build, params=None, species=None,
+                cache_dir=DEFAULT_DATASET_DIR, columns=None, individuals=None):
+    """
+    Read a dataset from the cache, building and storing it on a miss
+
+    Parameters:
+    source_path: CSV file the dataset is built from
+    namespace: sub-directory grouping datasets of one kind
+    build: function returning the DataFrame (or None) when the cache misses
+    params: options that change the result, part of the cache key
+    species: species partition value
+    cache_dir: root directory of the dataset cache (None disables the cache)
+    columns: columns to return
+    individuals: individual IDs to return
+
+    Returns:
+    DataFrame, or None if build returned None
+    """
+    if cache_dir is None or not PYARROW_AVAILABLE or not os.path.exists(source_path):
+        return _select(build(), columns, individuals)
+
+    path = dataset_path(source_path, namespace, params, cache_dir)
+    df = read_dataset(path, columns=columns, individuals=individuals)
+    if df is not None:
+        print(f"Loaded {len(df):,} cached records from {path}")
+        return df
+
+    df = build()
+    if df is not None:
+        write_dataset(df, path, species=species, metadata={'source': os.path.abspath(source_path), 'params': params})
+    return _select(df, columns, individuals)
+
+
+def _select(df, columns=None, individuals=None):
+    if df is None:
+        return None
+    if individuals is not None and 'individual_id' in df.columns:
+        df = df[df['individual_id'].astype(str).isin([str(value) for value in individuals])]
+    if columns is not None:
+        df = df[[col for col in columns if col in df.columns]]
+    return df
+
+
+def read_csv_cached(filepath, columns=None, individuals=None, cache_dir=DEFAULT_DATASET_DIR, **read_options):
+    """
+    pd.read_csv through the dataset cache
+
+    The first read parses the whole CSV (with stripped column names) and stores
+    it as Parquet; later reads of the unchanged file only decode the requested
+    columns and individuals.
+
+    Parameters:
+    filepath: CSV file
+    columns: columns to return (all if None)
+    individuals: values of the individual_id column to return (all if None)
+    cache_dir: root directory of the dataset cache (None disables the cache)
+    read_options: keyword arguments for pd.read_csv, part of the cache key
+
+    Returns:
+    DataFrame
+    """
+    def build():
+        df = pd.read_csv(filepath, **read_options)
+        df.columns = df.columns.str.strip()
+        return df
+
+    return load_cached(filepath, 'csv', build, params={'read_options': read_options},
+                       cache_dir=cache_dir, columns=columns, individuals=individuals)
@@ -3,33 +3,66 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+import time
 from hmmlearn import hmm
 from scipy.stats import circmean, circstd
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import confusion_matrix, classification_report, accuracy_score
 import warnings
-warnings.filterwarnings('ignore')
 
-np.random.seed(42)
+try:
+    from .parallel_utils import contiguous_groups, map_individuals, map_tasks
+except ImportError:
+    from parallel_utils import contiguous_groups, map_individuals, map_tasks
 
-plt.style.use('default')
-sns.set_palette("husl")
+try:
+    from .dataset_cache import DEFAULT_DATASET_DIR, PYARROW_AVAILABLE, dataset_path, read_dataset, source_digest, write_dataset
+except ImportError:
+    from dataset_cache import DEFAULT_DATASET_DIR, PYARROW_AVAILABLE, dataset_path, read_dataset, source_digest, write_dataset
 
 output_dir = '/data/outputs'
 results_dir = '/data/results'
-os.makedirs(output_dir, exist_ok=True)
-os.makedirs(results_dir, exist_ok=True)
-
-print("Hidden Markov Model for Animal Behavior Classification")
-print("Analyzing step length and turning angles to identify behavioral states")
-print()
 
 ELEPHANT_FILE = '/content/Elephant-Data-Tanzania.csv'
 WILDEBEEST_FILE = '/content/White-bearded wildebeest in Kenya-gps.csv'
 
-print("File paths configured:")
-print(f"  Elephant data: {ELEPHANT_FILE}")
-print(f"  Wildebeest data: {WILDEBEEST_FILE}")
+SPECIES_FILES = {
+    'Elephant': ELEPHANT_FILE,
+    'Wildebeest': WILDEBEEST_FILE
+}
+
+# Model selection: fits per state count, EM iteration cap and early-stopping
+# tolerance on the per-observation log likelihood gain
+HMM_RESTARTS = 3
+HMM_MAX_ITER = 200
+HMM_TOL = 1e-4
+
+
+def setup_pipeline(config):
+    """
+    Seed, plot style and output directories for a pipeline run
+
+    Parameters:
+    config: run options from the pipeline runner
+    """
+    warnings.filterwarnings('ignore')
+    np.random.seed(42)
+
+    plt.style.use('default')
+    sns.set_palette("husl")
+
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(results_dir, exist_ok=True)
+
+    print("Hidden Markov Model for Animal Behavior Classification")
+    print("Analyzing step length and turning angles to identify behavioral states")
+    print()
+
+    print("File paths configured:")
+    for species_name, filepath in SPECIES_FILES.items():
+        print(f"  {species_name} data: {filepath}")
+    print(f"Worker processes: {config.get('workers', 1)}")
+
 
 def load_data(filepath, species_name):
     """
@@ -62,16 +95,6 @@ def load_data(filepath, species_name):
         print(f"Error loading file: {str(e)}")
         return None
 
-print("STEP 1: LOADING DATA")
-print()
-
-print("ELEPHANT DATA ANALYSIS")
-print()
-elephant_raw = load_data(ELEPHANT_FILE, 'Elephant')
-
-print("WILDEBEEST DATA ANALYSIS")
-print()
-wildebeest_raw = load_data(WILDEBEEST_FILE, 'Wildebeest')
 
 def inspect_data_quality(df, species_name):
     """
@@ -118,20 +141,6 @@ def inspect_data_quality(df, species_name):
 
     return missing_df
 
-print("STEP 2: INSPECTING DATA QUALITY")
-print()
-
-if elephant_raw is not None:
-    elephant_missing = inspect_data_quality(elephant_raw, 'Elephant')
-else:
-    print("Elephant data not loaded, skipping quality inspection")
-    print()
-
-if wildebeest_raw is not None:
-    wildebeest_missing = inspect_data_quality(wildebeest_raw, 'Wildebeest')
-else:
-    print("Wildebeest data not loaded, skipping quality inspection")
-    print()
 
 def identify_coordinate_columns(df, species_name):
     """
@@ -170,18 +179,6 @@ def identify_coordinate_columns(df, species_name):
 
     return coord_mapping
 
-print("STEP 3: IDENTIFYING COORDINATE COLUMNS")
-print()
-
-if elephant_raw is not None:
-    elephant_coords = identify_coordinate_columns(elephant_raw, 'Elephant')
-else:
-    elephant_coords = None
-
-if wildebeest_raw is not None:
-    wildebeest_coords = identify_coordinate_columns(wildebeest_raw, 'Wildebeest')
-else:
-    wildebeest_coords = None
 
 def identify_timestamp_columns(df, species_name):
     """
@@ -275,14 +272,6 @@ def identify_timestamp_columns(df, species_name):
 
     return df
 
-print("STEP 4: PARSING TIMESTAMPS")
-print()
-
-if elephant_raw is not None:
-    elephant_raw = identify_timestamp_columns(elephant_raw, 'Elephant')
-
-if wildebeest_raw is not None:
-    wildebeest_raw = identify_timestamp_columns(wildebeest_raw, 'Wildebeest')
 
 def identify_individual_column(df, species_name):
     """
@@ -339,18 +328,6 @@ def identify_individual_column(df, species_name):
 
     return id_col
 
-print("STEP 5: IDENTIFYING INDIVIDUAL IDs")
-print()
-
-if elephant_raw is not None:
-    elephant_id_col = identify_individual_column(elephant_raw, 'Elephant')
-else:
-    elephant_id_col = None
-
-if wildebeest_raw is not None:
-    wildebeest_id_col = identify_individual_column(wildebeest_raw, 'Wildebeest')
-else:
-    wildebeest_id_col = None
 
 def clean_data(df, coord_mapping, id_col, species_name):
     """
@@ -435,22 +412,6 @@ def clean_data(df, coord_mapping, id_col, species_name):
 
     return df_clean
 
-print("STEP 6: CLEANING DATA")
-print()
-
-elephant_clean = None
-if elephant_raw is not None and elephant_coords and elephant_id_col:
-    elephant_clean = clean_data(elephant_raw, elephant_coords, elephant_id_col, 'Elephant')
-else:
-    print("Cannot clean elephant data: missing coordinates or ID column")
-    print()
-
-wildebeest_clean = None
-if wildebeest_raw is not None and wildebeest_coords and wildebeest_id_col:
-    wildebeest_clean = clean_data(wildebeest_raw, wildebeest_coords, wildebeest_id_col, 'Wildebeest')
-else:
-    print("Cannot clean wildebeest data: missing coordinates or ID column")
-    print()
 
 def calculate_step_length(df):
     """
@@ -507,22 +468,6 @@ def calculate_step_length(df):
 
     return df
 
-print("STEP 7: CALCULATING STEP LENGTHS")
-print()
-
-if elephant_clean is not None and len(elephant_clean) > 0:
-    elephant_clean = calculate_step_length(elephant_clean)
-else:
-    print("Elephant data not available or empty after cleaning")
-    elephant_clean = None
-    print()
-
-if wildebeest_clean is not None and len(wildebeest_clean) > 0:
-    wildebeest_clean = calculate_step_length(wildebeest_clean)
-else:
-    print("Wildebeest data not available or empty after cleaning")
-    wildebeest_clean = None
-    print()
 
 def calculate_turning_angle(df):
     """
@@ -590,22 +535,6 @@ def calculate_turning_angle(df):
 
     return df
 
-print("STEP 8: CALCULATING TURNING ANGLES")
-print()
-
-if elephant_clean is not None and len(elephant_clean) > 0:
-    elephant_clean = calculate_turning_angle(elephant_clean)
-else:
-    print("Elephant data not available or empty")
-    elephant_clean = None
-    print()
-
-if wildebeest_clean is not None and len(wildebeest_clean) > 0:
-    wildebeest_clean = calculate_turning_angle(wildebeest_clean)
-else:
-    print("Wildebeest data not available or empty")
-    wildebeest_clean = None
-    print()
 
 def filter_movement_outliers(df, species_name):
     """
@@ -704,22 +633,6 @@ def filter_movement_outliers(df, species_name):
 
     return df_filtered
 
-print("STEP 9: FILTERING MOVEMENT OUTLIERS")
-print()
-
-elephant_filtered = None
-if elephant_clean is not None and len(elephant_clean) > 0:
-    elephant_filtered = filter_movement_outliers(elephant_clean, 'Elephant')
-else:
-    print("Elephant data not available or empty")
-    print()
-
-wildebeest_filtered = None
-if wildebeest_clean is not None and len(wildebeest_clean) > 0:
-    wildebeest_filtered = filter_movement_outliers(wildebeest_clean, 'Wildebeest')
-else:
-    print("Wildebeest data not available or empty")
-    print()
 
 def visualize_cleaned_data(df, species_name):
     """
@@ -772,20 +685,6 @@ def visualize_cleaned_data(df, species_name):
     print(f"Saved visualization to {species_name.lower()}_cleaned_data_visualization.png")
     print()
 
-print("STEP 10: VISUALIZING CLEANED DATA")
-print()
-
-if elephant_filtered is not None and len(elephant_filtered) > 0:
-    visualize_cleaned_data(elephant_filtered, 'Elephant')
-else:
-    print("Elephant data not available or empty")
-    print()
-
-if wildebeest_filtered is not None and len(wildebeest_filtered) > 0:
-    visualize_cleaned_data(wildebeest_filtered, 'Wildebeest')
-else:
-    print("Wildebeest data not available or empty")
-    print()
 
 def prepare_hmm_features(df, species_name):
     """
@@ -874,77 +773,147 @@ def prepare_hmm_features(df, species_name):
 
     return X_scaled, df_features, scaler
 
-elephant_X = None
-elephant_features = None
-elephant_scaler = None
-if elephant_filtered is not None and len(elephant_filtered) > 0:
-    elephant_X, elephant_features, elephant_scaler = prepare_hmm_features(elephant_filtered, 'Elephant')
-else:
-    print("Elephant data not available or empty")
-    print()
 
-wildebeest_X = None
-wildebeest_features = None
-wildebeest_scaler = None
-if wildebeest_filtered is not None and len(wildebeest_filtered) > 0:
-    wildebeest_X, wildebeest_features, wildebeest_scaler = prepare_hmm_features(wildebeest_filtered, 'Wildebeest')
-else:
-    print("Wildebeest data not available or empty")
-    print()
+def fit_hmm_candidate(X, n_states, restart=0, seed=42, n_iter=HMM_MAX_ITER, tol=HMM_TOL):
+    """
+    Fit one full-covariance Gaussian HMM candidate
+
+    Restart 0 starts from k-means state means; later restarts start from
+    randomly chosen observations so they explore other optima. Fitting stops
+    once the mean log likelihood per observation improves by less than `tol`.
+
+    Parameters:
+    X: Feature matrix
+    n_states: number of behavioral states
+    restart: restart index (selects the initialization)
+    seed: base random seed
+    n_iter: maximum number of EM iterations
+    tol: early-stopping tolerance on the per-observation log likelihood gain
 
-def select_optimal_states(X, species_name, min_states=2, max_states=5):
+    Returns:
+    Fitted HMM model
+    """
+    if restart == 0:
+        from sklearn.cluster import KMeans
+        kmeans = KMeans(n_clusters=n_states, random_state=seed, n_init=10)
+        kmeans.fit(X)
+        means = kmeans.cluster_centers_
+    else:
+        rng = np.random.default_rng(seed + restart)
+        means = X[rng.choice(len(X), size=n_states, replace=False)]
+
+    model = hmm.GaussianHMM(
+        n_components=n_states,
+        covariance_type='full',
+        n_iter=n_iter,
+        tol=tol * len(X),
+        random_state=seed + restart,
+        verbose=False,
+        init_params='stc'
+    )
+    model.means_ = means
+    model.fit(X)
+    return model
+
+
+def _fit_candidate_task(key, arrays, n_iter, tol):
+    """Fit and score one (n_states, restart) candidate"""
+    n_states, restart = key
+    X = arrays['X']
+    start = time.perf_counter()
+    try:
+        model = fit_hmm_candidate(X, n_states, restart=restart, n_iter=n_iter, tol=tol)
+        log_likelihood = model.score(X)
+        error = None
+    except Exception as e:
+        model, log_likelihood, error = None, -np.inf, str(e)
+    return {
+        'model': model,
+        'log_likelihood': log_likelihood,
+        'n_iter': model.monitor_.iter if model is not None else 0,
+        'converged': bool(model.monitor_.converged) if model is not None else False,
+        'fit_seconds': time.perf_counter() - start,
+        'error': error,
+    }
+
+
+def select_optimal_states(X, species_name, min_states=2, max_states=5, restarts=HMM_RESTARTS,
+                          n_iter=HMM_MAX_ITER, tol=HMM_TOL, workers=1):
     """
     Determine the optimal number of behavioral states using model selection criteria
     Tests different numbers of states and compares BIC and AIC scores
 
+    Every (number of states, restart) candidate is fitted in its own worker
+    process. The best restart of each state count is scored, and the winning
+    fitted model is returned so it does not have to be trained again.
+
     Parameters:
     X: Feature matrix
     species_name: name of the species for display purposes
     min_states: minimum number of states to test
     max_states: maximum number of states to test
+    restarts: fits per number of states, each from a different initialization
+    n_iter: maximum number of EM iterations per fit
+    tol: early-stopping tolerance on the per-observation log likelihood gain
+    workers: number of worker processes
 
     Returns:
-    Optimal number of states based on BIC
+    tuple of (optimal number of states based on BIC, its fitted model,
+    DataFrame with one row per candidate fit including its timing)
     """
     print(f"Determining optimal number of states for {species_name}")
-    print(f"Testing {min_states} to {max_states} states")
+    print(f"Testing {min_states} to {max_states} states ({restarts} restarts each, {workers} workers)")
+
+    n_states_range = range(min_states, max_states + 1)
+    keys = [(n_states, restart) for n_states in n_states_range for restart in range(restarts)]
+    results = map_tasks(_fit_candidate_task, {'X': np.asarray(X, dtype=float)}, keys,
+                        args=(n_iter, tol), workers=workers)
+
+    candidates = pd.DataFrame([
+        {'n_states': n_states, 'restart': restart,
+         **{k: v for k, v in result.items() if k != 'model'}}
+        for (n_states, restart), result in results
+    ])
 
     bic_scores = []
     aic_scores = []
     log_likelihoods = []
-    n_states_range = range(min_states, max_states + 1)
+    best_models = {}
 
     for n_states in n_states_range:
-        print(f"  Testing {n_states} states...", end=' ')
+        rows = [(restart, result) for (n, restart), result in results if n == n_states]
+        total_seconds = sum(result['fit_seconds'] for _, result in rows)
+        best_restart, best = max(rows, key=lambda row: row[1]['log_likelihood'])
 
-        model = hmm.GaussianHMM(
-            n_components=n_states,
-            covariance_type='full',
-            n_iter=100,
-            random_state=42
-        )
-
-        try:
-            model.fit(X)
-            log_likelihood = model.score(X)
+        if best['model'] is None:
+            print(f"  {n_states} states: Failed: {best['error']}")
+            bic_scores.append(np.inf)
+            aic_scores.append(np.inf)
+            log_likelihoods.append(-np.inf)
+            continue
 
-            n_params = n_states * n_states + n_states * X.shape[1] * 2
-            bic = -2 * log_likelihood * X.shape[0] + n_params * np.log(X.shape[0])
-            aic = -2 * log_likelihood * X.shape[0] + 2 * n_params
+        log_likelihood = best['log_likelihood']
+        n_params = n_states * n_states + n_states * X.shape[1] * 2
+        bic = -2 * log_likelihood * X.shape[0] + n_params * np.log(X.shape[0])
+        aic = -2 * log_likelihood * X.shape[0] + 2 * n_params
 
-            bic_scores.append(bic)
-            aic_scores.append(aic)
-            log_likelihoods.append(log_likelihood)
+        bic_scores.append(bic)
+        aic_scores.append(aic)
+        log_likelihoods.append(log_likelihood)
+        best_models[n_states] = (best_restart, best)
 
-            print(f"BIC: {bic:.2f}, AIC: {aic:.2f}")
+        print(f"  {n_states} states: BIC: {bic:.2f}, AIC: {aic:.2f} "
+              f"(best restart {best_restart}, {best['n_iter']} iterations, {total_seconds:.1f}s)")
 
-        except Exception as e:
-            print(f"Failed: {str(e)}")
-            bic_scores.append(np.inf)
-            aic_scores.append(np.inf)
-            log_likelihoods.append(-np.inf)
+    candidates['bic'] = candidates['n_states'].map(dict(zip(n_states_range, bic_scores)))
+    candidates['aic'] = candidates['n_states'].map(dict(zip(n_states_range, aic_scores)))
+    candidates['selected'] = [
+        n_states in best_models and best_models[n_states][0] == restart
+        for n_states, restart in zip(candidates['n_states'], candidates['restart'])
+    ]
 
     optimal_n_states = n_states_range[np.argmin(bic_scores)]
+    best_model = best_models[optimal_n_states][1]['model'] if optimal_n_states in best_models else None
     print()
     print(f"Optimal number of states (based on BIC): {optimal_n_states}")
     print()
@@ -988,28 +957,16 @@ def select_optimal_states(X, species_name, min_states=2, max_states=5):
     plt.close()
 
     print(f"Saved model selection plot to {species_name.lower()}_model_selection.png")
-    print()
 
-    return optimal_n_states
-
-print("STEP 12: SELECTING OPTIMAL NUMBER OF STATES")
-print()
-
-elephant_n_states = None
-if elephant_X is not None and len(elephant_X) > 0:
-    elephant_n_states = select_optimal_states(elephant_X, 'Elephant', min_states=2, max_states=5)
-else:
-    print("Elephant data not available or insufficient for state selection")
+    candidates_file = f'{results_dir}/{species_name.lower()}_model_selection.csv'
+    candidates.to_csv(candidates_file, index=False)
+    print(f"Saved candidate fits and timings to {candidates_file}")
     print()
 
-wildebeest_n_states = None
-if wildebeest_X is not None and len(wildebeest_X) > 0:
-    wildebeest_n_states = select_optimal_states(wildebeest_X, 'Wildebeest', min_states=2, max_states=5)
-else:
-    print("Wildebeest data not available or insufficient for state selection")
-    print()
+    return optimal_n_states, best_model, candidates
 
-def train_hmm_model(X, n_states, species_name):
+
+def train_hmm_model(X, n_states, species_name, n_iter=HMM_MAX_ITER, tol=HMM_TOL):
     """
     Train a Gaussian Hidden Markov Model on the movement features
     Uses k-means initialization for better convergence
@@ -1019,6 +976,8 @@ def train_hmm_model(X, n_states, species_name):
     X: Feature matrix
     n_states: number of behavioral states
     species_name: name of the species for display purposes
+    n_iter: maximum number of EM iterations
+    tol: early-stopping tolerance on the per-observation log likelihood gain
 
     Returns:
     Trained HMM model
@@ -1029,24 +988,8 @@ def train_hmm_model(X, n_states, species_name):
     print(f"Number of observations: {X.shape[0]}")
 
     print("Initializing model with k-means clustering...")
-    from sklearn.cluster import KMeans
-
-    kmeans = KMeans(n_clusters=n_states, random_state=42, n_init=10)
-    kmeans.fit(X)
-
-    model = hmm.GaussianHMM(
-        n_components=n_states,
-        covariance_type='full',
-        n_iter=200,
-        random_state=42,
-        verbose=False,
-        init_params='stc'
-    )
-
-    model.means_ = kmeans.cluster_centers_
-
     print("Fitting model to data...")
-    model.fit(X)
+    model = fit_hmm_candidate(X, n_states, restart=0, n_iter=n_iter, tol=tol)
 
     log_likelihood = model.score(X)
     print(f"Model trained successfully")
@@ -1056,38 +999,33 @@ def train_hmm_model(X, n_states, species_name):
 
     return model
 
-print("STEP 13: TRAINING HMM MODELS")
-print()
 
-elephant_model = None
-if elephant_X is not None and elephant_n_states is not None and len(elephant_X) > 0:
-    elephant_model = train_hmm_model(elephant_X, elephant_n_states, 'Elephant')
-else:
-    print("Elephant data not available or insufficient for model training")
-    print()
+def _decode_states_task(individual_id, arrays, model):
+    """Viterbi-decode one individual's feature rows"""
+    return model.predict(arrays['X'])
 
-wildebeest_model = None
-if wildebeest_X is not None and wildebeest_n_states is not None and len(wildebeest_X) > 0:
-    wildebeest_model = train_hmm_model(wildebeest_X, wildebeest_n_states, 'Wildebeest')
-else:
-    print("Wildebeest data not available or insufficient for model training")
-    print()
-
-def predict_states(model, X, df_features):
+def predict_states(model, X, df_features, workers=1):
     """
     Predict behavioral states for each observation using the trained HMM
 
+    Each individual's track is decoded as its own sequence, so state paths do
+    not run across individuals. Individuals are decoded in parallel worker
+    processes and merged back in row order.
+
     Parameters:
     model: Trained HMM model
     X: Feature matrix
-    df_features: DataFrame with original features
+    df_features: DataFrame with original features (rows grouped by individual)
+    workers: number of worker processes
 
     Returns:
     DataFrame with predicted states
     """
     print("Predicting behavioral states")
 
-    states = model.predict(X)
+    groups = contiguous_groups(df_features['individual_id'])
+    results = map_individuals(_decode_states_task, {'X': X}, groups, args=(model,), workers=workers)
+    states = np.concatenate([individual_states for _, individual_states in results]) if results else np.array([], dtype=int)
 
     df_with_states = df_features.copy()
     df_with_states['state'] = states
@@ -1102,22 +1040,6 @@ def predict_states(model, X, df_features):
 
     return df_with_states
 
-print("STEP 14: PREDICTING BEHAVIORAL STATES")
-print()
-
-elephant_with_states = None
-if elephant_model is not None and elephant_X is not None and elephant_features is not None and len(elephant_X) > 0:
-    elephant_with_states = predict_states(elephant_model, elephant_X, elephant_features)
-else:
-    print("Elephant data not available or insufficient for state prediction")
-    print()
-
-wildebeest_with_states = None
-if wildebeest_model is not None and wildebeest_X is not None and wildebeest_features is not None and len(wildebeest_X) > 0:
-    wildebeest_with_states = predict_states(wildebeest_model, wildebeest_X, wildebeest_features)
-else:
-    print("Wildebeest data not available or insufficient for state prediction")
-    print()
 
 def characterize_states(df_with_states, species_name):
     """
@@ -1302,22 +1224,22 @@ def characterize_states(df_with_states, species_name):
     print()
     return stats_df
 
-print("STEP 15: CHARACTERIZING BEHAVIORAL STATES")
-print()
 
-elephant_stats = None
-if elephant_with_states is not None and len(elephant_with_states) > 0:
-    elephant_stats = characterize_states(elephant_with_states, 'Elephant')
-else:
-    print("Elephant data not available or insufficient for state characterization")
-    print()
+def assign_behaviors(df_with_states, stats_df):
+    """
+    Add a 'behavior' column mapping each decoded state to its behavioral label
+
+    Parameters:
+    df_with_states: DataFrame with predicted states (modified in place)
+    stats_df: DataFrame with state statistics from characterize_states
+
+    Returns:
+    df_with_states with the 'behavior' column
+    """
+    state_behavior_map = dict(zip(stats_df['state'], stats_df['behavior']))
+    df_with_states['behavior'] = df_with_states['state'].map(state_behavior_map)
+    return df_with_states
 
-wildebeest_stats = None
-if wildebeest_with_states is not None and len(wildebeest_with_states) > 0:
-    wildebeest_stats = characterize_states(wildebeest_with_states, 'Wildebeest')
-else:
-    print("Wildebeest data not available or insufficient for state characterization")
-    print()
 
 def visualize_state_characteristics(df_with_states, stats_df, species_name):
     """
@@ -1331,8 +1253,7 @@ def visualize_state_characteristics(df_with_states, stats_df, species_name):
     """
     print(f"Creating state characteristic visualizations for {species_name}")
 
-    state_behavior_map = dict(zip(stats_df['state'], stats_df['behavior']))
-    df_with_states['behavior'] = df_with_states['state'].map(state_behavior_map)
+    assign_behaviors(df_with_states, stats_df)
 
     fig, axes = plt.subplots(2, 2, figsize=(14, 10))
     fig.suptitle(f'{species_name} Behavioral State Characteristics', fontsize=16, fontweight='bold')
@@ -1389,20 +1310,6 @@ def visualize_state_characteristics(df_with_states, stats_df, species_name):
     print(f"Saved state characteristics plot to {species_name.lower()}_state_characteristics.png")
     print()
 
-print("STEP 16: VISUALIZING STATE CHARACTERISTICS")
-print()
-
-if elephant_with_states is not None and elephant_stats is not None and len(elephant_with_states) > 0:
-    visualize_state_characteristics(elephant_with_states, elephant_stats, 'Elephant')
-else:
-    print("Elephant data not available or insufficient for state visualization")
-    print()
-
-if wildebeest_with_states is not None and wildebeest_stats is not None and len(wildebeest_with_states) > 0:
-    visualize_state_characteristics(wildebeest_with_states, wildebeest_stats, 'Wildebeest')
-else:
-    print("Wildebeest data not available or insufficient for state visualization")
-    print()
 
 def analyze_state_transitions(model, stats_df, species_name):
     """
@@ -1465,20 +1372,6 @@ def analyze_state_transitions(model, stats_df, species_name):
         print(f"  {from_behavior}: {staying_prob:.1%} probability of staying in same state")
     print()
 
-print("STEP 17: ANALYZING STATE TRANSITIONS")
-print()
-
-if elephant_model is not None and elephant_stats is not None:
-    analyze_state_transitions(elephant_model, elephant_stats, 'Elephant')
-else:
-    print("Elephant data not available or insufficient for transition analysis")
-    print()
-
-if wildebeest_model is not None and wildebeest_stats is not None:
-    analyze_state_transitions(wildebeest_model, wildebeest_stats, 'Wildebeest')
-else:
-    print("Wildebeest data not available or insufficient for transition analysis")
-    print()
 
 """## Model Evaluation"""
 
@@ -1794,37 +1687,6 @@ def visualize_feature_distributions(df_validation, species_name):
 
     print()
 
-print("STEP 18: CREATING VALIDATION LABELS")
-print()
-
-elephant_validation = None
-if elephant_with_states is not None:
-    elephant_validation = create_validation_labels(elephant_with_states, 'Elephant')
-else:
-    print("Elephant data not available for validation label creation")
-    print()
-
-wildebeest_validation = None
-if wildebeest_with_states is not None:
-    wildebeest_validation = create_validation_labels(wildebeest_with_states, 'Wildebeest')
-else:
-    print("Wildebeest data not available for validation label creation")
-    print()
-
-print("STEP 18a: CREATING DIAGNOSTIC VISUALIZATIONS")
-print()
-
-if elephant_validation is not None and len(elephant_validation) > 0:
-    visualize_feature_distributions(elephant_validation, 'Elephant')
-else:
-    print("Elephant validation data not available for visualization")
-    print()
-
-if wildebeest_validation is not None and len(wildebeest_validation) > 0:
-    visualize_feature_distributions(wildebeest_validation, 'Wildebeest')
-else:
-    print("Wildebeest validation data not available for visualization")
-    print()
 
 def calculate_accuracy_metrics(df_validation):
     """
@@ -1924,26 +1786,6 @@ def calculate_accuracy_metrics(df_validation):
 
     return metrics
 
-print("STEP 19: CALCULATING ACCURACY METRICS")
-print()
-
-elephant_accuracy = None
-if elephant_validation is not None:
-    print("ELEPHANT MODEL EVALUATION")
-    print()
-    elephant_accuracy = calculate_accuracy_metrics(elephant_validation)
-else:
-    print("Elephant data not available for accuracy calculation")
-    print()
-
-wildebeest_accuracy = None
-if wildebeest_validation is not None:
-    print("WILDEBEEST MODEL EVALUATION")
-    print()
-    wildebeest_accuracy = calculate_accuracy_metrics(wildebeest_validation)
-else:
-    print("Wildebeest data not available for accuracy calculation")
-    print()
 
 def generate_confusion_matrix(df_validation, species_name):
     """
@@ -2014,20 +1856,6 @@ def generate_confusion_matrix(df_validation, species_name):
     print(cm_df)
     print()
 
-print("STEP 20: GENERATING CONFUSION MATRICES")
-print()
-
-if elephant_validation is not None:
-    generate_confusion_matrix(elephant_validation, 'Elephant')
-else:
-    print("Elephant data not available for confusion matrix")
-    print()
-
-if wildebeest_validation is not None:
-    generate_confusion_matrix(wildebeest_validation, 'Wildebeest')
-else:
-    print("Wildebeest data not available for confusion matrix")
-    print()
 
 def calculate_movement_errors(df_validation, stats_df):
     """
@@ -2090,22 +1918,6 @@ def calculate_movement_errors(df_validation, stats_df):
 
     return errors, df_validation
 
-print("STEP 21: CALCULATING MOVEMENT ERRORS")
-print()
-
-elephant_errors = None
-if elephant_validation is not None and elephant_stats is not None:
-    elephant_errors, elephant_validation = calculate_movement_errors(elephant_validation, elephant_stats)
-else:
-    print("Elephant data not available for movement error calculation")
-    print()
-
-wildebeest_errors = None
-if wildebeest_validation is not None and wildebeest_stats is not None:
-    wildebeest_errors, wildebeest_validation = calculate_movement_errors(wildebeest_validation, wildebeest_stats)
-else:
-    print("Wildebeest data not available for movement error calculation")
-    print()
 
 def visualize_movement_errors(df_validation, species_name):
     """
@@ -2162,20 +1974,6 @@ def visualize_movement_errors(df_validation, species_name):
     print(f"Saved movement error plots to {species_name.lower()}_movement_errors.png")
     print()
 
-print("STEP 22: VISUALIZING MOVEMENT ERRORS")
-print()
-
-if elephant_validation is not None:
-    visualize_movement_errors(elephant_validation, 'Elephant')
-else:
-    print("Elephant data not available for error visualization")
-    print()
-
-if wildebeest_validation is not None:
-    visualize_movement_errors(wildebeest_validation, 'Wildebeest')
-else:
-    print("Wildebeest data not available for error visualization")
-    print()
 
 def generate_evaluation_summary(accuracy_metrics, movement_errors, stats_df, species_name):
     """
@@ -2253,20 +2051,6 @@ def generate_evaluation_summary(accuracy_metrics, movement_errors, stats_df, spe
         print(f" Turning angle prediction errors are relatively high")
     print()
 
-print("STEP 23: GENERATING EVALUATION SUMMARIES")
-print()
-
-if elephant_accuracy is not None and elephant_errors is not None and elephant_stats is not None:
-    generate_evaluation_summary(elephant_accuracy, elephant_errors, elephant_stats, 'Elephant')
-else:
-    print("Elephant data not available for evaluation summary")
-    print()
-
-if wildebeest_accuracy is not None and wildebeest_errors is not None and wildebeest_stats is not None:
-    generate_evaluation_summary(wildebeest_accuracy, wildebeest_errors, wildebeest_stats, 'Wildebeest')
-else:
-    print("Wildebeest data not available for evaluation summary")
-    print()
 
 def save_results(df_validation, stats_df, species_name):
     """
@@ -2288,82 +2072,470 @@ def save_results(df_validation, stats_df, species_name):
     print(f"Saved state statistics to {stats_file}")
     print()
 
-print("STEP 24: SAVING RESULTS TO CSV FILES")
-print()
 
-if elephant_validation is not None and elephant_stats is not None:
-    save_results(elephant_validation, elephant_stats, 'Elephant')
-    print("ELEPHANT ANALYSIS COMPLETED SUCCESSFULLY")
+"""## Pipeline stages"""
+
+
+def cleaned_tracks_path(species_name, filepath, config):
+    """
+    Dataset cache entry for the cleaned tracks of a species
+
+    The key covers the source file contents and the code of every loading and
+    cleaning step, so editing the CSV or the cleaning rules starts a new entry.
+
+    Parameters:
+    species_name: name of the species
+    filepath: tracking CSV of the species
+    config: run options from the pipeline runner ('dataset_cache' is the cache root, None disables it)
+
+    Returns:
+    dataset directory, or None if the cache is disabled
+    """
+    cache_dir = config.get('dataset_cache', DEFAULT_DATASET_DIR)
+    if not cache_dir or not PYARROW_AVAILABLE or not os.path.exists(filepath):
+        return None
+    code = source_digest(load_data, identify_coordinate_columns, identify_timestamp_columns,
+                         identify_individual_column, clean_data, calculate_step_length,
+                         calculate_turning_angle, filter_movement_outliers)
+    return dataset_path(filepath, 'hmm_tracks', {'species': species_name, 'code': code}, cache_dir)
+
+
+def stage_load(state, config):
+    """
+    Steps 1-5: load tracking data and identify coordinate, timestamp and ID columns
+
+    Species whose cleaned tracks are in the dataset cache skip steps 1-9.
+
+    Parameters:
+    state: pipeline state, updated with one dict per species
+    config: run options from the pipeline runner
+    """
+    print("STEP 1: LOADING DATA")
+    print()
+
+    for species_name, filepath in SPECIES_FILES.items():
+        print(f"{species_name.upper()} DATA ANALYSIS")
+        print()
+        tracks_path = cleaned_tracks_path(species_name, filepath, config)
+        filtered = read_dataset(tracks_path) if tracks_path else None
+        if filtered is not None:
+            print(f"Loaded {len(filtered):,} cleaned records from the dataset cache: {tracks_path}")
+            print()
+            state[species_name] = {'raw': None, 'filtered': filtered, 'tracks_path': tracks_path}
+        else:
+            state[species_name] = {'raw': load_data(filepath, species_name), 'tracks_path': tracks_path}
+
+    pending = [species_name for species_name in SPECIES_FILES if 'filtered' not in state[species_name]]
+
+    print("STEP 2: INSPECTING DATA QUALITY")
     print()
-else:
-    print("Elephant data not available for saving results")
+
+    for species_name in pending:
+        raw = state[species_name]['raw']
+        if raw is not None:
+            inspect_data_quality(raw, species_name)
+        else:
+            print(f"{species_name} data not loaded, skipping quality inspection")
+            print()
+
+    print("STEP 3: IDENTIFYING COORDINATE COLUMNS")
     print()
 
-if wildebeest_validation is not None and wildebeest_stats is not None:
-    save_results(wildebeest_validation, wildebeest_stats, 'Wildebeest')
-    print("WILDEBEEST ANALYSIS COMPLETED SUCCESSFULLY")
+    for species_name in pending:
+        raw = state[species_name]['raw']
+        state[species_name]['coords'] = identify_coordinate_columns(raw, species_name) if raw is not None else None
+
+    print("STEP 4: PARSING TIMESTAMPS")
     print()
-else:
-    print("Wildebeest data not available for saving results")
+
+    for species_name in pending:
+        if state[species_name]['raw'] is not None:
+            state[species_name]['raw'] = identify_timestamp_columns(state[species_name]['raw'], species_name)
+
+    print("STEP 5: IDENTIFYING INDIVIDUAL IDs")
     print()
 
-print("COMPARATIVE ANALYSIS SUMMARY")
-print()
+    for species_name in pending:
+        raw = state[species_name]['raw']
+        state[species_name]['id_col'] = identify_individual_column(raw, species_name) if raw is not None else None
+
 
-if elephant_filtered is not None and wildebeest_filtered is not None:
-    print("Both species analyzed successfully")
+def stage_clean(state, config):
+    """
+    Steps 6-9: clean records, compute step lengths and turning angles, filter outliers
+
+    The filtered tracks are stored in the dataset cache for later runs.
+    """
+    pending = [species_name for species_name in SPECIES_FILES if 'filtered' not in state[species_name]]
+
+    print("STEP 6: CLEANING DATA")
     print()
 
-    print("ELEPHANT BEHAVIORAL PROFILE:")
-    print(f"  Individuals tracked: {elephant_filtered['individual_id'].nunique()}")
-    print(f"  Total observations: {len(elephant_filtered)}")
-    if elephant_n_states is not None:
-        print(f"  Number of HMM states discovered: {elephant_n_states}")
-    if elephant_stats is not None:
-        print("  Behavioral time budget (aggregated by behavior):")
-        behavior_totals = elephant_stats.groupby('behavior')['percentage'].sum()
-        for behavior in ['Resting', 'Foraging', 'Traveling']:
-            if behavior in behavior_totals.index:
-                print(f"    {behavior}: {behavior_totals[behavior]:.1f}%")
-        print(f"\n  Detailed state breakdown:")
-        for _, row in elephant_stats.iterrows():
-            print(f"    State {row['state']} ({row['behavior']}): {row['percentage']:.1f}% - persistence={row['mean_persistence']:.3f}")
+    cleaned = {}
+    for species_name in pending:
+        data = state[species_name]
+        cleaned[species_name] = None
+        if data['raw'] is not None and data['coords'] and data['id_col']:
+            cleaned[species_name] = clean_data(data['raw'], data['coords'], data['id_col'], species_name)
+        else:
+            print(f"Cannot clean {species_name.lower()} data: missing coordinates or ID column")
+            print()
+        # Raw records are not needed after cleaning; keeps stage caches small
+        data.pop('raw', None)
+
+    print("STEP 7: CALCULATING STEP LENGTHS")
+    print()
+
+    for species_name, df in cleaned.items():
+        if df is not None and len(df) > 0:
+            cleaned[species_name] = calculate_step_length(df)
+        else:
+            print(f"{species_name} data not available or empty after cleaning")
+            cleaned[species_name] = None
+            print()
+
+    print("STEP 8: CALCULATING TURNING ANGLES")
+    print()
+
+    for species_name, df in cleaned.items():
+        if df is not None and len(df) > 0:
+            cleaned[species_name] = calculate_turning_angle(df)
+        else:
+            print(f"{species_name} data not available or empty")
+            cleaned[species_name] = None
+            print()
+
+    print("STEP 9: FILTERING MOVEMENT OUTLIERS")
+    print()
+
+    for species_name, df in cleaned.items():
+        state[species_name]['filtered'] = None
+        if df is not None and len(df) > 0:
+            state[species_name]['filtered'] = filter_movement_outliers(df, species_name)
+            tracks_path = state[species_name].get('tracks_path')
+            if tracks_path:
+                write_dataset(state[species_name]['filtered'], tracks_path, species=species_name)
+        else:
+            print(f"{species_name} data not available or empty")
+            print()
+
+
+def stage_visualize_data(state, config):
+    """
+    Step 10: plot the cleaned tracks
+    """
+    print("STEP 10: VISUALIZING CLEANED DATA")
+    print()
+
+    if not config.get('plots', True):
+        print("Plotting disabled, skipping")
+        print()
+        return
+
+    for species_name in SPECIES_FILES:
+        filtered = state[species_name]['filtered']
+        if filtered is not None and len(filtered) > 0:
+            visualize_cleaned_data(filtered, species_name)
+        else:
+            print(f"{species_name} data not available or empty")
+            print()
+
+
+def stage_features(state, config):
+    """
+    Step 11: standardized HMM feature matrices
+    """
+    for species_name in SPECIES_FILES:
+        data = state[species_name]
+        data['X'], data['features'], data['scaler'] = None, None, None
+        if data['filtered'] is not None and len(data['filtered']) > 0:
+            data['X'], data['features'], data['scaler'] = prepare_hmm_features(data['filtered'], species_name)
+        else:
+            print(f"{species_name} data not available or empty")
+            print()
+
+
+def stage_fit(state, config):
+    """
+    Steps 12-13: select the number of states and keep the best fitted HMMs
+    """
+    print("STEP 12: SELECTING OPTIMAL NUMBER OF STATES")
+    print()
+
+    for species_name in SPECIES_FILES:
+        data = state[species_name]
+        data['n_states'] = None
+        data['model'] = None
+        data['model_selection'] = None
+        if data['X'] is not None and len(data['X']) > 0:
+            data['n_states'], data['model'], data['model_selection'] = select_optimal_states(
+                data['X'], species_name, min_states=2, max_states=5, workers=config.get('workers', 1)
+            )
+        else:
+            print(f"{species_name} data not available or insufficient for state selection")
+            print()
+
+    print("STEP 13: TRAINING HMM MODELS")
+    print()
+
+    for species_name in SPECIES_FILES:
+        data = state[species_name]
+        if data['model'] is not None:
+            candidates = data['model_selection']
+            selected = candidates[candidates['selected'] & (candidates['n_states'] == data['n_states'])].iloc[0]
+            print(f"Using the {data['n_states']}-state model fitted during selection for {species_name}")
+            print(f"Restart {selected['restart']}: {selected['n_iter']} iterations, "
+                  f"{'converged' if selected['converged'] else 'stopped at iteration limit'}, {selected['fit_seconds']:.1f}s")
+            print(f"Log likelihood: {selected['log_likelihood']:.2f}")
+            print()
+        elif data['X'] is not None and data['n_states'] is not None and len(data['X']) > 0:
+            data['model'] = train_hmm_model(data['X'], data['n_states'], species_name)
+        else:
+            print(f"{species_name} data not available or insufficient for model training")
+            print()
+
+
+def stage_decode(state, config):
+    """
+    Step 14: most likely behavioral state of every observation
+    """
+    print("STEP 14: PREDICTING BEHAVIORAL STATES")
+    print()
+
+    for species_name in SPECIES_FILES:
+        data = state[species_name]
+        data['with_states'] = None
+        if data['model'] is not None and data['X'] is not None and data['features'] is not None and len(data['X']) > 0:
+            data['with_states'] = predict_states(data['model'], data['X'], data['features'], workers=config.get('workers', 1))
+        else:
+            print(f"{species_name} data not available or insufficient for state prediction")
+            print()
+
+
+def stage_characterize(state, config):
+    """
+    Steps 15-17: label states as behaviors, plot them and analyze transitions
+    """
+    print("STEP 15: CHARACTERIZING BEHAVIORAL STATES")
+    print()
+
+    for species_name in SPECIES_FILES:
+        data = state[species_name]
+        data['stats'] = None
+        if data['with_states'] is not None and len(data['with_states']) > 0:
+            data['stats'] = characterize_states(data['with_states'], species_name)
+            assign_behaviors(data['with_states'], data['stats'])
+        else:
+            print(f"{species_name} data not available or insufficient for state characterization")
+            print()
+
+    print("STEP 16: VISUALIZING STATE CHARACTERISTICS")
+    print()
+
+    if config.get('plots', True):
+        for species_name in SPECIES_FILES:
+            data = state[species_name]
+            if data['with_states'] is not None and data['stats'] is not None and len(data['with_states']) > 0:
+                visualize_state_characteristics(data['with_states'], data['stats'], species_name)
+            else:
+                print(f"{species_name} data not available or insufficient for state visualization")
+                print()
+
+    print("STEP 17: ANALYZING STATE TRANSITIONS")
+    print()
+
+    for species_name in SPECIES_FILES:
+        data = state[species_name]
+        if data['model'] is not None and data['stats'] is not None:
+            analyze_state_transitions(data['model'], data['stats'], species_name)
+        else:
+            print(f"{species_name} data not available or insufficient for transition analysis")
+            print()
+
+
+def stage_evaluate(state, config):
+    """
+    Steps 18-23: validation labels, accuracy metrics, confusion matrices and movement errors
+    """
+    plots = config.get('plots', True)
+
+    print("STEP 18: CREATING VALIDATION LABELS")
+    print()
+
+    for species_name in SPECIES_FILES:
+        data = state[species_name]
+        data['validation'] = None
+        if data['with_states'] is not None:
+            data['validation'] = create_validation_labels(data['with_states'], species_name)
+        else:
+            print(f"{species_name} data not available for validation label creation")
+            print()
+
+    print("STEP 18a: CREATING DIAGNOSTIC VISUALIZATIONS")
+    print()
+
+    for species_name in SPECIES_FILES:
+        validation = state[species_name]['validation']
+        if validation is not None and len(validation) > 0:
+            visualize_feature_distributions(validation, species_name)
+        else:
+            print(f"{species_name} validation data not available for visualization")
+            print()
+
+    print("STEP 19: CALCULATING ACCURACY METRICS")
+    print()
+
+    for species_name in SPECIES_FILES:
+        data = state[species_name]
+        data['accuracy'] = None
+        if data['validation'] is not None:
+            print(f"{species_name.upper()} MODEL EVALUATION")
+            print()
+            data['accuracy'] = calculate_accuracy_metrics(data['validation'])
+        else:
+            print(f"{species_name} data not available for accuracy calculation")
+            print()
+
+    print("STEP 20: GENERATING CONFUSION MATRICES")
+    print()
+
+    for species_name in SPECIES_FILES:
+        validation = state[species_name]['validation']
+        if validation is not None:
+            generate_confusion_matrix(validation, species_name)
+        else:
+            print(f"{species_name} data not available for confusion matrix")
+            print()
+
+    print("STEP 21: CALCULATING MOVEMENT ERRORS")
+    print()
+
+    for species_name in SPECIES_FILES:
+        data = state[species_name]
+        data['errors'] = None
+        if data['validation'] is not None and data['stats'] is not None:
+            data['errors'], data['validation'] = calculate_movement_errors(data['validation'], data['stats'])
+        else:
+            print(f"{species_name} data not available for movement error calculation")
+            print()
+
+    print("STEP 22: VISUALIZING MOVEMENT ERRORS")
     print()
 
-    print("WILDEBEEST BEHAVIORAL PROFILE:")
-    print(f"  Individuals tracked: {wildebeest_filtered['individual_id'].nunique()}")
-    print(f"  Total observations: {len(wildebeest_filtered)}")
-    if wildebeest_n_states is not None:
-        print(f"  Number of HMM states discovered: {wildebeest_n_states}")
-    if wildebeest_stats is not None:
+    if plots:
+        for species_name in SPECIES_FILES:
+            validation = state[species_name]['validation']
+            if validation is not None:
+                visualize_movement_errors(validation, species_name)
+            else:
+                print(f"{species_name} data not available for error visualization")
+                print()
+
+    print("STEP 23: GENERATING EVALUATION SUMMARIES")
+    print()
+
+    for species_name in SPECIES_FILES:
+        data = state[species_name]
+        if data['accuracy'] is not None and data['errors'] is not None and data['stats'] is not None:
+            generate_evaluation_summary(data['accuracy'], data['errors'], data['stats'], species_name)
+        else:
+            print(f"{species_name} data not available for evaluation summary")
+            print()
+
+
+def print_behavioral_profile(data, species_name):
+    """
+    Print the tracked individuals, state count and time budget of one species
+    """
+    filtered = data['filtered']
+    stats = data.get('stats')
+
+    print(f"{species_name.upper()} BEHAVIORAL PROFILE:")
+    print(f"  Individuals tracked: {filtered['individual_id'].nunique()}")
+    print(f"  Total observations: {len(filtered)}")
+    if data.get('n_states') is not None:
+        print(f"  Number of HMM states discovered: {data['n_states']}")
+    if stats is not None:
         print("  Behavioral time budget (aggregated by behavior):")
-        behavior_totals = wildebeest_stats.groupby('behavior')['percentage'].sum()
+        behavior_totals = stats.groupby('behavior')['percentage'].sum()
         for behavior in ['Resting', 'Foraging', 'Traveling']:
             if behavior in behavior_totals.index:
                 print(f"    {behavior}: {behavior_totals[behavior]:.1f}%")
         print(f"\n  Detailed state breakdown:")
-        for _, row in wildebeest_stats.iterrows():
+        for _, row in stats.iterrows():
             print(f"    State {row['state']} ({row['behavior']}): {row['percentage']:.1f}% - persistence={row['mean_persistence']:.3f}")
     print()
 
-    if elephant_stats is not None and wildebeest_stats is not None:
-        print("MOVEMENT COMPARISON:")
-        elephant_avg_step = elephant_stats['mean_step_length'].mean()
-        wildebeest_avg_step = wildebeest_stats['mean_step_length'].mean()
-        print(f"  Elephant average step length: {elephant_avg_step:.3f} km")
-        print(f"  Wildebeest average step length: {wildebeest_avg_step:.3f} km")
-        if elephant_avg_step > 0:
-            print(f"  Ratio (Wildebeest / Elephant): {wildebeest_avg_step / elephant_avg_step:.2f}x")
-        print()
 
-    if elephant_accuracy is not None and wildebeest_accuracy is not None:
-        print("MODEL PERFORMANCE COMPARISON:")
-        print(f"  Elephant classification accuracy: {elephant_accuracy['accuracy']:.2%}")
-        print(f"  Wildebeest classification accuracy: {wildebeest_accuracy['accuracy']:.2%}")
-        if elephant_errors is not None and wildebeest_errors is not None:
-            print(f"  Elephant step length error: {elephant_errors['mean_step_error']:.4f} km")
-            print(f"  Wildebeest step length error: {wildebeest_errors['mean_step_error']:.4f} km")
+def stage_save(state, config):
+    """
+    Step 24: write results to CSV and print the comparative summary
+    """
+    print("STEP 24: SAVING RESULTS TO CSV FILES")
+    print()
+
+    for species_name in SPECIES_FILES:
+        data = state[species_name]
+        if data['validation'] is not None and data['stats'] is not None:
+            save_results(data['validation'], data['stats'], species_name)
+            print(f"{species_name.upper()} ANALYSIS COMPLETED SUCCESSFULLY")
+            print()
+        else:
+            print(f"{species_name} data not available for saving results")
+            print()
+
+    print("COMPARATIVE ANALYSIS SUMMARY")
+    print()
+
+    elephant = state['Elephant']
+    wildebeest = state['Wildebeest']
+    if elephant['filtered'] is not None and wildebeest['filtered'] is not None:
+        print("Both species analyzed successfully")
         print()
 
-print("ANALYSIS COMPLETE")
-print()
\ No newline at end of file
+        print_behavioral_profile(elephant, 'Elephant')
+        print_behavioral_profile(wildebeest, 'Wildebeest')
+
+        if elephant['stats'] is not None and wildebeest['stats'] is not None:
+            print("MOVEMENT COMPARISON:")
+            elephant_avg_step = elephant['stats']['mean_step_length'].mean()
+            wildebeest_avg_step = wildebeest['stats']['mean_step_length'].mean()
+            print(f"  Elephant average step length: {elephant_avg_step:.3f} km")
+            print(f"  Wildebeest average step length: {wildebeest_avg_step:.3f} km")
+            if elephant_avg_step > 0:
+                print(f"  Ratio (Wildebeest / Elephant): {wildebeest_avg_step / elephant_avg_step:.2f}x")
+            print()
+
+        if elephant['accuracy'] is not None and wildebeest['accuracy'] is not None:
+            print("MODEL PERFORMANCE COMPARISON:")
+            print(f"  Elephant classification accuracy: {elephant['accuracy']['accuracy']:.2%}")
+            print(f"  Wildebeest classification accuracy: {wildebeest['accuracy']['accuracy']:.2%}")
+            if elephant['errors'] is not None and wildebeest['errors'] is not None:
+                print(f"  Elephant step length error: {elephant['errors']['mean_step_error']:.4f} km")
+                print(f"  Wildebeest step length error: {wildebeest['errors']['mean_step_error']:.4f} km")
+            print()
+
+    print("ANALYSIS COMPLETE")
+    print()
+
+
+PIPELINE_STAGES = [
+    ('load', stage_load),
+    ('clean', stage_clean),
+    ('visualize_data', stage_visualize_data),
+    ('features', stage_features),
+    ('fit', stage_fit),
+    ('decode', stage_decode),
+    ('characterize', stage_characterize),
+    ('evaluate', stage_evaluate),
+    ('save', stage_save),
+]
+
+
+if __name__ == '__main__':
+    import sys
+    try:
+        from .pipeline import run_cli
+    except ImportError:
+        from pipeline import run_cli
+    run_cli(sys.modules[__name__], 'hmm')
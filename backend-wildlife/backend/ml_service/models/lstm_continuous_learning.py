@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
@@ -13,13 +14,57 @@ import os
 from datetime import datetime
 import matplotlib.pyplot as plt
 import seaborn as sns
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import euclidean
 import warnings
-from collections import deque
-warnings.filterwarnings('ignore')
 
-np.random.seed(42)
-tf.random.set_seed(42)
+try:
+    from .pipeline import PipelineError
+    from .replay_buffer import ReplayBuffer
+except ImportError:
+    from pipeline import PipelineError
+    from replay_buffer import ReplayBuffer
+
+try:
+    from .dataset_cache import DEFAULT_DATASET_DIR, read_csv_cached
+except ImportError:
+    from dataset_cache import DEFAULT_DATASET_DIR, read_csv_cached
+
+try:
+    from ..core.lstm_runtime import export_lstm_model
+except ImportError:
+    try:
+        from ml_service.core.lstm_runtime import export_lstm_model
+    except ImportError:
+        export_lstm_model = None
+
+HMM_FILES = ['/content/elephant_predictions.csv', '/content/wildebeest_predictions.csv']
+BBMM_FILES = ['/content/wildebeest_bbmm_gps_data.csv', '/content/elephant_bbmm_gps_data.csv']
+XGB_FILES = ['/content/xgboost_habitat_model_elephant.pkl', '/content/xgboost_habitat_model_wildebeest.pkl']
+OUTPUT_DIRECTORY = '/data/outputs'
+
+SEQUENCE_LENGTH = 10
+
+# Use the features that actually exist in your HMM data
+FEATURE_COLUMNS = [
+    'latitude', 'longitude', 'step_length', 'turning_angle',
+    'elevation', 'rainfall', 'ndvi', 'landcover',
+    'distance_to_water', 'distance_to_settlement',
+    'state', 'utilization_density', 'suitability_score'
+]
+
+TARGET_COLUMNS = ['latitude', 'longitude', 'suitability_score']
+
+# Replay memory: set REPLAY_BUFFER_DIR to memory-map it to disk (and reopen it on restart)
+REPLAY_BUFFER_CAPACITY = int(os.environ.get('REPLAY_BUFFER_CAPACITY', 10000))
+REPLAY_BUFFER_DIR = os.environ.get('REPLAY_BUFFER_DIR')
+REPLAY_PRIORITIZED = os.environ.get('REPLAY_PRIORITIZED', 'False').lower() == 'true'
+
+def setup_pipeline(config):
+    warnings.filterwarnings('ignore')
+
+    np.random.seed(42)
+    tf.random.set_seed(42)
 
 def detect_column_name(data, provided_col, possible_names):
     if provided_col and provided_col in data.columns:
@@ -42,15 +87,14 @@ def detect_column_name(data, provided_col, possible_names):
 
     return None
 
-def load_csv_data(filepath, description):
-    """Load CSV data with error handling"""
+def load_csv_data(filepath, description, cache_dir=DEFAULT_DATASET_DIR):
+    """Load CSV data with error handling (through the Parquet dataset cache unless cache_dir is None)"""
     print(f"Loading {description} from {filepath}")
     try:
         if not os.path.exists(filepath):
             print(f"File not found: {filepath}")
             return None
-        df = pd.read_csv(filepath, low_memory=False)
-        df.columns = df.columns.str.strip()
+        df = read_csv_cached(filepath, cache_dir=cache_dir, low_memory=False)
         print(f"Loaded {len(df)} records with {len(df.columns)} columns")
         return df
     except Exception as e:
@@ -81,35 +125,6 @@ def load_pickle_model(filepath, description):
         print(f"Error loading model: {str(e)}")
         return None
 
-print("Step 1: Loading HMM outputs")
-hmm_files = ['/content/elephant_predictions.csv', '/content/wildebeest_predictions.csv']
-hmm_dfs = []
-for filepath in hmm_files:
-    df = load_csv_data(filepath, f"HMM data")
-    if df is not None:
-        print(f"Columns in {filepath}: {list(df.columns)}")
-        print(f"Sample data from {filepath}:")
-        print(df.head(2))
-    hmm_dfs.append(df)
-
-print("Step 2: Loading BBMM outputs")
-bbmm_files = ['/content/wildebeest_bbmm_gps_data.csv', '/content/elephant_bbmm_gps_data.csv']
-bbmm_dfs = []
-for filepath in bbmm_files:
-    df = load_csv_data(filepath, f"BBMM data")
-    if df is not None:
-        print(f"Columns in {filepath}: {list(df.columns)}")
-        print(f"Sample data from {filepath}:")
-        print(df.head(2))
-    bbmm_dfs.append(df)
-
-print("Step 3: Loading XGBoost models")
-xgb_files = ['/content/xgboost_habitat_model_elephant.pkl', '/content/xgboost_habitat_model_wildebeest.pkl']
-xgb_models = []
-for filepath in xgb_files:
-    model = load_pickle_model(filepath, f"XGBoost model")
-    xgb_models.append(model)
-
 def preprocess_dataframe(df, data_type):
     print(f"Preprocessing {data_type} data")
 
@@ -199,23 +214,12 @@ def calculate_movement_features(df):
     df = df.sort_values(['individual_id', 'timestamp'])
     df = df.reset_index(drop=True)
 
-    # Avoid groupby - use manual iteration instead
-    df['prev_lat'] = np.nan
-    df['prev_lon'] = np.nan
-    df['prev_prev_lat'] = np.nan
-    df['prev_prev_lon'] = np.nan
-
-    for individual_id in df['individual_id'].unique():
-        mask = df['individual_id'] == individual_id
-        indices = df[mask].index
-
-        if len(indices) > 0:
-            df.loc[indices[1:], 'prev_lat'] = df.loc[indices[:-1], 'latitude'].values
-            df.loc[indices[1:], 'prev_lon'] = df.loc[indices[:-1], 'longitude'].values
-
-        if len(indices) > 1:
-            df.loc[indices[2:], 'prev_prev_lat'] = df.loc[indices[:-2], 'latitude'].values
-            df.loc[indices[2:], 'prev_prev_lon'] = df.loc[indices[:-2], 'longitude'].values
+    # Previous and previous-previous fixes of the same individual
+    grouped = df.groupby('individual_id', sort=False)
+    df['prev_lat'] = grouped['latitude'].shift(1)
+    df['prev_lon'] = grouped['longitude'].shift(1)
+    df['prev_prev_lat'] = grouped['latitude'].shift(2)
+    df['prev_prev_lon'] = grouped['longitude'].shift(2)
 
     def haversine_vectorized(lat1, lon1, lat2, lon2):
         R = 6371.0
@@ -375,6 +379,14 @@ def merge_model_outputs(hmm_dfs, bbmm_dfs, xgb_models):
                             df = df.drop(columns=['_merge'] if '_merge' in df.columns else [])
                             print(f"Successfully merged utilization density from BBMM data")
 
+                            # Rows without an exact match take the nearest BBMM point's value
+                            unmatched = df['utilization_density'].isna()
+                            if unmatched.any() and {'latitude', 'longitude'} <= set(bbmm_df.columns):
+                                df.loc[unmatched, 'utilization_density'] = find_nearest_utilization(
+                                    df[unmatched], bbmm_df[bbmm_df[util_col].notna()], util_col
+                                )
+                                print(f"Matched {unmatched.sum()} rows to the nearest BBMM point")
+
                             # Fill NaN values with mean
                             if df['utilization_density'].isna().any():
                                 mean_util = df['utilization_density'].mean()
@@ -382,6 +394,10 @@ def merge_model_outputs(hmm_dfs, bbmm_dfs, xgb_models):
                                 print(f"Filled {df['utilization_density'].isna().sum()} NaN values with mean {mean_util:.3f}")
                         else:
                             df['utilization_density'] = 0.5
+                    elif {'latitude', 'longitude'} <= set(bbmm_df.columns):
+                        print("No common columns for merge, joining on the nearest BBMM point")
+                        df['utilization_density'] = find_nearest_utilization(df, bbmm_df, util_col)
+                        df['utilization_density'] = df['utilization_density'].fillna(df['utilization_density'].mean())
                     else:
                         print("No common columns for merge, using default utilization density")
                         df['utilization_density'] = 0.5
@@ -536,21 +552,52 @@ def merge_model_outputs(hmm_dfs, bbmm_dfs, xgb_models):
 
     return merged_df
 
-def find_nearest_utilization(df, bbmm_df):
-    """Simple spatial matching - you might want to implement proper spatial join"""
-    utilizations = []
-    for idx, row in df.iterrows():
-        lat, lon = row['latitude'], row['longitude']
-        distances = np.sqrt((bbmm_df['latitude'] - lat)**2 + (bbmm_df['longitude'] - lon)**2)
-        closest_idx = distances.idxmin()
-        utilizations.append(bbmm_df.loc[closest_idx, 'utilization_density'])
-    return utilizations
-
-print("Step 4: Merging all model outputs")
-merged_data = merge_model_outputs(hmm_dfs, bbmm_dfs, xgb_models)
-
-def prepare_sequences_for_lstm(df, sequence_length, feature_columns, target_columns):
-    """Prepare sequences for LSTM training using only available data - OPTIMIZED VERSION"""
+def find_nearest_utilization(df, bbmm_df, value_col='utilization_density'):
+    """Value of the nearest BBMM point (in lat/lon degrees) for every row, via a KD-tree"""
+    points = bbmm_df[['latitude', 'longitude']].to_numpy(dtype=float)
+    values = bbmm_df[value_col].to_numpy()
+    usable = np.isfinite(points).all(axis=1)
+    points, values = points[usable], values[usable]
+
+    queries = df[['latitude', 'longitude']].to_numpy(dtype=float)
+    valid = np.isfinite(queries).all(axis=1)
+    utilizations = np.full(len(df), np.nan)
+    if len(points) and valid.any():
+        _, nearest = cKDTree(points).query(queries[valid])
+        utilizations[valid] = values[nearest]
+    return utilizations.tolist()
+
+class SequenceWindows:
+    """
+    All LSTM input windows of a dataset without materializing them
+
+    Rows of every individual are stored once, back to back, in a 2-D feature
+    array. Windows are zero-copy views from sliding_window_view; only the
+    windows of a requested batch are copied.
+    """
+
+    def __init__(self, features, targets, starts, feature_names, target_names, sequence_length):
+        self.features = features
+        self.targets = targets
+        self.starts = starts
+        self.feature_names = feature_names
+        self.target_names = target_names
+        self.sequence_length = sequence_length
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def windows(self):
+        # (n_rows - sequence_length + 1, sequence_length, n_features) view of self.features
+        return sliding_window_view(self.features, self.sequence_length, axis=0).transpose(0, 2, 1)
+
+    def take(self, indices):
+        starts = self.starts[indices]
+        return self.windows[starts], self.targets[starts + self.sequence_length]
+
+def build_sequence_windows(df, sequence_length, feature_columns, target_columns):
+    """Index every valid window of every individual (no NaN or inf in its rows or target)"""
     print(f"Preparing sequences with length {sequence_length}")
 
     # Use only columns that actually exist in the data
@@ -560,195 +607,131 @@ def prepare_sequences_for_lstm(df, sequence_length, feature_columns, target_colu
     print(f"Available features: {available_features}")
     print(f"Available targets: {available_targets}")
 
-    # Check if we have the minimum required data
     if len(available_features) == 0 or len(available_targets) == 0:
         print("ERROR: No features or targets available!")
-        return np.array([]), np.array([])
+        return None
 
     if len(df) < sequence_length + 1:
         print(f"ERROR: Not enough data. Have {len(df)} rows but need at least {sequence_length + 1}")
-        return np.array([]), np.array([])
+        return None
 
-    X_sequences = []
-    y_sequences = []
+    sort_columns = [col for col in ['individual_id', 'timestamp'] if col in df.columns]
+    if 'individual_id' not in df.columns:
+        print("No individual_id found, processing as single individual")
+    df = df.sort_values(sort_columns, kind='stable') if sort_columns else df
+
+    features = np.ascontiguousarray(df[available_features].to_numpy(dtype=np.float64))
+    targets = np.ascontiguousarray(df[available_targets].to_numpy(dtype=np.float64))
 
-    # Group by individual if available, otherwise treat as one individual
     if 'individual_id' in df.columns:
-        groups = df.groupby('individual_id')
-        print(f"Processing {len(groups)} individuals")
-
-        # Limit the number of individuals to process to avoid memory issues
-        max_individuals = 20  # Adjust this based on your memory capacity
-        individual_count = 0
-
-        for individual_id, individual_df in groups:
-            individual_count += 1
-            if individual_count > max_individuals:
-                print(f"  Limiting to first {max_individuals} individuals to avoid memory issues")
-                break
-
-            print(f"  Processing individual {individual_count}: {individual_id}")
-            individual_df = individual_df.sort_values('timestamp' if 'timestamp' in individual_df.columns else individual_df.index).reset_index(drop=True)
-
-            if len(individual_df) <= sequence_length:
-                print(f"    Individual {individual_id} has only {len(individual_df)} records, skipping")
-                continue
-
-            # Sample sequences more efficiently - don't create every possible sequence
-            max_sequences_per_individual = 100  # Limit sequences per individual
-            step_size = max(1, len(individual_df) // max_sequences_per_individual)
-
-            sequences_created = 0
-            for i in range(0, len(individual_df) - sequence_length, step_size):
-                X_seq = individual_df[available_features].iloc[i:i+sequence_length].values
-                y_seq = individual_df[available_targets].iloc[i+sequence_length].values
-
-                # Check for valid data
-                if (not np.any(np.isnan(X_seq)) and
-                    not np.any(np.isnan(y_seq)) and
-                    np.all(np.isfinite(X_seq)) and
-                    np.all(np.isfinite(y_seq))):
-                    X_sequences.append(X_seq)
-                    y_sequences.append(y_seq)
-                    sequences_created += 1
-
-                    if sequences_created >= max_sequences_per_individual:
-                        break
-
-            print(f"    Created {sequences_created} sequences for individual {individual_id}")
+        codes = pd.factorize(df['individual_id'])[0]
+        boundaries = np.flatnonzero(np.diff(codes)) + 1
+        group_starts = np.concatenate([[0], boundaries])
+        group_stops = np.concatenate([boundaries, [len(df)]])
+        print(f"Processing {len(group_starts)} individuals")
     else:
-        print("No individual_id found, processing as single individual")
-        individual_df = df.sort_values('timestamp' if 'timestamp' in df.columns else df.index).reset_index(drop=True)
+        group_starts, group_stops = np.array([0]), np.array([len(df)])
+
+    # Rolling count of invalid rows: a window starting at i is clean when no
+    # row in [i, i + sequence_length) is invalid
+    bad_rows = ~np.isfinite(features).all(axis=1)
+    bad_counts = np.concatenate([[0], np.cumsum(bad_rows)])
+    target_ok = np.isfinite(targets).all(axis=1)
+
+    starts = []
+    skipped = 0
+    for start, stop in zip(group_starts, group_stops):
+        if stop - start <= sequence_length:
+            skipped += 1
+            continue
+        candidates = np.arange(start, stop - sequence_length)
+        clean = bad_counts[candidates + sequence_length] == bad_counts[candidates]
+        starts.append(candidates[clean & target_ok[candidates + sequence_length]])
 
-        if len(individual_df) <= sequence_length:
-            print(f"  Data has only {len(individual_df)} records, skipping")
-        else:
-            # Limit total sequences for single individual case
-            max_total_sequences = 1000
-            step_size = max(1, len(individual_df) // max_total_sequences)
-
-            sequences_created = 0
-            for i in range(0, len(individual_df) - sequence_length, step_size):
-                X_seq = individual_df[available_features].iloc[i:i+sequence_length].values
-                y_seq = individual_df[available_targets].iloc[i+sequence_length].values
-
-                # Check for valid data
-                if (not np.any(np.isnan(X_seq)) and
-                    not np.any(np.isnan(y_seq)) and
-                    np.all(np.isfinite(X_seq)) and
-                    np.all(np.isfinite(y_seq))):
-                    X_sequences.append(X_seq)
-                    y_sequences.append(y_seq)
-                    sequences_created += 1
-
-                    if sequences_created >= max_total_sequences:
-                        break
-
-            print(f"  Created {sequences_created} sequences")
-
-    if len(X_sequences) == 0:
+    starts = np.concatenate(starts) if starts else np.array([], dtype=np.int64)
+    if skipped:
+        print(f"  Skipped {skipped} individuals with {sequence_length} or fewer records")
+
+    if len(starts) == 0:
         print("ERROR: No valid sequences created!")
         print("This could be due to:")
         print("  - Not enough data per individual")
         print("  - Missing values in the data")
         print("  - Incorrect column names")
+        return None
+
+    print(f"Indexed {len(starts)} valid sequences")
+    return SequenceWindows(features, targets, starts, available_features, available_targets, sequence_length)
+
+def prepare_sequences_for_lstm(df, sequence_length, feature_columns, target_columns):
+    """Materialize every valid sequence of a (small) dataset as (X, y) arrays"""
+    sequence_windows = build_sequence_windows(df, sequence_length, feature_columns, target_columns)
+    if sequence_windows is None:
         return np.array([]), np.array([])
 
-    X = np.array(X_sequences)
-    y = np.array(y_sequences)
+    X, y = sequence_windows.take(np.arange(len(sequence_windows)))
 
     print(f"Successfully created {len(X)} sequences")
     print(f"X shape: {X.shape}, y shape: {y.shape}")
 
     return X, y
 
-if merged_data is not None:
-    print("Step 5: Preparing sequences for LSTM")
-    sequence_length = 10
-
-    # Use the features that actually exist in your HMM data
-    feature_columns = [
-        'latitude', 'longitude', 'step_length', 'turning_angle',
-        'elevation', 'rainfall', 'ndvi', 'landcover',
-        'distance_to_water', 'distance_to_settlement',
-        'state', 'utilization_density', 'suitability_score'
-    ]
-
-    target_columns = ['latitude', 'longitude', 'suitability_score']
-
-    X, y = prepare_sequences_for_lstm(
-        merged_data, sequence_length, feature_columns, target_columns
-    )
-
-    available_features = [col for col in feature_columns if col in merged_data.columns]
-    available_targets = [col for col in target_columns if col in merged_data.columns]
-
-    print(f"Final available features: {available_features}")
-    print(f"Final available targets: {available_targets}")
-
-    if len(X) == 0:
-        print("CRITICAL: No sequences were created. Cannot continue.")
-        print("Please check your input data files and column names.")
-        exit()
-
-if merged_data is not None and len(X) > 0:
-    print("Step 6: Splitting data into train/val/test")
-
-    X_temp, X_test, y_temp, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42
-    )
-    X_train, X_val, y_train, y_val = train_test_split(
-        X_temp, y_temp, test_size=0.2, random_state=42
-    )
-
-    train_df, test_df = train_test_split(merged_data, test_size=0.2, random_state=42)
-
-    print(f"Train: {len(X_train)}, Val: {len(X_val)}, Test: {len(X_test)}")
-
-if merged_data is not None and len(X) > 0:
-    print("Step 7: Scaling features and targets")
-
+def fit_sequence_scalers(sequence_windows, indices, batch_size=4096):
+    """Fit the flattened-window X scaler batch by batch, and the y scaler on the targets"""
     scaler_x = StandardScaler()
-    scaler_y = StandardScaler()
-
-    X_train_flat = X_train.reshape(X_train.shape[0], -1)
-    X_val_flat = X_val.reshape(X_val.shape[0], -1)
-    X_test_flat = X_test.reshape(X_test.shape[0], -1)
+    for batch_start in range(0, len(indices), batch_size):
+        X_batch, _ = sequence_windows.take(indices[batch_start:batch_start + batch_size])
+        scaler_x.partial_fit(X_batch.reshape(len(X_batch), -1))
 
-    X_train_scaled_flat = scaler_x.fit_transform(X_train_flat)
-    X_val_scaled_flat = scaler_x.transform(X_val_flat)
-    X_test_scaled_flat = scaler_x.transform(X_test_flat)
-
-    X_train_scaled = X_train_scaled_flat.reshape(X_train.shape)
-    X_val_scaled = X_val_scaled_flat.reshape(X_val.shape)
-    X_test_scaled = X_test_scaled_flat.reshape(X_test.shape)
-
-    y_train_scaled = scaler_y.fit_transform(y_train)
-    y_val_scaled = scaler_y.transform(y_val)
-    y_test_scaled = scaler_y.transform(y_test)
+    scaler_y = StandardScaler()
+    scaler_y.fit(sequence_windows.targets[sequence_windows.starts[indices] + sequence_windows.sequence_length])
+
+    return scaler_x, scaler_y
+
+def materialize_windows(sequence_windows, indices, scaler_x, scaler_y):
+    X, y = sequence_windows.take(indices)
+    X_scaled = scaler_x.transform(X.reshape(len(X), -1)).reshape(X.shape)
+    return X_scaled.astype(np.float32), scaler_y.transform(y).astype(np.float32)
+
+def iter_sequence_batches(sequence_windows, indices, scaler_x, scaler_y, batch_size=32, shuffle=False, rng=None):
+    """Yield scaled (X, y) batches; only one batch of windows is copied at a time"""
+    order = (rng or np.random.default_rng()).permutation(indices) if shuffle else indices
+    for batch_start in range(0, len(order), batch_size):
+        yield materialize_windows(sequence_windows, order[batch_start:batch_start + batch_size], scaler_x, scaler_y)
+
+def make_sequence_dataset(sequence_windows, indices, scaler_x, scaler_y, batch_size=32, shuffle=False, seed=42):
+    """tf.data source streaming scaled batches (reshuffled every epoch when shuffle is set)"""
+    rng = np.random.default_rng(seed)
+    n_features = len(sequence_windows.feature_names)
+    n_targets = len(sequence_windows.target_names)
+
+    dataset = tf.data.Dataset.from_generator(
+        lambda: iter_sequence_batches(sequence_windows, indices, scaler_x, scaler_y, batch_size, shuffle, rng),
+        output_signature=(
+            tf.TensorSpec(shape=(None, sequence_windows.sequence_length, n_features), dtype=tf.float32),
+            tf.TensorSpec(shape=(None, n_targets), dtype=tf.float32)
+        )
+    )
+    return dataset.prefetch(tf.data.AUTOTUNE)
 
-    print(f"X_train_scaled range: [{X_train_scaled.min():.2f}, {X_train_scaled.max():.2f}]")
-    print(f"y_train_scaled range: [{y_train_scaled.min():.2f}, {y_train_scaled.max():.2f}]")
+def create_replay_buffer():
+    if REPLAY_BUFFER_DIR and os.path.exists(os.path.join(REPLAY_BUFFER_DIR, 'metadata.json')):
+        print(f"Reopening replay buffer from {REPLAY_BUFFER_DIR}")
+        return ReplayBuffer.load(REPLAY_BUFFER_DIR)
+    return ReplayBuffer(REPLAY_BUFFER_CAPACITY, prioritized=REPLAY_PRIORITIZED, directory=REPLAY_BUFFER_DIR)
 
-experience_replay_buffer = deque(maxlen=10000)
+experience_replay_buffer = create_replay_buffer()
 
 def add_to_replay_buffer(X, y):
     print(f"Adding {len(X)} samples to replay buffer")
-    for i in range(len(X)):
-        experience_replay_buffer.append((X[i], y[i]))
+    experience_replay_buffer.add(X, y)
     print(f"Replay buffer now has {len(experience_replay_buffer)} samples")
 
 def sample_from_replay_buffer(batch_size):
-    if len(experience_replay_buffer) < batch_size:
-        batch_size = len(experience_replay_buffer)
+    return experience_replay_buffer.sample(batch_size)
 
-    indices = np.random.choice(len(experience_replay_buffer), batch_size, replace=False)
-    batch = [experience_replay_buffer[i] for i in indices]
-
-    X_batch = np.array([item[0] for item in batch])
-    y_batch = np.array([item[1] for item in batch])
-
-    return X_batch, y_batch
+def restore_replay_buffer(snapshot):
+    experience_replay_buffer.restore(snapshot)
 
 def build_prototypical_network(embedding_dim=128, input_dim=130):
     print("Building prototypical network for animal re-identification")
@@ -868,14 +851,6 @@ def create_lstm_model(sequence_length, n_features, n_targets):
 
     return model
 
-if merged_data is not None and len(X) > 0:
-    print("Step 8: Creating LSTM model")
-    lstm_model = create_lstm_model(
-        sequence_length=sequence_length,
-        n_features=len(available_features),
-        n_targets=len(available_targets)
-    )
-
 def train_lstm_model(model, X_train, y_train, X_val, y_val, epochs=30, batch_size=32):
     print(f"Training LSTM model for {epochs} epochs with batch size {batch_size}")
 
@@ -894,29 +869,29 @@ def train_lstm_model(model, X_train, y_train, X_val, y_val, epochs=30, batch_siz
         verbose=1
     )
 
-    history = model.fit(
-        X_train, y_train,
-        validation_data=(X_val, y_val),
-        epochs=epochs,
-        batch_size=batch_size,
-        callbacks=[early_stopping, reduce_lr],
-        verbose=1
-    )
+    if y_train is None:
+        # X_train and X_val are batched datasets of (X, y), e.g. from make_sequence_dataset
+        history = model.fit(
+            X_train,
+            validation_data=X_val,
+            epochs=epochs,
+            callbacks=[early_stopping, reduce_lr],
+            verbose=1
+        )
+    else:
+        history = model.fit(
+            X_train, y_train,
+            validation_data=(X_val, y_val),
+            epochs=epochs,
+            batch_size=batch_size,
+            callbacks=[early_stopping, reduce_lr],
+            verbose=1
+        )
 
     print("Training complete")
 
     return history
 
-if merged_data is not None and len(X) > 0:
-    print("Step 9: Training LSTM model")
-    history = train_lstm_model(
-        lstm_model, X_train_scaled, y_train_scaled,
-        X_val_scaled, y_val_scaled, epochs=30, batch_size=32
-    )
-
-    print("Step 9b: Adding training data to replay buffer")
-    add_to_replay_buffer(X_train_scaled, y_train_scaled)
-
 def evaluate_model(model, X_test, y_test, scaler_y):
     print("Evaluating model on test data")
 
@@ -956,12 +931,6 @@ def evaluate_model(model, X_test, y_test, scaler_y):
 
     return metrics, y_test_original, y_pred_original
 
-if merged_data is not None and len(X) > 0:
-    print("Step 10: Evaluating model")
-    evaluation_metrics, y_test_true, y_test_pred = evaluate_model(
-        lstm_model, X_test_scaled, y_test_scaled, scaler_y
-    )
-
 def continuous_learning_update(model, new_X, new_y, replay_ratio=0.5, epochs=5):
     print("Performing continuous learning update")
     print(f"New data: {len(new_X)} samples, Replay ratio: {replay_ratio}")
@@ -972,8 +941,9 @@ def continuous_learning_update(model, new_X, new_y, replay_ratio=0.5, epochs=5):
     replay_batch_size = int(len(new_X) * replay_ratio)
 
     for epoch in range(epochs):
+        X_replay = None
         if len(experience_replay_buffer) > 0:
-            X_replay, y_replay = sample_from_replay_buffer(replay_batch_size)
+            X_replay, y_replay, replay_indices = experience_replay_buffer.sample(replay_batch_size, return_indices=True)
             X_combined = np.concatenate([new_X, X_replay], axis=0)
             y_combined = np.concatenate([new_y, y_replay], axis=0)
         else:
@@ -987,6 +957,11 @@ def continuous_learning_update(model, new_X, new_y, replay_ratio=0.5, epochs=5):
             verbose=0
         )
 
+        if X_replay is not None and experience_replay_buffer.prioritized and len(X_replay):
+            # Replay the samples the model still gets wrong more often
+            replay_errors = np.mean((model.predict(X_replay, verbose=0) - y_replay) ** 2, axis=1)
+            experience_replay_buffer.update_priorities(replay_indices, replay_errors)
+
         if epoch % 2 == 0:
             print(f"  Epoch {epoch+1}/{epochs}: Loss = {history.history['loss'][0]:.6f}")
 
@@ -1095,55 +1070,6 @@ def adapt_to_new_species(model, support_X, support_y, num_steps=10):
 
     print("Adaptation to new species complete")
 
-if merged_data is not None and len(X) > 0:
-    print("Step 11: Demonstrating continuous learning")
-    new_data_indices = np.random.choice(len(X_test_scaled), 50, replace=False)
-    continuous_learning_update(
-        lstm_model,
-        X_test_scaled[new_data_indices],
-        y_test_scaled[new_data_indices],
-        replay_ratio=0.5,
-        epochs=5
-    )
-
-if merged_data is not None and len(X) > 0:
-    print("Step 12: Demonstrating fine-tuning")
-    finetune_indices = np.random.choice(len(X_test_scaled), 100, replace=False)
-    fine_tune_history = fine_tune_model(
-        lstm_model,
-        X_test_scaled[finetune_indices],
-        y_test_scaled[finetune_indices],
-        epochs=5,
-        lr=0.0001
-    )
-
-if merged_data is not None and len(X) > 0:
-    print("Step 13: Building and training prototypical network")
-    proto_model = build_prototypical_network(embedding_dim=128, input_dim=X_train_scaled.shape[1] * X_train_scaled.shape[2])
-
-    support_indices = np.random.choice(len(X_train_scaled), 50, replace=False)
-    support_X_flat = X_train_scaled[support_indices].reshape(50, -1)
-    support_labels = np.random.randint(0, 5, 50)
-
-    query_indices = np.random.choice(len(X_train_scaled), 30, replace=False)
-    query_X_flat = X_train_scaled[query_indices].reshape(30, -1)
-    query_labels = np.random.randint(0, 5, 30)
-
-    train_prototypical_network(
-        proto_model, support_X_flat, support_labels,
-        query_X_flat, query_labels, epochs=20
-    )
-
-if merged_data is not None and len(X) > 0:
-    print("Step 14: Demonstrating MAML adaptation")
-    new_species_indices = np.random.choice(len(X_test_scaled), 10, replace=False)
-    adapt_to_new_species(
-        lstm_model,
-        X_test_scaled[new_species_indices],
-        y_test_scaled[new_species_indices],
-        num_steps=10
-    )
-
 def save_model_and_scalers(model, scaler_x, scaler_y, metrics, output_dir):
     print(f"Saving model and scalers to {output_dir}")
 
@@ -1166,6 +1092,14 @@ def save_model_and_scalers(model, scaler_x, scaler_y, metrics, output_dir):
         f.write(model_json)
     print(f"Saved model architecture to {model_arch_path}")
 
+    # NumPy inference export: lets the trackers serve the model without TensorFlow
+    if export_lstm_model is not None:
+        runtime_path = os.path.join(output_dir, 'lstm_final_model.npz')
+        export_lstm_model(model, runtime_path)
+        print(f"Saved NumPy inference export to {runtime_path}")
+    else:
+        print("ml_service.core is not importable; convert later with: python -m ml_service.core.lstm_runtime lstm_final_model.h5")
+
     scaler_x_path = os.path.join(output_dir, 'scaler_x.pkl')
     with open(scaler_x_path, 'wb') as f:
         pickle.dump(scaler_x, f)
@@ -1176,9 +1110,8 @@ def save_model_and_scalers(model, scaler_x, scaler_y, metrics, output_dir):
         pickle.dump(scaler_y, f)
     print(f"Saved Y scaler to {scaler_y_path}")
 
-    buffer_path = os.path.join(output_dir, 'replay_buffer.pkl')
-    with open(buffer_path, 'wb') as f:
-        pickle.dump(list(experience_replay_buffer), f)
+    buffer_path = os.path.join(output_dir, 'replay_buffer')
+    experience_replay_buffer.save(buffer_path)
     print(f"Saved replay buffer to {buffer_path}")
 
     metrics_path = os.path.join(output_dir, 'evaluation_metrics.csv')
@@ -1188,21 +1121,17 @@ def save_model_and_scalers(model, scaler_x, scaler_y, metrics, output_dir):
 
     return model_path, scaler_x_path, scaler_y_path, metrics_path
 
-if merged_data is not None and len(X) > 0:
-    print("Step 15: Saving model and results")
-    output_directory = '/data/outputs'
-    model_path, scaler_x_path, scaler_y_path, metrics_path = save_model_and_scalers(
-        lstm_model, scaler_x, scaler_y, evaluation_metrics, output_directory
-    )
-
 def plot_training_history(history, output_dir):
     print("Plotting training history")
 
+    # Accepts a keras History or its .history dict (as cached by the pipeline runner)
+    history = getattr(history, 'history', history)
+
     plt.figure(figsize=(12, 4))
 
     plt.subplot(1, 2, 1)
-    plt.plot(history.history['loss'], label='Train Loss')
-    plt.plot(history.history['val_loss'], label='Val Loss')
+    plt.plot(history['loss'], label='Train Loss')
+    plt.plot(history['val_loss'], label='Val Loss')
     plt.xlabel('Epoch')
     plt.ylabel('Loss')
     plt.title('Training and Validation Loss')
@@ -1210,8 +1139,8 @@ def plot_training_history(history, output_dir):
     plt.grid(True, alpha=0.3)
 
     plt.subplot(1, 2, 2)
-    plt.plot(history.history['mae'], label='Train MAE')
-    plt.plot(history.history['val_mae'], label='Val MAE')
+    plt.plot(history['mae'], label='Train MAE')
+    plt.plot(history['val_mae'], label='Val MAE')
     plt.xlabel('Epoch')
     plt.ylabel('MAE')
     plt.title('Training and Validation MAE')
@@ -1252,11 +1181,6 @@ def plot_predictions_comparison(y_true, y_pred, output_dir, n_samples=100):
     print(f"Saved predictions comparison plot to {plot_path}")
     plt.close()
 
-if merged_data is not None and len(X) > 0:
-    print("Step 16: Creating visualizations")
-    plot_training_history(history, output_directory)
-    plot_predictions_comparison(y_test_true, y_test_pred, output_directory)
-
 def predict_on_new_data(model, scaler_x, scaler_y, new_df, sequence_length, feature_columns, target_columns):
     print("Making predictions on new unseen data")
 
@@ -1291,12 +1215,202 @@ def predict_on_new_data(model, scaler_x, scaler_y, new_df, sequence_length, feat
 
     return y_pred_original
 
-if merged_data is not None and len(X) > 0:
+"""Pipeline stages"""
+
+def load_csv_outputs(filepaths, description, cache_dir=DEFAULT_DATASET_DIR):
+    dfs = []
+    for filepath in filepaths:
+        df = load_csv_data(filepath, description, cache_dir)
+        if df is not None:
+            print(f"Columns in {filepath}: {list(df.columns)}")
+            print(f"Sample data from {filepath}:")
+            print(df.head(2))
+        dfs.append(df)
+    return dfs
+
+def stage_load(state, config):
+    print("Step 1: Loading HMM outputs")
+    cache_dir = config.get('dataset_cache', DEFAULT_DATASET_DIR)
+    state['hmm_dfs'] = load_csv_outputs(HMM_FILES, "HMM data", cache_dir)
+
+    print("Step 2: Loading BBMM outputs")
+    state['bbmm_dfs'] = load_csv_outputs(BBMM_FILES, "BBMM data", cache_dir)
+
+    print("Step 3: Loading XGBoost models")
+    state['xgb_models'] = [load_pickle_model(filepath, f"XGBoost model") for filepath in XGB_FILES]
+
+def stage_merge(state, config):
+    print("Step 4: Merging all model outputs")
+    merged_data = merge_model_outputs(state.pop('hmm_dfs'), state.pop('bbmm_dfs'), state.pop('xgb_models'))
+    if merged_data is None:
+        raise PipelineError("Failed to merge data or create sequences, pipeline stopped")
+    state['merged_data'] = merged_data
+
+def stage_sequences(state, config):
+    merged_data = state['merged_data']
+
+    print("Step 5: Preparing sequences for LSTM")
+    sequence_windows = build_sequence_windows(
+        merged_data, SEQUENCE_LENGTH, FEATURE_COLUMNS, TARGET_COLUMNS
+    )
+
+    if sequence_windows is None:
+        print("CRITICAL: No sequences were created. Cannot continue.")
+        print("Please check your input data files and column names.")
+        raise PipelineError("Failed to merge data or create sequences, pipeline stopped")
+
+    available_features = sequence_windows.feature_names
+    available_targets = sequence_windows.target_names
+
+    print(f"Final available features: {available_features}")
+    print(f"Final available targets: {available_targets}")
+
+    print("Step 6: Splitting data into train/val/test")
+
+    # Split window indices; windows are only copied batch by batch when used
+    indices = np.arange(len(sequence_windows))
+    temp_idx, test_idx = train_test_split(indices, test_size=0.2, random_state=42)
+    train_idx, val_idx = train_test_split(temp_idx, test_size=0.2, random_state=42)
+
+    train_df, test_df = train_test_split(merged_data, test_size=0.2, random_state=42)
+
+    print(f"Train: {len(train_idx)}, Val: {len(val_idx)}, Test: {len(test_idx)}")
+
+    print("Step 7: Scaling features and targets")
+
+    scaler_x, scaler_y = fit_sequence_scalers(sequence_windows, train_idx)
+
+    y_test = sequence_windows.targets[sequence_windows.starts[test_idx] + SEQUENCE_LENGTH]
+    y_test_scaled = scaler_y.transform(y_test)
+
+    print(f"Scalers fitted on {len(train_idx)} training windows ({scaler_x.n_features_in_} flattened features)")
+
+    state.update({
+        'available_features': available_features,
+        'available_targets': available_targets,
+        'test_df': test_df,
+        'scaler_x': scaler_x,
+        'scaler_y': scaler_y,
+        'sequence_windows': sequence_windows,
+        'train_idx': train_idx,
+        'val_idx': val_idx,
+        'test_idx': test_idx,
+        'y_test_scaled': y_test_scaled
+    })
+
+def stage_train(state, config):
+    sequence_windows = state['sequence_windows']
+    scaler_x, scaler_y = state['scaler_x'], state['scaler_y']
+
+    print("Step 8: Creating LSTM model")
+    lstm_model = create_lstm_model(
+        sequence_length=SEQUENCE_LENGTH,
+        n_features=len(state['available_features']),
+        n_targets=len(state['available_targets'])
+    )
+
+    print("Step 9: Training LSTM model")
+    train_data = make_sequence_dataset(sequence_windows, state['train_idx'], scaler_x, scaler_y, batch_size=32, shuffle=True)
+    val_data = make_sequence_dataset(sequence_windows, state['val_idx'], scaler_x, scaler_y, batch_size=256)
+    history = train_lstm_model(lstm_model, train_data, None, val_data, None, epochs=30)
+
+    print("Step 9b: Adding training data to replay buffer")
+    # The buffer keeps only its newest `capacity` samples, so only those are copied
+    restore_replay_buffer(None)
+    replay_idx = state['train_idx'][-experience_replay_buffer.capacity:]
+    add_to_replay_buffer(*materialize_windows(sequence_windows, replay_idx, scaler_x, scaler_y))
+
+    state['lstm_model'] = lstm_model
+    state['history'] = history.history
+    state['replay_buffer'] = experience_replay_buffer.snapshot()
+
+def stage_evaluate(state, config):
+    print("Step 10: Evaluating model")
+    test_data = make_sequence_dataset(
+        state['sequence_windows'], state['test_idx'], state['scaler_x'], state['scaler_y'], batch_size=256
+    )
+    state['evaluation_metrics'], state['y_test_true'], state['y_test_pred'] = evaluate_model(
+        state['lstm_model'], test_data, state['y_test_scaled'], state['scaler_y']
+    )
+
+def stage_adapt(state, config):
+    lstm_model = state['lstm_model']
+    sequence_windows = state['sequence_windows']
+    train_idx, test_idx = state['train_idx'], state['test_idx']
+    scaler_x, scaler_y = state['scaler_x'], state['scaler_y']
+    restore_replay_buffer(state.get('replay_buffer'))
+
+    def sample(indices, size):
+        return materialize_windows(sequence_windows, indices[np.random.choice(len(indices), size, replace=False)], scaler_x, scaler_y)
+
+    print("Step 11: Demonstrating continuous learning")
+    new_X, new_y = sample(test_idx, 50)
+    continuous_learning_update(
+        lstm_model,
+        new_X,
+        new_y,
+        replay_ratio=0.5,
+        epochs=5
+    )
+
+    print("Step 12: Demonstrating fine-tuning")
+    finetune_X, finetune_y = sample(test_idx, 100)
+    fine_tune_model(
+        lstm_model,
+        finetune_X,
+        finetune_y,
+        epochs=5,
+        lr=0.0001
+    )
+
+    print("Step 13: Building and training prototypical network")
+    proto_model = build_prototypical_network(embedding_dim=128, input_dim=SEQUENCE_LENGTH * len(state['available_features']))
+
+    support_X, _ = sample(train_idx, 50)
+    support_X_flat = support_X.reshape(50, -1)
+    support_labels = np.random.randint(0, 5, 50)
+
+    query_X, _ = sample(train_idx, 30)
+    query_X_flat = query_X.reshape(30, -1)
+    query_labels = np.random.randint(0, 5, 30)
+
+    train_prototypical_network(
+        proto_model, support_X_flat, support_labels,
+        query_X_flat, query_labels, epochs=20
+    )
+
+    print("Step 14: Demonstrating MAML adaptation")
+    new_species_X, new_species_y = sample(test_idx, 10)
+    adapt_to_new_species(
+        lstm_model,
+        new_species_X,
+        new_species_y,
+        num_steps=10
+    )
+
+    state['replay_buffer'] = experience_replay_buffer.snapshot()
+
+def stage_save(state, config):
+    lstm_model = state['lstm_model']
+    evaluation_metrics = state['evaluation_metrics']
+    restore_replay_buffer(state.get('replay_buffer'))
+
+    print("Step 15: Saving model and results")
+    save_model_and_scalers(
+        lstm_model, state['scaler_x'], state['scaler_y'], evaluation_metrics, OUTPUT_DIRECTORY
+    )
+
+    if config.get('plots', True):
+        print("Step 16: Creating visualizations")
+        plot_training_history(state['history'], OUTPUT_DIRECTORY)
+        plot_predictions_comparison(state['y_test_true'], state['y_test_pred'], OUTPUT_DIRECTORY)
+
     print("Step 17: Testing prediction on sample of test data")
+    test_df = state['test_df']
     sample_test_df = test_df.sample(min(100, len(test_df)))
     new_predictions = predict_on_new_data(
-        lstm_model, scaler_x, scaler_y, sample_test_df,
-        sequence_length, available_features, available_targets
+        lstm_model, state['scaler_x'], state['scaler_y'], sample_test_df,
+        SEQUENCE_LENGTH, state['available_features'], state['available_targets']
     )
 
     if new_predictions is not None:
@@ -1304,7 +1418,6 @@ if merged_data is not None and len(X) > 0:
         print("First 5 predictions:")
         print(new_predictions[:5])
 
-if merged_data is not None and len(X) > 0:
     print("Pipeline execution complete")
     print(f"Final MSE: {evaluation_metrics['mse']:.6f}")
     print(f"Final RMSE: {evaluation_metrics['rmse']:.6f}")
@@ -1320,6 +1433,21 @@ if merged_data is not None and len(X) > 0:
     print(f"  - Experience Replay Buffer with {len(experience_replay_buffer)} samples")
     print("  - Continuous learning capabilities")
     print("  - Fine-tuning capabilities")
-else:
-    print("Failed to merge data or create sequences, pipeline stopped")
 
+PIPELINE_STAGES = [
+    ('load', stage_load),
+    ('merge', stage_merge),
+    ('sequences', stage_sequences),
+    ('train', stage_train),
+    ('evaluate', stage_evaluate),
+    ('adapt', stage_adapt),
+    ('save', stage_save),
+]
+
+if __name__ == '__main__':
+    import sys
+    try:
+        from .pipeline import run_cli
+    except ImportError:
+        from pipeline import run_cli
+    run_cli(sys.modules[__name__], 'lstm')
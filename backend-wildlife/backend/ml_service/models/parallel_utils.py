@@ -0,0 +1,162 @@
+"""
+Per-individual parallel processing for the movement model pipelines (BBMM, HMM)
+
+Tracks are grouped once, their numeric columns are copied into shared memory,
+and each worker process receives only an (individual, start, stop) slice.
+Results come back in group order, so output does not depend on worker count
+or scheduling.
+"""
+
+import os
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+
+def get_worker_count(default=1):
+    """
+    Number of worker processes from the --workers option
+
+    Falls back to the PIPELINE_WORKERS environment variable, then `default`.
+    Values of 0 or below mean one worker per CPU.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('PIPELINE_WORKERS', default)))
+    args, _ = parser.parse_known_args()
+    if args.workers <= 0:
+        return os.cpu_count() or 1
+    return args.workers
+
+
+def group_individuals(df, id_col='individual_id', time_col='timestamp'):
+    """
+    Sort rows by individual (in order of first appearance) and time, once
+
+    Rows without an individual ID belong to no track and are dropped.
+
+    Parameters:
+    df: DataFrame with GPS data
+    id_col: individual identifier column
+    time_col: timestamp column
+
+    Returns:
+    tuple of (sorted DataFrame with a fresh index, list of (individual_id, start, stop))
+    """
+    df = df[df[id_col].notna()]
+    codes, _ = pd.factorize(df[id_col])
+    order = np.lexsort((df[time_col].to_numpy(), codes))
+    sorted_df = df.iloc[order].reset_index(drop=True)
+    return sorted_df, contiguous_groups(sorted_df[id_col])
+
+
+def contiguous_groups(ids):
+    """
+    Runs of equal consecutive individual IDs
+
+    Missing IDs (None/NaN) are treated as one value, so a run of them forms
+    its own group instead of being merged into another individual.
+
+    Parameters:
+    ids: sequence of individual IDs where each individual's rows are contiguous
+
+    Returns:
+    list of (individual_id, start, stop)
+    """
+    ids = pd.Series(ids).reset_index(drop=True)
+    if len(ids) == 0:
+        return []
+    codes, uniques = pd.factorize(ids, use_na_sentinel=False)
+    boundaries = np.flatnonzero(np.diff(codes)) + 1
+    starts = np.concatenate([[0], boundaries])
+    stops = np.concatenate([boundaries, [len(codes)]])
+    return [(uniques[codes[start]], int(start), int(stop)) for start, stop in zip(starts, stops)]
+
+
+class SharedArrays:
+    """Copies named NumPy arrays into shared memory blocks for worker processes"""
+
+    def __init__(self, arrays):
+        self.blocks = []
+        self.spec = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.spec[name] = (block.name, array.shape, array.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+
+
+def _run_task(func, spec, key, start, stop, args):
+    """Attach to shared arrays, slice out one individual and apply func"""
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)[start:stop]
+    try:
+        return func(key, arrays, *args)
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+
+def map_individuals(func, arrays, groups, args=(), workers=1):
+    """
+    Apply func(individual_id, arrays, *args) to every individual
+
+    Parameters:
+    func: module-level function; receives dict of per-individual array slices
+          and must not return views of them
+    arrays: dict of column arrays covering all individuals (rows grouped by individual)
+    groups: list of (individual_id, start, stop) from group_individuals or contiguous_groups
+    args: extra positional arguments passed to func
+    workers: number of worker processes (1 runs in this process)
+
+    Returns:
+    list of (individual_id, result) in group order
+    """
+    if workers <= 1 or len(groups) <= 1:
+        return [(key, func(key, {name: a[start:stop] for name, a in arrays.items()}, *args))
+                for key, start, stop in groups]
+
+    # Fork keeps functions defined in pipeline scripts importable by workers
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    with SharedArrays(arrays) as shared:
+        with ProcessPoolExecutor(max_workers=min(workers, len(groups)), mp_context=context) as pool:
+            futures = [pool.submit(_run_task, func, shared.spec, key, start, stop, args)
+                       for key, start, stop in groups]
+            return [(key, future.result()) for (key, _, _), future in zip(groups, futures)]
+
+
+def map_tasks(func, arrays, keys, args=(), workers=1):
+    """
+    Apply func(key, arrays, *args) to every key, each call seeing the full arrays
+
+    For independent jobs over the same data, such as fitting model candidates.
+    The arrays are shared with workers once instead of being pickled per job.
+
+    Parameters:
+    func: module-level function; must not return views of the arrays
+    arrays: dict of equal-length column arrays
+    keys: picklable job identifiers passed to func
+    args: extra positional arguments passed to func
+    workers: number of worker processes (1 runs in this process)
+
+    Returns:
+    list of (key, result) in key order
+    """
+    n_rows = len(next(iter(arrays.values()))) if arrays else 0
+    return map_individuals(func, arrays, [(key, 0, n_rows) for key in keys], args=args, workers=workers)
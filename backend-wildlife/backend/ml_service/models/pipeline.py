@@ -0,0 +1,256 @@
+"""
+Command-line runner for the model training pipelines
+
+The model modules (hmm_behavior, bbmm_movement, xgboost_habitat_modeling,
+lstm_continuous_learning) only define functions; importing them runs nothing.
+Each one exposes `setup_pipeline(config)` and an ordered `PIPELINE_STAGES`
+list of (name, stage_function) pairs. A stage receives the shared state dict
+and the run config and updates the state in place.
+
+After every stage the state is pickled to the cache directory, so a later run
+can start from any stage without repeating the work before it.
+
+Usage:
+    python pipeline.py hmm                          # full pipeline
+    python pipeline.py hmm --stage fit              # only HMM fitting, from cached features
+    python pipeline.py bbmm --from-stage predict    # predict and every later stage
+    python pipeline.py lstm --resume                # skip stages that already have a cache
+    python pipeline.py hmm --no-plots --workers 4
+    python pipeline.py bbmm --no-dataset-cache      # re-read and re-clean the source CSVs
+
+Cleaned tracks and parsed CSVs are also kept as Parquet datasets keyed by the
+source file hash (see dataset_cache.py), so a fresh run on unchanged data
+skips the CSV parsing and cleaning steps.
+
+The XGBoost pipeline samples rasters through ml_service.core, so run it as a
+package module from the backend directory:
+    python -m ml_service.models.pipeline xgboost
+    python -m ml_service.models.pipeline xgboost --stage train --search reuse
+"""
+
+import os
+import sys
+import time
+import pickle
+import argparse
+import importlib
+
+try:
+    from .parallel_utils import get_worker_count
+    from .dataset_cache import DEFAULT_DATASET_DIR
+except ImportError:
+    from parallel_utils import get_worker_count
+    from dataset_cache import DEFAULT_DATASET_DIR
+
+PIPELINES = {
+    'hmm': 'hmm_behavior',
+    'bbmm': 'bbmm_movement',
+    'xgboost': 'xgboost_habitat_modeling',
+    'lstm': 'lstm_continuous_learning',
+}
+
+DEFAULT_CACHE_DIR = os.environ.get('PIPELINE_CACHE_DIR', '/data/cache/pipelines')
+
+
+class PipelineError(RuntimeError):
+    """Raised by a stage when the pipeline cannot continue"""
+
+
+def stage_cache_path(cache_dir, pipeline_name, stage_names, stage_name):
+    """
+    Cache file holding the pipeline state after a stage
+
+    Parameters:
+    cache_dir: root cache directory
+    pipeline_name: pipeline key (e.g. 'hmm')
+    stage_names: ordered stage names of the pipeline
+    stage_name: stage whose output the file holds
+
+    Returns:
+    path of the pickle file
+    """
+    index = stage_names.index(stage_name)
+    return os.path.join(cache_dir, pipeline_name, f"{index:02d}_{stage_name}.pkl")
+
+
+def load_stage_cache(path):
+    """Load the pipeline state saved after a stage"""
+    with open(path, 'rb') as f:
+        return pickle.load(f)['state']
+
+
+def save_stage_cache(path, stage_name, state):
+    """Pickle the pipeline state after a stage (atomically replaces older caches)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'stage': stage_name, 'created': time.time(), 'state': state}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        print(f"Warning: could not cache output of stage '{stage_name}': {e}")
+
+
+def run_pipeline(module, pipeline_name, config=None, stages=None, from_stage=None,
+                 resume=False, cache_dir=DEFAULT_CACHE_DIR, use_cache=True):
+    """
+    Run the stages of a model pipeline with per-stage caching
+
+    Parameters:
+    module: imported pipeline module (defines setup_pipeline and PIPELINE_STAGES)
+    pipeline_name: key used for the cache sub-directory
+    config: dict of run options passed to every stage (workers, plots, ...)
+    stages: stage names to run alone, starting from the cache of the stage before the first
+    from_stage: stage name to start at, continuing to the end of the pipeline
+    resume: start after the last stage that already has a cache
+    cache_dir: root directory for stage caches
+    use_cache: write stage caches
+
+    Returns:
+    dict with the final pipeline state
+    """
+    config = dict(config or {})
+    all_stages = list(module.PIPELINE_STAGES)
+    stage_names = [name for name, _ in all_stages]
+
+    for name in (stages or []) + ([from_stage] if from_stage else []):
+        if name not in stage_names:
+            raise PipelineError(f"Unknown stage '{name}' for {pipeline_name}. Available stages: {', '.join(stage_names)}")
+
+    if stages:
+        selected = [i for i, name in enumerate(stage_names) if name in stages]
+    elif from_stage:
+        selected = list(range(stage_names.index(from_stage), len(stage_names)))
+    else:
+        selected = list(range(len(stage_names)))
+
+    if resume and not stages and not from_stage:
+        cached = [i for i in selected
+                  if os.path.exists(stage_cache_path(cache_dir, pipeline_name, stage_names, stage_names[i]))]
+        if cached:
+            selected = [i for i in selected if i > max(cached)]
+            if not selected:
+                print(f"All {pipeline_name} stages are cached; nothing to run")
+                return load_stage_cache(stage_cache_path(cache_dir, pipeline_name, stage_names, stage_names[max(cached)]))
+
+    state = {}
+    first = selected[0] if selected else 0
+    if first > 0:
+        previous = stage_names[first - 1]
+        cache_path = stage_cache_path(cache_dir, pipeline_name, stage_names, previous)
+        if not os.path.exists(cache_path):
+            raise PipelineError(f"No cached output for stage '{previous}' at {cache_path}. Run the earlier stages first.")
+        print(f"Loading cached output of stage '{previous}' from {cache_path}")
+        state = load_stage_cache(cache_path)
+
+    module.setup_pipeline(config)
+
+    timings = {}
+    for i in selected:
+        name, stage = all_stages[i]
+        start = time.perf_counter()
+        stage(state, config)
+        timings[name] = time.perf_counter() - start
+        print(f"[{pipeline_name}] stage '{name}' finished in {timings[name]:.1f}s")
+        if use_cache:
+            save_stage_cache(stage_cache_path(cache_dir, pipeline_name, stage_names, name), name, state)
+            # Later caches were built from the previous output of this stage
+            for later in stage_names[i + 1:]:
+                later_path = stage_cache_path(cache_dir, pipeline_name, stage_names, later)
+                if stages and later in stages:
+                    continue
+                if os.path.exists(later_path):
+                    os.remove(later_path)
+
+    state['stage_timings'] = timings
+    return state
+
+
+def run_cli(module, pipeline_name, argv=None):
+    """
+    Parse command-line options and run a pipeline
+
+    Parameters:
+    module: imported pipeline module
+    pipeline_name: key used for the cache sub-directory
+    argv: argument list (defaults to sys.argv[1:])
+    """
+    stage_names = [name for name, _ in module.PIPELINE_STAGES]
+    parser = argparse.ArgumentParser(description=f"Run the {pipeline_name} training pipeline")
+    parser.add_argument('--stage', action='append', choices=stage_names,
+                        help='run only this stage (repeatable); earlier stages are read from the cache')
+    parser.add_argument('--from-stage', choices=stage_names,
+                        help='run this stage and every later one; earlier stages are read from the cache')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip stages that already have a cache')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='directory for stage caches')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not write stage caches')
+    parser.add_argument('--dataset-cache-dir', default=DEFAULT_DATASET_DIR,
+                        help='directory for the Parquet cache of cleaned tracks and parsed CSVs')
+    parser.add_argument('--no-dataset-cache', action='store_true',
+                        help='always read and clean the source CSVs')
+    parser.add_argument('--no-plots', action='store_true',
+                        help='skip plotting steps')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (0 = one per CPU; defaults to PIPELINE_WORKERS or 1)')
+    parser.add_argument('--search', choices=['run', 'skip', 'reuse'], default='run',
+                        help='XGBoost hyperparameter search: run it, skip it (base parameters), '
+                             'or reuse the configurations saved by the previous run')
+    parser.add_argument('--list-stages', action='store_true',
+                        help='print the stage names and exit')
+    args = parser.parse_args(argv)
+
+    if args.list_stages:
+        print('\n'.join(stage_names))
+        return None
+
+    if args.workers is not None:
+        workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    else:
+        workers = get_worker_count()
+
+    config = {
+        'workers': workers,
+        'plots': not args.no_plots,
+        'dataset_cache': None if args.no_dataset_cache else args.dataset_cache_dir,
+        'search': args.search,
+    }
+    if args.no_plots:
+        import matplotlib
+        matplotlib.use('Agg')
+
+    try:
+        return run_pipeline(
+            module, pipeline_name, config=config, stages=args.stage, from_stage=args.from_stage,
+            resume=args.resume, cache_dir=args.cache_dir, use_cache=not args.no_cache
+        )
+    except PipelineError as e:
+        print(f"Pipeline stopped: {e}")
+        sys.exit(1)
+
+
+def main(argv=None):
+    """Entry point: python pipeline.py {hmm,bbmm,xgboost,lstm} [options]"""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in PIPELINES:
+        print(f"Usage: python pipeline.py {{{','.join(PIPELINES)}}} [--stage NAME] [--from-stage NAME] "
+              f"[--resume] [--no-plots] [--workers N]")
+        sys.exit(2)
+
+    pipeline_name = argv.pop(0)
+    module_name = PIPELINES[pipeline_name]
+    try:
+        module = importlib.import_module(f".{module_name}", __package__) if __package__ else importlib.import_module(module_name)
+    except ImportError:
+        module = importlib.import_module(module_name)
+    return run_cli(module, pipeline_name, argv)
+
+
+if __name__ == '__main__':
+    # Run through the importable module so stages and runner share one PipelineError class
+    importlib.import_module(__spec__.name if __spec__ else 'pipeline').main()
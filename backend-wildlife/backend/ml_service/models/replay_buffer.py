@@ -0,0 +1,154 @@
+"""
+Experience replay memory for the LSTM models
+
+Kept free of TensorFlow and plotting imports so the training pipeline and the
+online learner in ml_service.core can share it.
+"""
+
+import os
+import json
+import numpy as np
+
+
+class ReplayBuffer:
+    """
+    Fixed-capacity experience replay memory backed by NumPy arrays
+
+    Samples live in preallocated (capacity, sequence_length, n_features) and
+    (capacity, n_targets) arrays written as a ring, so inserts and sampling
+    are vectorized and the oldest samples are overwritten first. With a
+    directory the arrays are memory-mapped .npy files, which lets the buffer
+    outgrow RAM and survive restarts (see save and load).
+    """
+
+    def __init__(self, capacity=10000, prioritized=False, alpha=0.6, directory=None, seed=None):
+        self.capacity = int(capacity)
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.directory = directory
+        self.rng = np.random.default_rng(seed)
+        self.X = None
+        self.y = None
+        self.priorities = None
+        self.max_priority = 1.0
+        self.size = 0
+        self.position = 0
+
+    def __len__(self):
+        return self.size
+
+    def _allocate(self, sample_shape, target_shape):
+        shapes = {
+            'X': (self.capacity,) + tuple(sample_shape),
+            'y': (self.capacity,) + tuple(target_shape),
+            'priorities': (self.capacity,)
+        }
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            arrays = {
+                name: np.lib.format.open_memmap(os.path.join(self.directory, f'{name}.npy'), mode='w+',
+                                                dtype=np.float32, shape=shape)
+                for name, shape in shapes.items()
+            }
+        else:
+            arrays = {name: np.zeros(shape, dtype=np.float32) for name, shape in shapes.items()}
+        self.X, self.y, self.priorities = arrays['X'], arrays['y'], arrays['priorities']
+
+    def add(self, X, y, priorities=None):
+        X = np.asarray(X, dtype=np.float32)
+        y = np.asarray(y, dtype=np.float32)
+        if len(X) == 0:
+            return
+        if self.X is None:
+            self._allocate(X.shape[1:], y.shape[1:])
+
+        if priorities is None:
+            # New samples are replayed at least as often as any stored one
+            priorities = np.full(len(X), self.max_priority, dtype=np.float32)
+        priorities = np.asarray(priorities, dtype=np.float32)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+        # Only the newest `capacity` samples of an oversized insert can be kept
+        if len(X) > self.capacity:
+            X, y, priorities = X[-self.capacity:], y[-self.capacity:], priorities[-self.capacity:]
+
+        slots = (self.position + np.arange(len(X))) % self.capacity
+        self.X[slots] = X
+        self.y[slots] = y
+        self.priorities[slots] = priorities
+        self.position = int((self.position + len(X)) % self.capacity)
+        self.size = min(self.size + len(X), self.capacity)
+
+    def sample(self, batch_size, return_indices=False):
+        batch_size = min(batch_size, self.size)
+        if self.prioritized:
+            # Weighted sampling without replacement (Efraimidis-Spirakis keys)
+            weights = np.maximum(self.priorities[:self.size], 1e-6) ** self.alpha
+            keys = np.log(self.rng.random(self.size)) / weights
+            indices = np.argpartition(keys, self.size - batch_size)[self.size - batch_size:] if batch_size else np.array([], dtype=np.int64)
+        else:
+            indices = self.rng.choice(self.size, batch_size, replace=False)
+
+        X_batch, y_batch = self.X[indices], self.y[indices]
+        if return_indices:
+            return X_batch, y_batch, indices
+        return X_batch, y_batch
+
+    def update_priorities(self, indices, priorities):
+        priorities = np.asarray(priorities, dtype=np.float32)
+        self.priorities[indices] = priorities
+        if len(priorities):
+            self.max_priority = max(self.max_priority, float(priorities.max()))
+
+    def clear(self):
+        self.size = 0
+        self.position = 0
+
+    def snapshot(self):
+        """Samples and priorities from oldest to newest"""
+        if self.size == 0:
+            return None
+        order = (self.position - self.size + np.arange(self.size)) % self.capacity
+        return {'X': np.array(self.X[order]), 'y': np.array(self.y[order]), 'priorities': np.array(self.priorities[order])}
+
+    def restore(self, snapshot):
+        self.clear()
+        if snapshot is not None:
+            self.add(snapshot['X'], snapshot['y'], snapshot['priorities'])
+
+    def save(self, directory):
+        """Write the buffer as .npy arrays plus a metadata file"""
+        os.makedirs(directory, exist_ok=True)
+        if self.directory and os.path.abspath(directory) == os.path.abspath(self.directory):
+            # Already memory-mapped there; only flush
+            for array in (self.X, self.y, self.priorities):
+                if array is not None:
+                    array.flush()
+        elif self.X is not None:
+            for name, array in (('X', self.X), ('y', self.y), ('priorities', self.priorities)):
+                np.save(os.path.join(directory, f'{name}.npy'), array)
+
+        metadata = {
+            'capacity': self.capacity, 'size': self.size, 'position': self.position,
+            'prioritized': self.prioritized, 'alpha': self.alpha, 'max_priority': self.max_priority
+        }
+        with open(os.path.join(directory, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True, seed=None):
+        """Reopen a saved buffer; with mmap the arrays stay on disk and new samples are written there"""
+        with open(os.path.join(directory, 'metadata.json')) as f:
+            metadata = json.load(f)
+
+        buffer = cls(metadata['capacity'], metadata['prioritized'], metadata['alpha'],
+                     directory=directory if mmap else None, seed=seed)
+        if metadata['size'] > 0:
+            mode = 'r+' if mmap else None
+            buffer.X = np.load(os.path.join(directory, 'X.npy'), mmap_mode=mode)
+            buffer.y = np.load(os.path.join(directory, 'y.npy'), mmap_mode=mode)
+            buffer.priorities = np.load(os.path.join(directory, 'priorities.npy'), mmap_mode=mode)
+        buffer.size = metadata['size']
+        buffer.position = metadata['position']
+        buffer.max_priority = metadata.get('max_priority', 1.0)
+        return buffer
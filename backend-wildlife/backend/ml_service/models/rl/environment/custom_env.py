@@ -29,6 +29,11 @@ except ImportError:
     DataConnector = None
     DynamicSpeciesHandler = None
 
+try:
+    from stable_baselines3.common.callbacks import BaseCallback
+except ImportError:
+    BaseCallback = None
+
 class SpeciesType(Enum):
     ELEPHANT = "elephant"
     WILDEBEEST = "wildebeest"
@@ -92,6 +97,10 @@ class WildlifeCorridorEnv(gym.Env):
         self.lstm_forecasts = {}
         self.habitat_suitability_map = {}
         self.dynamic_species = set()
+        self.hmm_state_grids = {}
+        self.bbmm_density_grids = {}
+        self._raster_means = {}
+        self.batched_lstm_updates = False
         
         self.terrain_grid = None
         self.habitat_quality = None
@@ -126,6 +135,7 @@ class WildlifeCorridorEnv(gym.Env):
                                "Please provide a DataConnector instance.")
             try:
                 self._load_real_data()
+                self._prepare_model_grids()
             except Exception as e:
                 raise ValueError(f"Failed to load required real data: {e}. "
                                "Please ensure GPS tracking API is accessible and environmental rasters are available.")
@@ -281,7 +291,7 @@ class WildlifeCorridorEnv(gym.Env):
                 
                 try:
                     resolved_path = file_loader.resolve_path(raster_path)
-                        raster_data = self.data_connector.load_environmental_raster(
+                    raster_data = self.data_connector.load_environmental_raster(
                         raster_type,
                         raster_path=str(resolved_path),
                         bbox=None
@@ -292,8 +302,8 @@ class WildlifeCorridorEnv(gym.Env):
                             self.environmental_rasters[raster_type] = raster_data
                         else:
                             missing_rasters.append(raster_type)
-                        else:
-                            missing_rasters.append(raster_type)
+                    else:
+                        missing_rasters.append(raster_type)
                 except Exception as e:
                     try:
                         raster_data = self.data_connector.load_environmental_raster(raster_type, bbox=self.bbox)
@@ -386,52 +396,78 @@ class WildlifeCorridorEnv(gym.Env):
         if not self.model_loader or not self.model_loader.lstm_model:
             raise ValueError("LSTM model is required but not loaded. Please provide trained LSTM model.")
         
-        timesteps = 10
-        historical_features = []
-        
-        for t in range(timesteps):
-            if 'ndvi' not in self.environmental_rasters or self.environmental_rasters['ndvi']['data'] is None:
-                raise ValueError("Real NDVI raster data is required for LSTM prediction.")
-            ndvi_val = np.mean(self.environmental_rasters['ndvi']['data'])
-            
-            if 'rainfall' not in self.environmental_rasters or self.environmental_rasters['rainfall']['data'] is None:
-                raise ValueError("Real rainfall raster data is required for LSTM prediction.")
-            rainfall_val = np.mean(self.environmental_rasters['rainfall']['data'])
-            
-            if 'elevation' not in self.environmental_rasters or self.environmental_rasters['elevation']['data'] is None:
-                raise ValueError("Real elevation raster data is required for LSTM prediction.")
-            elev_val = np.mean(self.environmental_rasters['elevation']['data'])
-            
-            if self.habitat_quality is None:
-                raise ValueError("Habitat quality (from XGBoost) is required for LSTM prediction.")
-            habitat_qual_mean = np.mean(self.habitat_quality)
-            
-            if self.corridor_strength is None:
-                raise ValueError("Corridor strength is required for LSTM prediction.")
-            corridor_strength_mean = np.mean(self.corridor_strength)
-            
-            feature_row = [
-                ndvi_val,
-                rainfall_val,
-                elev_val,
-                self.climate_shift,
-                float(self.season == "wet"),
-                self.drought_intensity,
-                habitat_qual_mean,
-                corridor_strength_mean,
-                len(self.animals) / 100.0,
-                self.conflicts / 25.0,
-                float(t) / timesteps,
-                self.current_step / self.max_steps,
-                np.mean([animal.energy for animal in self.animals]) / 100.0 if self.animals else 0.5,
-            ]
-            
-            historical_features.append(feature_row[:13])
-        
-        historical_data = np.array(historical_features)
+        historical_data = self._lstm_history()
         forecasts = self.model_loader.predict_temporal_trends(historical_data, forecast_steps=10)
         self.lstm_forecasts = forecasts
     
+    @staticmethod
+    def update_lstm_forecasts_batch(envs: List["WildlifeCorridorEnv"], forecast_steps: int = 10):
+        """
+        Refresh LSTM forecasts for several environment copies in one forward pass.
+        
+        Intended for vectorized training (e.g. the `envs` of a DummyVecEnv).
+        Environments passed here stop refreshing their own forecasts in step();
+        the caller drives the refresh instead, usually through
+        BatchedLSTMForecasts or LSTMForecastCallback.
+        """
+        by_loader = {}
+        for env in envs:
+            env.batched_lstm_updates = True
+            if env.model_loader is None or not env.model_loader.lstm_model:
+                raise ValueError("LSTM model is required but not loaded. Please provide trained LSTM model.")
+            by_loader.setdefault(id(env.model_loader), []).append(env)
+        
+        for group in by_loader.values():
+            histories = np.stack([env._lstm_history() for env in group])
+            forecasts = group[0].model_loader.predict_temporal_trends_batch(histories, forecast_steps=forecast_steps)
+            for env, forecast in zip(group, forecasts):
+                env.lstm_forecasts = forecast
+    
+    def _raster_mean(self, raster_type: str) -> float:
+        """Mean of an environmental raster, cached until the raster array is replaced."""
+        raster = self.environmental_rasters.get(raster_type)
+        if raster is None or raster.get('data') is None:
+            raise ValueError(f"Real {raster_type} raster data is required for LSTM prediction.")
+        
+        data = raster['data']
+        cached = self._raster_means.get(raster_type)
+        if cached is None or cached[0] is not data:
+            cached = (data, float(np.mean(data)))
+            self._raster_means[raster_type] = cached
+        return cached[1]
+    
+    def _lstm_history(self, timesteps: int = 10) -> np.ndarray:
+        """Build the (timesteps, 13) LSTM input sequence for the current state."""
+        ndvi_val = self._raster_mean('ndvi')
+        rainfall_val = self._raster_mean('rainfall')
+        elev_val = self._raster_mean('elevation')
+        
+        if self.habitat_quality is None:
+            raise ValueError("Habitat quality (from XGBoost) is required for LSTM prediction.")
+        if self.corridor_strength is None:
+            raise ValueError("Corridor strength is required for LSTM prediction.")
+        
+        feature_row = np.array([
+            ndvi_val,
+            rainfall_val,
+            elev_val,
+            self.climate_shift,
+            float(self.season == "wet"),
+            self.drought_intensity,
+            np.mean(self.habitat_quality),
+            np.mean(self.corridor_strength),
+            len(self.animals) / 100.0,
+            self.conflicts / 25.0,
+            0.0,
+            self.current_step / self.max_steps,
+            np.mean([animal.energy for animal in self.animals]) / 100.0 if self.animals else 0.5,
+        ], dtype=float)
+        
+        # Every timestep shares the current state except the relative time column
+        historical_data = np.tile(feature_row, (timesteps, 1))
+        historical_data[:, 10] = np.arange(timesteps) / timesteps
+        return historical_data
+    
     def _latlon_to_grid(self, lat, lon):
         """Convert lat/lon to grid coordinates."""
         min_lon, min_lat, max_lon, max_lat = self.bbox
@@ -548,17 +584,23 @@ class WildlifeCorridorEnv(gym.Env):
         if self.habitat_quality is None:
             self.habitat_quality = np.ones((self.grid_size, self.grid_size), dtype=np.float32) * 0.5
         
+        cells = np.arange(self.grid_size)
+        xs, ys = np.meshgrid(cells, cells, indexing='ij')
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        lons = min_lon + (xs.ravel() / self.grid_size) * (max_lon - min_lon)
+        lats = min_lat + (ys.ravel() / self.grid_size) * (max_lat - min_lat)
+        try:
+            feature_grid = self.data_connector.extract_environmental_features_batch(
+                lats, lons, rasters=self.environmental_rasters
+            )
+        except:
+            return
+        
         for i in range(self.grid_size):
             for j in range(self.grid_size):
-                lat, lon = self._grid_to_latlon(i, j)
-                
-                try:
-                    env_features = self.data_connector.extract_environmental_features(
-                        lat, lon, rasters=self.environmental_rasters
-                    )
-                except:
-                    continue
-                
+                cell = i * self.grid_size + j
+                env_features = {name: values[cell] for name, values in feature_grid.items()}
+
                 suitability_scores = []
                 for species in ["elephant", "wildebeest"]:
                     if species in self.model_loader.xgboost_models:
@@ -706,9 +748,8 @@ class WildlifeCorridorEnv(gym.Env):
         
         for animal in self.animals:
             animal_species = animal.species.value if isinstance(animal.species, SpeciesType) else animal.species
-            if self.model_loader and animal_species in self.model_loader.hmm_models:
-                lat, lon = self._grid_to_latlon(animal.x, animal.y)
-                hmm_probs = self.model_loader.get_hmm_state_probs(animal_species, lat, lon)
+            hmm_probs = self._hmm_state_probs_at(animal_species, animal.x, animal.y)
+            if hmm_probs is not None:
                 max_state = max(hmm_probs.items(), key=lambda x: x[1])[0]
                 if max_state == 'foraging':
                     animal.behavior_state = BehaviorState.FORAGING
@@ -725,83 +766,46 @@ class WildlifeCorridorEnv(gym.Env):
                     animal.behavior_state = BehaviorState.FORAGING
             
             if animal.behavior_state == BehaviorState.MIGRATING:
-                animal_species = animal.species.value if isinstance(animal.species, SpeciesType) else animal.species
-                current_lat, current_lon = self._grid_to_latlon(animal.x, animal.y)
+                neighbours = self._neighbour_cells(animal.x, animal.y)
+                bbmm_probs = self._bbmm_density_at_cells(animal_species, neighbours)
                 
                 move_scores = []
-                for dx in [-1, 0, 1]:
-                    for dy in [-1, 0, 1]:
-                        new_x = np.clip(animal.x + dx, 0, self.grid_size - 1)
-                        new_y = np.clip(animal.y + dy, 0, self.grid_size - 1)
-                        
-                        if new_x == animal.x and new_y == animal.y:
-                            continue
-                        
-                        new_lat, new_lon = self._grid_to_latlon(new_x, new_y)
-                        
-                        bbmm_prob = 0.5
-                        if self.model_loader and animal_species in self.model_loader.bbmm_models:
-                            try:
-                                bbmm_prob = self.model_loader.get_bbmm_density(animal_species, new_lat, new_lon)
-                            except:
-                                bbmm_prob = 0.5
-                        
-                        habitat_score = self.habitat_quality[new_x, new_y]
-                        
-                        terrain_type = TerrainType.GRASSLAND
-                        if hasattr(self, 'terrain_grid') and self.terrain_grid is not None:
-                            terrain_idx = int(self.terrain_grid[new_x, new_y])
-                            if 0 <= terrain_idx < len(list(TerrainType)):
-                                terrain_type = list(TerrainType)[terrain_idx]
-                        conflict_penalty = 0.0
-                        if terrain_type == TerrainType.SETTLEMENT:
-                            conflict_penalty = -0.5
-                        
-                        combined_score = (bbmm_prob * 0.4 +
-                                        habitat_score * 0.4 +
-                                        conflict_penalty)
-                        
-                        move_scores.append((combined_score, new_x, new_y, dx, dy))
+                for (new_x, new_y), bbmm_prob in zip(neighbours, bbmm_probs):
+                    habitat_score = self.habitat_quality[new_x, new_y]
+                    
+                    terrain_type = TerrainType.GRASSLAND
+                    if hasattr(self, 'terrain_grid') and self.terrain_grid is not None:
+                        terrain_idx = int(self.terrain_grid[new_x, new_y])
+                        if 0 <= terrain_idx < len(list(TerrainType)):
+                            terrain_type = list(TerrainType)[terrain_idx]
+                    conflict_penalty = 0.0
+                    if terrain_type == TerrainType.SETTLEMENT:
+                        conflict_penalty = -0.5
+                    
+                    combined_score = (bbmm_prob * 0.4 +
+                                    habitat_score * 0.4 +
+                                    conflict_penalty)
+                    
+                    move_scores.append((combined_score, new_x, new_y))
                 
                 if move_scores:
-                    best_score, best_x, best_y, best_dx, best_dy = max(move_scores, key=lambda x: x[0])
+                    best_score, best_x, best_y = max(move_scores, key=lambda x: x[0])
                     animal.x = best_x
                     animal.y = best_y
                     
             elif animal.behavior_state == BehaviorState.FORAGING:
-                animal_species = animal.species.value if isinstance(animal.species, SpeciesType) else animal.species
-                current_lat, current_lon = self._grid_to_latlon(animal.x, animal.y)
-                
-                current_bbmm = 0.5
-                if self.model_loader and animal_species in self.model_loader.bbmm_models:
-                    try:
-                        current_bbmm = self.model_loader.get_bbmm_density(animal_species, current_lat, current_lon)
-                    except:
-                        current_bbmm = 0.5
+                # Current cell first, then the 3x3 neighbourhood in scan order
+                cells = [(animal.x, animal.y)] + self._neighbour_cells(animal.x, animal.y, include_self=True)
+                bbmm_values = self._bbmm_density_at_cells(animal_species, cells)
+                current_bbmm = bbmm_values[0]
                 
                 if self.habitat_quality[animal.x, animal.y] < 0.5 or current_bbmm < 0.4:
-                    for dx in [-1, 0, 1]:
-                        for dy in [-1, 0, 1]:
-                            new_x = np.clip(animal.x + dx, 0, self.grid_size - 1)
-                            new_y = np.clip(animal.y + dy, 0, self.grid_size - 1)
-                            
-                            new_lat, new_lon = self._grid_to_latlon(new_x, new_y)
-                            
-                            new_bbmm = 0.5
-                            if self.model_loader and animal_species in self.model_loader.bbmm_models:
-                                try:
-                                    new_bbmm = self.model_loader.get_bbmm_density(animal_species, new_lat, new_lon)
-                                except:
-                                    new_bbmm = 0.5
-                            
-                            if (new_bbmm > current_bbmm * 1.1 or 
-                                (new_bbmm >= current_bbmm and self.habitat_quality[new_x, new_y] > self.habitat_quality[animal.x, animal.y])):
-                                animal.x = new_x
-                                animal.y = new_y
-                                break
-                        else:
-                            continue
-                        break
+                    for (new_x, new_y), new_bbmm in zip(cells[1:], bbmm_values[1:]):
+                        if (new_bbmm > current_bbmm * 1.1 or 
+                            (new_bbmm >= current_bbmm and self.habitat_quality[new_x, new_y] > self.habitat_quality[animal.x, animal.y])):
+                            animal.x = new_x
+                            animal.y = new_y
+                            break
             
             if animal.behavior_state == BehaviorState.FORAGING:
                 energy_gain = self.habitat_quality[animal.x, animal.y] * 2
@@ -837,6 +841,65 @@ class WildlifeCorridorEnv(gym.Env):
             if self.use_real_data and animal_species in self.gps_data:
                 pass
     
+    def _neighbour_cells(self, x: int, y: int, include_self: bool = False) -> List[Tuple[int, int]]:
+        """List the clipped 3x3 neighbourhood of a cell in (dx, dy) scan order."""
+        cells = []
+        for dx in [-1, 0, 1]:
+            for dy in [-1, 0, 1]:
+                new_x = int(np.clip(x + dx, 0, self.grid_size - 1))
+                new_y = int(np.clip(y + dy, 0, self.grid_size - 1))
+                if not include_self and new_x == x and new_y == y:
+                    continue
+                cells.append((new_x, new_y))
+        return cells
+    
+    def _prepare_model_grids(self):
+        """Rasterize HMM and BBMM results onto the environment grid once per species."""
+        if not self.model_loader or not hasattr(self.model_loader, 'rasterize_bbmm_density'):
+            return
+        
+        for species in list(self.model_loader.hmm_models.keys()):
+            try:
+                self.hmm_state_grids[species] = self.model_loader.rasterize_hmm_state_probs(
+                    species, self.grid_size, self.bbox)
+            except Exception as e:
+                print(f"Warning: could not rasterize HMM results for {species}: {e}")
+        
+        for species in list(self.model_loader.bbmm_models.keys()):
+            try:
+                self.bbmm_density_grids[species] = self.model_loader.rasterize_bbmm_density(
+                    species, self.grid_size, self.bbox)
+            except Exception as e:
+                print(f"Warning: could not rasterize BBMM results for {species}: {e}")
+    
+    def _hmm_state_probs_at(self, species: str, x: int, y: int) -> Optional[Dict[str, float]]:
+        """HMM state probabilities at a grid cell, or None when no HMM results exist for the species."""
+        grid = self.hmm_state_grids.get(species)
+        if grid is not None:
+            foraging, resting, traveling = grid[x, y]
+            return {'foraging': float(foraging), 'resting': float(resting), 'traveling': float(traveling)}
+        
+        if not self.model_loader or species not in self.model_loader.hmm_models:
+            return None
+        lat, lon = self._grid_to_latlon(x, y)
+        return self.model_loader.get_hmm_state_probs(species, lat, lon)
+    
+    def _bbmm_density_at_cells(self, species: str, cells: List[Tuple[int, int]]) -> np.ndarray:
+        """BBMM density for a list of grid cells (0.5 when unavailable)."""
+        grid = self.bbmm_density_grids.get(species)
+        if grid is not None and cells:
+            xs, ys = np.asarray(cells, dtype=int).T
+            return np.asarray(grid[xs, ys], dtype=float)
+        
+        if not cells or not self.model_loader or species not in self.model_loader.bbmm_models:
+            return np.full(len(cells), 0.5)
+        
+        coords = np.array([self._grid_to_latlon(cx, cy) for cx, cy in cells])
+        try:
+            return self.model_loader.get_bbmm_density_batch(species, coords[:, 0], coords[:, 1])
+        except Exception:
+            return np.full(len(cells), 0.5)
+    
     def _get_agent_position(self, agent_name: str) -> Tuple[int, int]:
         """Get the current position of the specified agent."""
         
@@ -868,15 +931,11 @@ class WildlifeCorridorEnv(gym.Env):
         species = agent_name.replace("_agent", "")
         
         if self.model_loader:
-            if hasattr(self.model_loader, 'hmm_models') and species in self.model_loader.hmm_models:
-                hmm_state = self.model_loader.get_hmm_state_probs(species, lat, lon)
-            else:
+            hmm_state = self._hmm_state_probs_at(species, agent_x, agent_y)
+            if hmm_state is None:
                 hmm_state = {'foraging': 0.33, 'resting': 0.33, 'traveling': 0.33}
             
-            if hasattr(self.model_loader, 'bbmm_models') and species in self.model_loader.bbmm_models:
-                bbmm_density = self.model_loader.get_bbmm_density(species, lat, lon)
-            else:
-                bbmm_density = 0.5
+            bbmm_density = float(self._bbmm_density_at_cells(species, [(agent_x, agent_y)])[0])
             
             env_features = {}
             if self.data_connector:
@@ -1042,11 +1101,11 @@ class WildlifeCorridorEnv(gym.Env):
                 reward += habitat_suitability * 30.0
             
             if species in self.model_loader.bbmm_models:
-                bbmm_density = self.model_loader.get_bbmm_density(species, lat, lon)
+                bbmm_density = float(self._bbmm_density_at_cells(species, [(agent_x, agent_y)])[0])
                 reward += bbmm_density * 20.0
             
-            if species in self.model_loader.hmm_models:
-                hmm_state = self.model_loader.get_hmm_state_probs(species, lat, lon)
+            hmm_state = self._hmm_state_probs_at(species, agent_x, agent_y)
+            if hmm_state is not None:
                 reward += hmm_state.get('foraging', 0.33) * 10.0
                 if hmm_state['traveling'] > 0.5 and action in [0, 1, 2, 3]:
                     reward += 10.0
@@ -1392,7 +1451,7 @@ class WildlifeCorridorEnv(gym.Env):
                     except Exception as e:
                         pass
         
-        if self.current_step % self.update_frequency == 0:
+        if self.current_step % self.update_frequency == 0 and not self.batched_lstm_updates:
             try:
                 self._update_lstm_forecasts()
             except Exception as e:
@@ -1487,6 +1546,7 @@ class WildlifeCorridorEnv(gym.Env):
         if self.use_real_data and self.data_connector:
             self._load_real_data()
             self._detect_new_species()
+            self._prepare_model_grids()
         else:
             self._generate_landscape()
         
@@ -1686,6 +1746,62 @@ class WildlifeCorridorEnv(gym.Env):
             pygame.display.quit()
             pygame.quit()
 
+class BatchedLSTMForecasts:
+    """
+    Drives WildlifeCorridorEnv.update_lstm_forecasts_batch for in-process env copies.
+    
+    Call step() once per vectorized step; every update_frequency steps all
+    copies are refreshed with one LSTM forward pass. The envs stop refreshing
+    their own forecasts as soon as this is created.
+    """
+    
+    def __init__(self, envs, update_frequency: Optional[int] = None, forecast_steps: int = 10):
+        self.envs = [getattr(env, 'unwrapped', env) for env in envs]
+        if not self.envs:
+            raise ValueError("At least one environment is required")
+        self.update_frequency = update_frequency or self.envs[0].update_frequency
+        self.forecast_steps = forecast_steps
+        self.num_steps = 0
+        WildlifeCorridorEnv.update_lstm_forecasts_batch(self.envs, forecast_steps=self.forecast_steps)
+    
+    def step(self):
+        """Count one vectorized step and refresh the forecasts when due."""
+        self.num_steps += 1
+        if self.num_steps % self.update_frequency == 0:
+            WildlifeCorridorEnv.update_lstm_forecasts_batch(self.envs, forecast_steps=self.forecast_steps)
+
+
+if BaseCallback is not None:
+    class LSTMForecastCallback(BaseCallback):
+        """
+        Stable-Baselines3 callback refreshing the LSTM forecasts of all training
+        env copies in one forward pass.
+        
+        Needs an in-process VecEnv (DummyVecEnv); with SubprocVecEnv the copies
+        live in other processes and keep refreshing themselves.
+        """
+        
+        def __init__(self, update_frequency: Optional[int] = None, forecast_steps: int = 10, verbose: int = 0):
+            super().__init__(verbose)
+            self.update_frequency = update_frequency
+            self.forecast_steps = forecast_steps
+            self.forecasts = None
+        
+        def _on_training_start(self):
+            vec_env = getattr(self.training_env, 'unwrapped', self.training_env)
+            envs = getattr(vec_env, 'envs', None)
+            if not envs:
+                if self.verbose:
+                    print("LSTMForecastCallback: envs are not in this process, per-env refresh kept")
+                return
+            self.forecasts = BatchedLSTMForecasts(envs, self.update_frequency, self.forecast_steps)
+        
+        def _on_step(self) -> bool:
+            if self.forecasts is not None:
+                self.forecasts.step()
+            return True
+
+
 def test_improved_wildlife_environment():
     """Test function for the wildlife environment - requires real data."""
     from integration.model_loader import ModelLoader
@@ -4,12 +4,14 @@ Connects to tracking API and loads environmental rasters
 """
 
 import os
+import sys
 import requests
 import numpy as np
 import pandas as pd
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Any
 import json
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import warnings
 warnings.filterwarnings('ignore')
@@ -17,10 +19,22 @@ warnings.filterwarnings('ignore')
 try:
     import rasterio
     from rasterio.transform import from_bounds
+    from rasterio.windows import Window
 except ImportError:
     print("Warning: rasterio not available. Raster loading will be limited.")
     rasterio = None
     from_bounds = None
+    Window = None
+
+try:
+    from ml_service.core.raster_stack import get_raster_stack
+except ImportError:
+    # Run from ml_service/ (service) or as a script from the RL directory
+    sys.path.append(str(Path(__file__).resolve().parents[3]))
+    try:
+        from core.raster_stack import get_raster_stack
+    except ImportError:
+        get_raster_stack = None
 
 class DataConnector:
     """
@@ -31,12 +45,14 @@ class DataConnector:
     
     def __init__(self, api_base_url: str = None, ml_service_url: str = None, 
                  api_key: str = None, token: str = None, cache_dir: str = "data_cache",
-                 use_api: bool = False):
+                 use_api: bool = False, tile_size: int = 256, max_cached_tiles: int = 64):
         """
         DataConnector - loads data from local files only by default.
         
         Args:
             use_api: If False (default), only loads from local files. Set True to enable API calls.
+            tile_size: Edge length (pixels) of the raster tiles read from disk
+            max_cached_tiles: Number of decoded raster tiles kept in the LRU cache
         """
         # API settings (only used if use_api=True)
         self.use_api = use_api
@@ -52,6 +68,10 @@ class DataConnector:
         self.raster_cache = {}
         self.last_update = {}
         
+        self.tile_size = int(tile_size)
+        self.max_cached_tiles = int(max_cached_tiles)
+        self.tile_cache = OrderedDict()
+        
     def fetch_gps_data(self, species: str, start_date: str = None, end_date: str = None, 
                       bbox: Tuple[float, float, float, float] = None, use_cache: bool = True) -> pd.DataFrame:
         """
@@ -178,38 +198,25 @@ class DataConnector:
             return self.raster_cache[cache_key]
         
         try:
+            if raster_path and Path(raster_path).exists() and not bbox:
+                # Whole standard layers come from the shared memory-mapped RasterStack
+                shared = self._shared_raster(raster_type, raster_path)
+                if shared is not None:
+                    self.raster_cache[cache_key] = shared
+                    return shared
+            
             if raster_path and Path(raster_path).exists():
-                # Load from local file
+                # Load from local file, reading only the tiles covering the bbox
                 with rasterio.open(raster_path) as src:
-                    data = src.read(1)  # Read first band
-                    transform = src.transform
-                    bounds = src.bounds
-                    crs = src.crs
+                    window = Window(0, 0, src.width, src.height)
                     
-                    # Crop to bbox if provided and valid
+                    # Crop to bbox if provided and it overlaps the raster
                     if bbox and len(bbox) == 4:
-                        try:
-                            # Ensure bbox is valid (min_lon, min_lat, max_lon, max_lat)
-                            # Check if bbox overlaps with raster bounds
-                            raster_min_lon, raster_min_lat, raster_max_lon, raster_max_lat = bounds
-                            bbox_min_lon, bbox_min_lat, bbox_max_lon, bbox_max_lat = bbox
-                            
-                            # Only crop if bbox overlaps with raster
-                            if (bbox_max_lon > raster_min_lon and bbox_min_lon < raster_max_lon and
-                                bbox_max_lat > raster_min_lat and bbox_min_lat < raster_max_lat):
-                                from rasterio.windows import from_bounds
-                                window = from_bounds(
-                                    bbox_min_lon, bbox_min_lat, bbox_max_lon, bbox_max_lat, 
-                                    transform, boundless=False
-                                )
-                                cropped_data = src.read(1, window=window)
-                                # Only use cropped data if it's not empty
-                                if cropped_data.size > 0 and cropped_data.shape[0] > 0 and cropped_data.shape[1] > 0:
-                                    data = cropped_data
-                                    transform = src.window_transform(window)
-                        except Exception:
-                            # If cropping fails, use full raster
-                            pass
+                        bbox_window = self._bbox_window(src, bbox)
+                        if bbox_window is not None:
+                            window = bbox_window
+                    
+                    data = self._read_window(src, str(raster_path), window)
                     
                     # Validate data is not empty
                     if data is None or data.size == 0 or data.shape[0] == 0 or data.shape[1] == 0:
@@ -217,9 +224,10 @@ class DataConnector:
                     
                     result = {
                         'data': data,
-                        'transform': transform,
-                        'bounds': bounds,
-                        'crs': crs,
+                        'transform': src.window_transform(window),
+                        'bounds': rasterio.windows.bounds(window, src.transform),
+                        'crs': src.crs,
+                        'nodata': src.nodata,
                         'raster_type': raster_type
                     }
                     
@@ -238,6 +246,155 @@ class DataConnector:
             # Return None instead of raising - will be handled by environment generating from GPS data
             return None
     
+    @staticmethod
+    def _shared_raster(raster_type: str, raster_path: str) -> Optional[Dict[str, Any]]:
+        """
+        A standard `{raster_type}_raster_kenya_tanzania.tif` layer from the shared
+        RasterStack of its directory, or None for other files.
+        
+        The band is decoded once into a memory-mapped cache, so every environment
+        copy (and the XGBoost pipeline) reads the same pages.
+        """
+        path = Path(raster_path)
+        if path.name != f"{raster_type}_raster_kenya_tanzania.tif":
+            return None
+        if get_raster_stack is None:
+            return None
+        stack = get_raster_stack(path.parent)
+        if raster_type not in stack:
+            return None
+        return stack.as_env_rasters([raster_type])[raster_type]
+    
+    @staticmethod
+    def _bbox_window(src, bbox: Tuple[float, float, float, float]):
+        """Pixel-aligned window of `src` covering bbox, or None when they do not overlap."""
+        bbox_min_lon, bbox_min_lat, bbox_max_lon, bbox_max_lat = bbox
+        raster_min_lon, raster_min_lat, raster_max_lon, raster_max_lat = src.bounds
+        if not (bbox_max_lon > raster_min_lon and bbox_min_lon < raster_max_lon and
+                bbox_max_lat > raster_min_lat and bbox_min_lat < raster_max_lat):
+            return None
+        
+        inverse = ~src.transform
+        corners = [inverse * (lon, lat) for lon in (bbox_min_lon, bbox_max_lon)
+                   for lat in (bbox_min_lat, bbox_max_lat)]
+        cols = [c for c, _ in corners]
+        rows = [r for _, r in corners]
+        col_off = max(0, int(np.floor(min(cols))))
+        row_off = max(0, int(np.floor(min(rows))))
+        col_end = min(src.width, int(np.ceil(max(cols))))
+        row_end = min(src.height, int(np.ceil(max(rows))))
+        if col_end <= col_off or row_end <= row_off:
+            return None
+        return Window(col_off, row_off, col_end - col_off, row_end - row_off)
+    
+    def _read_tile(self, src, raster_path: str, tile_row: int, tile_col: int, band: int = 1) -> np.ndarray:
+        """Read one decoded tile, serving repeats from the LRU tile cache."""
+        key = (raster_path, band, tile_row, tile_col)
+        tile = self.tile_cache.get(key)
+        if tile is not None:
+            self.tile_cache.move_to_end(key)
+            return tile
+        
+        row_off = tile_row * self.tile_size
+        col_off = tile_col * self.tile_size
+        window = Window(col_off, row_off,
+                        min(self.tile_size, src.width - col_off),
+                        min(self.tile_size, src.height - row_off))
+        tile = src.read(band, window=window)
+        
+        self.tile_cache[key] = tile
+        while len(self.tile_cache) > self.max_cached_tiles:
+            self.tile_cache.popitem(last=False)
+        return tile
+    
+    def _read_window(self, src, raster_path: str, window, band: int = 1) -> np.ndarray:
+        """Assemble a window of a band from cached tiles."""
+        row_off, col_off = int(window.row_off), int(window.col_off)
+        height, width = int(window.height), int(window.width)
+        data = np.empty((height, width), dtype=src.dtypes[band - 1])
+        
+        ts = self.tile_size
+        for tile_row in range(row_off // ts, (row_off + height - 1) // ts + 1):
+            for tile_col in range(col_off // ts, (col_off + width - 1) // ts + 1):
+                tile = self._read_tile(src, raster_path, tile_row, tile_col, band)
+                # Intersection of the tile with the requested window, in raster pixels
+                r0 = max(row_off, tile_row * ts)
+                r1 = min(row_off + height, tile_row * ts + tile.shape[0])
+                c0 = max(col_off, tile_col * ts)
+                c1 = min(col_off + width, tile_col * ts + tile.shape[1])
+                data[r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off] = \
+                    tile[r0 - tile_row * ts:r1 - tile_row * ts, c0 - tile_col * ts:c1 - tile_col * ts]
+        return data
+    
+    @staticmethod
+    def _world_to_pixel(transform, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Invert an affine geotransform (a, b, c, d, e, f) for arrays of coordinates."""
+        a, b, c, d, e, f = tuple(transform)[:6]
+        det = a * e - b * d
+        dx = lons - c
+        dy = lats - f
+        cols = np.floor((e * dx - b * dy) / det).astype(np.int64)
+        rows = np.floor((a * dy - d * dx) / det).astype(np.int64)
+        return rows, cols
+    
+    def sample_raster(self, raster_data: Dict[str, Any], lats, lons) -> np.ndarray:
+        """
+        Sample a loaded raster at arrays of coordinates.
+        
+        Points outside the raster or on nodata pixels come back as NaN. Layers
+        without a geotransform (generated from GPS coverage) are uniform, so the
+        centre pixel is returned for every point.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+        values = np.full(lats.shape, np.nan)
+        
+        data = raster_data.get('data') if raster_data else None
+        if data is None or data.size == 0:
+            return values
+        
+        transform = raster_data.get('transform')
+        if transform is None:
+            values[:] = float(data[data.shape[0] // 2, data.shape[1] // 2])
+            return values
+        
+        rows, cols = self._world_to_pixel(transform, lats, lons)
+        inside = (rows >= 0) & (rows < data.shape[0]) & (cols >= 0) & (cols < data.shape[1])
+        values[inside] = data[rows[inside], cols[inside]]
+        
+        nodata = raster_data.get('nodata')
+        if nodata is not None and not np.isnan(nodata):
+            values[values == nodata] = np.nan
+        return values
+    
+    def sample_raster_file(self, raster_path: str, lats, lons, band: int = 1) -> np.ndarray:
+        """
+        Sample a raster file at arrays of coordinates without loading the full band.
+        
+        Only the tiles containing the points are decoded, and they stay in the
+        LRU tile cache for subsequent calls.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+        values = np.full(lats.shape, np.nan)
+        
+        with rasterio.open(raster_path) as src:
+            rows, cols = self._world_to_pixel(src.transform, lats, lons)
+            inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+            
+            idx = np.flatnonzero(inside)
+            tile_rows = rows[idx] // self.tile_size
+            tile_cols = cols[idx] // self.tile_size
+            for tile_row, tile_col in set(zip(tile_rows.tolist(), tile_cols.tolist())):
+                tile = self._read_tile(src, str(raster_path), tile_row, tile_col, band)
+                members = idx[(tile_rows == tile_row) & (tile_cols == tile_col)]
+                values[members] = tile[rows[members] - tile_row * self.tile_size,
+                                       cols[members] - tile_col * self.tile_size]
+            
+            if src.nodata is not None and not np.isnan(src.nodata):
+                values[values == src.nodata] = np.nan
+        return values
+    
     def _fetch_raster_from_api(self, raster_type: str, bbox: Tuple[float, float, float, float]) -> Dict[str, Any]:
         """Fetch raster from API (placeholder - implement based on your API)."""
         # This would make an API call to fetch raster tiles
@@ -257,6 +414,27 @@ class DataConnector:
         Returns:
             Dict of environmental features
         """
+        batch = self.extract_environmental_features_batch([lat], [lon], rasters)
+        features = {}
+        for name, values in batch.items():
+            features[name] = int(values[0]) if name == 'landcover' else float(values[0])
+        return features
+    
+    def extract_environmental_features_batch(self, lats, lons,
+                                             rasters: Dict[str, Dict[str, Any]] = None) -> Dict[str, np.ndarray]:
+        """
+        Extract environmental features at many locations at once.
+        
+        Args:
+            lats: Array of latitudes
+            lons: Array of longitudes
+            rasters: Dict of loaded rasters (from load_environmental_raster)
+        
+        Returns:
+            Dict mapping feature name to an array with one value per location
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
         features = {}
         
         if rasters is None:
@@ -268,40 +446,35 @@ class DataConnector:
                 'landcover': self.load_environmental_raster('landcover')
             }
         
-        # Extract values at location (simplified - would need proper coordinate transformation)
-        # This assumes rasters are in the same coordinate system and spatial extent
         for raster_type, raster_data in rasters.items():
-            data = raster_data['data']
+            if not raster_data or raster_data.get('data') is None or raster_data['data'].size == 0:
+                continue
             
-            # Simple extraction (replace with proper coordinate transformation)
-            # In practice, use rasterio to sample at exact coordinates
-            if data is not None and data.size > 0:
-                # Use center of raster as approximation
-                mid_y, mid_x = data.shape[0] // 2, data.shape[1] // 2
-                value = float(data[mid_y, mid_x])
-                
-                if raster_type == 'ndvi':
-                    features['ndvi'] = np.clip(value, 0, 1) if not np.isnan(value) else 0.5
-                elif raster_type == 'rainfall':
-                    features['rainfall'] = max(0, value) if not np.isnan(value) else 0.0
-                elif raster_type == 'elevation':
-                    features['elevation'] = value if not np.isnan(value) else 1000.0
-                elif raster_type == 'landcover':
-                    # Convert to one-hot encoding
-                    landcover_value = int(value) if not np.isnan(value) else 2
-                    features['landcover'] = landcover_value
-                    features['landcover_forest'] = 1.0 if landcover_value == 1 else 0.0
-                    features['landcover_grassland'] = 1.0 if landcover_value == 2 else 0.0
-                    features['landcover_agriculture'] = 1.0 if landcover_value == 3 else 0.0
-                    features['landcover_settlement'] = 1.0 if landcover_value == 4 else 0.0
+            values = self.sample_raster(raster_data, lats, lons)
+            missing = np.isnan(values)
+            
+            if raster_type == 'ndvi':
+                features['ndvi'] = np.where(missing, 0.5, np.clip(values, 0, 1))
+            elif raster_type == 'rainfall':
+                features['rainfall'] = np.where(missing, 0.0, np.maximum(values, 0))
+            elif raster_type == 'elevation':
+                features['elevation'] = np.where(missing, 1000.0, values)
+            elif raster_type == 'landcover':
+                # Convert to one-hot encoding
+                landcover_value = np.where(missing, 2, np.nan_to_num(values)).astype(int)
+                features['landcover'] = landcover_value
+                features['landcover_forest'] = (landcover_value == 1).astype(float)
+                features['landcover_grassland'] = (landcover_value == 2).astype(float)
+                features['landcover_agriculture'] = (landcover_value == 3).astype(float)
+                features['landcover_settlement'] = (landcover_value == 4).astype(float)
         
         # Add distance features (required by XGBoost model)
         # These would ideally be calculated from actual geospatial layers
         # For now, use placeholders or call ML service for better predictions
-        features['distance_to_water'] = features.get('distance_to_water', 5000.0)
-        features['distance_to_settlement'] = features.get('distance_to_settlement', 10000.0)
-        features['distance_to_roads'] = features.get('distance_to_roads', 3000.0)  # XGBoost expects this
-        features['distance_to_protected_areas'] = features.get('distance_to_protected_areas', 2000.0)  # XGBoost expects this
+        features['distance_to_water'] = np.full(lats.shape, 5000.0)
+        features['distance_to_settlement'] = np.full(lats.shape, 10000.0)
+        features['distance_to_roads'] = np.full(lats.shape, 3000.0)  # XGBoost expects this
+        features['distance_to_protected_areas'] = np.full(lats.shape, 2000.0)  # XGBoost expects this
         
         return features
     
@@ -11,6 +11,7 @@ import pandas as pd
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Any
 import json
+import hashlib
 from datetime import datetime
 import joblib
 import warnings
@@ -30,11 +31,81 @@ try:
 except (ImportError, AttributeError):
     pass  # NumPy 2.x already has numpy._core, or older versions don't need this
 
+try:
+    from ml_service.core.xgboost_runtime import try_compile, apply_scaler
+except ImportError:
+    # Run from ml_service/ (service) or as a script from the RL directory
+    sys.path.append(str(Path(__file__).resolve().parents[3]))
+    try:
+        from core.xgboost_runtime import try_compile, apply_scaler
+    except ImportError:
+        try_compile = apply_scaler = None
+
 try:
     from scipy.ndimage import zoom
+    from scipy.spatial import cKDTree
 except ImportError:
     print("Warning: scipy not available. Some functionality may be limited.")
     zoom = None
+    cKDTree = None
+
+HMM_STATE_COLUMNS = {
+    'foraging': 'state_prob_foraging',
+    'resting': 'state_prob_resting',
+    'traveling': 'state_prob_traveling',
+}
+
+
+class SpatialIndex:
+    """
+    Nearest-neighbour index over a results point cloud.
+    
+    Built once per species at load time. Queries return rows of the value
+    matrix by position, so the source DataFrame index is never consulted.
+    Falls back to a chunked brute-force search when scipy is unavailable.
+    """
+    
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        valid = np.isfinite(lats) & np.isfinite(lons)
+        
+        self.points = np.column_stack([lats[valid], lons[valid]])
+        self.values = np.asarray(values)[valid]
+        self.tree = cKDTree(self.points) if cKDTree is not None and len(self.points) > 0 else None
+        
+        digest = hashlib.sha1()
+        digest.update(np.ascontiguousarray(self.points).tobytes())
+        digest.update(np.ascontiguousarray(self.values, dtype=np.float64).tobytes())
+        self.content_hash = digest.hexdigest()
+    
+    def __len__(self):
+        return len(self.points)
+    
+    def query(self, lats, lons) -> np.ndarray:
+        """Return positional indices of the nearest record for each query point."""
+        queries = np.column_stack([
+            np.atleast_1d(np.asarray(lats, dtype=np.float64)),
+            np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        ])
+        
+        if self.tree is not None:
+            _, positions = self.tree.query(queries, k=1)
+            return np.asarray(positions, dtype=np.int64)
+        
+        # Brute force in chunks to bound the (queries x records) distance matrix
+        positions = np.empty(len(queries), dtype=np.int64)
+        chunk = max(1, 2_000_000 // max(len(self.points), 1))
+        for start in range(0, len(queries), chunk):
+            block = queries[start:start + chunk]
+            d2 = ((block[:, None, :] - self.points[None, :, :]) ** 2).sum(axis=2)
+            positions[start:start + chunk] = np.argmin(d2, axis=1)
+        return positions
+    
+    def lookup(self, lats, lons) -> np.ndarray:
+        """Return the value rows of the nearest record for each query point."""
+        return self.values[self.query(lats, lons)]
+
 
 class ModelLoader:
     """Load and manage all pre-trained models for RL integration."""
@@ -46,8 +117,15 @@ class ModelLoader:
         self.hmm_models = {}
         self.bbmm_models = {}
         self.xgboost_models = {}
+        self.xgboost_scalers = {}
+        self.xgboost_compiled = {}
         self.lstm_model = None
         
+        self.hmm_indexes = {}
+        self.bbmm_indexes = {}
+        self.grid_rasters = {}
+        self.grid_cache_dir = self.models_dir / "grid_cache"
+        
         self.model_metadata = {}
         self.model_versions = {}
         
@@ -94,6 +172,7 @@ class ModelLoader:
                 df['lon'] = df['longitude']
         
         self.hmm_models[species] = df
+        self._build_hmm_index(species, df)
         print(f"Loaded HMM results for {species}: {len(df)} records")
         return df
     
@@ -155,9 +234,38 @@ class ModelLoader:
                 df['lon'] = df['longitude']
         
         self.bbmm_models[species] = df
+        self._build_bbmm_index(species, df)
         print(f"Loaded BBMM results for {species}: {len(df)} records")
         return df
     
+    def _build_hmm_index(self, species: str, df: pd.DataFrame):
+        """Build the spatial index over HMM state probabilities for a species."""
+        self.hmm_indexes.pop(species, None)
+        if 'lat' not in df.columns or 'lon' not in df.columns:
+            return
+        
+        values = np.column_stack([
+            df[col].to_numpy(dtype=np.float64) if col in df.columns else np.full(len(df), 0.33)
+            for col in HMM_STATE_COLUMNS.values()
+        ])
+        index = SpatialIndex(df['lat'].to_numpy(), df['lon'].to_numpy(), values)
+        if len(index) > 0:
+            self.hmm_indexes[species] = index
+    
+    def _build_bbmm_index(self, species: str, df: pd.DataFrame):
+        """Build the spatial index over BBMM utilization density for a species."""
+        self.bbmm_indexes.pop(species, None)
+        if 'lat' not in df.columns or 'lon' not in df.columns:
+            return
+        
+        col_name = 'prob_density' if 'prob_density' in df.columns else 'movement_probability'
+        if col_name not in df.columns:
+            return
+        
+        index = SpatialIndex(df['lat'].to_numpy(), df['lon'].to_numpy(), df[col_name].to_numpy(dtype=np.float64))
+        if len(index) > 0:
+            self.bbmm_indexes[species] = index
+    
     def load_xgboost_model(self, species: str, model_path: str) -> Any:
         """
         Load trained XGBoost model for habitat suitability.
@@ -230,6 +338,12 @@ class ModelLoader:
                 except Exception:
                     model = pickle.load(open(model_path, 'rb'))
             
+            # Training packages (xgboost_habitat_modeling.py) bundle the classifier with its scaler
+            scaler = None
+            if isinstance(model, dict) and 'model' in model:
+                scaler = model.get('scaler')
+                model = model['model']
+            
             # If the loaded object doesn't have predict but has a booster, wrap it
             if not hasattr(model, 'predict'):
                 booster = None
@@ -251,11 +365,19 @@ class ModelLoader:
             # Skipping validation here to avoid warnings - model will work with proper feature names
             
             self.xgboost_models[species] = model
+            self.xgboost_scalers[species] = scaler
+            # Single-row suitability calls are served by the compiled tree runtime
+            compiled = try_compile(model) if try_compile else None
+            if compiled is not None:
+                self.xgboost_compiled[species] = compiled
+            else:
+                self.xgboost_compiled.pop(species, None)
             self.model_metadata[f"xgboost_{species}"] = {
                 'path': model_path,
                 'loaded_at': datetime.now().isoformat(),
                 'type': 'XGBoost',
-                'status': 'loaded'
+                'status': 'loaded',
+                'compiled': compiled is not None
             }
             print(f"Loaded XGBoost model for {species}")
             return model
@@ -366,58 +488,146 @@ class ModelLoader:
         Returns:
             dict with keys: 'foraging', 'resting', 'traveling'
         """
+        probs = self.get_hmm_state_probs_batch(species, [lat], [lon])[0]
+        return {state: float(p) for state, p in zip(HMM_STATE_COLUMNS, probs)}
+    
+    def get_hmm_state_probs_batch(self, species: str, lats, lons) -> np.ndarray:
+        """
+        Get HMM behavioral state probabilities for many locations at once.
+        
+        Args:
+            species: Species name
+            lats: Array-like of latitudes
+            lons: Array-like of longitudes
+        
+        Returns:
+            Array of shape (N, 3) with columns ordered foraging, resting, traveling
+        """
         if species not in self.hmm_models:
             raise ValueError(f"HMM model results for '{species}' are required but not loaded. Please provide HMM CSV results.")
         
-        df = self.hmm_models[species]
-        
-        # Find nearest record (can be enhanced with spatial indexing)
-        if 'lat' in df.columns and 'lon' in df.columns:
-            distances = np.sqrt((df['lat'] - lat)**2 + (df['lon'] - lon)**2)
-            nearest_idx = distances.idxmin()
-            row = df.iloc[nearest_idx]
-            
-            return {
-                'foraging': float(row.get('state_prob_foraging', 0.33)),
-                'resting': float(row.get('state_prob_resting', 0.33)),
-                'traveling': float(row.get('state_prob_traveling', 0.33))
-            }
+        n_queries = len(np.atleast_1d(lats))
+        index = self.hmm_indexes.get(species)
+        if index is not None:
+            return index.lookup(lats, lons)
         
         # If no spatial data, still use real data (mean of loaded results)
+        df = self.hmm_models[species]
         if len(df) == 0:
             raise ValueError(f"HMM results for '{species}' contain no data. Please provide valid HMM CSV results.")
-        return {
-            'foraging': float(df['state_prob_foraging'].mean()),
-            'resting': float(df['state_prob_resting'].mean()),
-            'traveling': float(df['state_prob_traveling'].mean())
-        }
+        means = np.array([float(df[col].mean()) for col in HMM_STATE_COLUMNS.values()])
+        return np.tile(means, (n_queries, 1))
     
     def get_bbmm_density(self, species: str, lat: float, lon: float) -> float:
         """Get BBMM movement probability density for a location."""
+        return float(self.get_bbmm_density_batch(species, [lat], [lon])[0])
+    
+    def get_bbmm_density_batch(self, species: str, lats, lons) -> np.ndarray:
+        """
+        Get BBMM movement probability density for many locations at once.
+        
+        Uses prob_density (utilization distribution) as primary measure.
+        High density = high probability the animal will use this area.
+        
+        Returns:
+            Array of shape (N,) with densities
+        """
         if species not in self.bbmm_models:
             raise ValueError(f"BBMM model results for '{species}' are required but not loaded. Please provide BBMM CSV results.")
         
-        df = self.bbmm_models[species]
-        
-        if 'lat' in df.columns and 'lon' in df.columns:
-            distances = np.sqrt((df['lat'] - lat)**2 + (df['lon'] - lon)**2)
-            nearest_idx = distances.idxmin()
-            row = df.iloc[nearest_idx]
-            # Use prob_density (utilization distribution) as primary measure
-            # This represents where the animal is most likely to be (foraging/resting areas)
-            # For movement decisions, high density = high probability animal will use this area
-            density = row.get('prob_density') if 'prob_density' in row else row.get('movement_probability')
-            if density is None:
-                raise ValueError(f"BBMM results for '{species}' missing required columns. Need 'prob_density' or 'movement_probability'.")
-            return float(density)
+        n_queries = len(np.atleast_1d(lats))
+        index = self.bbmm_indexes.get(species)
+        if index is not None:
+            return index.lookup(lats, lons)
         
         # If no spatial data, still use real data (mean of loaded results)
+        df = self.bbmm_models[species]
         if len(df) == 0:
             raise ValueError(f"BBMM results for '{species}' contain no data. Please provide valid BBMM CSV results.")
         col_name = 'movement_probability' if 'movement_probability' in df.columns else 'prob_density'
         if col_name not in df.columns:
             raise ValueError(f"BBMM results for '{species}' missing required columns. Need 'movement_probability' or 'prob_density'.")
-        return float(df[col_name].mean())
+        return np.full(n_queries, float(df[col_name].mean()))
+    
+    def rasterize_hmm_state_probs(self, species: str, grid_size: int,
+                                  bbox: Tuple[float, float, float, float]) -> np.ndarray:
+        """
+        Rasterize HMM state probabilities onto an RL grid.
+        
+        Returns:
+            float32 array of shape (grid_size, grid_size, 3) indexed [x, y, state]
+            with states ordered foraging, resting, traveling
+        """
+        return self._rasterize('hmm', species, grid_size, bbox)
+    
+    def rasterize_bbmm_density(self, species: str, grid_size: int,
+                               bbox: Tuple[float, float, float, float]) -> np.ndarray:
+        """
+        Rasterize BBMM utilization density onto an RL grid.
+        
+        Returns:
+            float32 array of shape (grid_size, grid_size) indexed [x, y]
+        """
+        return self._rasterize('bbmm', species, grid_size, bbox)
+    
+    def _rasterize(self, kind: str, species: str, grid_size: int,
+                   bbox: Tuple[float, float, float, float]) -> np.ndarray:
+        """
+        Sample a model point cloud at every RL grid cell once.
+        
+        Cells use the same (x, y) -> (lat, lon) mapping as WildlifeCorridorEnv,
+        so raster[x, y] equals the per-cell lookup. Results are persisted as
+        .npy files keyed by a hash of the source data, grid and bbox, and are
+        memory-mapped on later runs.
+        """
+        models = self.hmm_models if kind == 'hmm' else self.bbmm_models
+        if species not in models:
+            raise ValueError(f"{kind.upper()} model results for '{species}' are required but not loaded.")
+        
+        bbox = tuple(float(v) for v in bbox)
+        index = (self.hmm_indexes if kind == 'hmm' else self.bbmm_indexes).get(species)
+        source_hash = index.content_hash if index is not None else f"mean-{len(models[species])}"
+        key_hash = hashlib.sha1(f"{kind}|{species}|{source_hash}|{grid_size}|{bbox}".encode()).hexdigest()[:16]
+        
+        cache_key = (kind, species, grid_size, bbox)
+        cached = self.grid_rasters.get(cache_key)
+        if cached is not None and cached[0] == key_hash:
+            return cached[1]
+        
+        cache_file = self.grid_cache_dir / f"{kind}_{species}_{grid_size}_{key_hash}.npy"
+        if cache_file.exists():
+            try:
+                raster = np.load(cache_file, mmap_mode='r')
+                self.grid_rasters[cache_key] = (key_hash, raster)
+                return raster
+            except Exception as e:
+                print(f"Warning: could not memory-map {cache_file}: {e}. Rebuilding.")
+        
+        min_lon, min_lat, max_lon, max_lat = bbox
+        cells = np.arange(grid_size)
+        xs, ys = np.meshgrid(cells, cells, indexing='ij')
+        lons = min_lon + (xs.ravel() / grid_size) * (max_lon - min_lon)
+        lats = min_lat + (ys.ravel() / grid_size) * (max_lat - min_lat)
+        
+        if kind == 'hmm':
+            values = self.get_hmm_state_probs_batch(species, lats, lons)
+            raster = values.reshape(grid_size, grid_size, -1).astype(np.float32)
+        else:
+            values = self.get_bbmm_density_batch(species, lats, lons)
+            raster = values.reshape(grid_size, grid_size).astype(np.float32)
+        
+        try:
+            self.grid_cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_name(f"{cache_file.stem}.tmp-{os.getpid()}.npy")
+            np.save(tmp_file, raster)
+            os.replace(tmp_file, cache_file)
+            raster = np.load(cache_file, mmap_mode='r')
+        except OSError as e:
+            print(f"Warning: could not persist {kind} raster for {species}: {e}")
+        
+        self.grid_rasters[cache_key] = (key_hash, raster)
+        print(f"Rasterized {kind.upper()} results for {species} onto {grid_size}x{grid_size} grid")
+        return raster
     
     def predict_habitat_suitability(self, species: str, env_features: Dict[str, float]) -> float:
         """
@@ -521,6 +731,13 @@ class ModelLoader:
                 'land_cover_16': env_features.get('land_cover_16', 0.0),
             }
             
+            scaler = self.xgboost_scalers.get(species)
+            compiled = self.xgboost_compiled.get(species)
+            if compiled is not None and compiled.feature_names:
+                row = np.array([[features_dict.get(name, 0.0) for name in compiled.feature_names]], dtype=np.float64)
+                proba = compiled.predict_proba(apply_scaler(scaler, row))[0]
+                return float(proba[1] if len(proba) > 1 else proba[0])
+            
             # Build input with feature names if the model expects them
             if feature_names:
                 import pandas as _pd
@@ -528,6 +745,8 @@ class ModelLoader:
                 feature_array = _pd.DataFrame([row])[feature_names]
             else:
                 feature_array = np.array([[features_dict.get(k, 0.0) for k in sorted(features_dict.keys())]])
+            if scaler is not None:
+                feature_array = scaler.transform(feature_array)
             
             # Case 1: scikit-learn API (XGBClassifier/XGBRegressor)
             try:
@@ -573,93 +792,107 @@ class ModelLoader:
         Returns:
             Dict with forecasted values for 'ndvi_trend', 'rainfall_trend', etc.
         """
+        historical_data = np.asarray(historical_data, dtype=float)
+        if historical_data.ndim == 1:
+            # Single feature time series - add feature dimension
+            historical_data = historical_data.reshape(-1, 1)
+        return self.predict_temporal_trends_batch(historical_data[np.newaxis], forecast_steps)[0]
+    
+    def predict_temporal_trends_batch(self, historical_batch: np.ndarray,
+                                      forecast_steps: int = 10) -> List[Dict[str, np.ndarray]]:
+        """
+        Predict temporal environmental trends for many sequences in one forward pass.
+        
+        Args:
+            historical_batch: (batch, timesteps, features) array, e.g. one history
+                per vectorized environment copy
+            forecast_steps: Number of steps to forecast ahead
+        
+        Returns:
+            List of forecast dicts (same keys as predict_temporal_trends), one per sequence
+        """
+        historical_batch = np.asarray(historical_batch, dtype=float)
+        batch_size = historical_batch.shape[0]
+        
         if self.lstm_model is None:
             # Return neutral trends if model not available
-            return {
+            return [{
                 'ndvi_trend': np.ones(forecast_steps) * 0.5,
                 'rainfall_trend': np.zeros(forecast_steps),
                 'vegetation_trend': np.ones(forecast_steps) * 0.5
-            }
+            } for _ in range(batch_size)]
         
         try:
-            # Get model expected input shape
             model = self.lstm_model
-            expected_shape = None
-            
-            # Try to get expected input shape from model
-            if hasattr(model, 'input_shape') and model.input_shape:
-                expected_shape = model.input_shape
-            elif hasattr(model, 'inputs') and model.inputs and len(model.inputs) > 0:
-                try:
-                    expected_shape = model.inputs[0].shape.as_list()
-                except:
-                    pass
-            
-            # Reshape data for LSTM input (batch_size, timesteps, features)
-            if historical_data.ndim == 1:
-                # Single feature time series - add feature dimension
-                historical_data = historical_data.reshape(1, -1, 1)
-            elif historical_data.ndim == 2:
-                # (timesteps, features) - add batch dimension
-                if expected_shape and len(expected_shape) >= 3:
-                    # Match model's expected shape
-                    expected_timesteps = expected_shape[1] if expected_shape[1] is not None else historical_data.shape[0]
-                    expected_features = expected_shape[2] if len(expected_shape) > 2 and expected_shape[2] is not None else historical_data.shape[1]
-                    
-                    # Pad or trim to match expected shape
-                    if historical_data.shape[0] != expected_timesteps:
-                        if historical_data.shape[0] < expected_timesteps:
-                            # Pad with last value
-                            padding = np.tile(historical_data[-1:], (expected_timesteps - historical_data.shape[0], 1))
-                            historical_data = np.vstack([historical_data, padding])
-                        else:
-                            # Trim to expected length
-                            historical_data = historical_data[:expected_timesteps]
-                    
-                    if historical_data.shape[1] != expected_features:
-                        if historical_data.shape[1] < expected_features:
-                            # Pad features with zeros
-                            padding = np.zeros((historical_data.shape[0], expected_features - historical_data.shape[1]))
-                            historical_data = np.hstack([historical_data, padding])
-                        else:
-                            # Use only first N features
-                            historical_data = historical_data[:, :expected_features]
-                
-                historical_data = historical_data.reshape(1, historical_data.shape[0], historical_data.shape[1])
+            historical_batch = self._match_lstm_input_shape(historical_batch)
             
             # Predict future values
-            predictions = model.predict(historical_data, verbose=0)
+            predictions = model.predict(historical_batch, verbose=0)
             
             # Extract trend components
             # Model outputs (batch, 3) where 3 features are predicted
             # Typically: [NDVI/vegetation, rainfall, other_feature]
-            if predictions.ndim >= 2:
-                # Model outputs single prediction per sample with 3 features
-                # For forecasting, we replicate this over forecast_steps
-                if predictions.shape[-1] >= 3:
-                    # Extract the 3 feature values
-                    feature_0 = float(predictions[0, 0])  # NDVI/vegetation
-                    feature_1 = float(predictions[0, 1])  # Rainfall
-                    feature_2 = float(predictions[0, 2]) if predictions.shape[1] > 2 else 0.0  # Other
-                    
-                    # For forecasting, create trends by replicating or interpolating
-                    ndvi_trend = np.ones(forecast_steps) * feature_0
-                    rainfall_trend = np.ones(forecast_steps) * feature_1
-                    vegetation_trend = np.ones(forecast_steps) * feature_0
-                else:
-                    raise ValueError(f"LSTM model output shape unexpected: {predictions.shape}. Expected (batch, 3) or (batch, timesteps, 3).")
-            else:
+            if predictions.ndim < 2:
                 raise ValueError(f"LSTM model output shape unexpected: {predictions.shape}. Expected at least 2 dimensions.")
+            if predictions.shape[-1] < 3:
+                raise ValueError(f"LSTM model output shape unexpected: {predictions.shape}. Expected (batch, 3) or (batch, timesteps, 3).")
             
-            return {
-                'ndvi_trend': ndvi_trend[:forecast_steps],
-                'rainfall_trend': rainfall_trend[:forecast_steps],
-                'vegetation_trend': vegetation_trend[:forecast_steps]
-            }
+            # Model outputs a single prediction per sample; for forecasting we
+            # replicate it over forecast_steps
+            predictions = np.asarray(predictions, dtype=float)
+            forecasts = []
+            for i in range(batch_size):
+                feature_0 = float(predictions[i, 0])  # NDVI/vegetation
+                feature_1 = float(predictions[i, 1])  # Rainfall
+                forecasts.append({
+                    'ndvi_trend': np.ones(forecast_steps) * feature_0,
+                    'rainfall_trend': np.ones(forecast_steps) * feature_1,
+                    'vegetation_trend': np.ones(forecast_steps) * feature_0
+                })
+            return forecasts
             
         except Exception as e:
             raise ValueError(f"LSTM prediction failed: {e}") from e
     
+    def _match_lstm_input_shape(self, historical_batch: np.ndarray) -> np.ndarray:
+        """Pad or trim a (batch, timesteps, features) array to the LSTM's expected input shape."""
+        model = self.lstm_model
+        expected_shape = None
+        
+        # Try to get expected input shape from model
+        if hasattr(model, 'input_shape') and model.input_shape:
+            expected_shape = model.input_shape
+        elif hasattr(model, 'inputs') and model.inputs and len(model.inputs) > 0:
+            try:
+                expected_shape = model.inputs[0].shape.as_list()
+            except:
+                pass
+        
+        if not expected_shape or len(expected_shape) < 3:
+            return historical_batch
+        
+        _, timesteps, features = historical_batch.shape
+        expected_timesteps = expected_shape[1] if expected_shape[1] is not None else timesteps
+        expected_features = expected_shape[2] if expected_shape[2] is not None else features
+        
+        if timesteps < expected_timesteps:
+            # Pad with last value
+            padding = np.repeat(historical_batch[:, -1:, :], expected_timesteps - timesteps, axis=1)
+            historical_batch = np.concatenate([historical_batch, padding], axis=1)
+        elif timesteps > expected_timesteps:
+            # Trim to expected length
+            historical_batch = historical_batch[:, :expected_timesteps, :]
+        
+        if features < expected_features:
+            # Pad features with zeros
+            padding = np.zeros(historical_batch.shape[:2] + (expected_features - features,))
+            historical_batch = np.concatenate([historical_batch, padding], axis=2)
+        elif features > expected_features:
+            # Use only first N features
+            historical_batch = historical_batch[:, :, :expected_features]
+        
+        return historical_batch
+    
     def save_model_versions(self, output_path: str):
         """Save model version metadata for tracking."""
         versions = {
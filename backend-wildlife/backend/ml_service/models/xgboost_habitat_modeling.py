@@ -8,23 +8,23 @@ import os
 import pickle
 import json
 import xgboost as xgb
-from sklearn.model_selection import train_test_split, cross_val_score, StratifiedKFold
+from sklearn.model_selection import train_test_split, cross_validate, StratifiedKFold
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score, accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, roc_auc_score
 from scipy.spatial.distance import cdist
 from scipy.interpolate import griddata
-import rasterio
-from rasterio.transform import rowcol
 
-warnings.filterwarnings('ignore')
-np.random.seed(42)
+try:
+    from .pipeline import PipelineError
+    from .parallel_utils import map_tasks
+except ImportError:
+    from pipeline import PipelineError
+    from parallel_utils import map_tasks
 
-print("XGBoost Habitat Suitability Model")
-print("Wildlife Corridor Conservation - Kenya/Tanzania Study Area")
-print()
-
-plt.style.use('seaborn-v0_8-darkgrid')
-sns.set_palette("husl")
+try:
+    from .dataset_cache import DEFAULT_DATASET_DIR, read_csv_cached
+except ImportError:
+    from dataset_cache import DEFAULT_DATASET_DIR, read_csv_cached
 
 """Geographic configuration"""
 
@@ -37,16 +37,62 @@ KENYA_TANZANIA_BBOX = {
 }
 
 output_dir = '/data/outputs'
-os.makedirs(f'{output_dir}/models', exist_ok=True)
-os.makedirs(f'{output_dir}/plots', exist_ok=True)
-os.makedirs(f'{output_dir}/data', exist_ok=True)
-os.makedirs(f'{output_dir}/evaluations', exist_ok=True)
 
-# File paths
 ELEPHANT_BBMM_FILE = '/elephant_bbmm_gps_data.csv'
 WILDEBEEST_BBMM_FILE = '/wildebeest_bbmm_gps_data.csv'
 ENV_DATA_DIR = '/data/environmental_data'
 
+"""Model configuration"""
+
+XGB_BASE_PARAMS = {
+    'n_estimators': 200,
+    'max_depth': 4,
+    'learning_rate': 0.05,
+    'subsample': 0.7,
+    'colsample_bytree': 0.7,
+    'min_child_weight': 10,
+    'gamma': 0.3,
+    'reg_alpha': 0.5,
+    'reg_lambda': 2.0,
+    'random_state': 42,
+    'eval_metric': 'logloss',
+}
+
+# Values sampled by the hyperparameter search around XGB_BASE_PARAMS
+XGB_SEARCH_SPACE = {
+    'max_depth': [3, 4, 5, 6, 8],
+    'learning_rate': [0.03, 0.05, 0.1, 0.2],
+    'subsample': [0.6, 0.7, 0.8, 1.0],
+    'colsample_bytree': [0.6, 0.7, 0.8, 1.0],
+    'min_child_weight': [1, 5, 10, 20],
+    'gamma': [0.0, 0.1, 0.3, 1.0],
+    'reg_alpha': [0.0, 0.5, 1.0],
+    'reg_lambda': [1.0, 2.0, 5.0],
+}
+
+# Successive halving: sampled configurations, tree budget of each rung, share of
+# configurations kept after a rung (1/keep) and early-stopping patience
+XGB_SEARCH_CONFIGS = 16
+XGB_SEARCH_BUDGETS = (50, 150, 400)
+XGB_SEARCH_KEEP = 3
+XGB_EARLY_STOPPING_ROUNDS = 20
+
+def setup_pipeline(config):
+    warnings.filterwarnings('ignore')
+    np.random.seed(42)
+
+    print("XGBoost Habitat Suitability Model")
+    print("Wildlife Corridor Conservation - Kenya/Tanzania Study Area")
+    print()
+
+    plt.style.use('seaborn-v0_8-darkgrid')
+    sns.set_palette("husl")
+
+    os.makedirs(f'{output_dir}/models', exist_ok=True)
+    os.makedirs(f'{output_dir}/plots', exist_ok=True)
+    os.makedirs(f'{output_dir}/data', exist_ok=True)
+    os.makedirs(f'{output_dir}/evaluations', exist_ok=True)
+
 def haversine_distance(lat1, lon1, lat2, lon2):
     R = 6371.0
     lat1_rad = np.radians(lat1)
@@ -120,17 +166,17 @@ def find_optimal_threshold(model, X_val, y_val):
     print(f"Optimal threshold: {best_threshold:.2f} (score: {best_score:.3f})")
     return best_threshold
 
-def load_bbmm_results(elephant_path, wildebeest_path):
+def load_bbmm_results(elephant_path, wildebeest_path, cache_dir=DEFAULT_DATASET_DIR):
     print("STEP 1: LOADING BBMM OUTPUT DATA")
     try:
-        elephant_bbmm = pd.read_csv(elephant_path)
+        elephant_bbmm = read_csv_cached(elephant_path, cache_dir=cache_dir)
         print(f"Loaded elephant BBMM data: {len(elephant_bbmm):,} records")
     except FileNotFoundError:
         print(f"ERROR: Elephant BBMM file not found at {elephant_path}")
         return None, None
 
     try:
-        wildebeest_bbmm = pd.read_csv(wildebeest_path)
+        wildebeest_bbmm = read_csv_cached(wildebeest_path, cache_dir=cache_dir)
         print(f"Loaded wildebeest BBMM data: {len(wildebeest_bbmm):,} records")
     except FileNotFoundError:
         print(f"ERROR: Wildebeest BBMM file not found at {wildebeest_path}")
@@ -148,36 +194,6 @@ def load_bbmm_results(elephant_path, wildebeest_path):
 
     return elephant_bbmm, wildebeest_bbmm
 
-elephant_data, wildebeest_data = load_bbmm_results(ELEPHANT_BBMM_FILE, WILDEBEEST_BBMM_FILE)
-
-if elephant_data is None or wildebeest_data is None:
-    print("Cannot proceed without BBMM data.")
-    exit(1)
-
-print("STEP 2: GEOGRAPHIC VALIDATION")
-elephant_data, n_invalid_elephant, error_elephant = validate_geographic_bounds(elephant_data, KENYA_TANZANIA_BBOX)
-if elephant_data is None or len(elephant_data) == 0:
-    print("FATAL ERROR: No valid elephant GPS data")
-    exit(1)
-
-wildebeest_data, n_invalid_wildebeest, error_wildebeest = validate_geographic_bounds(wildebeest_data, KENYA_TANZANIA_BBOX)
-if wildebeest_data is None or len(wildebeest_data) == 0:
-    print("FATAL ERROR: No valid wildebeest GPS data")
-    exit(1)
-
-if n_invalid_elephant > 0 or n_invalid_wildebeest > 0:
-    print(f"GEOGRAPHIC FILTERING APPLIED:")
-    print(f"Elephant: Removed {n_invalid_elephant:,} points")
-    print(f"Wildebeest: Removed {n_invalid_wildebeest:,} points")
-    print(f"Total removed: {n_invalid_elephant + n_invalid_wildebeest:,} points")
-    print(f"Remaining data: {len(elephant_data) + len(wildebeest_data):,} points")
-
-print("STEP 3: COMBINING SPECIES DATA")
-combined_data = pd.concat([elephant_data, wildebeest_data], ignore_index=True)
-print(f"Combined data shape: {combined_data.shape}")
-print(f"Elephant records: {len(combined_data[combined_data['species'] == 'elephant']):,}")
-print(f"Wildebeest records: {len(combined_data[combined_data['species'] == 'wildebeest']):,}")
-
 def extract_environmental_data_from_rasters(gps_df, env_data_dir):
     """
     Extract environmental data from rasters.
@@ -185,6 +201,7 @@ def extract_environmental_data_from_rasters(gps_df, env_data_dir):
     """
     from pathlib import Path
     from ..core.cloudflare_loader import get_file_loader
+    from ..core.raster_stack import RasterStack
     from ..config.settings import get_settings
     
     settings = get_settings()
@@ -212,167 +229,53 @@ def extract_environmental_data_from_rasters(gps_df, env_data_dir):
             return local_path
         return None
 
-    print("1. NDVI")
-    ndvi_path = resolve_raster_path('ndvi')
-    if ndvi_path:
-
-
-        with rasterio.open(ndvi_path) as src:
-            rows, cols = rowcol(src.transform, lon_array, lat_array)
-            valid_mask = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
-            values = np.full(len(lon_array), np.nan, dtype=np.float32)
-            raster_data = src.read(1)
-            values[valid_mask] = raster_data[rows[valid_mask], cols[valid_mask]]
-            if src.nodata is not None:
-                values[values == src.nodata] = np.nan
-        gps_df['ndvi'] = values
-        extraction_results['ndvi'] = True
-        print(f"NDVI extracted: {(~np.isnan(values)).sum()} valid values")
-    else:
-        print(f"NDVI file not found: {ndvi_path}")
-
-    print("2. Land Cover")
-    landcover_path = resolve_raster_path('landcover')
-    if landcover_path:
-
-
-        with rasterio.open(landcover_path) as src:
-            rows, cols = rowcol(src.transform, lon_array, lat_array)
-            valid_mask = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
-            values = np.full(len(lon_array), -1, dtype=np.int32)
-            raster_data = src.read(1)
-            values[valid_mask] = raster_data[rows[valid_mask], cols[valid_mask]]
-            if src.nodata is not None:
-                values[values == src.nodata] = -1
-        gps_df['land_cover'] = values
-        extraction_results['land_cover'] = True
-        print(f"Land cover extracted: {(values != -1).sum()} valid values")
-    else:
-        print(f"Land cover file not found: {landcover_path}")
-
-    print("3. Elevation")
-    elevation_path = resolve_raster_path('elevation')
-    if elevation_path:
-
-
-        with rasterio.open(elevation_path) as src:
-            rows, cols = rowcol(src.transform, lon_array, lat_array)
-            valid_mask = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
-            values = np.full(len(lon_array), np.nan, dtype=np.float32)
-            raster_data = src.read(1)
-            values[valid_mask] = raster_data[rows[valid_mask], cols[valid_mask]]
-            if src.nodata is not None:
-                values[values == src.nodata] = np.nan
-        gps_df['elevation'] = values
-        extraction_results['elevation'] = True
-        print(f"Elevation extracted: {(~np.isnan(values)).sum()} valid values")
-    else:
-        print(f"Elevation file not found: {elevation_path}")
-
-    print("4. Rainfall")
-    rainfall_path = resolve_raster_path('rainfall')
-    if rainfall_path:
-
-
-        with rasterio.open(rainfall_path) as src:
-            rows, cols = rowcol(src.transform, lon_array, lat_array)
-            valid_mask = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
-            values = np.full(len(lon_array), np.nan, dtype=np.float32)
-            raster_data = src.read(1)
-            values[valid_mask] = raster_data[rows[valid_mask], cols[valid_mask]]
-            if src.nodata is not None:
-                values[values == src.nodata] = np.nan
-        gps_df['rainfall_mm'] = values
-        extraction_results['rainfall'] = True
-        print(f"Rainfall extracted: {(~np.isnan(values)).sum()} valid values")
-    else:
-        print(f"Rainfall file not found: {rainfall_path}")
-
-    print("5. Distance to Water")
-    water_path = resolve_raster_path('dist_water')
-    if water_path:
-
-
-        with rasterio.open(water_path) as src:
-            rows, cols = rowcol(src.transform, lon_array, lat_array)
-            valid_mask = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
-            values = np.full(len(lon_array), np.nan, dtype=np.float32)
-            raster_data = src.read(1)
-            values[valid_mask] = raster_data[rows[valid_mask], cols[valid_mask]]
-            if src.nodata is not None:
-                values[values == src.nodata] = np.nan
-        gps_df['distance_to_water_km'] = values
-        extraction_results['distance_to_water'] = True
-        print(f"Distance to water extracted: {(~np.isnan(values)).sum()} valid values")
-    else:
-        print(f"Distance to water file not found: {water_path}")
-        if 'ndvi' in gps_df.columns:
-            gps_df['distance_to_water_km'] = (1 - gps_df['ndvi']) * 10
-
-    print("6. Distance to Settlement")
-    settlement_path = resolve_raster_path('dist_settlement')
-    if settlement_path:
-
-
-        with rasterio.open(settlement_path) as src:
-            rows, cols = rowcol(src.transform, lon_array, lat_array)
-            valid_mask = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
-            values = np.full(len(lon_array), np.nan, dtype=np.float32)
-            raster_data = src.read(1)
-            values[valid_mask] = raster_data[rows[valid_mask], cols[valid_mask]]
-            if src.nodata is not None:
-                values[values == src.nodata] = np.nan
-        gps_df['distance_to_settlement_km'] = values
-        extraction_results['distance_to_settlement'] = True
-        print(f"Distance to settlement extracted: {(~np.isnan(values)).sum()} valid values")
-    else:
-        print(f"Distance to settlement file not found: {settlement_path}")
-        if 'land_cover' in gps_df.columns:
-            urban_mask = gps_df['land_cover'] == 13
-            gps_df['distance_to_settlement_km'] = 10.0
-            gps_df.loc[urban_mask, 'distance_to_settlement_km'] = 0.5
-
-    print("7. Distance to Roads")
-    roads_path = resolve_raster_path('dist_roads')
-    if roads_path:
-
-
-        with rasterio.open(roads_path) as src:
-            rows, cols = rowcol(src.transform, lon_array, lat_array)
-            valid_mask = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
-            values = np.full(len(lon_array), np.nan, dtype=np.float32)
-            raster_data = src.read(1)
-            values[valid_mask] = raster_data[rows[valid_mask], cols[valid_mask]]
-            if src.nodata is not None:
-                values[values == src.nodata] = np.nan
-        gps_df['distance_to_roads_km'] = values
-        extraction_results['distance_to_roads'] = True
-        print(f"Distance to roads extracted: {(~np.isnan(values)).sum()} valid values")
-    else:
-        print(f"Distance to roads file not found: {roads_path}")
-        if 'ndvi' in gps_df.columns:
-            gps_df['distance_to_roads_km'] = (1 - gps_df['ndvi']) * 10
-
-    print("8. Distance to Protected Areas")
-    protected_path = resolve_raster_path('dist_protected_areas')
-    if protected_path:
-
-
-        with rasterio.open(protected_path) as src:
-            rows, cols = rowcol(src.transform, lon_array, lat_array)
-            valid_mask = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
-            values = np.full(len(lon_array), np.nan, dtype=np.float32)
-            raster_data = src.read(1)
-            values[valid_mask] = raster_data[rows[valid_mask], cols[valid_mask]]
-            if src.nodata is not None:
-                values[values == src.nodata] = np.nan
-        gps_df['distance_to_protected_areas_km'] = values
-        extraction_results['distance_to_protected_areas'] = True
-        print(f"Distance to protected areas extracted: {(~np.isnan(values)).sum()} valid values")
-    else:
-        print(f"Distance to protected areas file not found: {protected_path}")
-        if 'ndvi' in gps_df.columns:
-            gps_df['distance_to_protected_areas_km'] = (1 - gps_df['ndvi']) * 10
+    # (raster layer, output column, extraction_results key, label)
+    raster_layers = [
+        ('ndvi', 'ndvi', 'ndvi', 'NDVI'),
+        ('landcover', 'land_cover', 'land_cover', 'Land cover'),
+        ('elevation', 'elevation', 'elevation', 'Elevation'),
+        ('rainfall', 'rainfall_mm', 'rainfall', 'Rainfall'),
+        ('dist_water', 'distance_to_water_km', 'distance_to_water', 'Distance to water'),
+        ('dist_settlement', 'distance_to_settlement_km', 'distance_to_settlement', 'Distance to settlement'),
+        ('dist_roads', 'distance_to_roads_km', 'distance_to_roads', 'Distance to roads'),
+        ('dist_protected_areas', 'distance_to_protected_areas_km', 'distance_to_protected_areas', 'Distance to protected areas'),
+    ]
+
+    raster_paths = {layer: resolve_raster_path(layer) for layer, _, _, _ in raster_layers}
+    stack = RasterStack({layer: path for layer, path in raster_paths.items() if path})
+    if not stack.aligned:
+        print("Warning: raster layers are on different grids; each layer sampled with its own transform")
+    samples = stack.sample(lat_array, lon_array)
+    stack.close()
+
+    for i, (layer, column, result_key, label) in enumerate(raster_layers, start=1):
+        print(f"{i}. {label}")
+        if layer not in samples:
+            print(f"{label} file not found: {raster_paths[layer]}")
+            continue
+
+        values = samples[layer]
+        if layer == 'landcover':
+            values = np.where(np.isnan(values), -1, values).astype(np.int32)
+            n_valid = (values != -1).sum()
+        else:
+            values = values.astype(np.float32)
+            n_valid = (~np.isnan(values)).sum()
+        gps_df[column] = values
+        extraction_results[result_key] = True
+        print(f"{label} extracted: {n_valid} valid values")
+
+    # Fallbacks for missing distance layers
+    if 'distance_to_water_km' not in gps_df.columns and 'ndvi' in gps_df.columns:
+        gps_df['distance_to_water_km'] = (1 - gps_df['ndvi']) * 10
+    if 'distance_to_settlement_km' not in gps_df.columns and 'land_cover' in gps_df.columns:
+        urban_mask = gps_df['land_cover'] == 13
+        gps_df['distance_to_settlement_km'] = 10.0
+        gps_df.loc[urban_mask, 'distance_to_settlement_km'] = 0.5
+    if 'distance_to_roads_km' not in gps_df.columns and 'ndvi' in gps_df.columns:
+        gps_df['distance_to_roads_km'] = (1 - gps_df['ndvi']) * 10
+    if 'distance_to_protected_areas_km' not in gps_df.columns and 'ndvi' in gps_df.columns:
+        gps_df['distance_to_protected_areas_km'] = (1 - gps_df['ndvi']) * 10
 
     critical_vars = ['ndvi', 'land_cover', 'elevation', 'rainfall_mm']
     missing_critical = [var for var in critical_vars if not extraction_results.get(var.replace('_mm', ''), False)]
@@ -387,11 +290,6 @@ def extract_environmental_data_from_rasters(gps_df, env_data_dir):
     print(f"Successfully extracted {sum(extraction_results.values())} / 8 variables")
     return gps_df
 
-combined_data = extract_environmental_data_from_rasters(combined_data, ENV_DATA_DIR)
-if combined_data is None:
-    print("Cannot proceed without environmental data.")
-    exit(1)
-
 def add_temporal_features(df):
     print("STEP 5: ADDING TEMPORAL FEATURES")
     df['month'] = df['timestamp'].dt.month
@@ -406,8 +304,6 @@ def add_temporal_features(df):
     print(f"Date range: {df['timestamp'].min()} to {df['timestamp'].max()}")
     return df
 
-combined_data = add_temporal_features(combined_data)
-
 def calculate_movement_features_vectorized(df):
     print("STEP 6: CALCULATING MOVEMENT FEATURES")
     has_step_length = 'step_length' in df.columns and df['step_length'].notna().sum() > 0
@@ -445,8 +341,6 @@ def calculate_movement_features_vectorized(df):
     print(f"Removed {before_filter - len(df):,} outliers with unrealistic speeds")
     return df
 
-combined_data = calculate_movement_features_vectorized(combined_data)
-
 def calculate_bbmm_features_vectorized(df):
     print("STEP 7: CALCULATING BBMM FEATURES")
     sigma1 = 100
@@ -470,8 +364,6 @@ def calculate_bbmm_features_vectorized(df):
     print("BBMM features calculated")
     return df
 
-combined_data = calculate_bbmm_features_vectorized(combined_data)
-
 def create_habitat_suitability_target(df):
     print("STEP 8: CREATING HABITAT SUITABILITY TARGET (NO LEAKAGE VERSION)")
 
@@ -521,11 +413,6 @@ def create_habitat_suitability_target(df):
 
     return df, le_species, le_time_of_day
 
-combined_data, le_species, le_time_of_day = create_habitat_suitability_target(combined_data)
-if combined_data is None:
-    print("Cannot proceed without target variable.")
-    exit(1)
-
 def enhance_conflict_features(df):
     print("ENHANCING CONFLICT-SPECIFIC FEATURES (FIXED VERSION)")
 
@@ -552,8 +439,6 @@ def enhance_conflict_features(df):
 
     return df
 
-combined_data = enhance_conflict_features(combined_data)
-
 def prepare_model_data(df):
     print("\nSTEP 9: PREPARING MODEL DATA - ENVIRONMENTAL FEATURES ONLY")
 
@@ -612,8 +497,6 @@ def prepare_model_data(df):
 
     return X, y, available_features
 
-X, y, feature_columns = prepare_model_data(combined_data)
-
 def split_and_scale_data(X, y, species_data=None):
     print("\nSTEP 10: TRAIN-VAL-TEST SPLIT")
 
@@ -652,10 +535,7 @@ def split_and_scale_data(X, y, species_data=None):
 
     return X_train_scaled, X_val_scaled, X_test_scaled, y_train, y_val, y_test, scaler
 
-species_data = combined_data.loc[X.index, 'species']
-X_train_scaled, X_val_scaled, X_test_scaled, y_train, y_val, y_test, scaler = split_and_scale_data(X, y, species_data)
-
-def perform_cross_validation(X, y, n_folds=5):
+def perform_cross_validation(X, y, n_folds=5, workers=1):
     print("STEP 11: CROSS-VALIDATION")
     print(f"Performing {n_folds}-fold cross-validation...")
     class_counts = y.value_counts()
@@ -664,12 +544,16 @@ def perform_cross_validation(X, y, n_folds=5):
     else:
         scale_pos_weight_value = 1.0
 
-    temp_model = xgb.XGBClassifier(n_estimators=100, max_depth=6, learning_rate=0.05, subsample=0.8, colsample_bytree=0.8, scale_pos_weight=scale_pos_weight_value, random_state=42, n_jobs=-1, eval_metric='logloss')
+    # Folds run in `workers` processes and share the CPU threads between them
+    fold_workers = max(1, min(workers, n_folds))
+    threads = max(1, (os.cpu_count() or 1) // fold_workers)
+    temp_model = xgb.XGBClassifier(n_estimators=100, max_depth=6, learning_rate=0.05, subsample=0.8, colsample_bytree=0.8, scale_pos_weight=scale_pos_weight_value, random_state=42, n_jobs=threads, eval_metric='logloss')
     cv = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=42)
-    cv_accuracy = cross_val_score(temp_model, X, y, cv=cv, scoring='accuracy', n_jobs=-1)
-    cv_precision = cross_val_score(temp_model, X, y, cv=cv, scoring='precision', n_jobs=-1)
-    cv_recall = cross_val_score(temp_model, X, y, cv=cv, scoring='recall', n_jobs=-1)
-    cv_f1 = cross_val_score(temp_model, X, y, cv=cv, scoring='f1', n_jobs=-1)
+    scores = cross_validate(temp_model, X, y, cv=cv, scoring=['accuracy', 'precision', 'recall', 'f1'], n_jobs=fold_workers)
+    cv_accuracy = scores['test_accuracy']
+    cv_precision = scores['test_precision']
+    cv_recall = scores['test_recall']
+    cv_f1 = scores['test_f1']
 
     cv_results = {
         'accuracy_mean': cv_accuracy.mean(),
@@ -690,11 +574,143 @@ def perform_cross_validation(X, y, n_folds=5):
 
     return cv_results
 
-cv_results = perform_cross_validation(X_train_scaled, y_train)
+def build_search_space(n_configs=XGB_SEARCH_CONFIGS, seed=42):
+    """
+    Distinct configurations sampled from XGB_SEARCH_SPACE
+
+    The first configuration is the hand-tuned XGB_BASE_PARAMS, so the search
+    never does worse on validation than the fixed parameters it replaces.
+    """
+    rng = np.random.default_rng(seed)
+    configs = [{key: XGB_BASE_PARAMS[key] for key in XGB_SEARCH_SPACE}]
+    seen = {tuple(configs[0].items())}
+    n_possible = int(np.prod([len(values) for values in XGB_SEARCH_SPACE.values()]))
+    while len(configs) < min(n_configs, n_possible):
+        candidate = {key: values[rng.integers(len(values))] for key, values in XGB_SEARCH_SPACE.items()}
+        if tuple(candidate.items()) not in seen:
+            seen.add(tuple(candidate.items()))
+            configs.append(candidate)
+    return configs
+
+def _search_fold_task(key, arrays, configs, n_estimators, threads):
+    """Fit one configuration on one species' training folds, early-stopped on the held-out fold"""
+    species_code, config_index, fold = key
+    in_species = arrays['species'] == species_code
+    train = in_species & (arrays['fold'] != fold)
+    val = in_species & (arrays['fold'] == fold)
+    X, y = arrays['X'], arrays['y']
+
+    positives = int(y[train].sum())
+    negatives = int(train.sum()) - positives
+    params = dict(XGB_BASE_PARAMS, **configs[config_index])
+    params.update(
+        n_estimators=n_estimators, n_jobs=threads, early_stopping_rounds=XGB_EARLY_STOPPING_ROUNDS,
+        scale_pos_weight=negatives / positives if positives else 1.0
+    )
+
+    model = xgb.XGBClassifier(**params)
+    model.fit(X[train], y[train], eval_set=[(X[val], y[val])], verbose=False)
+    y_proba = model.predict_proba(X[val])[:, 1]
+    auc = roc_auc_score(y[val], y_proba) if len(np.unique(y[val])) == 2 else np.nan
+    return {'logloss': float(model.best_score), 'auc': float(auc), 'best_iteration': int(model.best_iteration)}
+
+def search_species_hyperparameters(X_train, y_train, species_data, configs=None, n_folds=5,
+                                   budgets=XGB_SEARCH_BUDGETS, keep=XGB_SEARCH_KEEP, workers=1):
+    """
+    Successive-halving hyperparameter search for each species' model
+
+    Every rung fits the surviving configurations on all cross-validation folds
+    of all species at once, in `workers` processes that split the CPU threads
+    between them. Each fit early-stops on its held-out fold. After a rung only
+    the best 1/keep configurations of each species (by mean validation log loss)
+    go on to the next, larger tree budget.
+
+    Parameters:
+    X_train: scaled training features
+    y_train: training labels
+    species_data: species of every row (indexed like the full feature table)
+    configs: list of parameter dicts to search (build_search_space() if None)
+    n_folds: cross-validation folds per species
+    budgets: maximum trees of each rung
+    keep: divisor applied to the number of configurations after each rung
+    workers: worker processes
+
+    Returns:
+    tuple of (dict species -> best configuration, leaderboard DataFrame)
+    """
+    print("STEP 11B: HYPERPARAMETER SEARCH")
+    configs = configs or build_search_space()
+
+    y_values = y_train.to_numpy().astype(np.int64)
+    codes, names = pd.factorize(species_data.loc[X_train.index].to_numpy())
+    fold = np.full(len(y_values), -1, dtype=np.int64)
+
+    active = []
+    for code, name in enumerate(names):
+        rows = np.flatnonzero(codes == code)
+        class_counts = np.bincount(y_values[rows], minlength=2)
+        if len(rows) < 100 or class_counts.min() < n_folds:
+            print(f"Skipping {name}: not enough samples of both classes for {n_folds}-fold search")
+            continue
+        cv = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=42)
+        for k, (_, val_rows) in enumerate(cv.split(rows, y_values[rows])):
+            fold[rows[val_rows]] = k
+        active.append(code)
+
+    if not active:
+        return {}, pd.DataFrame()
+
+    arrays = {'X': X_train.to_numpy(dtype=np.float32), 'y': y_values, 'species': codes, 'fold': fold}
+    threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+    candidates = {code: list(range(len(configs))) for code in active}
+    rows = []
+
+    for rung, n_estimators in enumerate(budgets):
+        keys = [(code, index, k) for code in active for index in candidates[code] for k in range(n_folds)]
+        print(f"Rung {rung + 1}/{len(budgets)}: {len(keys) // n_folds} species configurations x {n_folds} folds, "
+              f"up to {n_estimators} trees ({workers} workers x {threads} threads)")
+        results = map_tasks(_search_fold_task, arrays, keys, args=(configs, n_estimators, threads), workers=workers)
+
+        fold_results = {}
+        for (code, index, _), result in results:
+            fold_results.setdefault((code, index), []).append(result)
+
+        mean_logloss = {}
+        for (code, index), scores in fold_results.items():
+            logloss = np.array([score['logloss'] for score in scores])
+            auc = np.array([score['auc'] for score in scores])
+            mean_logloss[(code, index)] = logloss.mean()
+            rows.append({
+                'species': names[code], 'config': index, 'rung': rung, 'n_estimators': n_estimators,
+                'logloss_mean': logloss.mean(), 'logloss_std': logloss.std(),
+                'auc_mean': np.nanmean(auc) if not np.isnan(auc).all() else np.nan,
+                'best_iteration_mean': np.mean([score['best_iteration'] for score in scores]),
+                **configs[index]
+            })
+
+        if rung < len(budgets) - 1:
+            for code in active:
+                ranked = sorted(candidates[code], key=lambda index: mean_logloss[(code, index)])
+                candidates[code] = ranked[:max(1, -(-len(ranked) // keep))]
+
+    leaderboard = pd.DataFrame(rows).sort_values(
+        ['species', 'rung', 'logloss_mean'], ascending=[True, False, True]
+    ).reset_index(drop=True)
+
+    best_configs = {}
+    for species, species_rows in leaderboard.groupby('species', sort=False):
+        best = species_rows.iloc[0]
+        best_configs[species] = configs[int(best['config'])]
+        print(f"{species.capitalize()}: best configuration {int(best['config'])} "
+              f"(log loss {best['logloss_mean']:.4f}, AUC {best['auc_mean']:.4f}, ~{best['best_iteration_mean']:.0f} trees)")
+
+    return best_configs, leaderboard
 
 def train_species_specific_models(X_train_scaled, X_val_scaled, X_test_scaled,
-                                  y_train, y_val, y_test, species_data, scaler):
+                                  y_train, y_val, y_test, species_data, scaler, species_params=None):
+    """species_params maps a species to the configuration found by search_species_hyperparameters"""
     print("\nSTEP 12: TRAINING HABITAT SUITABILITY MODELS")
+    species_params = species_params or {}
     models = {}
     results = {}
 
@@ -724,22 +740,12 @@ def train_species_specific_models(X_train_scaled, X_val_scaled, X_test_scaled,
         scale_pos_weight = counts[0] / counts[1]
         print(f"scale_pos_weight: {scale_pos_weight:.3f}")
 
-        params = {
-            'n_estimators': 200,
-            'max_depth': 4,
-            'learning_rate': 0.05,
-            'subsample': 0.7,
-            'colsample_bytree': 0.7,
-            'min_child_weight': 10,
-            'gamma': 0.3,
-            'reg_alpha': 0.5,
-            'reg_lambda': 2.0,
-            'scale_pos_weight': scale_pos_weight,
-            'random_state': 42,
-            'n_jobs': -1,
-            'eval_metric': 'logloss',
-            'early_stopping_rounds': 20,
-        }
+        params = dict(XGB_BASE_PARAMS, scale_pos_weight=scale_pos_weight, n_jobs=-1,
+                      early_stopping_rounds=XGB_EARLY_STOPPING_ROUNDS)
+        if species in species_params:
+            # Early stopping on the validation set picks the tree count within the largest search budget
+            params.update(species_params[species], n_estimators=max(XGB_SEARCH_BUDGETS))
+            print(f"Using searched parameters: {species_params[species]}")
 
         model = xgb.XGBClassifier(**params)
 
@@ -786,8 +792,6 @@ def train_species_specific_models(X_train_scaled, X_val_scaled, X_test_scaled,
 
     return models, results
 
-species_models, species_results = train_species_specific_models(X_train_scaled, X_val_scaled, X_test_scaled, y_train, y_val, y_test, species_data, scaler)
-
 def evaluate_species_models(species_models, species_results, X_test_scaled, y_test, species_data):
     print("\nSTEP 13: EVALUATION")
     overall_metrics = {}
@@ -831,9 +835,6 @@ def evaluate_species_models(species_models, species_results, X_test_scaled, y_te
 
     return overall_metrics
 
-print("Evaluating species-specific models...")
-overall_metrics = evaluate_species_models(species_models, species_results, X_test_scaled, y_test, species_data)
-
 def analyze_species_habitat_preferences(species_models, species_results, feature_columns):
     print("STEP 14: SPECIES HABITAT PREFERENCE ANALYSIS")
     species_preferences = {}
@@ -888,8 +889,6 @@ def analyze_species_habitat_preferences(species_models, species_results, feature
 
     return species_preferences
 
-species_preferences = analyze_species_habitat_preferences(species_models, species_results, feature_columns)
-
 def create_species_feature_importance_plots(species_preferences, output_dir):
     print("STEP 15: SPECIES-SPECIFIC FEATURE IMPORTANCE VISUALIZATION")
     fig, axes = plt.subplots(1, len(species_preferences), figsize=(6*len(species_preferences), 8))
@@ -973,8 +972,6 @@ def create_species_feature_importance_plots(species_preferences, output_dir):
 
     print("Feature importance analysis complete!")
 
-create_species_feature_importance_plots(species_preferences, output_dir)
-
 def generate_conservation_insights(species_preferences, overall_metrics):
     print("STEP 16: CONSERVATION INSIGHTS AND RECOMMENDATIONS")
     print("KEY CONSERVATION INSIGHTS")
@@ -1040,9 +1037,7 @@ def generate_conservation_insights(species_preferences, overall_metrics):
 
     print("Conservation insight generation complete!")
 
-generate_conservation_insights(species_preferences, overall_metrics)
-
-def save_species_models_and_results(species_models, species_results, overall_metrics, species_preferences, combined_data, feature_columns, cv_results, output_dir):
+def save_species_models_and_results(species_models, species_results, overall_metrics, species_preferences, combined_data, feature_columns, cv_results, output_dir, species_data, X_test_scaled, y_test, le_species, le_time_of_day):
     print("STEP 17: SAVING SPECIES-SPECIFIC MODELS AND RESULTS")
     for species, result in species_results.items():
         print(f"Saving {species} model...")
@@ -1206,7 +1201,162 @@ TOP FEATURES BY SPECIES:
     print("4. Human-wildlife conflict mitigation")
     print("RESTRICTED to Kenya-Tanzania wildlife corridors only.")
 
-save_species_models_and_results(species_models, species_results, overall_metrics, species_preferences, combined_data, feature_columns, cv_results, output_dir)
+def save_search_leaderboard(leaderboard, species_params, output_dir):
+    """Write the hyperparameter search leaderboard and the chosen configuration of each species"""
+    if leaderboard is None or len(leaderboard) == 0:
+        return
+    leaderboard.to_csv(f'{output_dir}/evaluations/xgboost_search_leaderboard.csv', index=False)
+    with open(f'{output_dir}/models/xgboost_search_best_params.json', 'w') as f:
+        json.dump({
+            'created': datetime.now().isoformat(),
+            'budgets': list(XGB_SEARCH_BUDGETS),
+            'keep': XGB_SEARCH_KEEP,
+            'early_stopping_rounds': XGB_EARLY_STOPPING_ROUNDS,
+            'species': species_params,
+        }, f, indent=4)
+    print(f"Search leaderboard saved to {output_dir}/evaluations/xgboost_search_leaderboard.csv")
+
+def load_search_best_params(output_dir):
+    """Configurations chosen by the previous search (save_search_leaderboard), or None if there is none"""
+    path = f'{output_dir}/models/xgboost_search_best_params.json'
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        saved = json.load(f)
+    print(f"Reusing the search results of {saved.get('created', 'an earlier run')} from {path}")
+    return saved.get('species', {})
+
+"""Pipeline stages"""
+
+def stage_load(state, config):
+    elephant_data, wildebeest_data = load_bbmm_results(
+        ELEPHANT_BBMM_FILE, WILDEBEEST_BBMM_FILE, cache_dir=config.get('dataset_cache', DEFAULT_DATASET_DIR)
+    )
+
+    if elephant_data is None or wildebeest_data is None:
+        raise PipelineError("Cannot proceed without BBMM data.")
+
+    print("STEP 2: GEOGRAPHIC VALIDATION")
+    elephant_data, n_invalid_elephant, error_elephant = validate_geographic_bounds(elephant_data, KENYA_TANZANIA_BBOX)
+    if elephant_data is None or len(elephant_data) == 0:
+        raise PipelineError("FATAL ERROR: No valid elephant GPS data")
+
+    wildebeest_data, n_invalid_wildebeest, error_wildebeest = validate_geographic_bounds(wildebeest_data, KENYA_TANZANIA_BBOX)
+    if wildebeest_data is None or len(wildebeest_data) == 0:
+        raise PipelineError("FATAL ERROR: No valid wildebeest GPS data")
+
+    if n_invalid_elephant > 0 or n_invalid_wildebeest > 0:
+        print(f"GEOGRAPHIC FILTERING APPLIED:")
+        print(f"Elephant: Removed {n_invalid_elephant:,} points")
+        print(f"Wildebeest: Removed {n_invalid_wildebeest:,} points")
+        print(f"Total removed: {n_invalid_elephant + n_invalid_wildebeest:,} points")
+        print(f"Remaining data: {len(elephant_data) + len(wildebeest_data):,} points")
+
+    print("STEP 3: COMBINING SPECIES DATA")
+    combined_data = pd.concat([elephant_data, wildebeest_data], ignore_index=True)
+    print(f"Combined data shape: {combined_data.shape}")
+    print(f"Elephant records: {len(combined_data[combined_data['species'] == 'elephant']):,}")
+    print(f"Wildebeest records: {len(combined_data[combined_data['species'] == 'wildebeest']):,}")
+    state['combined_data'] = combined_data
+
+def stage_features(state, config):
+    combined_data = extract_environmental_data_from_rasters(state['combined_data'], ENV_DATA_DIR)
+    if combined_data is None:
+        raise PipelineError("Cannot proceed without environmental data.")
+
+    combined_data = add_temporal_features(combined_data)
+    combined_data = calculate_movement_features_vectorized(combined_data)
+    combined_data = calculate_bbmm_features_vectorized(combined_data)
+
+    combined_data, le_species, le_time_of_day = create_habitat_suitability_target(combined_data)
+    if combined_data is None:
+        raise PipelineError("Cannot proceed without target variable.")
+
+    state['combined_data'] = enhance_conflict_features(combined_data)
+    state['le_species'] = le_species
+    state['le_time_of_day'] = le_time_of_day
+
+def stage_split(state, config):
+    combined_data = state['combined_data']
+    X, y, feature_columns = prepare_model_data(combined_data)
+
+    species_data = combined_data.loc[X.index, 'species']
+    X_train_scaled, X_val_scaled, X_test_scaled, y_train, y_val, y_test, scaler = split_and_scale_data(X, y, species_data)
+
+    state.update({
+        'feature_columns': feature_columns,
+        'species_data': species_data,
+        'X_train_scaled': X_train_scaled,
+        'X_val_scaled': X_val_scaled,
+        'X_test_scaled': X_test_scaled,
+        'y_train': y_train,
+        'y_val': y_val,
+        'y_test': y_test,
+        'scaler': scaler
+    })
+
+def stage_train(state, config):
+    workers = config.get('workers', 1)
+    state['cv_results'] = perform_cross_validation(state['X_train_scaled'], state['y_train'], workers=workers)
+
+    # search: 'run' the hyperparameter search, 'skip' it (XGB_BASE_PARAMS), or
+    # 'reuse' the configurations saved by the previous run
+    search = config.get('search', 'run')
+    species_params = load_search_best_params(output_dir) if search == 'reuse' else None
+    if search == 'reuse' and species_params is None:
+        print("No saved search results to reuse; running the search")
+    if search == 'skip':
+        print("Skipping the hyperparameter search; training with the base parameters")
+        state['species_params'], state['search_leaderboard'] = {}, None
+    elif species_params is not None:
+        state['species_params'], state['search_leaderboard'] = species_params, None
+    else:
+        state['species_params'], state['search_leaderboard'] = search_species_hyperparameters(
+            state['X_train_scaled'], state['y_train'], state['species_data'], workers=workers
+        )
+
+    state['species_models'], state['species_results'] = train_species_specific_models(
+        state['X_train_scaled'], state['X_val_scaled'], state['X_test_scaled'],
+        state['y_train'], state['y_val'], state['y_test'], state['species_data'], state['scaler'],
+        species_params=state['species_params']
+    )
+
+def stage_evaluate(state, config):
+    print("Evaluating species-specific models...")
+    state['overall_metrics'] = evaluate_species_models(
+        state['species_models'], state['species_results'], state['X_test_scaled'], state['y_test'], state['species_data']
+    )
 
+    state['species_preferences'] = analyze_species_habitat_preferences(
+        state['species_models'], state['species_results'], state['feature_columns']
+    )
+
+    if config.get('plots', True):
+        create_species_feature_importance_plots(state['species_preferences'], output_dir)
 
+    generate_conservation_insights(state['species_preferences'], state['overall_metrics'])
 
+def stage_save(state, config):
+    save_species_models_and_results(
+        state['species_models'], state['species_results'], state['overall_metrics'], state['species_preferences'],
+        state['combined_data'], state['feature_columns'], state['cv_results'], output_dir,
+        state['species_data'], state['X_test_scaled'], state['y_test'], state['le_species'], state['le_time_of_day']
+    )
+    save_search_leaderboard(state.get('search_leaderboard'), state.get('species_params', {}), output_dir)
+
+PIPELINE_STAGES = [
+    ('load', stage_load),
+    ('features', stage_features),
+    ('split', stage_split),
+    ('train', stage_train),
+    ('evaluate', stage_evaluate),
+    ('save', stage_save),
+]
+
+if __name__ == '__main__':
+    import sys
+    try:
+        from .pipeline import run_cli
+    except ImportError:
+        from pipeline import run_cli
+    run_cli(sys.modules[__name__], 'xgboost')
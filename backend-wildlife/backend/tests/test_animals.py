@@ -238,3 +238,97 @@ class TestAnimalPermissions:
         response = admin_client.post(url, data)
         assert response.status_code == status.HTTP_201_CREATED
 
+
+
+@pytest.fixture
+def keras_lstm():
+    tf = pytest.importorskip('tensorflow')
+    
+    tf.keras.utils.set_random_seed(0)
+    inputs = tf.keras.Input(shape=(10, 3))
+    x = tf.keras.layers.LSTM(16, return_sequences=True)(inputs)
+    x = tf.keras.layers.Dropout(0.3)(x)
+    x = tf.keras.layers.LSTM(8)(x)
+    x = tf.keras.layers.Dense(8, activation='relu')(x)
+    outputs = tf.keras.layers.Dense(3)(x)
+    return tf.keras.Model(inputs, outputs)
+
+@pytest.mark.unit
+class TestLSTMRuntime:
+    def test_exported_model_matches_keras(self, keras_lstm, tmp_path):
+        import numpy as np
+        from ml_service.core.lstm_runtime import NumpyLSTMModel, export_lstm_model, load_lstm_model
+        
+        X = np.random.default_rng(0).normal(size=(64, 10, 3)).astype(np.float32)
+        expected = keras_lstm.predict(X, verbose=0)
+        
+        keras_lstm.save(tmp_path / 'model.h5')
+        from_h5 = NumpyLSTMModel.from_h5(tmp_path / 'model.h5')
+        export_lstm_model(keras_lstm, tmp_path / 'model.npz')
+        exported = load_lstm_model(tmp_path / 'model.h5')
+        
+        assert isinstance(exported, NumpyLSTMModel)
+        assert exported.input_shape == (None, 10, 3)
+        assert np.allclose(from_h5.predict(X), expected, atol=1e-5)
+        assert np.allclose(exported.predict(X, verbose=0), expected, atol=1e-5)
+        assert np.allclose(exported.to_keras().predict(X, verbose=0), expected, atol=1e-5)
+    
+    def test_movement_predictor_prefers_export(self, keras_lstm, tmp_path, monkeypatch):
+        import pickle
+        import numpy as np
+        import pandas as pd
+        from sklearn.preprocessing import StandardScaler
+        from apps.animals import movement_predictor
+        from ml_service.core.lstm_runtime import NumpyLSTMModel, export_lstm_model
+        
+        (tmp_path / 'lstm').mkdir()
+        export_lstm_model(keras_lstm, tmp_path / 'lstm' / 'elephant_lstm.npz')
+        rng = np.random.default_rng(1)
+        scalers = {
+            'x': StandardScaler().fit(rng.normal(size=(50, 30))),
+            'y': StandardScaler().fit(rng.normal(size=(50, 3)))
+        }
+        for name, scaler in scalers.items():
+            with open(tmp_path / 'lstm' / f'elephant_lstm_scaler_{name}.pkl', 'wb') as f:
+                pickle.dump(scaler, f)
+        monkeypatch.setattr(movement_predictor, 'DATA_DIR', tmp_path)
+        
+        predictor = movement_predictor.MovementPredictor()
+        history = pd.DataFrame({
+            'lat': -2.0 + 0.001 * np.arange(12), 'lon': 34.0 + 0.001 * np.arange(12), 'speed_kmh': np.full(12, 3.0)
+        })
+        lat, lon = predictor.predict_with_lstm(-1.989, 34.011, history, 'elephant')
+        
+        window = scalers['x'].transform(history[['lat', 'lon', 'speed_kmh']].values[-10:].reshape(1, -1)).reshape(1, 10, 3)
+        expected = scalers['y'].inverse_transform(keras_lstm.predict(window, verbose=0))[0]
+        
+        assert isinstance(predictor.lstm_models['elephant']['model'], NumpyLSTMModel)
+        assert np.allclose([lat, lon], expected[:2], atol=1e-4)
+    
+    def test_stale_export_is_rebuilt_from_h5(self, keras_lstm, tmp_path, monkeypatch):
+        import os
+        import numpy as np
+        from ml_service.core.lstm_runtime import NumpyLSTMModel, export_lstm_model, load_lstm_model
+        
+        X = np.random.default_rng(2).normal(size=(16, 10, 3)).astype(np.float32)
+        export_lstm_model(keras_lstm, tmp_path / 'model.npz')
+        old_prediction = keras_lstm.predict(X, verbose=0)
+        
+        # Retrained weights written to the .h5 after the export
+        keras_lstm.set_weights([w + 0.1 for w in keras_lstm.get_weights()])
+        keras_lstm.save(tmp_path / 'model.h5')
+        exported_at = (tmp_path / 'model.npz').stat().st_mtime_ns
+        os.utime(tmp_path / 'model.h5', ns=(exported_at + 10**9, exported_at + 10**9))
+        expected = keras_lstm.predict(X, verbose=0)
+        
+        model = load_lstm_model(tmp_path / 'model.h5')
+        
+        assert not np.allclose(expected, old_prediction, atol=1e-3)
+        assert np.allclose(model.predict(X), expected, atol=1e-5)
+        assert np.allclose(NumpyLSTMModel.load(tmp_path / 'model.npz').predict(X), expected, atol=1e-5)
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['model.h5', 'model.npz']
+        
+        # The re-export records the .h5 it came from, so it is used from now on
+        # even though it is older than the (future-dated) .h5
+        monkeypatch.setattr(NumpyLSTMModel, 'from_h5', None)
+        assert np.allclose(load_lstm_model(tmp_path / 'model.h5').predict(X), expected, atol=1e-5)
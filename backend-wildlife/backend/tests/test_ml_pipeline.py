@@ -0,0 +1,942 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+pytestmark = [pytest.mark.ml, pytest.mark.unit]
+
+
+def track_frame(seed=0):
+    """GPS fixes of three individuals, interleaved and out of time order"""
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(['E2', 'E1', 'W7'], 60)
+    return pd.DataFrame({
+        'individual_id': ids,
+        'timestamp': pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.permutation(60), unit='h'),
+        'lat': rng.uniform(-4, -2, 60),
+        'lon': rng.uniform(34, 36, 60),
+    }, index=rng.permutation(60) + 100)
+
+
+def track_summary(key, arrays, scale):
+    """Per-individual result built from the array slices (module level, so workers can run it)"""
+    return {
+        'n': len(arrays['lat']),
+        'mean': float(arrays['lat'].mean()) * scale,
+        'first_time': arrays['time'][0].copy(),
+        'steps': np.diff(arrays['lon']).copy(),
+    }
+
+
+class TestParallelUtils:
+    def test_group_individuals(self):
+        from ml_service.models.parallel_utils import group_individuals
+
+        df = track_frame()
+        sorted_df, groups = group_individuals(df)
+
+        first_seen = list(dict.fromkeys(df['individual_id']))
+        assert [key for key, _, _ in groups] == first_seen
+        assert sorted_df.index.tolist() == list(range(len(df)))
+        for key, start, stop in groups:
+            part = sorted_df.iloc[start:stop]
+            assert (part['individual_id'] == key).all()
+            assert part['timestamp'].is_monotonic_increasing
+            assert stop - start == (df['individual_id'] == key).sum()
+        assert groups[-1][2] == len(df)
+
+    def test_contiguous_groups(self):
+        from ml_service.models.parallel_utils import contiguous_groups
+
+        ids = pd.Series(['a', 'a', 'b', 'a', 'a', 'c'], index=[5, 3, 9, 1, 0, 2])
+
+        assert contiguous_groups(ids) == [('a', 0, 2), ('b', 2, 3), ('a', 3, 5), ('c', 5, 6)]
+        assert contiguous_groups([]) == []
+
+    def test_missing_ids(self):
+        from ml_service.models.parallel_utils import contiguous_groups, group_individuals
+
+        groups = contiguous_groups(['a', np.nan, None, 'b', np.nan])
+        assert [(start, stop) for _, start, stop in groups] == [(0, 1), (1, 3), (3, 4), (4, 5)]
+        assert [key for key, _, _ in groups][::2] == ['a', 'b']
+        assert all(pd.isna(key) for key, _, _ in groups[1::2])
+
+        df = track_frame()
+        df.loc[df.index[::5], 'individual_id'] = np.nan
+        sorted_df, groups = group_individuals(df)
+
+        assert len(sorted_df) == df['individual_id'].notna().sum()
+        assert [key for key, _, _ in groups] == list(df['individual_id'].dropna().unique())
+        for key, start, stop in groups:
+            assert stop - start == (df['individual_id'] == key).sum()
+
+    def test_workers_match_single_process(self):
+        from ml_service.models.parallel_utils import group_individuals, map_individuals
+
+        sorted_df, groups = group_individuals(track_frame())
+        arrays = {
+            'lat': sorted_df['lat'].to_numpy(),
+            'lon': sorted_df['lon'].to_numpy(),
+            'time': sorted_df['timestamp'].to_numpy(),
+        }
+
+        serial = map_individuals(track_summary, arrays, groups, args=(2.0,), workers=1)
+        parallel = map_individuals(track_summary, arrays, groups, args=(2.0,), workers=2)
+
+        assert [key for key, _ in parallel] == [key for key, _, _ in groups]
+        for (key, expected), (_, result) in zip(serial, parallel):
+            assert result['n'] == expected['n']
+            assert result['mean'] == expected['mean']
+            assert result['first_time'] == expected['first_time']
+            np.testing.assert_array_equal(result['steps'], expected['steps'])
+
+    def test_map_tasks_sees_full_arrays(self):
+        from ml_service.models.parallel_utils import map_tasks
+
+        arrays = {'lat': np.linspace(-4, -2, 10), 'lon': np.linspace(34, 36, 10),
+                  'time': np.arange(10).astype('datetime64[h]')}
+
+        results = map_tasks(track_summary, arrays, ['x', 'y', 'z'], args=(1.0,), workers=2)
+
+        assert [key for key, _ in results] == ['x', 'y', 'z']
+        assert all(result['n'] == 10 for _, result in results)
+
+
+@pytest.fixture
+def toy_pipeline():
+    """Pipeline module with three stages that record their runs"""
+    import types
+
+    module = types.ModuleType('toy_pipeline')
+    module.runs = []
+    module.configs = []
+
+    def make_stage(name):
+        def stage(state, config):
+            module.runs.append(name)
+            state.setdefault('trail', []).append(name)
+            state[name] = len(state['trail'])
+        return stage
+
+    module.setup_pipeline = module.configs.append
+    module.PIPELINE_STAGES = [(name, make_stage(name)) for name in ('load', 'fit', 'report')]
+    return module
+
+
+class TestPipelineRunner:
+    def cache_files(self, cache_dir):
+        return sorted(p.name for p in (cache_dir / 'toy').iterdir())
+
+    def test_full_run_caches_every_stage(self, toy_pipeline, tmp_path):
+        from ml_service.models.pipeline import run_pipeline, load_stage_cache
+
+        state = run_pipeline(toy_pipeline, 'toy', config={'workers': 2}, cache_dir=str(tmp_path))
+
+        assert toy_pipeline.runs == ['load', 'fit', 'report']
+        assert toy_pipeline.configs == [{'workers': 2}]
+        assert state['trail'] == ['load', 'fit', 'report']
+        assert set(state['stage_timings']) == {'load', 'fit', 'report'}
+        assert self.cache_files(tmp_path) == ['00_load.pkl', '01_fit.pkl', '02_report.pkl']
+        assert load_stage_cache(tmp_path / 'toy' / '01_fit.pkl')['trail'] == ['load', 'fit']
+
+    def test_single_stage_starts_from_the_previous_cache(self, toy_pipeline, tmp_path):
+        from ml_service.models.pipeline import run_pipeline
+
+        run_pipeline(toy_pipeline, 'toy', cache_dir=str(tmp_path))
+        toy_pipeline.runs.clear()
+
+        state = run_pipeline(toy_pipeline, 'toy', stages=['fit'], cache_dir=str(tmp_path))
+
+        assert toy_pipeline.runs == ['fit']
+        assert state['trail'] == ['load', 'fit']
+        # The report cache was built from the old fit output
+        assert self.cache_files(tmp_path) == ['00_load.pkl', '01_fit.pkl']
+
+    def test_from_stage_runs_to_the_end(self, toy_pipeline, tmp_path):
+        from ml_service.models.pipeline import run_pipeline
+
+        run_pipeline(toy_pipeline, 'toy', cache_dir=str(tmp_path))
+        toy_pipeline.runs.clear()
+
+        state = run_pipeline(toy_pipeline, 'toy', from_stage='fit', cache_dir=str(tmp_path))
+
+        assert toy_pipeline.runs == ['fit', 'report']
+        assert state['trail'] == ['load', 'fit', 'report']
+
+    def test_resume_skips_cached_stages(self, toy_pipeline, tmp_path):
+        from ml_service.models.pipeline import run_pipeline
+
+        run_pipeline(toy_pipeline, 'toy', stages=['load'], cache_dir=str(tmp_path))
+        toy_pipeline.runs.clear()
+
+        state = run_pipeline(toy_pipeline, 'toy', resume=True, cache_dir=str(tmp_path))
+        assert toy_pipeline.runs == ['fit', 'report']
+        assert state['trail'] == ['load', 'fit', 'report']
+
+        toy_pipeline.runs.clear()
+        state = run_pipeline(toy_pipeline, 'toy', resume=True, cache_dir=str(tmp_path))
+        assert toy_pipeline.runs == []
+        assert state['trail'] == ['load', 'fit', 'report']
+
+    def test_missing_cache_and_unknown_stage(self, toy_pipeline, tmp_path):
+        from ml_service.models.pipeline import run_pipeline, PipelineError
+
+        with pytest.raises(PipelineError, match="No cached output for stage 'load'"):
+            run_pipeline(toy_pipeline, 'toy', stages=['fit'], cache_dir=str(tmp_path))
+        with pytest.raises(PipelineError, match='Unknown stage'):
+            run_pipeline(toy_pipeline, 'toy', from_stage='predict', cache_dir=str(tmp_path))
+        assert toy_pipeline.runs == []
+
+    def test_no_cache_writes_nothing(self, toy_pipeline, tmp_path):
+        from ml_service.models.pipeline import run_pipeline
+
+        run_pipeline(toy_pipeline, 'toy', cache_dir=str(tmp_path), use_cache=False)
+
+        assert not (tmp_path / 'toy').exists()
+
+    def test_cli_options(self, toy_pipeline, tmp_path):
+        from ml_service.models.pipeline import run_cli
+
+        cache = ['--cache-dir', str(tmp_path), '--no-dataset-cache', '--workers', '3']
+        run_cli(toy_pipeline, 'toy', cache + ['--no-plots'])
+        toy_pipeline.runs.clear()
+        assert toy_pipeline.configs[-1]['search'] == 'run'
+        state = run_cli(toy_pipeline, 'toy', cache + ['--stage', 'fit', '--stage', 'report', '--search', 'reuse'])
+
+        assert toy_pipeline.runs == ['fit', 'report']
+        assert state['trail'] == ['load', 'fit', 'report']
+        assert toy_pipeline.configs[-1] == {'workers': 3, 'plots': True, 'dataset_cache': None, 'search': 'reuse'}
+        assert self.cache_files(tmp_path) == ['00_load.pkl', '01_fit.pkl', '02_report.pkl']
+
+        with pytest.raises(SystemExit):
+            run_cli(toy_pipeline, 'toy', cache + ['--from-stage', 'predict'])
+
+
+def replay_samples(start, stop):
+    """Windows of shape (2, 3) and targets of shape (2,) whose values are the sample number"""
+    ids = np.arange(start, stop, dtype=np.float32)
+    return np.repeat(ids, 6).reshape(-1, 2, 3), np.repeat(ids, 2).reshape(-1, 2)
+
+
+class TestReplayBuffer:
+    def test_ring_overwrites_oldest_first(self):
+        from ml_service.models.replay_buffer import ReplayBuffer
+
+        buffer = ReplayBuffer(capacity=5, seed=0)
+        buffer.add(*replay_samples(0, 3))
+        buffer.add(*replay_samples(3, 7))
+
+        assert len(buffer) == 5
+        assert buffer.position == 2
+        snapshot = buffer.snapshot()
+        assert snapshot['X'][:, 0, 0].tolist() == [2, 3, 4, 5, 6]
+        assert snapshot['y'][:, 0].tolist() == [2, 3, 4, 5, 6]
+
+        restored = ReplayBuffer(capacity=5)
+        restored.restore(snapshot)
+        assert restored.snapshot()['X'][:, 0, 0].tolist() == [2, 3, 4, 5, 6]
+        restored.add(*replay_samples(7, 8))
+        assert restored.snapshot()['X'][:, 0, 0].tolist() == [3, 4, 5, 6, 7]
+
+    def test_oversized_add_keeps_the_newest(self):
+        from ml_service.models.replay_buffer import ReplayBuffer
+
+        buffer = ReplayBuffer(capacity=4, seed=0)
+        buffer.add(*replay_samples(0, 1))
+        buffer.add(*replay_samples(1, 11), priorities=np.arange(1, 11))
+
+        snapshot = buffer.snapshot()
+        assert len(buffer) == 4
+        assert snapshot['X'][:, 0, 0].tolist() == [7, 8, 9, 10]
+        assert snapshot['priorities'].tolist() == [7, 8, 9, 10]
+        assert buffer.max_priority == 10
+
+    def test_mmap_load_writes_new_samples_to_disk(self, tmp_path):
+        from ml_service.models.replay_buffer import ReplayBuffer
+
+        buffer = ReplayBuffer(capacity=6, seed=0)
+        buffer.add(*replay_samples(0, 4))
+        buffer.save(str(tmp_path))
+
+        loaded = ReplayBuffer.load(str(tmp_path), mmap=True)
+        assert isinstance(loaded.X, np.memmap)
+        assert loaded.snapshot()['X'][:, 0, 0].tolist() == [0, 1, 2, 3]
+
+        loaded.add(*replay_samples(4, 8))
+        loaded.save(str(tmp_path))
+
+        on_disk = np.load(tmp_path / 'X.npy')
+        assert on_disk[:, 0, 0].tolist() == [6, 7, 2, 3, 4, 5]
+        reopened = ReplayBuffer.load(str(tmp_path), mmap=False)
+        assert reopened.snapshot()['X'][:, 0, 0].tolist() == [2, 3, 4, 5, 6, 7]
+
+    def test_sample_without_replacement(self):
+        from ml_service.models.replay_buffer import ReplayBuffer
+
+        for prioritized in (False, True):
+            buffer = ReplayBuffer(capacity=20, prioritized=prioritized, seed=1)
+            buffer.add(*replay_samples(0, 12))
+
+            X_batch, y_batch, indices = buffer.sample(8, return_indices=True)
+            assert len(set(indices.tolist())) == 8
+            np.testing.assert_array_equal(X_batch[:, 0, 0], indices)
+            np.testing.assert_array_equal(y_batch[:, 0], indices)
+
+            # More than is stored returns every sample once
+            _, _, indices = buffer.sample(50, return_indices=True)
+            assert sorted(indices.tolist()) == list(range(12))
+
+    def test_prioritized_sampling_favours_high_priorities(self):
+        from ml_service.models.replay_buffer import ReplayBuffer
+
+        buffer = ReplayBuffer(capacity=100, prioritized=True, alpha=1.0, seed=2)
+        priorities = np.where(np.arange(100) < 10, 10.0, 0.1)
+        buffer.add(*replay_samples(0, 100), priorities=priorities)
+
+        counts = np.zeros(100)
+        for _ in range(200):
+            _, _, indices = buffer.sample(10, return_indices=True)
+            counts[indices] += 1
+
+        # The ten high-priority samples carry ~91% of the weight
+        assert counts[:10].mean() > 5 * counts[10:].mean()
+
+        buffer.update_priorities(np.arange(10), np.full(10, 0.1))
+        buffer.update_priorities(np.arange(90, 100), np.full(10, 10.0))
+        counts[:] = 0
+        for _ in range(200):
+            _, _, indices = buffer.sample(10, return_indices=True)
+            counts[indices] += 1
+        assert counts[90:].mean() > 5 * counts[:90].mean()
+
+
+def legacy_movement_features(df):
+    """Step lengths and turning angles from the per-individual loop the grouped shifts replaced"""
+    df = df.sort_values(['individual_id', 'timestamp']).reset_index(drop=True)
+    for col in ('prev_lat', 'prev_lon', 'prev_prev_lat', 'prev_prev_lon'):
+        df[col] = np.nan
+    for individual_id in df['individual_id'].unique():
+        indices = df[df['individual_id'] == individual_id].index
+        df.loc[indices[1:], 'prev_lat'] = df.loc[indices[:-1], 'latitude'].values
+        df.loc[indices[1:], 'prev_lon'] = df.loc[indices[:-1], 'longitude'].values
+        df.loc[indices[2:], 'prev_prev_lat'] = df.loc[indices[:-2], 'latitude'].values
+        df.loc[indices[2:], 'prev_prev_lon'] = df.loc[indices[:-2], 'longitude'].values
+
+    lat, lon = np.radians(df['latitude']), np.radians(df['longitude'])
+    prev_lat, prev_lon = np.radians(df['prev_lat']), np.radians(df['prev_lon'])
+    prev_prev_lat, prev_prev_lon = np.radians(df['prev_prev_lat']), np.radians(df['prev_prev_lon'])
+
+    a = np.sin((lat - prev_lat) / 2) ** 2 + np.cos(prev_lat) * np.cos(lat) * np.sin((lon - prev_lon) / 2) ** 2
+    step_length = (6371.0 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))).fillna(0)
+
+    def bearing(lat1, lon1, lat2, lon2):
+        return np.arctan2(np.sin(lon2 - lon1) * np.cos(lat2),
+                          np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1))
+
+    turn = bearing(prev_lat, prev_lon, lat, lon) - bearing(prev_prev_lat, prev_prev_lon, prev_lat, prev_lon)
+    turning_angle = np.arctan2(np.sin(turn), np.cos(turn)).fillna(0)
+    return df[['individual_id', 'timestamp']], step_length, turning_angle
+
+
+def legacy_nearest_utilization(df, bbmm_df):
+    """Brute-force nearest BBMM point for every row, as the old iterrows scan did"""
+    utilizations = []
+    for _, row in df.iterrows():
+        distances = np.sqrt((bbmm_df['latitude'] - row['latitude']) ** 2 + (bbmm_df['longitude'] - row['longitude']) ** 2)
+        utilizations.append(np.nan if distances.isna().all() else bbmm_df.loc[distances.idxmin(), 'utilization_density'])
+    return utilizations
+
+
+@pytest.fixture
+def lstm_training():
+    pytest.importorskip('tensorflow')
+    from ml_service.models import lstm_continuous_learning
+    return lstm_continuous_learning
+
+
+class TestLSTMFeatureJoins:
+    def tracks_with_gaps(self):
+        df = track_frame(seed=4).rename(columns={'lat': 'latitude', 'lon': 'longitude'})
+        df.loc[df.index[::9], 'latitude'] = np.nan
+        df.loc[df.index[4], 'longitude'] = np.nan
+        return df
+
+    def test_grouped_lags_match_loop(self, lstm_training):
+        df = self.tracks_with_gaps()
+
+        result = lstm_training.calculate_movement_features(df)
+        keys, step_length, turning_angle = legacy_movement_features(df)
+
+        pd.testing.assert_frame_equal(result[['individual_id', 'timestamp']], keys)
+        np.testing.assert_allclose(result['step_length'], step_length)
+        np.testing.assert_allclose(result['turning_angle'], turning_angle)
+        # Lags never cross from one individual into the next
+        first_fixes = result.groupby('individual_id').head(1).index
+        assert (result.loc[first_fixes, ['step_length', 'turning_angle']] == 0).all().all()
+
+    def test_kd_tree_join_matches_brute_force(self, lstm_training):
+        rng = np.random.default_rng(5)
+        df = self.tracks_with_gaps()
+        bbmm_df = pd.DataFrame({
+            'latitude': rng.uniform(-4, -2, 80),
+            'longitude': rng.uniform(34, 36, 80),
+            'utilization_density': rng.random(80),
+        }, index=rng.permutation(80) * 3)
+        bbmm_df.iloc[7, 0] = np.nan
+
+        result = lstm_training.find_nearest_utilization(df, bbmm_df)
+        expected = legacy_nearest_utilization(df, bbmm_df)
+
+        np.testing.assert_allclose(result, expected)
+        assert np.isnan(result).sum() == df[['latitude', 'longitude']].isna().any(axis=1).sum()
+
+
+def sequence_frame(seed=6):
+    """Shuffled tracks of three individuals (one too short for a window) with gaps"""
+    df = track_frame(seed=seed).rename(columns={'lat': 'latitude', 'lon': 'longitude'})
+    df['speed'] = np.random.default_rng(seed).random(len(df))
+    df.loc[df.index[::11], 'speed'] = np.nan
+    df.loc[df.index[5], 'latitude'] = np.inf
+    short = pd.DataFrame({
+        'individual_id': 'S1',
+        'timestamp': pd.date_range('2024-01-01', periods=3, freq='h'),
+        'latitude': [-3.0, -3.1, -3.2], 'longitude': [35.0, 35.1, 35.2], 'speed': [0.1, 0.2, 0.3],
+    })
+    return pd.concat([df, short], ignore_index=True).sample(frac=1, random_state=seed)
+
+
+def legacy_sequence_windows(df, sequence_length, features, targets):
+    """Every valid window of every individual, found with the old per-individual row loop"""
+    X, y, ids = [], [], []
+    for individual_id, group in df.groupby('individual_id'):
+        group = group.sort_values('timestamp')
+        for i in range(len(group) - sequence_length):
+            X_seq = group[features].iloc[i:i + sequence_length].to_numpy(dtype=float)
+            y_seq = group[targets].iloc[i + sequence_length].to_numpy(dtype=float)
+            if np.isfinite(X_seq).all() and np.isfinite(y_seq).all():
+                X.append(X_seq)
+                y.append(y_seq)
+                ids.append(individual_id)
+    return np.array(X), np.array(y), ids
+
+
+class TestSequenceWindows:
+    features = ['latitude', 'longitude', 'speed']
+    targets = ['latitude', 'longitude']
+
+    def test_windows_match_loop(self, lstm_training):
+        df = sequence_frame()
+
+        sw = lstm_training.build_sequence_windows(df, 4, self.features + ['missing'], self.targets)
+        X, y = sw.take(np.arange(len(sw)))
+        expected_X, expected_y, expected_ids = legacy_sequence_windows(df, 4, self.features, self.targets)
+
+        assert sw.feature_names == self.features
+        np.testing.assert_array_equal(X, expected_X)
+        np.testing.assert_array_equal(y, expected_y)
+        # Each window and its target belong to a single individual
+        ids = df.sort_values(['individual_id', 'timestamp'], kind='stable')['individual_id'].to_numpy()
+        for start, individual_id in zip(sw.starts, expected_ids):
+            assert set(ids[start:start + 5]) == {individual_id}
+        assert 'S1' not in expected_ids
+
+    def test_batches_have_expected_shapes(self, lstm_training):
+        sw = lstm_training.build_sequence_windows(sequence_frame(), 4, self.features, self.targets)
+        indices = np.arange(len(sw))
+        scaler_x, scaler_y = lstm_training.fit_sequence_scalers(sw, indices, batch_size=7)
+
+        batches = list(lstm_training.iter_sequence_batches(sw, indices, scaler_x, scaler_y, batch_size=8))
+        assert [len(X) for X, _ in batches] == [8] * (len(sw) // 8) + ([len(sw) % 8] if len(sw) % 8 else [])
+        assert all(X.shape[1:] == (4, 3) and y.shape == (len(X), 2) for X, y in batches)
+        X_all, y_all = lstm_training.materialize_windows(sw, indices, scaler_x, scaler_y)
+        np.testing.assert_allclose(np.concatenate([X for X, _ in batches]), X_all)
+        np.testing.assert_allclose(np.concatenate([y for _, y in batches]), y_all)
+
+        dataset = lstm_training.make_sequence_dataset(sw, indices, scaler_x, scaler_y, batch_size=8, shuffle=True, seed=1)
+        streamed = [(X.numpy(), y.numpy()) for X, y in dataset]
+        assert [len(X) for X, _ in streamed] == [len(X) for X, _ in batches]
+        assert all(X.dtype == np.float32 and X.shape[1:] == (4, 3) and y.shape[1:] == (2,) for X, y in streamed)
+        # A shuffled epoch still yields every window exactly once
+        np.testing.assert_allclose(np.sort(np.concatenate([y for _, y in streamed]), axis=0),
+                                   np.sort(y_all, axis=0), rtol=1e-6, atol=1e-6)
+
+
+def cached_tracks():
+    """Fixes with a tz-aware timestamp, a shuffled integer index and IDs that contain '/'"""
+    rng = np.random.default_rng(6)
+    ids = rng.choice(['KE/E-01', 'TZ/W 7', 'E2'], 40)
+    return pd.DataFrame({
+        'individual_id': ids,
+        'timestamp': pd.date_range('2023-01-01', periods=40, freq='h', tz='Africa/Nairobi'),
+        'lat': rng.uniform(-4, -2, 40),
+        'lon': rng.uniform(34, 36, 40),
+        'state': rng.integers(1, 4, 40),
+        'habitat': rng.choice(['forest', 'savanna', None], 40),
+    }, index=pd.Index(rng.permutation(40) * 7 + 3, name='fix'))
+
+
+@pytest.fixture
+def dataset_cache():
+    pytest.importorskip('pyarrow')
+    from ml_service.models import dataset_cache
+    return dataset_cache
+
+
+class TestDatasetCache:
+    def test_round_trip(self, dataset_cache, tmp_path):
+        df = cached_tracks()
+        path = str(tmp_path / 'tracks')
+
+        assert dataset_cache.write_dataset(df, path, species='elephant')
+
+        pd.testing.assert_frame_equal(dataset_cache.read_dataset(path), df)
+        assert not list(tmp_path.glob('*.tmp-*'))
+
+    def test_column_projection_and_individual_pushdown(self, dataset_cache, tmp_path):
+        df = cached_tracks()
+        path = str(tmp_path / 'tracks')
+        dataset_cache.write_dataset(df, path, species='elephant')
+
+        result = dataset_cache.read_dataset(path, columns=['timestamp', 'lat', 'missing'], individuals=['KE/E-01'])
+
+        expected = df.loc[df['individual_id'] == 'KE/E-01', ['timestamp', 'lat']]
+        pd.testing.assert_frame_equal(result, expected)
+
+        filtered = dataset_cache.read_dataset(path, columns=['lat'], filters=[('state', '=', 2)])
+        pd.testing.assert_frame_equal(filtered, df.loc[df['state'] == 2, ['lat']])
+
+    def test_source_change_misses(self, dataset_cache, tmp_path):
+        source = tmp_path / 'tracks.csv'
+        cached_tracks().to_csv(source)
+        cache_dir = str(tmp_path / 'cache')
+
+        first = dataset_cache.read_csv_cached(str(source), cache_dir=cache_dir)
+        cached = dataset_cache.read_csv_cached(str(source), columns=['lat'], individuals=['E2'], cache_dir=cache_dir)
+        pd.testing.assert_frame_equal(cached, first.loc[first['individual_id'] == 'E2', ['lat']])
+
+        changed = cached_tracks().head(10)
+        changed['lat'] = 0.0
+        changed.to_csv(source)
+        reread = dataset_cache.read_csv_cached(str(source), cache_dir=cache_dir)
+
+        assert len(reread) == 10
+        assert (reread['lat'] == 0.0).all()
+        assert len(list((tmp_path / 'cache' / 'csv').iterdir())) == 2
+
+    def test_load_cached_without_cache_dir(self, dataset_cache, tmp_path):
+        df = cached_tracks()
+        source = tmp_path / 'tracks.csv'
+        source.write_text('unused')
+        builds = []
+
+        def build():
+            builds.append(1)
+            return df
+
+        for _ in range(2):
+            result = dataset_cache.load_cached(str(source), 'tracks', build, cache_dir=None,
+                                               columns=['lat'], individuals=['TZ/W 7'])
+            pd.testing.assert_frame_equal(result, df.loc[df['individual_id'] == 'TZ/W 7', ['lat']])
+
+        assert len(builds) == 2
+        assert list(tmp_path.iterdir()) == [source]
+
+
+def bridge_segments(seed=7, n=12):
+    """Consecutive fixes of one track: start/end coordinates and durations in hours, one of them zero"""
+    rng = np.random.default_rng(seed)
+    lons = 35.0 + np.cumsum(rng.normal(0, 0.01, n + 1))
+    lats = -3.0 + np.cumsum(rng.normal(0, 0.01, n + 1))
+    durations = rng.uniform(0.5, 4.0, n)
+    durations[3] = 0.0
+    return lons[:-1], lats[:-1], lons[1:], lats[1:], durations
+
+
+def legacy_bridge_density(x1, y1, x2, y2, durations, lon_grid, lat_grid, sigma_squared, location_error, n_time_slices):
+    """Per-cell loop over segments and time slices, as the utilization distribution used to be built"""
+    from ml_service.models.bbmm_movement import calculate_brownian_bridge_probability
+
+    density = np.zeros((len(lat_grid), len(lon_grid)))
+    for k in range(len(durations)):
+        if durations[k] <= 0:
+            continue
+        for s in range(n_time_slices):
+            t = durations[k] * (s + 0.5) / n_time_slices
+            for iy, y in enumerate(lat_grid):
+                for ix, x in enumerate(lon_grid):
+                    density[iy, ix] += calculate_brownian_bridge_probability(
+                        x, y, x1[k], y1[k], x2[k], y2[k], t, 0.0, durations[k], sigma_squared, location_error
+                    ) / n_time_slices
+    return density
+
+
+class TestBrownianBridgeDensity:
+    def grids(self, x1, y1, x2, y2, n=15):
+        lon_grid = np.linspace(min(x1.min(), x2.min()) - 0.01, max(x1.max(), x2.max()) + 0.01, n)
+        lat_grid = np.linspace(min(y1.min(), y2.min()) - 0.01, max(y1.max(), y2.max()) + 0.01, n + 3)
+        return lon_grid, lat_grid
+
+    def test_separable_engine_matches_cell_loop(self):
+        from ml_service.models.bbmm_movement import brownian_bridge_density_grid
+
+        x1, y1, x2, y2, durations = bridge_segments()
+        lon_grid, lat_grid = self.grids(x1, y1, x2, y2)
+
+        for n_time_slices in (1, 3, 5):
+            expected = legacy_bridge_density(x1, y1, x2, y2, durations, lon_grid, lat_grid, 1e-4, 0.01, n_time_slices)
+            # One chunk for everything, and chunks of a single row
+            for max_chunk_elements in (8_000_000, 40):
+                density = brownian_bridge_density_grid(
+                    x1, y1, x2, y2, durations, lon_grid, lat_grid, 1e-4, 0.01,
+                    n_time_slices=n_time_slices, max_chunk_elements=max_chunk_elements
+                )
+                np.testing.assert_allclose(density, expected, rtol=1e-10, atol=1e-12)
+
+    def test_footprints_and_tiles_match_full_grid(self, monkeypatch):
+        from ml_service.models import bbmm_movement
+        from ml_service.models.bbmm_movement import brownian_bridge_density_grid
+
+        x1, y1, x2, y2, durations = bridge_segments(n=40)
+        lon_grid, lat_grid = self.grids(x1, y1, x2, y2, n=60)
+        args = (x1, y1, x2, y2, durations, lon_grid, lat_grid, 1e-5, 0.002)
+        full = brownian_bridge_density_grid(*args, n_time_slices=3)
+
+        # Beyond six standard deviations a kernel is below exp(-18) of its peak
+        truncated = brownian_bridge_density_grid(*args, n_time_slices=3, footprint_sigmas=6)
+        np.testing.assert_allclose(truncated, full, rtol=0, atol=1e-7 * full.max())
+        assert (truncated <= full + 1e-12).all() and (truncated < full).any()
+
+        for tile_size in (7, 16, 64):
+            tiled = brownian_bridge_density_grid(*args, n_time_slices=3, footprint_sigmas=6, tile_size=tile_size)
+            np.testing.assert_allclose(tiled, truncated, rtol=1e-12, atol=1e-15)
+
+        # Every footprint through the bincount scatter, in small chunks, and every one through the row loop
+        for threshold, max_chunk_elements in ((10 ** 9, 400), (0, 8_000_000)):
+            monkeypatch.setattr(bbmm_movement, 'VECTORIZED_FOOTPRINT_CELLS', threshold)
+            density = brownian_bridge_density_grid(*args, n_time_slices=3, footprint_sigmas=6, tile_size=16,
+                                                   max_chunk_elements=max_chunk_elements)
+            np.testing.assert_allclose(density, truncated, rtol=1e-12, atol=1e-15)
+
+    def test_footprints_accumulate_into_out(self, tmp_path):
+        from ml_service.models.bbmm_movement import brownian_bridge_density_grid
+
+        x1, y1, x2, y2, durations = bridge_segments(n=20)
+        lon_grid, lat_grid = self.grids(x1, y1, x2, y2, n=30)
+        args = (x1, y1, x2, y2, durations, lon_grid, lat_grid, 1e-5, 0.002)
+        expected = brownian_bridge_density_grid(*args, footprint_sigmas=5)
+
+        out = np.lib.format.open_memmap(tmp_path / 'ud.npy', mode='w+', dtype=float, shape=expected.shape)
+        result = brownian_bridge_density_grid(*args, footprint_sigmas=5, tile_size=8, out=out)
+
+        assert result is out
+        np.testing.assert_allclose(np.load(tmp_path / 'ud.npy'), expected, rtol=1e-12)
+
+
+def legacy_intermediate_locations(df, n_predictions_per_step):
+    """Per-step interpolation loop that predict_intermediate_locations replaced"""
+    records = []
+    for individual_id in df['individual_id'].unique():
+        individual = df[df['individual_id'] == individual_id].dropna(subset=['lat', 'lon', 'timestamp'])
+        individual = individual.sort_values('timestamp', kind='stable')
+        for i in range(len(individual) - 1):
+            row1, row2 = individual.iloc[i], individual.iloc[i + 1]
+            if row2['timestamp'] <= row1['timestamp']:
+                continue
+            for j in range(1, n_predictions_per_step + 1):
+                p = j / (n_predictions_per_step + 1)
+                records.append({
+                    'individual_id': individual_id,
+                    'timestamp': row1['timestamp'] + (row2['timestamp'] - row1['timestamp']) * p,
+                    'predicted_lon': row1['lon'] + (row2['lon'] - row1['lon']) * p,
+                    'predicted_lat': row1['lat'] + (row2['lat'] - row1['lat']) * p,
+                    'start_lon': row1['lon'], 'start_lat': row1['lat'],
+                    'end_lon': row2['lon'], 'end_lat': row2['lat'],
+                    'start_time': row1['timestamp'], 'end_time': row2['timestamp'],
+                    'time_proportion': p
+                })
+    return pd.DataFrame(records)
+
+
+class TestIntermediateLocations:
+    def tracks(self):
+        df = track_frame(seed=8)
+        df.loc[df.index[5], 'lat'] = np.nan
+        # A repeated fix at the same place gives a zero-length step that is skipped
+        repeat = df.iloc[[10]].copy()
+        repeat.index = [999]
+        return pd.concat([df, repeat])
+
+    def test_mean_matches_step_loop(self):
+        from ml_service.models.bbmm_movement import predict_intermediate_locations
+
+        df = self.tracks()
+        result = predict_intermediate_locations(df, 2.0, 'Test', n_predictions_per_step=3)
+        expected = legacy_intermediate_locations(df, 3)
+
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    def test_noise_is_reproducible(self):
+        from ml_service.models.bbmm_movement import predict_intermediate_locations
+
+        df = self.tracks()
+        mean = predict_intermediate_locations(df, 2.0, 'Test', n_predictions_per_step=4)
+        first = predict_intermediate_locations(df, 2.0, 'Test', 4, sample_noise=True, random_state=11)
+        again = predict_intermediate_locations(df, 2.0, 'Test', 4, sample_noise=True,
+                                               random_state=np.random.default_rng(11))
+        other = predict_intermediate_locations(df, 2.0, 'Test', 4, sample_noise=True, random_state=12)
+
+        pd.testing.assert_frame_equal(first, again)
+        assert not np.allclose(first['predicted_lat'], other['predicted_lat'])
+        pd.testing.assert_frame_equal(first.drop(columns=['predicted_lon', 'predicted_lat']),
+                                      mean.drop(columns=['predicted_lon', 'predicted_lat']))
+
+        # Latitude noise has the Brownian bridge standard deviation
+        hours = (mean['end_time'] - mean['start_time']).dt.total_seconds() / 3600
+        p = mean['time_proportion']
+        std_lat = np.sqrt(2.0 * hours * p * (1 - p)) / 111.32
+        z = (first['predicted_lat'] - mean['predicted_lat']) / std_lat
+        assert abs(z.mean()) < 0.3 and 0.7 < z.std() < 1.3
+
+
+def legacy_prediction_errors(preds, acts):
+    """Nearest observation inside each prediction window, searched one prediction at a time"""
+    from ml_service.models.bbmm_movement import haversine_distance
+
+    errors = []
+    for individual_id, pred_group in preds.groupby(preds['individual_id'].astype(str)):
+        group = acts[acts['individual_id'].astype(str) == individual_id].sort_values('timestamp', kind='stable')
+        times_ns = group['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        for _, row in pred_group.iterrows():
+            left = np.searchsorted(times_ns, row['start_time'].value, side='left')
+            right = np.searchsorted(times_ns, row['end_time'].value, side='right')
+            if left >= right:
+                continue
+            nearest = left + np.argmin(np.abs(times_ns[left:right] - row['timestamp'].value))
+            errors.append(haversine_distance(row['predicted_lat'], row['predicted_lon'],
+                                             group['lat'].iloc[nearest], group['lon'].iloc[nearest]))
+    return np.array(errors)
+
+
+class TestBBMMEvaluation:
+    def held_out_tracks(self):
+        """Tracks with repeated fixes at the same time; predictions come from every third fix"""
+        df = track_frame(seed=9)
+        df['timestamp'] = df['timestamp'].dt.round('h')
+        repeats = df.sample(12, random_state=1).copy()
+        repeats[['lat', 'lon']] += 0.05
+        repeats.index = repeats.index + 1000
+        # Some repeats come before the fix they duplicate, some after
+        actual = pd.concat([repeats.iloc[:6], df, repeats.iloc[6:]])
+        kept = df.sort_values('timestamp').groupby('individual_id').nth(slice(None, None, 3))
+        return kept, actual
+
+    def test_accuracy_matches_window_search(self):
+        from ml_service.models.bbmm_movement import calculate_prediction_accuracy, predict_intermediate_locations
+
+        kept, actual = self.held_out_tracks()
+        # Odd step counts put predictions exactly between two fixes and at window edges
+        for n_predictions in (1, 2, 5):
+            preds = predict_intermediate_locations(kept, 2.0, 'Test', n_predictions)
+            metrics = calculate_prediction_accuracy(preds, actual, 'Test')
+            errors = legacy_prediction_errors(preds, actual)
+
+            assert metrics['n_matched'] == len(errors)
+            assert metrics['n_total_predictions'] == len(preds)
+            np.testing.assert_allclose(
+                [metrics['mae'], metrics['rmse'], metrics['median_error'], metrics['q25'], metrics['q75'], metrics['max_error']],
+                [errors.mean(), np.sqrt((errors ** 2).mean()), np.median(errors),
+                 np.percentile(errors, 25), np.percentile(errors, 75), errors.max()]
+            )
+
+    def test_step_length_error_matches_row_loop(self):
+        from ml_service.models.bbmm_movement import (
+            calculate_step_length, calculate_step_length_error, haversine_distance, predict_intermediate_locations
+        )
+
+        kept, actual = self.held_out_tracks()
+        preds = predict_intermediate_locations(kept, 2.0, 'Test', 3)
+        preds.loc[preds.index[4], 'predicted_lat'] = np.nan
+        tracks = calculate_step_length(actual.sort_values(['individual_id', 'timestamp']).reset_index(drop=True))
+
+        metrics = calculate_step_length_error(tracks, preds, 'Test')
+
+        rows = preds.dropna(subset=['start_lat', 'start_lon', 'predicted_lat', 'predicted_lon', 'end_lat', 'end_lon'])
+        steps = np.array(
+            [haversine_distance(r.start_lat, r.start_lon, r.predicted_lat, r.predicted_lon) for r in rows.itertuples()]
+            + [haversine_distance(r.predicted_lat, r.predicted_lon, r.end_lat, r.end_lon) for r in rows.itertuples()]
+        )
+        actual_steps = tracks['step_length'].dropna().to_numpy()
+        assert metrics['n_predicted_steps'] == len(steps) == 2 * (len(preds) - 1)
+        np.testing.assert_allclose(metrics['predicted_mean'], steps.mean())
+        np.testing.assert_allclose(metrics['predicted_median'], np.median(steps))
+        np.testing.assert_allclose(metrics['mean_error'], abs(steps.mean() - actual_steps.mean()))
+
+
+def two_state_sequence(n=400, seed=10):
+    """Observations from a sticky two-state Gaussian HMM (resting / travelling)"""
+    rng = np.random.default_rng(seed)
+    states = np.zeros(n, dtype=int)
+    for i in range(1, n):
+        states[i] = states[i - 1] if rng.random() < 0.95 else 1 - states[i - 1]
+    means = np.array([[0.1, 0.0], [2.0, 1.5]])
+    return means[states] + rng.normal(0, 0.2, (n, 2)), states
+
+
+@pytest.fixture
+def hmm_training(monkeypatch, tmp_path):
+    pytest.importorskip('hmmlearn')
+    import matplotlib
+    matplotlib.use('Agg')
+    from ml_service.models import hmm_behavior
+
+    monkeypatch.setattr(hmm_behavior, 'output_dir', str(tmp_path))
+    monkeypatch.setattr(hmm_behavior, 'results_dir', str(tmp_path))
+    return hmm_behavior
+
+
+class TestHMMStateSelection:
+    def test_selects_two_states_and_writes_candidates(self, hmm_training, tmp_path):
+        X, _ = two_state_sequence()
+
+        n_states, model, candidates = hmm_training.select_optimal_states(
+            X, 'Test', min_states=2, max_states=3, restarts=3, workers=1
+        )
+
+        # The state count with the lowest BIC wins and its best restart is returned
+        bic = candidates.groupby('n_states')['bic'].first()
+        assert n_states == bic.idxmin()
+        assert model.n_components == n_states
+
+        assert len(candidates) == 6
+        assert set(candidates.columns) >= {'n_states', 'restart', 'log_likelihood', 'n_iter', 'converged',
+                                           'fit_seconds', 'error', 'bic', 'aic', 'selected'}
+        assert candidates.groupby('n_states')['selected'].sum().tolist() == [1, 1]
+        # The kept restart is the one with the best log likelihood
+        for _, group in candidates.groupby('n_states'):
+            assert group.loc[group['selected'], 'log_likelihood'].item() == group['log_likelihood'].max()
+        selected = candidates[candidates['selected'] & (candidates['n_states'] == n_states)]
+        assert model.score(X) == pytest.approx(selected['log_likelihood'].item())
+
+        written = pd.read_csv(tmp_path / 'test_model_selection.csv')
+        pd.testing.assert_frame_equal(written.drop(columns=['fit_seconds', 'error']),
+                                      candidates.drop(columns=['fit_seconds', 'error']), check_dtype=False)
+
+    def test_restarts_are_reproducible(self, hmm_training):
+        X, _ = two_state_sequence(n=200, seed=11)
+
+        for restart in (0, 1):
+            first = hmm_training.fit_hmm_candidate(X, 2, restart=restart)
+            again = hmm_training.fit_hmm_candidate(X, 2, restart=restart)
+            np.testing.assert_array_equal(first.means_, again.means_)
+
+    def test_workers_match_single_process(self, hmm_training):
+        X, _ = two_state_sequence(n=300, seed=12)
+
+        serial = hmm_training.select_optimal_states(X, 'Serial', min_states=2, max_states=3, restarts=2, workers=1)
+        parallel = hmm_training.select_optimal_states(X, 'Parallel', min_states=2, max_states=3, restarts=2, workers=2)
+
+        assert serial[0] == parallel[0]
+        np.testing.assert_allclose(parallel[1].means_, serial[1].means_)
+        columns = ['n_states', 'restart', 'log_likelihood', 'n_iter', 'bic', 'selected']
+        pd.testing.assert_frame_equal(parallel[2][columns], serial[2][columns])
+
+
+def habitat_training_data(n=600, seed=13):
+    """Scaled features and labels for two species, indexed like a shuffled feature table"""
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(n, 5)), columns=[f'f{i}' for i in range(5)], index=rng.permutation(n) * 2)
+    y = pd.Series((X['f0'] + 0.5 * X['f1'] + rng.normal(0, 0.8, n) > 0.3).astype(int), index=X.index)
+    species = pd.Series(np.where(np.arange(n) % 2, 'elephant', 'wildebeest'), index=X.index)
+    return X, y, species
+
+
+@pytest.fixture
+def habitat_training(monkeypatch, tmp_path):
+    pytest.importorskip('xgboost')
+    import matplotlib
+    matplotlib.use('Agg')
+    from ml_service.models import xgboost_habitat_modeling
+
+    for name in ('models', 'evaluations'):
+        (tmp_path / name).mkdir()
+    monkeypatch.setattr(xgboost_habitat_modeling, 'output_dir', str(tmp_path))
+    return xgboost_habitat_modeling
+
+
+class TestHabitatSearch:
+    search = {'n_folds': 3, 'budgets': (5, 10, 20), 'keep': 3}
+
+    def test_search_space_starts_with_base_config(self, habitat_training):
+        configs = habitat_training.build_search_space(n_configs=12, seed=3)
+
+        assert configs[0] == {key: habitat_training.XGB_BASE_PARAMS[key] for key in habitat_training.XGB_SEARCH_SPACE}
+        assert len({tuple(config.items()) for config in configs}) == 12
+        assert all(config[key] in values for config in configs for key, values in habitat_training.XGB_SEARCH_SPACE.items())
+        assert configs == habitat_training.build_search_space(n_configs=12, seed=3)
+
+    def test_rungs_keep_the_best_third(self, habitat_training):
+        X, y, species = habitat_training_data()
+        configs = habitat_training.build_search_space(n_configs=7)
+
+        best, leaderboard = habitat_training.search_species_hyperparameters(X, y, species, configs=configs, **self.search)
+
+        for name, rows in leaderboard.groupby('species'):
+            # 7 configurations, then ceil(7 / 3) = 3, then 1
+            assert rows.groupby('rung').size().tolist() == [7, 3, 1]
+            assert rows.groupby('rung')['n_estimators'].first().tolist() == [5, 10, 20]
+            for rung in (0, 1):
+                ranked = rows[rows['rung'] == rung].sort_values('logloss_mean')['config']
+                survivors = set(rows.loc[rows['rung'] == rung + 1, 'config'])
+                assert survivors == set(ranked.iloc[:len(survivors)])
+            final = rows[rows['rung'] == 2].iloc[0]
+            assert best[name] == configs[int(final['config'])]
+
+    def test_leaderboard_and_best_params_are_written(self, habitat_training, tmp_path):
+        import json
+
+        X, y, species = habitat_training_data()
+        best, leaderboard = habitat_training.search_species_hyperparameters(
+            X, y, species, configs=habitat_training.build_search_space(n_configs=4), **self.search
+        )
+        habitat_training.save_search_leaderboard(leaderboard, best, str(tmp_path))
+
+        written = pd.read_csv(tmp_path / 'evaluations' / 'xgboost_search_leaderboard.csv')
+        pd.testing.assert_frame_equal(written, leaderboard, check_dtype=False)
+        saved = json.loads((tmp_path / 'models' / 'xgboost_search_best_params.json').read_text())
+        assert saved['species'] == best
+        assert habitat_training.load_search_best_params(str(tmp_path)) == best
+
+    def test_workers_match_single_process(self, habitat_training):
+        X, y, species = habitat_training_data(n=400, seed=14)
+        configs = habitat_training.build_search_space(n_configs=4)
+
+        serial = habitat_training.search_species_hyperparameters(X, y, species, configs=configs, workers=1, **self.search)
+        parallel = habitat_training.search_species_hyperparameters(X, y, species, configs=configs, workers=2, **self.search)
+
+        assert parallel[0] == serial[0]
+        pd.testing.assert_frame_equal(parallel[1], serial[1])
+
+        cv_serial = habitat_training.perform_cross_validation(X, y, n_folds=3, workers=1)
+        cv_parallel = habitat_training.perform_cross_validation(X, y, n_folds=3, workers=2)
+        assert cv_parallel == pytest.approx(cv_serial)
+
+    def test_train_stage_can_skip_or_reuse_the_search(self, habitat_training, monkeypatch, tmp_path):
+        X, y, species = habitat_training_data()
+        state = {'X_train_scaled': X, 'X_val_scaled': X, 'X_test_scaled': X, 'y_train': y, 'y_val': y,
+                 'y_test': y, 'species_data': species, 'scaler': None}
+        reused = {'elephant': {'max_depth': 3}}
+        habitat_training.save_search_leaderboard(pd.DataFrame([{'species': 'elephant'}]), reused, str(tmp_path))
+
+        def no_search(*args, **kwargs):
+            raise AssertionError('the search should not run')
+
+        monkeypatch.setattr(habitat_training, 'search_species_hyperparameters', no_search)
+        monkeypatch.setattr(habitat_training, 'perform_cross_validation', lambda *args, **kwargs: {})
+
+        habitat_training.stage_train(state, {'search': 'skip'})
+        assert state['species_params'] == {} and state['search_leaderboard'] is None
+        assert set(state['species_models']) == {'elephant', 'wildebeest'}
+
+        habitat_training.stage_train(state, {'search': 'reuse'})
+        assert state['species_params'] == reused
+        assert state['species_models']['elephant'].get_params()['max_depth'] == 3
+        assert state['species_models']['wildebeest'].get_params()['max_depth'] == habitat_training.XGB_BASE_PARAMS['max_depth']
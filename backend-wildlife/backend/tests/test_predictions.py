@@ -222,3 +222,483 @@ class TestPredictionAccuracy:
         assert prediction.id is not None
         assert actual_tracking.id is not None
 
+
+
+@pytest.fixture
+def habitat_predictor(tmp_path, monkeypatch, settings):
+    """Habitat predictor with a small suitability model and an NDVI raster over part of the map"""
+    import pickle
+    import numpy as np
+    import pandas as pd
+    from django.core.cache import cache
+    from sklearn.linear_model import LogisticRegression
+    from apps.predictions import xgboost_loader
+    from apps.predictions.xgboost_loader import XGBoostHabitatPredictor
+
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    settings.HABITAT_RASTER_DIR = str(tmp_path / 'rasters')
+    cache.clear()
+
+    feature_names = ['ndvi', 'water_access_quality', 'land_cover_10']
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.random((200, len(feature_names))), columns=feature_names)
+    y = (X['ndvi'] > 0.5).astype(int)
+    X['water_access_quality'] = 0.0
+    model_path = tmp_path / 'xgboost_habitat_model_elephant.pkl'
+    package = {'model': LogisticRegression().fit(X, y), 'scaler': None, 'feature_names': feature_names}
+    model_path.write_bytes(pickle.dumps(package))
+
+    monkeypatch.setenv('DISABLE_LOCAL_ML', 'True')
+    predictor = XGBoostHabitatPredictor()
+    predictor.models['elephant'] = package
+    predictor.model_paths['elephant'] = str(model_path)
+    monkeypatch.setattr(xgboost_loader, '_xgboost_predictor', predictor)
+    return predictor
+
+
+def write_ndvi_raster(raster_dir, bounds, value=0.9):
+    rasterio = pytest.importorskip('rasterio')
+    import numpy as np
+    from rasterio.transform import from_bounds
+
+    raster_dir.mkdir(parents=True, exist_ok=True)
+    data = np.full((40, 40), value, dtype='float32')
+    with rasterio.open(
+        raster_dir / 'ndvi_raster_kenya_tanzania.tif', 'w', driver='GTiff', height=40, width=40,
+        count=1, dtype='float32', crs='EPSG:4326', transform=from_bounds(*bounds, 40, 40), nodata=-9999
+    ) as dst:
+        dst.write(data, 1)
+
+
+@pytest.mark.api
+@pytest.mark.ml
+class TestHabitatGridAPI:
+    def test_rle_grid(self, api_client, habitat_predictor):
+        import numpy as np
+        
+        url = reverse('xgboost-grid')
+        response = api_client.get(url, {'bbox': '34,-4,36,-2', 'resolution': 0.1, 'month': 4})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['width'] == 20
+        assert response.data['height'] == 20
+        assert response.data['encoding'] == 'rle'
+        assert sum(response.data['counts']) == 20 * 20
+        values = np.repeat(response.data['values'], response.data['counts'])
+        assert values.max() <= response.data['scale']
+    
+    def test_binary_grid_matches_rle(self, api_client, habitat_predictor):
+        import numpy as np
+        
+        url = reverse('xgboost-grid')
+        params = {'bbox': '34,-4,36,-2', 'resolution': 0.1, 'month': 4}
+        rle = api_client.get(url, params).data
+        response = api_client.get(url, {**params, 'encoding': 'binary'})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'application/octet-stream'
+        assert response['X-Grid-Width'] == '20'
+        assert response['X-Grid-Height'] == '20'
+        grid = np.frombuffer(response.content, dtype=np.uint8)
+        assert grid.tolist() == np.repeat(rle['values'], rle['counts']).tolist()
+    
+    def test_tiles_are_cached(self, api_client, habitat_predictor, monkeypatch):
+        calls = []
+        score_points = habitat_predictor.score_points
+        monkeypatch.setattr(habitat_predictor, 'score_points', lambda *args: calls.append(1) or score_points(*args))
+        
+        url = reverse('xgboost-grid')
+        params = {'bbox': '34,-4,36,-2', 'resolution': 0.1, 'month': 4}
+        first = api_client.get(url, params)
+        second = api_client.get(url, params)
+        
+        assert len(calls) == 1
+        assert first.data['values'] == second.data['values']
+        assert first.data['counts'] == second.data['counts']
+    
+    def test_tiles_render_in_batches(self, habitat_predictor, monkeypatch):
+        import numpy as np
+        from apps.predictions.habitat_grid import render_tiles
+        
+        tiles = [(x, y) for x in range(37, 40) for y in (32, 33)][:5]
+        together = render_tiles(habitat_predictor, 'elephant', 4, 6, tiles)
+        
+        sizes = []
+        score_points = habitat_predictor.score_points
+        monkeypatch.setattr(habitat_predictor, 'score_points', lambda lats, *args: sizes.append(len(lats)) or score_points(lats, *args))
+        batched = render_tiles(habitat_predictor, 'elephant', 4, 6, tiles, batch_tiles=2)
+        
+        assert sizes == [2 * 256 * 256, 2 * 256 * 256, 256 * 256]
+        assert list(batched) == tiles
+        assert all(np.array_equal(batched[tile], together[tile]) for tile in tiles)
+    
+    def test_nodata_outside_rasters(self, api_client, habitat_predictor, settings, tmp_path):
+        import numpy as np
+        from apps.predictions.habitat_grid import NODATA
+        
+        write_ndvi_raster(tmp_path / 'rasters', (35.0, -4.0, 36.0, -2.0))
+        
+        url = reverse('xgboost-grid')
+        response = api_client.get(url, {'bbox': '34,-4,36,-2', 'resolution': 0.1, 'month': 4, 'encoding': 'binary'})
+        
+        grid = np.frombuffer(response.content, dtype=np.uint8).reshape(20, 20)
+        assert (grid[:, :9] == NODATA).all()
+        assert (grid[:, 11:] > 200).all()
+        assert (grid[:, 11:] != NODATA).all()
+    
+    @pytest.mark.parametrize('params', [
+        {'bbox': '36,-4,34,-2'},
+        {'bbox': '34,-4,36'},
+        {'bbox': '34,-4,36,-2', 'resolution': 0},
+        {'bbox': '34,-4,36,-2', 'month': 13},
+        {'bbox': '34,-4,36,-2', 'encoding': 'png'},
+        {'bbox': '0,-60,60,0', 'resolution': 0.001},
+    ])
+    def test_invalid_requests(self, api_client, habitat_predictor, params):
+        url = reverse('xgboost-grid')
+        response = api_client.get(url, params)
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+    
+    def test_species_without_model(self, api_client, habitat_predictor):
+        url = reverse('xgboost-grid')
+        response = api_client.get(url, {'bbox': '34,-4,36,-2', 'species': 'zebra'})
+        
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+@pytest.fixture
+def habitat_tiles(habitat_predictor, settings, tmp_path):
+    """Tile pyramid of the test model over a small area, for April"""
+    from django.core.management import call_command
+    
+    settings.HABITAT_TILE_DIR = str(tmp_path / 'tiles')
+    settings.HABITAT_TILE_BBOX = (34.0, -4.0, 36.0, -2.0)
+    call_command('build_habitat_tiles', '--months', '4', '--min-zoom', '5', '--max-zoom', '6')
+    return settings.HABITAT_TILE_DIR
+
+
+@pytest.mark.api
+@pytest.mark.ml
+class TestHabitatTileAPI:
+    def test_build_writes_index(self, habitat_tiles):
+        import json
+        from pathlib import Path
+        
+        index = json.loads((Path(habitat_tiles) / 'elephant' / 'm04' / 'index.json').read_text())
+        
+        assert index['species'] == 'elephant'
+        assert set(index['zooms']) == {'5', '6'}
+        level = index['zooms']['6']
+        size = (Path(habitat_tiles) / 'elephant' / 'm04' / level['file']).stat().st_size
+        assert size == (level['x1'] - level['x0'] + 1) * (level['y1'] - level['y0'] + 1) * 256 * 256
+    
+    def test_rebuild_swaps_index_to_new_packs(self, habitat_predictor, habitat_tiles, monkeypatch):
+        import numpy as np
+        from pathlib import Path
+        from apps.predictions.tile_pyramid import TilePyramid, build_pyramid
+        
+        path = Path(habitat_tiles) / 'elephant' / 'm04'
+        pyramid = TilePyramid(habitat_tiles)
+        old_index = pyramid.index('elephant', 4)
+        old_tile = pyramid.tile('elephant', 4, 6, 38, 32)
+        
+        # A failed rebuild leaves the current pyramid untouched
+        monkeypatch.setattr(habitat_predictor, 'score_points', lambda *args: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            build_pyramid(habitat_predictor, 'elephant', 4, (34.0, -4.0, 36.0, -2.0), [5, 6], habitat_tiles)
+        assert sorted(p.name for p in path.iterdir()) == sorted([level['file'] for level in old_index['zooms'].values()] + ['index.json'])
+        del habitat_predictor.score_points
+        
+        index = build_pyramid(habitat_predictor, 'elephant', 4, (34.0, -4.0, 36.0, -2.0), [5, 6], habitat_tiles)
+        
+        files = {level['file'] for level in index['zooms'].values()}
+        assert files.isdisjoint(level['file'] for level in old_index['zooms'].values())
+        assert {p.name for p in path.iterdir()} == files | {'index.json'}
+        # A reader that loaded the old index follows the swap to the new packs
+        assert np.array_equal(pyramid.tile('elephant', 4, 6, 38, 32), old_tile)
+        assert pyramid.index('elephant', 4)['created'] == index['created']
+    
+    def test_rebuild_skips_up_to_date(self, habitat_tiles):
+        from io import StringIO
+        from django.core.management import call_command
+        
+        out = StringIO()
+        call_command('build_habitat_tiles', '--months', '4', '--min-zoom', '5', '--max-zoom', '6', stdout=out)
+        
+        assert 'up to date' in out.getvalue()
+    
+    def test_tile_matches_rendering(self, api_client, habitat_predictor, habitat_tiles, monkeypatch):
+        import numpy as np
+        from apps.predictions.habitat_grid import render_tiles
+        
+        expected = render_tiles(habitat_predictor, 'elephant', 4, 6, [(38, 32)])[(38, 32)]
+        monkeypatch.setattr(habitat_predictor, 'score_points', lambda *args: pytest.fail('tile was rendered'))
+        
+        response = api_client.get(reverse('xgboost-tile', args=['elephant', 6, 38, 32]), {'month': 4})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response['X-Tile-Source'] == 'pyramid'
+        assert response['ETag']
+        assert np.array_equal(np.frombuffer(response.content, dtype=np.uint8).reshape(256, 256), expected)
+    
+    def test_etag_not_modified(self, api_client, habitat_tiles):
+        url = reverse('xgboost-tile', args=['elephant', 6, 38, 32])
+        etag = api_client.get(url, {'month': 4})['ETag']
+        
+        response = api_client.get(url, {'month': 4}, HTTP_IF_NONE_MATCH=etag)
+        
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['ETag'] == etag
+        assert response.content == b''
+    
+    def test_range_request(self, api_client, habitat_tiles):
+        url = reverse('xgboost-tile', args=['elephant', 6, 38, 32])
+        full = api_client.get(url, {'month': 4}).content
+        
+        response = api_client.get(url, {'month': 4}, HTTP_RANGE='bytes=256-511')
+        
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response['Content-Range'] == 'bytes 256-511/65536'
+        assert response.content == full[256:512]
+        
+        response = api_client.get(url, {'month': 4}, HTTP_RANGE='bytes=70000-')
+        assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+    
+    def test_grid_reads_pyramid(self, api_client, habitat_predictor, habitat_tiles, monkeypatch):
+        monkeypatch.setattr(habitat_predictor, 'score_points', lambda *args: pytest.fail('tile was rendered'))
+        
+        response = api_client.get(reverse('xgboost-grid'), {'bbox': '34.5,-3.5,35.5,-2.5', 'resolution': 0.03, 'month': 4})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['zoom'] == 6
+    
+    def test_tile_outside_pyramid_is_rendered(self, api_client, habitat_tiles):
+        response = api_client.get(reverse('xgboost-tile', args=['elephant', 6, 10, 10]), {'month': 4})
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response['X-Tile-Source'] == 'rendered'
+        assert len(response.content) == 256 * 256
+    
+    def test_stale_pyramid_is_rendered(self, api_client, habitat_predictor, habitat_tiles):
+        import os
+        import time
+        from apps.predictions.habitat_grid import grid_version
+        
+        url = reverse('xgboost-tile', args=['elephant', 6, 38, 32])
+        built = api_client.get(url, {'month': 4})
+        model_path = habitat_predictor.model_paths['elephant']
+        os.utime(model_path, ns=(time.time_ns(), time.time_ns() + 10**9))
+        
+        response = api_client.get(url, {'month': 4}, HTTP_IF_NONE_MATCH=built['ETag'])
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response['X-Tile-Source'] == 'rendered'
+        assert response['X-Model-Version'] == grid_version(habitat_predictor, 'elephant')
+        assert response['ETag'] != built['ETag']
+    
+    def test_unknown_species(self, api_client, habitat_tiles):
+        from apps.predictions.tile_pyramid import pyramid_path
+        
+        for species in ['zebra', '..']:
+            response = api_client.get(reverse('xgboost-tile', args=[species, 6, 38, 32]), {'month': 4})
+            assert response.status_code == status.HTTP_404_NOT_FOUND
+        
+        with pytest.raises(ValueError):
+            pyramid_path(habitat_tiles, '..', 4)
+    
+    def test_invalid_tile(self, api_client, habitat_tiles):
+        response = api_client.get(reverse('xgboost-tile', args=['elephant', 2, 9, 0]), {'month': 4})
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.ml
+class TestCompiledHabitatModel:
+    @pytest.fixture
+    def xgb_package(self):
+        xgb = pytest.importorskip('xgboost')
+        import numpy as np
+        import pandas as pd
+        from sklearn.preprocessing import StandardScaler
+        
+        feature_names = ['ndvi', 'rainfall_mm', 'elevation', 'distance_to_water_km', 'month', 'lat', 'lon', 'land_cover_10']
+        rng = np.random.default_rng(0)
+        X = pd.DataFrame(rng.random((400, len(feature_names))), columns=feature_names)
+        X.loc[::9, 'rainfall_mm'] = np.nan
+        y = ((X['ndvi'] + X['lat']) > 1).astype(int)
+        scaler = StandardScaler().fit(X)
+        model = xgb.XGBClassifier(n_estimators=40, max_depth=5, base_score=0.4).fit(
+            pd.DataFrame(scaler.transform(X), columns=feature_names), y
+        )
+        return {'model': model, 'scaler': scaler, 'feature_names': feature_names}, X
+    
+    def test_compiled_matches_booster(self, xgb_package):
+        import numpy as np
+        from ml_service.core.xgboost_runtime import compile_model
+        
+        package, X = xgb_package
+        compiled = compile_model(package)
+        compiled.booster = None
+        X_scaled = package['scaler'].transform(X).astype(np.float32)
+        
+        booster = package['model'].get_booster()
+        assert np.array_equal(compiled.predict_margin(X_scaled), booster.inplace_predict(X_scaled, predict_type='margin'))
+        np.testing.assert_array_max_ulp(compiled.predict_proba(X_scaled), package['model'].predict_proba(X_scaled), maxulp=1)
+        np.testing.assert_array_max_ulp(compiled.predict_proba(X_scaled[:1]), package['model'].predict_proba(X_scaled[:1]), maxulp=1)
+    
+    def test_compiled_save_load(self, xgb_package, tmp_path):
+        import numpy as np
+        from ml_service.core.xgboost_runtime import compile_model, CompiledTreeEnsemble
+        
+        package, X = xgb_package
+        compiled = compile_model(package, tmp_path / 'model.npz')
+        loaded = CompiledTreeEnsemble.load(tmp_path / 'model.npz')
+        
+        X_scaled = package['scaler'].transform(X)
+        assert loaded.booster is None
+        assert loaded.feature_names == package['feature_names']
+        assert np.array_equal(loaded.predict_proba(X_scaled), compiled.predict_proba(X_scaled))
+    
+    def test_predict_habitat_uses_compiled_model(self, xgb_package, monkeypatch, settings, tmp_path):
+        from ml_service.core.xgboost_runtime import compile_model
+        from apps.predictions.xgboost_loader import XGBoostHabitatPredictor
+        
+        package, _ = xgb_package
+        settings.HABITAT_RASTER_DIR = str(tmp_path / 'rasters')
+        monkeypatch.setenv('DISABLE_LOCAL_ML', 'True')
+        predictor = XGBoostHabitatPredictor()
+        predictor.models['elephant'] = package
+        predictor.compiled['elephant'] = compile_model(package)
+        
+        result = predictor.predict_habitat(-2.0, 35.0, 'elephant', features={'ndvi': 0.8})
+        
+        row = predictor.build_features([-2.0], [35.0], 'elephant', package['feature_names'], overrides={'ndvi': 0.8})
+        expected = package['model'].predict_proba(package['scaler'].transform(row))[0, 1]
+        assert result['model'] == 'xgboost'
+        assert result['habitat_score'] == pytest.approx(float(expected), abs=1e-7)
+
+
+def write_environment_rasters(raster_dir, bounds, size=20):
+    """The eight environmental layers, each a west-to-east gradient over the bounds"""
+    rasterio = pytest.importorskip('rasterio')
+    import numpy as np
+    from rasterio.transform import from_bounds
+    
+    ramp = np.tile(np.linspace(0.0, 1.0, size, dtype='float32'), (size, 1))
+    layers = {
+        'ndvi': 0.1 + 0.8 * ramp,
+        'landcover': np.where(ramp < 0.5, 7, 10).astype('float32'),
+        'elevation': 1000 + 500 * ramp,
+        'rainfall': 400 + 800 * ramp,
+        'dist_water': 20 - 19 * ramp,
+        'dist_settlement': 2 + 30 * ramp,
+        'dist_roads': 1 + 10 * ramp,
+        'dist_protected_areas': 15 - 15 * ramp,
+    }
+    raster_dir.mkdir(parents=True, exist_ok=True)
+    for name, data in layers.items():
+        with rasterio.open(
+            raster_dir / f'{name}_raster_kenya_tanzania.tif', 'w', driver='GTiff', height=size, width=size,
+            count=1, dtype='float32', crs='EPSG:4326', transform=from_bounds(*bounds, size, size), nodata=-9999
+        ) as dst:
+            dst.write(data.astype('float32'), 1)
+
+
+@pytest.mark.ml
+class TestHabitatRasterFeatures:
+    @pytest.fixture
+    def env_predictor(self, habitat_predictor, settings, tmp_path):
+        write_environment_rasters(tmp_path / 'rasters', (34.0, -4.0, 36.0, -2.0))
+        settings.HABITAT_RASTER_CACHE_DIR = str(tmp_path / 'bands')
+        return habitat_predictor
+    
+    def test_samples_all_layers(self, env_predictor):
+        import numpy as np
+        
+        env = env_predictor.sample_environment([-3.0, -3.0, 0.0], [34.05, 35.95, 35.0])
+        
+        assert len(env_predictor.raster_stack.layers) == 8
+        assert env['ndvi'][0] == pytest.approx(0.1)
+        assert env['ndvi'][1] == pytest.approx(0.9)
+        assert list(env['land_cover'][:2]) == [7.0, 10.0]
+        assert env['distance_to_settlement_km'][1] == pytest.approx(32.0)
+        assert env['distance_to_roads_km'][0] == pytest.approx(1.0)
+        assert np.isnan(env['ndvi'][2])
+        assert env['land_cover'][2] == -1.0
+    
+    def test_batch_matches_single_points(self, env_predictor):
+        lats = [-3.0, -2.5, -3.5, 1.0]
+        lons = [34.1, 35.0, 35.9, 35.0]
+        
+        batch = env_predictor.predict_habitat_batch(lats, lons, 'elephant')
+        
+        assert len(batch) == 4
+        for result, lat, lon in zip(batch, lats, lons):
+            single = env_predictor.predict_habitat(lat, lon, 'elephant')
+            assert result['habitat_score'] == pytest.approx(single['habitat_score'])
+            assert result['model'] == single['model']
+        assert batch[0]['suitability'] == 'Low'
+        assert batch[2]['suitability'] == 'High'
+        assert batch[3]['model'] == 'default'
+    
+    def test_overrides_apply_before_derived_features(self, env_predictor):
+        X, env = env_predictor.feature_matrix([-3.0], [34.1], 'elephant', ['ndvi', 'land_cover_10'],
+                                              overrides={'landcover': 10, 'ndvi': 0.7})
+        
+        assert X.tolist() == [[0.7, 1.0]]
+        assert env['land_cover'][0] == 10.0
+    
+    def test_environment_data_from_rasters(self, env_predictor):
+        data = env_predictor.get_environment_data(-3.0, 35.95, species='elephant')
+        
+        features = data['features']
+        assert features['source'] == 'rasters'
+        assert features['ndvi'] == pytest.approx(0.9)
+        assert features['land_cover'] == 'grassland'
+        assert features['land_cover_code'] == 10
+        assert features['vegetation_density'] == 'dense'
+        assert features['rainfall_mm'] == pytest.approx(1200.0)
+        assert features['water_distance_km'] == pytest.approx(1.0)
+        assert data['habitat']['model'] == 'xgboost'
+    
+    def test_predict_endpoint_scores_points(self, api_client, env_predictor):
+        url = reverse('xgboost-predict')
+        points = [{'lat': -3.0, 'lon': 34.1}, {'lat': -3.0, 'lon': 35.9}]
+        
+        response = api_client.post(url, {'species': 'elephant', 'points': points}, format='json')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 2
+        assert response.data['features_used'] == ['ndvi', 'water_access_quality', 'land_cover_10']
+        scores = [result['habitat_score'] for result in response.data['results']]
+        assert scores[0] < 0.5 < scores[1]
+    
+    def test_predict_endpoint_single_point(self, api_client, env_predictor):
+        url = reverse('xgboost-predict')
+        
+        response = api_client.post(url, {'species': 'elephant', 'lat': -3.0, 'lon': 35.9}, format='json')
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['model'] == 'xgboost'
+        assert response.data['features_used'] == ['ndvi', 'water_access_quality', 'land_cover_10']
+    
+    def test_predict_endpoint_rejects_bad_points(self, api_client, env_predictor):
+        url = reverse('xgboost-predict')
+        
+        response = api_client.post(url, {'species': 'elephant', 'points': [{'lat': -3.0}]}, format='json')
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+    
+    def test_predict_endpoint_rejects_bad_features(self, api_client, env_predictor):
+        url = reverse('xgboost-predict')
+        point = {'species': 'elephant', 'lat': -3.0, 'lon': 35.9}
+        
+        for features in [{'ndvi': 'high'}, {'ndvi': None}, {'ndvi': True}, {'ndvi': [0.5]}, 'ndvi=0.5', [0.5]]:
+            response = api_client.post(url, dict(point, features=features), format='json')
+            assert response.status_code == status.HTTP_400_BAD_REQUEST, features
+        
+        response = api_client.post(url, dict(point, features={'ndvi': 0.1}), format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['model'] == 'xgboost'
+        assert response.data['habitat_score'] < 0.5
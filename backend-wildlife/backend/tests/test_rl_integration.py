@@ -0,0 +1,425 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+pytestmark = [pytest.mark.ml, pytest.mark.unit]
+
+
+@pytest.fixture
+def model_loader(tmp_path):
+    from ml_service.models.rl.integration.model_loader import ModelLoader
+    return ModelLoader(models_dir=str(tmp_path / 'models'))
+
+
+def hmm_frame(n=300, seed=0):
+    """HMM results with a shuffled, non-default index and a few rows without coordinates"""
+    rng = np.random.default_rng(seed)
+    behaviors = rng.choice(['Resting', 'Foraging', 'Traveling'], n)
+    df = pd.DataFrame({
+        'lat': rng.uniform(-4.0, -2.0, n),
+        'lon': rng.uniform(34.0, 36.0, n),
+        'state_prob_foraging': (behaviors == 'Foraging').astype(float),
+        'state_prob_resting': (behaviors == 'Resting').astype(float),
+        'state_prob_traveling': (behaviors == 'Traveling').astype(float),
+    }, index=rng.permutation(np.arange(1000, 1000 + 2 * n, 2)))
+    df.iloc[::37, 0] = np.nan
+    return df
+
+
+class TestSpatialIndex:
+    def test_batch_lookup_matches_brute_force(self, model_loader):
+        df = hmm_frame()
+        model_loader.hmm_models['elephant'] = df
+        model_loader._build_hmm_index('elephant', df)
+
+        rng = np.random.default_rng(1)
+        lats = rng.uniform(-4.2, -1.8, 50)
+        lons = rng.uniform(33.8, 36.2, 50)
+        probs = model_loader.get_hmm_state_probs_batch('elephant', lats, lons)
+
+        columns = ['state_prob_foraging', 'state_prob_resting', 'state_prob_traveling']
+        for i, (lat, lon) in enumerate(zip(lats, lons)):
+            label = ((df['lat'] - lat) ** 2 + (df['lon'] - lon) ** 2).idxmin()
+            assert probs[i].tolist() == df.loc[label, columns].tolist()
+
+    def test_single_lookup_matches_batch(self, model_loader):
+        df = hmm_frame()
+        model_loader.hmm_models['elephant'] = df
+        model_loader._build_hmm_index('elephant', df)
+
+        single = model_loader.get_hmm_state_probs('elephant', -3.1, 35.2)
+        batch = model_loader.get_hmm_state_probs_batch('elephant', [-3.1], [35.2])[0]
+
+        assert [single[state] for state in ('foraging', 'resting', 'traveling')] == batch.tolist()
+
+    def test_brute_force_fallback_matches_tree(self):
+        from ml_service.models.rl.integration.model_loader import SpatialIndex
+
+        df = hmm_frame()
+        index = SpatialIndex(df['lat'].to_numpy(), df['lon'].to_numpy(), df['state_prob_foraging'].to_numpy())
+        brute = SpatialIndex(df['lat'].to_numpy(), df['lon'].to_numpy(), df['state_prob_foraging'].to_numpy())
+        brute.tree = None
+
+        rng = np.random.default_rng(2)
+        lats, lons = rng.uniform(-4, -2, 40), rng.uniform(34, 36, 40)
+        assert np.array_equal(index.query(lats, lons), brute.query(lats, lons))
+        assert len(index) == df['lat'].notna().sum()
+
+
+class TestGridRasters:
+    BBOX = (34.0, -4.0, 36.0, -2.0)
+
+    def load(self, loader, df):
+        loader.hmm_models['elephant'] = df
+        loader._build_hmm_index('elephant', df)
+
+    def test_raster_matches_cell_lookups(self, model_loader):
+        self.load(model_loader, hmm_frame())
+
+        raster = model_loader.rasterize_hmm_state_probs('elephant', 8, self.BBOX)
+
+        assert raster.shape == (8, 8, 3)
+        for x, y in [(0, 0), (3, 5), (7, 2)]:
+            lon = self.BBOX[0] + x / 8 * (self.BBOX[2] - self.BBOX[0])
+            lat = self.BBOX[1] + y / 8 * (self.BBOX[3] - self.BBOX[1])
+            expected = model_loader.get_hmm_state_probs_batch('elephant', [lat], [lon])[0]
+            assert raster[x, y].tolist() == expected.astype(np.float32).tolist()
+
+    def test_raster_is_reloaded_not_rebuilt(self, model_loader, tmp_path, monkeypatch):
+        from ml_service.models.rl.integration.model_loader import ModelLoader
+
+        df = hmm_frame()
+        self.load(model_loader, df)
+        first = np.array(model_loader.rasterize_hmm_state_probs('elephant', 8, self.BBOX))
+        cache_files = list(model_loader.grid_cache_dir.glob('hmm_elephant_8_*.npy'))
+        assert len(cache_files) == 1
+
+        reloaded = ModelLoader(models_dir=str(tmp_path / 'models'))
+        self.load(reloaded, df)
+
+        def rebuild(*args, **kwargs):
+            raise AssertionError("raster was rebuilt instead of loaded from the cache")
+
+        monkeypatch.setattr(reloaded, 'get_hmm_state_probs_batch', rebuild)
+        second = reloaded.rasterize_hmm_state_probs('elephant', 8, self.BBOX)
+
+        assert isinstance(second, np.memmap)
+        assert np.array_equal(first, second)
+        assert reloaded.rasterize_hmm_state_probs('elephant', 8, self.BBOX) is second
+
+    def test_changed_results_get_a_new_key(self, model_loader):
+        self.load(model_loader, hmm_frame(seed=0))
+        model_loader.rasterize_hmm_state_probs('elephant', 8, self.BBOX)
+
+        self.load(model_loader, hmm_frame(seed=3))
+        model_loader.rasterize_hmm_state_probs('elephant', 8, self.BBOX)
+        model_loader.rasterize_hmm_state_probs('elephant', 16, self.BBOX)
+
+        assert len(list(model_loader.grid_cache_dir.glob('hmm_elephant_8_*.npy'))) == 2
+        assert len(list(model_loader.grid_cache_dir.glob('hmm_elephant_16_*.npy'))) == 1
+
+
+def write_geotiff(path, data, bounds, nodata=-9999):
+    rasterio = pytest.importorskip('rasterio')
+    from rasterio.transform import from_bounds
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    height, width = data.shape
+    with rasterio.open(
+        path, 'w', driver='GTiff', height=height, width=width, count=1, dtype=str(data.dtype),
+        crs='EPSG:4326', transform=from_bounds(*bounds, width, height), nodata=nodata
+    ) as dst:
+        dst.write(data, 1)
+    return path
+
+
+class TestDataConnectorRasters:
+    BOUNDS = (34.0, -4.0, 36.0, -2.0)
+
+    @pytest.fixture
+    def raster(self, tmp_path):
+        data = np.arange(64 * 64, dtype='float32').reshape(64, 64)
+        data[10, 20] = -9999
+        return write_geotiff(tmp_path / 'ndvi.tif', data, self.BOUNDS), data
+
+    @pytest.fixture
+    def connector(self, tmp_path):
+        from ml_service.models.rl.integration.data_connector import DataConnector
+        return DataConnector(cache_dir=str(tmp_path / 'cache'), tile_size=16, max_cached_tiles=4)
+
+    def test_batch_sampling_matches_rowcol(self, connector, raster):
+        import rasterio
+        from rasterio.transform import rowcol
+
+        path, data = raster
+        rng = np.random.default_rng(0)
+        lats = rng.uniform(-3.99, -2.01, 200)
+        lons = rng.uniform(34.01, 35.99, 200)
+
+        values = connector.sample_raster_file(str(path), lats, lons)
+
+        with rasterio.open(path) as src:
+            rows, cols = rowcol(src.transform, lons, lats)
+        expected = data[np.asarray(rows), np.asarray(cols)].astype(float)
+        expected[expected == -9999] = np.nan
+        np.testing.assert_array_equal(values, expected)
+
+        loaded = connector.load_environmental_raster('ndvi', str(path))
+        np.testing.assert_array_equal(connector.sample_raster(loaded, lats, lons), expected)
+
+    def test_nodata_and_outside_points_are_nan(self, connector, raster):
+        path, data = raster
+        # Centre of pixel (10, 20), which holds nodata, then points west, north and south of the raster
+        lats = [-2.0 - 10.5 / 32, -3.0, 1.0, -4.5]
+        lons = [34.0 + 20.5 / 32, 33.5, 35.0, 35.0]
+
+        values = connector.sample_raster_file(str(path), lats, lons)
+        assert np.isnan(values).all()
+
+        loaded = connector.load_environmental_raster('ndvi', str(path))
+        assert np.isnan(connector.sample_raster(loaded, lats, lons)).all()
+
+    def test_bbox_window_reads_only_needed_tiles(self, connector, raster):
+        path, data = raster
+        # 1 x 0.5 degrees in the north-west corner: rows 0-15, columns 0-31
+        loaded = connector.load_environmental_raster('ndvi', str(path), bbox=(34.0, -2.5, 35.0, -2.0))
+
+        np.testing.assert_array_equal(loaded['data'], data[0:16, 0:32])
+        assert set(key[2:] for key in connector.tile_cache) == {(0, 0), (0, 1)}
+        assert tuple(loaded['bounds']) == pytest.approx((34.0, -2.5, 35.0, -2.0))
+
+        lats, lons = [-2.1, -2.4], [34.1, 34.9]
+        np.testing.assert_array_equal(
+            connector.sample_raster(loaded, lats, lons),
+            connector.sample_raster_file(str(path), lats, lons)
+        )
+
+    def test_tile_cache_evicts_least_recently_used(self, connector, raster):
+        path, _ = raster
+        # The four tiles of the top tile row, the first one again, then a fifth tile below it
+        lons = [34.0 + (16 * i + 8) / 32 for i in range(4)]
+        for lon in lons:
+            connector.sample_raster_file(str(path), [-2.1], [lon])
+        connector.sample_raster_file(str(path), [-2.1], [lons[0]])
+        connector.sample_raster_file(str(path), [-2.6], [lons[0]])
+
+        tiles = [key[2:] for key in connector.tile_cache]
+        assert len(tiles) == 4
+        assert (0, 1) not in tiles
+        assert tiles[-2:] == [(0, 0), (1, 0)]
+
+    def test_feature_batch_matches_single_points(self, connector, raster):
+        path, _ = raster
+        rasters = {'ndvi': connector.load_environmental_raster('ndvi', str(path))}
+        lats, lons = [-2.5, -3.5, 1.0], [34.5, 35.5, 35.0]
+
+        batch = connector.extract_environmental_features_batch(lats, lons, rasters)
+
+        for i, (lat, lon) in enumerate(zip(lats, lons)):
+            single = connector.extract_environmental_features(lat, lon, rasters)
+            assert single == {name: float(values[i]) for name, values in batch.items()}
+        assert batch['ndvi'][2] == 0.5
+
+
+def legacy_sample(path, lats, lons, fill=np.nan, dtype=np.float32):
+    """Per-layer open/read/rowcol extraction used before RasterStack"""
+    import rasterio
+    from rasterio.transform import rowcol
+
+    with rasterio.open(path) as src:
+        rows, cols = rowcol(src.transform, lons, lats)
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        valid_mask = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+        values = np.full(len(lons), fill, dtype=dtype)
+        raster_data = src.read(1)
+        values[valid_mask] = raster_data[rows[valid_mask], cols[valid_mask]]
+        if src.nodata is not None:
+            values[values == src.nodata] = fill
+    return values
+
+
+class TestRasterStack:
+    BOUNDS = (34.0, -4.0, 36.0, -2.0)
+    LAYERS = ('ndvi', 'landcover', 'elevation', 'rainfall', 'dist_water', 'dist_settlement', 'dist_roads')
+
+    @pytest.fixture
+    def raster_dir(self, tmp_path):
+        rng = np.random.default_rng(0)
+        for name in self.LAYERS:
+            if name == 'landcover':
+                data = rng.integers(0, 17, (30, 40)).astype('float32')
+            else:
+                data = rng.uniform(0, 1000, (30, 40)).astype('float32')
+            data[rng.random(data.shape) < 0.05] = -9999
+            write_geotiff(tmp_path / 'rasters' / f'{name}_raster_kenya_tanzania.tif', data, self.BOUNDS)
+        return tmp_path / 'rasters'
+
+    @pytest.fixture
+    def points(self):
+        rng = np.random.default_rng(1)
+        return rng.uniform(-4.3, -1.7, 500), rng.uniform(33.7, 36.3, 500)
+
+    def test_sample_matches_per_layer_extraction(self, raster_dir, points, tmp_path):
+        from ml_service.core.raster_stack import RasterStack
+
+        lats, lons = points
+        stack = RasterStack.from_directory(raster_dir, cache_dir=tmp_path / 'bands')
+        samples = stack.sample(lats, lons)
+
+        assert stack.layers == self.LAYERS
+        assert stack.aligned
+        for name in self.LAYERS:
+            path = raster_dir / f'{name}_raster_kenya_tanzania.tif'
+            if name == 'landcover':
+                expected = legacy_sample(path, lats, lons, fill=-1, dtype=np.int32)
+                actual = np.where(np.isnan(samples[name]), -1, samples[name]).astype(np.int32)
+                np.testing.assert_array_equal(actual, expected)
+            else:
+                np.testing.assert_array_equal(samples[name].astype(np.float32), legacy_sample(path, lats, lons))
+
+    def test_pipeline_extraction_matches_per_layer_extraction(self, raster_dir, points):
+        pytest.importorskip('pydantic_settings')
+        pytest.importorskip('xgboost')
+        from ml_service.models.xgboost_habitat_modeling import extract_environmental_data_from_rasters
+
+        lats, lons = points
+        df = extract_environmental_data_from_rasters(pd.DataFrame({'lat': lats, 'lon': lons}), str(raster_dir))
+
+        columns = {'ndvi': 'ndvi', 'elevation': 'elevation', 'rainfall': 'rainfall_mm',
+                   'dist_water': 'distance_to_water_km', 'dist_settlement': 'distance_to_settlement_km',
+                   'dist_roads': 'distance_to_roads_km'}
+        for layer, column in columns.items():
+            expected = legacy_sample(raster_dir / f'{layer}_raster_kenya_tanzania.tif', lats, lons)
+            np.testing.assert_array_equal(df[column].to_numpy(), expected)
+        landcover = legacy_sample(raster_dir / 'landcover_raster_kenya_tanzania.tif', lats, lons, fill=-1, dtype=np.int32)
+        np.testing.assert_array_equal(df['land_cover'].to_numpy(), landcover)
+        # No protected-areas layer: the training fallback applies
+        np.testing.assert_allclose(df['distance_to_protected_areas_km'], (1 - df['ndvi']) * 10)
+
+    def test_bands_are_cached_and_memory_mapped(self, raster_dir, tmp_path):
+        from ml_service.core.raster_stack import RasterStack
+
+        first = RasterStack.from_directory(raster_dir, cache_dir=tmp_path / 'bands')
+        band = first.band('ndvi')
+        second = RasterStack.from_directory(raster_dir, cache_dir=tmp_path / 'bands')
+        second._datasets = {}
+
+        assert isinstance(band, np.memmap)
+        assert np.array_equal(second.band('ndvi'), band)
+        assert [p.name for p in (tmp_path / 'bands').iterdir() if 'tmp' in p.name] == []
+
+    def test_env_rasters_come_from_the_shared_stack(self, raster_dir, tmp_path):
+        from ml_service.core import raster_stack
+        from ml_service.models.rl.integration.data_connector import DataConnector
+
+        path = str(raster_dir / 'ndvi_raster_kenya_tanzania.tif')
+        first = DataConnector(cache_dir=str(tmp_path / 'cache_a')).load_environmental_raster('ndvi', path)
+        second = DataConnector(cache_dir=str(tmp_path / 'cache_b')).load_environmental_raster('ndvi', path)
+
+        stack = raster_stack.get_raster_stack(raster_dir)
+        assert first['data'] is stack.band('ndvi')
+        assert second['data'] is first['data']
+        assert first['transform'] == stack.meta['ndvi']['transform']
+        lats, lons = [-3.01, -2.23, -5.0], [35.01, 34.31, 35.0]
+        connector = DataConnector(cache_dir=str(tmp_path / 'cache_a'))
+        np.testing.assert_array_equal(connector.sample_raster(first, lats, lons), legacy_sample(path, lats, lons))
+
+        cropped = DataConnector(cache_dir=str(tmp_path / 'cache_c')).load_environmental_raster(
+            'ndvi', path, bbox=(34.0, -3.0, 35.0, -2.0)
+        )
+        assert not isinstance(cropped['data'], np.memmap)
+        assert cropped['data'].shape == (15, 20)
+
+
+class CountingLSTM:
+    """LSTM stand-in whose output depends on every sequence and that counts forward passes"""
+    input_shape = (None, 12, 13)
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, X, verbose=0):
+        self.calls += 1
+        return np.stack([X.mean(axis=(1, 2)), X[:, -1, 0] - X[:, 0, 1], X[:, :, 2].max(axis=1)], axis=1)
+
+
+class TestBatchedLSTMForecasts:
+    def test_batch_matches_single_sequences(self, model_loader):
+        model_loader.lstm_model = CountingLSTM()
+        histories = np.random.default_rng(0).random((4, 10, 13))
+
+        batch = model_loader.predict_temporal_trends_batch(histories, forecast_steps=5)
+        assert model_loader.lstm_model.calls == 1
+
+        for history, forecast in zip(histories, batch):
+            single = model_loader.predict_temporal_trends(history, forecast_steps=5)
+            assert single.keys() == forecast.keys()
+            for key in single:
+                np.testing.assert_array_equal(single[key], forecast[key])
+
+    @pytest.fixture
+    def envs(self, model_loader):
+        pytest.importorskip('gymnasium')
+        pytest.importorskip('pygame')
+        from ml_service.models.rl.environment.custom_env import WildlifeCorridorEnv
+
+        model_loader.lstm_model = CountingLSTM()
+        rng = np.random.default_rng(1)
+        envs = []
+        for i in range(3):
+            # The constructor loads the real GPS data; only the state the forecasts read is set up
+            env = WildlifeCorridorEnv.__new__(WildlifeCorridorEnv)
+            env.model_loader = model_loader
+            env.update_frequency = 4
+            env.max_steps = 100
+            env.batched_lstm_updates = False
+            env.lstm_forecasts = {}
+            env._raster_means = {}
+            env.climate_shift, env.drought_intensity, env.season = 0.01 * i, 0.0, 'wet'
+            env.animals, env.conflicts = [], i
+            env.environmental_rasters = {
+                name: {'data': rng.random((6, 6)) * scale}
+                for name, scale in (('ndvi', 1), ('rainfall', 100), ('elevation', 2000))
+            }
+            env.habitat_quality = rng.random((8, 8)).astype(np.float32)
+            env.corridor_strength = rng.random((8, 8)).astype(np.float32)
+            env.current_step = 10 * i
+            envs.append(env)
+        return envs
+
+    def test_env_batch_matches_per_env_updates(self, envs, model_loader):
+        from ml_service.models.rl.environment.custom_env import WildlifeCorridorEnv
+
+        expected = []
+        for env in envs:
+            env._update_lstm_forecasts()
+            expected.append(env.lstm_forecasts)
+        model_loader.lstm_model.calls = 0
+
+        WildlifeCorridorEnv.update_lstm_forecasts_batch(envs)
+
+        assert model_loader.lstm_model.calls == 1
+        assert all(env.batched_lstm_updates for env in envs)
+        for env, forecast in zip(envs, expected):
+            for key in forecast:
+                np.testing.assert_array_equal(env.lstm_forecasts[key], forecast[key])
+        assert envs[0].lstm_forecasts['ndvi_trend'][0] != envs[1].lstm_forecasts['ndvi_trend'][0]
+
+    def test_refresher_drives_the_batched_update(self, envs, model_loader):
+        from ml_service.models.rl.environment.custom_env import BatchedLSTMForecasts
+
+        forecasts = BatchedLSTMForecasts(envs)
+        assert model_loader.lstm_model.calls == 1
+        assert all(env.batched_lstm_updates for env in envs)
+
+        for env in envs:
+            env.current_step += 1
+        for _ in range(7):
+            forecasts.step()
+        assert model_loader.lstm_model.calls == 2
+
+        expected = [model_loader.predict_temporal_trends(env._lstm_history()) for env in envs]
+        forecasts.step()
+        assert model_loader.lstm_model.calls == 2 + len(envs) + 1
+        for env, forecast in zip(envs, expected):
+            np.testing.assert_array_equal(env.lstm_forecasts['ndvi_trend'], forecast['ndvi_trend'])
@@ -280,3 +280,326 @@ class TestObservationAPI:
         results = response.data.get('results', response.data) if isinstance(response.data, dict) else response.data
         assert len(results) >= 1
 
+
+@pytest.mark.unit
+@pytest.mark.ml
+class TestHMMForwardFilter:
+    @pytest.fixture
+    def hmm_model(self):
+        hmm = pytest.importorskip('hmmlearn.hmm')
+        import numpy as np
+        
+        model = hmm.GaussianHMM(n_components=3, covariance_type='full', init_params='')
+        model.startprob_ = np.array([0.6, 0.3, 0.1])
+        model.transmat_ = np.array([
+            [0.8, 0.15, 0.05],
+            [0.2, 0.6, 0.2],
+            [0.05, 0.25, 0.7]
+        ])
+        model.means_ = np.array([[0.2, 10.0], [2.0, 90.0], [8.0, 20.0]])
+        model.covars_ = np.array([
+            [[0.1, 0.0], [0.0, 100.0]],
+            [[1.0, 0.5], [0.5, 900.0]],
+            [[4.0, -1.0], [-1.0, 200.0]]
+        ])
+        return model
+    
+    @pytest.fixture
+    def predictor(self, hmm_model, settings):
+        from django.core.cache import cache
+        from apps.tracking.hmm_loader import HMMBehaviorPredictor
+        
+        settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        cache.clear()
+        predictor = HMMBehaviorPredictor()
+        predictor.models = {'elephant': hmm_model}
+        predictor.models_loaded = True
+        return predictor
+    
+    def test_single_point_matches_viterbi(self, predictor, hmm_model):
+        import numpy as np
+        
+        for speed, angle in [(0.1, 5.0), (2.5, 100.0), (9.0, 15.0)]:
+            expected = int(hmm_model.predict(np.array([[speed, angle]]))[0])
+            behavior = predictor.predict_behavior(speed, angle, species='elephant')
+            assert behavior == predictor.STATE_MAPPING[expected]
+    
+    def test_update_behavior_matches_filtered_posterior(self, predictor, hmm_model):
+        import numpy as np
+        
+        fixes = np.array([[0.1, 5.0], [0.3, 20.0], [2.2, 80.0], [7.5, 25.0], [8.1, 18.0]])
+        start = timezone.now()
+        
+        for i, (speed, angle) in enumerate(fixes):
+            result = predictor.update_behavior(
+                'animal-1', speed, angle, species='elephant',
+                timestamp=start + timedelta(minutes=i)
+            )
+            # The filtered distribution equals the smoothed posterior at the end of the prefix
+            expected = hmm_model.predict_proba(fixes[:i + 1])[-1]
+            probabilities = [result['behavior_probabilities'][predictor.STATE_MAPPING[k]] for k in range(3)]
+            
+            assert result['model_used'] == 'hmm'
+            assert np.allclose(probabilities, expected)
+            assert result['behavior'] == predictor.STATE_MAPPING[int(np.argmax(expected))]
+    
+    def test_repeated_fix_does_not_update(self, predictor):
+        timestamp = timezone.now()
+        first = predictor.update_behavior('animal-2', 0.1, 5.0, species='elephant', timestamp=timestamp)
+        repeated = predictor.update_behavior('animal-2', 9.0, 15.0, species='elephant', timestamp=timestamp)
+        
+        assert repeated == first
+    
+    def test_analyze_sequence_uses_model_where_features_fit(self, predictor):
+        points = [{'speed_kmh': 0.1, 'directional_angle': 5.0}] + [
+            {'speed_kmh': 7.5, 'directional_angle': None} for _ in range(4)
+        ]
+        analyzed = predictor.analyze_movement_sequence(points, species='elephant')
+        
+        # Later points carry speed and previous speed, which the two-feature model also accepts
+        assert all(point['behavior_probabilities'] is not None for point in analyzed)
+        assert all(abs(sum(point['behavior_probabilities'].values()) - 1) < 1e-9 for point in analyzed)
+        assert analyzed[0]['behavior_state'] == predictor.STATE_RESTING
+    
+    def test_rule_fallback_without_model(self, predictor):
+        result = predictor.update_behavior('animal-3', 0.1, 5.0, species='wildebeest')
+        
+        assert result['model_used'] == 'rule_based'
+        assert result['behavior'] == predictor.STATE_RESTING
+
+@pytest.mark.unit
+@pytest.mark.ml
+class TestHMMSequenceDecoding:
+    hmm_model = TestHMMForwardFilter.hmm_model
+    predictor = TestHMMForwardFilter.predictor
+    
+    def test_viterbi_and_posteriors_match_hmmlearn(self, predictor, hmm_model):
+        import numpy as np
+        
+        rng = np.random.default_rng(0)
+        X = np.column_stack([rng.gamma(1.5, 2.0, 500), rng.uniform(0, 180, 500)])
+        log_emissions = predictor._emission_log_likelihood(hmm_model, 'elephant', X)
+        
+        assert np.allclose(log_emissions, hmm_model._compute_log_likelihood(X))
+        assert np.array_equal(predictor._viterbi(hmm_model, log_emissions), hmm_model.decode(X)[1])
+        assert np.allclose(predictor._forward_backward(hmm_model, log_emissions), hmm_model.predict_proba(X))
+    
+    def test_numpy_fallback_matches_compiled_kernels(self, predictor, hmm_model, monkeypatch):
+        import numpy as np
+        from apps.tracking import hmm_loader
+        
+        rng = np.random.default_rng(3)
+        X = np.column_stack([rng.gamma(1.5, 2.0, 200), rng.uniform(0, 180, 200)])
+        log_emissions = predictor._emission_log_likelihood(hmm_model, 'elephant', X)
+        
+        monkeypatch.setattr(hmm_loader, '_hmmc', None)
+        
+        assert np.array_equal(predictor._viterbi(hmm_model, log_emissions), hmm_model.decode(X)[1])
+        assert np.allclose(predictor._forward_backward(hmm_model, log_emissions), hmm_model.predict_proba(X))
+    
+    def test_batch_rules_match_scalar_rules(self, predictor):
+        import numpy as np
+        
+        rng = np.random.default_rng(1)
+        points = [
+            {
+                'speed_kmh': float(speed),
+                'directional_angle': None if missing else float(angle)
+            }
+            for speed, angle, missing in zip(
+                rng.uniform(0, 15, 300), rng.uniform(0, 360, 300), rng.random(300) < 0.1
+            )
+        ]
+        
+        decoded = predictor.decode_sequence(points, species='wildebeest')
+        
+        assert decoded['model_used'] == 'rule_based'
+        for i, point in enumerate(points):
+            previous = points[i - 1] if i > 0 else {}
+            expected = predictor._predict_with_rules(
+                point['speed_kmh'], point['directional_angle'],
+                previous.get('speed_kmh'), previous.get('directional_angle'), 'wildebeest'
+            )
+            assert decoded['behaviors'][i] == expected
+    
+    def test_long_window_decodes_in_one_pass(self, predictor, hmm_model, monkeypatch):
+        import numpy as np
+        
+        rng = np.random.default_rng(2)
+        # 30 days of fixes every five minutes
+        speeds = rng.gamma(1.5, 2.0, 30 * 24 * 12)
+        points = [{'speed_kmh': float(speed), 'directional_angle': None} for speed in speeds]
+        
+        passes = []
+        viterbi = predictor._viterbi
+        
+        def counting_viterbi(model, log_emissions):
+            passes.append(log_emissions.shape)
+            return viterbi(model, log_emissions)
+        
+        monkeypatch.setattr(predictor, '_viterbi', counting_viterbi)
+        decoded = predictor.decode_sequence(points, species='elephant')
+        
+        # Points after the first carry (speed, previous speed); the first is a missing observation
+        log_emissions = np.zeros((len(points), 3))
+        log_emissions[1:] = hmm_model._compute_log_likelihood(np.column_stack([speeds[1:], speeds[:-1]]))
+        
+        assert passes == [(len(points), 3)]
+        assert decoded['model_used'] == 'hmm'
+        assert decoded['states'] == viterbi(hmm_model, log_emissions).tolist()
+        assert decoded['behavior_probabilities'][0] is None
+        assert all(row is not None for row in decoded['behavior_probabilities'][1:])
+
+
+@pytest.fixture
+def lstm_tracker(monkeypatch, tmp_path):
+    tf = pytest.importorskip('tensorflow')
+    import numpy as np
+    from sklearn.preprocessing import StandardScaler
+    from ml_service.core import online_learner
+    from ml_service.core.realtime_tracker import RealTimeTracker
+    
+    monkeypatch.setattr(online_learner, 'ONLINE_LSTM_DIR', tmp_path)
+    monkeypatch.setattr(RealTimeTracker, '_load_all_models', lambda self: None)
+    
+    tf.keras.utils.set_random_seed(0)
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(10, 3)),
+        tf.keras.layers.LSTM(4),
+        tf.keras.layers.Dense(3)
+    ])
+    rng = np.random.default_rng(0)
+    # Flattened windows: (lat, lon, speed) repeated for each of the 10 steps
+    scaler_x = StandardScaler().fit(np.tile(np.column_stack([
+        rng.normal(-2.0, 0.05, 200), rng.normal(34.0, 0.05, 200), rng.gamma(2.0, 2.0, 200)
+    ]), 10))
+    scaler_y = StandardScaler().fit(np.column_stack([
+        rng.normal(-2.0, 0.05, 200), rng.normal(34.0, 0.05, 200), rng.uniform(0, 1, 200)
+    ]))
+    
+    tracker = RealTimeTracker()
+    tracker.lstm_models['elephant'] = model
+    tracker.lstm_scalers['elephant'] = {'x': scaler_x, 'y': scaler_y}
+    return tracker
+
+@pytest.fixture
+def online_worker(lstm_tracker, tmp_path):
+    from ml_service.core.online_learner import OnlineLSTMLearner
+    from apps.tracking.online_learning import OnlineLearningWorker
+    
+    learner = OnlineLSTMLearner(artifact_dir=tmp_path, tracker=lstm_tracker, min_windows=16, epochs=1)
+    return OnlineLearningWorker(learner=learner, state_path=tmp_path / 'watermark.json', batch_size=1000)
+
+def create_fixes(animal, count, start):
+    return [
+        TrackingFactory.create(
+            animal=animal, lat=-2.0 + 0.001 * i, lon=34.0 + 0.002 * i,
+            speed_kmh=3.0 + (i % 4), timestamp=start + timedelta(minutes=30 * i)
+        )
+        for i in range(count)
+    ]
+
+@pytest.mark.unit
+@pytest.mark.ml
+class TestOnlineLSTMLearning:
+    def test_new_fixes_publish_and_swap_model(self, online_worker, lstm_tracker, sample_animal, tmp_path):
+        import pandas as pd
+        
+        base_model = lstm_tracker.lstm_models['elephant']
+        fixes = create_fixes(sample_animal, 30, timezone.now() - timedelta(days=1))
+        
+        result = online_worker.run_once()
+        
+        assert result['rows'] == 30
+        assert result['windows'] == 20
+        assert result['published'] == {'elephant': 1}
+        assert (tmp_path / 'elephant' / 'LATEST').read_text() == '1'
+        assert lstm_tracker.lstm_versions['elephant'] == 1
+        assert lstm_tracker.lstm_models['elephant'] is not base_model
+        
+        history = pd.DataFrame([{'lat': f.lat, 'lon': f.lon, 'speed_kmh': f.speed_kmh} for f in fixes])
+        predicted = lstm_tracker.predict_with_lstm(fixes[-1].lat, fixes[-1].lon, history, 'elephant')
+        assert all(isinstance(value, float) for value in predicted)
+    
+    def test_watermark_consumes_each_fix_once(self, online_worker, sample_animal, tmp_path):
+        from apps.tracking.online_learning import OnlineLearningWorker
+        
+        start = timezone.now() - timedelta(days=2)
+        create_fixes(sample_animal, 12, start)
+        
+        first = online_worker.run_once()
+        assert (first['rows'], first['windows'], first['published']) == (12, 2, {})
+        assert online_worker.run_once()['rows'] == 0
+        
+        TrackingFactory.create(animal=sample_animal, lat=-1.9, lon=34.1, speed_kmh=4.0,
+                               timestamp=start + timedelta(hours=7))
+        assert online_worker.run_once()['windows'] == 1
+        
+        # A restarted worker resumes from the stored watermark and rebuilds the tail from the database
+        restarted = OnlineLearningWorker(
+            learner=type(online_worker.learner)(artifact_dir=tmp_path, min_windows=16),
+            state_path=tmp_path / 'watermark.json'
+        )
+        TrackingFactory.create(animal=sample_animal, lat=-1.89, lon=34.11, speed_kmh=4.0,
+                               timestamp=start + timedelta(hours=8))
+        result = restarted.run_once()
+        assert (result['rows'], result['windows']) == (1, 1)
+    
+    def test_restart_keeps_pending_windows(self, online_worker, lstm_tracker, sample_animal, tmp_path):
+        import json
+        from apps.tracking.online_learning import OnlineLearningWorker
+        
+        start = timezone.now() - timedelta(days=2)
+        create_fixes(sample_animal, 12, start)
+        assert online_worker.run_once()['published'] == {}
+        
+        state = json.loads((tmp_path / 'watermark.json').read_text())
+        assert (tmp_path / state['pending']).exists()
+        
+        # The two windows below min_windows survive the restart and are trained on with the next fixes
+        restarted = OnlineLearningWorker(
+            learner=type(online_worker.learner)(artifact_dir=tmp_path, tracker=lstm_tracker, min_windows=16, epochs=1),
+            state_path=tmp_path / 'watermark.json'
+        )
+        assert restarted.learner.pending_windows('elephant') == 2
+        
+        create_fixes(sample_animal, 14, start + timedelta(hours=6))
+        result = restarted.run_once()
+        
+        assert (result['rows'], result['windows'], result['published']) == (14, 14, {'elephant': 1})
+        metadata = json.loads((tmp_path / 'elephant' / 'v0001' / 'metadata.json').read_text())
+        assert metadata['windows'] == 16
+        
+        state = json.loads((tmp_path / 'watermark.json').read_text())
+        assert state['pending'] is None
+        assert not list(tmp_path.glob('watermark.pending-*.npz'))
+    
+    def test_failed_fine_tune_keeps_pending_windows(self, online_worker, sample_animal, monkeypatch):
+        learner = online_worker.learner
+        create_fixes(sample_animal, 30, timezone.now() - timedelta(days=1))
+        
+        def failing_fine_tune(species, X, targets):
+            raise RuntimeError('out of memory')
+        
+        monkeypatch.setattr(learner, 'fine_tune', failing_fine_tune)
+        with pytest.raises(RuntimeError):
+            online_worker.run_once()
+        assert learner.pending_windows('elephant') == 20
+        
+        # The windows are trained on once fine-tuning works again
+        del learner.fine_tune
+        assert learner.update() == {'elephant': 1}
+        assert learner.pending_windows('elephant') == 0
+    
+    def test_tracker_reloads_published_version(self, online_worker, lstm_tracker, sample_animal):
+        from ml_service.core.realtime_tracker import RealTimeTracker
+        
+        create_fixes(sample_animal, 30, timezone.now() - timedelta(days=1))
+        online_worker.run_once()
+        
+        other_process = RealTimeTracker()
+        other_process._refresh_published_lstm('elephant', force=True)
+        
+        assert other_process.lstm_versions['elephant'] == 1
+        assert other_process.lstm_models['elephant'].input_shape == (None, 10, 3)
+        assert not lstm_tracker.swap_lstm_model('elephant', None, {}, 1)
@@ -289,6 +289,28 @@ SUPABASE_JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')
 ML_SERVICE_URL = os.getenv('ML_SERVICE_URL', 'http://localhost:8001')
 ML_SERVICE_API_KEY = os.getenv('ML_SERVICE_API_KEY', None)
 
+# Online LSTM fine-tuning from new tracking fixes (apps/tracking/online_learning.py)
+ONLINE_LSTM_DIR = os.getenv('ONLINE_LSTM_DIR', str(BASE_DIR / 'ml_service' / 'data' / 'lstm' / 'online'))
+ONLINE_LSTM_INTERVAL = int(os.getenv('ONLINE_LSTM_INTERVAL', '300'))
+ONLINE_LSTM_BATCH_SIZE = int(os.getenv('ONLINE_LSTM_BATCH_SIZE', '5000'))
+ONLINE_LSTM_MIN_WINDOWS = int(os.getenv('ONLINE_LSTM_MIN_WINDOWS', '64'))
+ONLINE_LSTM_EPOCHS = int(os.getenv('ONLINE_LSTM_EPOCHS', '2'))
+
+# Habitat suitability grids (XGBoost models scored over the environmental rasters)
+HABITAT_RASTER_DIR = os.getenv('HABITAT_RASTER_DIR', str(BASE_DIR / 'ml_service' / 'data' / 'rasters'))
+# Memory-mapped decoded raster bands shared by the server workers (system temp dir if unset)
+HABITAT_RASTER_CACHE_DIR = os.getenv('HABITAT_RASTER_CACHE_DIR')
+HABITAT_MAX_POINTS = int(os.getenv('HABITAT_MAX_POINTS', '10000'))
+HABITAT_GRID_MAX_ZOOM = int(os.getenv('HABITAT_GRID_MAX_ZOOM', '10'))
+HABITAT_GRID_MAX_CELLS = int(os.getenv('HABITAT_GRID_MAX_CELLS', '250000'))
+HABITAT_GRID_MAX_TILES = int(os.getenv('HABITAT_GRID_MAX_TILES', '64'))
+HABITAT_TILE_CACHE_TIMEOUT = int(os.getenv('HABITAT_TILE_CACHE_TIMEOUT', '86400'))
+HABITAT_TILE_DIR = os.getenv('HABITAT_TILE_DIR', str(BASE_DIR / 'ml_service' / 'data' / 'habitat_tiles'))
+# Area and zoom levels of the precomputed tile pyramid (the RL DEFAULT_BBOX)
+HABITAT_TILE_BBOX = (29.0, -12.0, 42.0, 5.5)  # min_lon, min_lat, max_lon, max_lat
+HABITAT_TILE_MIN_ZOOM = int(os.getenv('HABITAT_TILE_MIN_ZOOM', '4'))
+HABITAT_TILE_MAX_ZOOM = int(os.getenv('HABITAT_TILE_MAX_ZOOM', '8'))
+
 # Geographic bounds for filtering tracking data
 # Kenya/Tanzania research area
 GEOGRAPHIC_BOUNDS = {